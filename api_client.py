@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+API Client for Field Management Application
+Pooled keep-alive HTTP client with retries, backoff and gzip request bodies,
+plus an asyncio variant with bounded concurrency
+"""
+
+import asyncio
+import gzip
+import json
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+DEFAULT_BASE_URL = "http://localhost:3000/api"
+DEFAULT_POOL_SIZE = 20
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.2
+DEFAULT_TIMEOUT = 30
+# Bodies smaller than this cost more to compress than they save on the wire
+GZIP_MIN_BYTES = 1024
+RETRY_STATUSES = (502, 503, 504)
+# Only these are retried after the request may have reached the server; the rest
+# (POST) are retried on connection failures only, so a write is never applied twice,
+# unless they carry an Idempotency-Key
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+# List response formats the server offers through Accept
+JSON_TYPE = "application/json"
+COLUMNS_TYPE = "application/vnd.fieldapp.columns+json"
+DELTA_TYPE = "application/vnd.fieldapp.delta+json"
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+# Existing admin the tools sign in as to grant admin to accounts they create, since registration
+# only creates agents. The server makes it an admin on first registration when the email is in
+# its ADMIN_EMAILS.
+ADMIN_EMAIL = os.environ.get("API_ADMIN_EMAIL", "fieldapp-admin@example.com")
+ADMIN_PASSWORD = os.environ.get("API_ADMIN_PASSWORD", "FieldAppAdmin123!")
+
+
+def encode_json_body(payload, gzip_min_bytes=GZIP_MIN_BYTES):
+    """Serialize a JSON body, gzipping it above gzip_min_bytes; returns (body, headers)"""
+    body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    headers = {"Content-Type": "application/json"}
+    if gzip_min_bytes is not None and len(body) >= gzip_min_bytes:
+        body = gzip.compress(body, compresslevel=5)
+        headers["Content-Encoding"] = "gzip"
+    return body, headers
+
+
+def backoff_delay(attempt, backoff=DEFAULT_BACKOFF):
+    """Exponential backoff with full jitter for the given retry attempt (0-based)"""
+    return random.uniform(0, backoff * (2 ** attempt))
+
+
+def parse_server_timing(header):
+    """Parse a Server-Timing header into {metric: {"dur": ms, "desc": text}}"""
+    metrics = {}
+    for entry in (header or "").split(","):
+        name, *params = [part.strip() for part in entry.split(";")]
+        if not name:
+            continue
+        metric = {"dur": 0.0, "desc": None}
+        for param in params:
+            key, _, value = param.partition("=")
+            if key == "dur":
+                metric["dur"] = float(value or 0)
+            elif key == "desc":
+                metric["desc"] = value.strip('"')
+        metrics[name] = metric
+    return metrics
+
+
+def _undelta(values, spec):
+    """Undo one delta-encoded column: running sums, scaled back or turned into ISO times"""
+    decoded, current = [], 0
+    for value in values:
+        if value is None:
+            decoded.append(None)
+            continue
+        current += value
+        if spec.get("unit") == "ms":
+            moment = EPOCH + timedelta(milliseconds=current)
+            decoded.append(moment.isoformat(timespec="milliseconds").replace("+00:00", "Z"))
+        else:
+            decoded.append(current / spec["scale"])
+    return decoded
+
+
+def decode_list(payload):
+    """Rows from a decoded list body in any of the server's formats
+
+    JSON arrays and {"rows", "users"} objects come back as they are. Columnar bodies
+    ({"count", "columns"}, with "deltas" for delta-encoded columns) are turned back into
+    row dicts; if they carry a users dictionary the result is {"rows", "users"} too.
+    Delta-encoded coordinates are rounded to 1e-7 degrees and times to milliseconds.
+    """
+    if isinstance(payload, list) or "columns" not in payload:
+        return payload
+    columns = dict(payload["columns"])
+    for name, spec in payload.get("deltas", {}).items():
+        columns[name] = _undelta(columns[name], spec)
+    names = list(columns)
+    rows = [dict(zip(names, values)) for values in zip(*(columns[name] for name in names))]
+    if "users" in payload:
+        return {"rows": rows, "users": payload["users"]}
+    return rows
+
+
+class PhaseRecorder:
+    """Thread-safe per-endpoint collection of client latency and server phase timings
+
+    Fed from responses' Server-Timing headers; summary() splits each endpoint's
+    latency into the server phases, unattributed server time and the network.
+    """
+
+    PHASES = ("auth", "parse", "queue", "db", "join", "serialize")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)
+
+    def record(self, response, client_ms=None):
+        timings = parse_server_timing(response.headers.get("Server-Timing"))
+        if "total" not in timings:
+            return
+        if client_ms is None:
+            client_ms = response.elapsed.total_seconds() * 1000
+        endpoint = f"{response.request.method} {timings['total']['desc'] or '?'}"
+        sample = {name: metric["dur"] for name, metric in timings.items()}
+        sample["client"] = client_ms
+        with self._lock:
+            self.samples[endpoint].append(sample)
+
+    def summary(self):
+        """Per-endpoint count and mean ms for client, server total, each phase, other and network"""
+        rows = {}
+        with self._lock:
+            for endpoint, samples in self.samples.items():
+                count = len(samples)
+                mean = lambda key: sum(sample.get(key, 0.0) for sample in samples) / count
+                row = {"count": count, "client": mean("client"), "total": mean("total")}
+                for phase in self.PHASES:
+                    row[phase] = mean(phase)
+                row["other"] = max(row["total"] - sum(row[phase] for phase in self.PHASES), 0.0)
+                row["network"] = max(row["client"] - row["total"], 0.0)
+                rows[endpoint] = row
+        return rows
+
+
+class _BaseClient:
+    # Keyword the underlying library takes raw request bytes under
+    body_argument = "data"
+
+    def __init__(self, base_url, gzip_min_bytes, timeout, token=None):
+        self.base_url = base_url.rstrip("/")
+        parts = urlsplit(self.base_url)
+        self.server_root = f"{parts.scheme}://{parts.netloc}"
+        self.gzip_min_bytes = gzip_min_bytes
+        self.timeout = timeout
+        # Access token sent as a bearer credential on every request; set by login()
+        self.token = token
+
+    def url(self, path):
+        """Resolve an API path ("photos"), a server path ("/api/blobs/...") or a full URL"""
+        if path.startswith(("http://", "https://")):
+            return path
+        if path.startswith("/"):
+            return f"{self.server_root}{path}"
+        return f"{self.base_url}/{path}"
+
+    def _prepare(self, kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        idempotency_key = kwargs.pop("idempotency_key", None)
+        if idempotency_key:
+            kwargs["headers"] = {"Idempotency-Key": idempotency_key, **(kwargs.get("headers") or {})}
+        if "json" in kwargs:
+            body, headers = encode_json_body(kwargs.pop("json"), self.gzip_min_bytes)
+            kwargs[self.body_argument] = body
+            kwargs["headers"] = {**headers, **(kwargs.get("headers") or {})}
+        if self.token:
+            kwargs["headers"] = {"Authorization": f"Bearer {self.token}", **(kwargs.get("headers") or {})}
+        return kwargs
+
+    @staticmethod
+    def _retryable(method, kwargs):
+        """Whether a request may be resent after it could have reached the server"""
+        return method in IDEMPOTENT_METHODS or "Idempotency-Key" in (kwargs.get("headers") or {})
+
+    def _use_session(self, response):
+        response.raise_for_status()
+        data = response.json()
+        self.token = data["session"]["access_token"]
+        return data
+
+
+class APIClient(_BaseClient):
+    """Thread-safe client over one pooled keep-alive session
+
+    Connections are reused across calls and threads (up to pool_size per
+    host), transient failures are retried with exponential backoff and JSON
+    bodies above gzip_min_bytes are sent gzip-encoded. Pass gzip_min_bytes=None
+    to never compress. With a phase_recorder, every response's Server-Timing
+    header is collected into it. After login() (or with token=) every request
+    carries the session's access token. A POST made with idempotency_key= is
+    retried on 502/503/504 like the idempotent methods, since the server
+    applies it only once.
+    """
+
+    def __init__(self, base_url=DEFAULT_BASE_URL, pool_size=DEFAULT_POOL_SIZE, retries=DEFAULT_RETRIES,
+                 backoff=DEFAULT_BACKOFF, gzip_min_bytes=GZIP_MIN_BYTES, timeout=DEFAULT_TIMEOUT,
+                 phase_recorder=None, token=None):
+        super().__init__(base_url, gzip_min_bytes, timeout, token)
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=IDEMPOTENT_METHODS,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True, max_retries=retry)
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.phase_recorder = phase_recorder
+        if phase_recorder is not None:
+            self.session.hooks["response"].append(lambda response, *args, **kwargs: phase_recorder.record(response))
+
+    def request(self, method, path, **kwargs):
+        kwargs = self._prepare(kwargs)
+        url = self.url(path)
+        # The adapter already retries idempotent methods; keyed POSTs get the same treatment here
+        attempts = self.retries + 1 if method not in IDEMPOTENT_METHODS and self._retryable(method, kwargs) else 1
+        for attempt in range(attempts):
+            response = self.session.request(method, url, **kwargs)
+            if response.status_code not in RETRY_STATUSES or attempt == attempts - 1:
+                return response
+            time.sleep(backoff_delay(attempt, self.backoff))
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request("PUT", path, **kwargs)
+
+    def login(self, email, password):
+        """Log in and send the returned access token from now on; returns the login response body"""
+        return self._use_session(self.post("auth/login", json={"email": email, "password": password}))
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def admin_client(base_url=DEFAULT_BASE_URL, email=ADMIN_EMAIL, password=ADMIN_PASSWORD, **kwargs):
+    """An APIClient signed in as the configured admin, registering the account on first use.
+    Raises RuntimeError when that account isn't an admin."""
+    client = APIClient(base_url, **kwargs)
+    try:
+        profile = client.login(email, password)["profile"]
+    except requests.HTTPError:
+        client.post("auth/register", json={"email": email, "password": password, "fullName": "Field App Admin"})
+        try:
+            profile = client.login(email, password)["profile"]
+        except requests.HTTPError as error:
+            client.close()
+            raise RuntimeError(f"Cannot sign in as {email}: {error}") from error
+    if profile.get("role") != "admin":
+        client.close()
+        raise RuntimeError(
+            f"{email} is not an admin; start the server with ADMIN_EMAILS={email} "
+            "or set API_ADMIN_EMAIL and API_ADMIN_PASSWORD to an existing admin"
+        )
+    return client
+
+
+def grant_admin(admin, user_id):
+    """Make user_id an admin through an admin's client; returns the updated profile"""
+    response = admin.put(f"users/{user_id}/role", json={"role": "admin"})
+    response.raise_for_status()
+    return response.json()
+
+
+class AsyncAPIClient(_BaseClient):
+    """asyncio client (httpx) with a shared connection pool and at most
+    `concurrency` requests in flight; same retry and gzip rules as APIClient"""
+
+    body_argument = "content"
+
+    def __init__(self, base_url=DEFAULT_BASE_URL, concurrency=DEFAULT_POOL_SIZE, retries=DEFAULT_RETRIES,
+                 backoff=DEFAULT_BACKOFF, gzip_min_bytes=GZIP_MIN_BYTES, timeout=DEFAULT_TIMEOUT, token=None):
+        if httpx is None:
+            raise RuntimeError("AsyncAPIClient requires httpx (pip install httpx)")
+        super().__init__(base_url, gzip_min_bytes, timeout, token)
+        self.retries = retries
+        self.backoff = backoff
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+            # Connection failures are retried by the transport for every method
+            transport=httpx.AsyncHTTPTransport(retries=retries),
+        )
+
+    async def request(self, method, path, **kwargs):
+        kwargs = self._prepare(kwargs)
+        url = self.url(path)
+        async with self.semaphore:
+            for attempt in range(self.retries + 1):
+                try:
+                    response = await self.client.request(method, url, **kwargs)
+                except httpx.TransportError:
+                    if not self._retryable(method, kwargs) or attempt == self.retries:
+                        raise
+                else:
+                    if (response.status_code not in RETRY_STATUSES or not self._retryable(method, kwargs)
+                            or attempt == self.retries):
+                        return response
+                await asyncio.sleep(backoff_delay(attempt, self.backoff))
+
+    async def get(self, path, **kwargs):
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        return await self.request("POST", path, **kwargs)
+
+    async def put(self, path, **kwargs):
+        return await self.request("PUT", path, **kwargs)
+
+    async def login(self, email, password):
+        return self._use_session(await self.post("auth/login", json={"email": email, "password": password}))
+
+    async def close(self):
+        await self.client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
@@ -1,314 +1,979 @@
 import { NextResponse } from 'next/server';
-import { supabase, initializeDatabase } from '../../../lib/supabase.js';
+import { gunzipSync } from 'zlib';
+import { supabase } from '../../../lib/supabase.js';
+import { checkDatabase, healthReport } from '../../../lib/health.js';
+import { parseListParams, applyKeyset, encodeCursor } from '../../../lib/pagination.js';
+import { putImage, getBlob, withThumbnail, MAX_UPLOAD_BYTES, MAX_UPLOAD_FORM_BYTES } from '../../../lib/blobStore.js';
+import { toGpsRow, toGpsRows } from '../../../lib/gps.js';
+import { LRUCache, etagFor } from '../../../lib/cache.js';
+import { publish, publishAll, subscribe, eventsSince } from '../../../lib/events.js';
+import { parseSpatialParams, querySpatial, forgetSpatialUsers } from '../../../lib/spatial.js';
+import { getTrack, dayBounds, DEFAULT_TOLERANCE_M, MAX_COMPACT_DAYS } from '../../../lib/tracks.js';
+import { dashboardSummary, parseSummaryParams, refreshSummary } from '../../../lib/dashboard.js';
+import { importLeads, exportLeads } from '../../../lib/leads.js';
+import { withTiming, timed, timedSync, setRoute, noteError, noteUser, noteBody, metricsText } from '../../../lib/metrics.js';
+import { authenticate, authCacheStats, canActFor, isAdmin, forgetUsers, registrationRole, ROLES } from '../../../lib/auth.js';
+import { runOnce, reserveKeys, releaseKeys, validKey, idempotencyStats, MAX_KEY_LENGTH } from '../../../lib/idempotency.js';
+import { WRITE_BEHIND, enqueueWrites, invalidRow, onDrained, writeQueueStats } from '../../../lib/writeBehind.js';
+import { USER_DIRECTORY, usersFor, embedUsers, userDirectoryStats } from '../../../lib/userDirectory.js';
+import { negotiateFormat, serializeList, encodedBody, entryBytes, JSON_TYPE } from '../../../lib/encoding.js';
+import { captureStats } from '../../../lib/capture.js';
+import { decodeToken, changesSince, markTableReset, SYNC_TABLES } from '../../../lib/sync.js';
+import { TEST_CLEANUP, OWNED_TABLES, validNamespace, inNamespace, removeNamespace } from '../../../lib/testData.js';
+import { readRecent, runRetention, markLateFixes, onRetention, hourlyReport, retentionCutoff, retentionStats, MAX_REPORT_DAYS } from '../../../lib/gpsHistory.js';
 
-export async function GET(request) {
+// Dashboard list responses, invalidated by tag whenever the underlying table is written
+const responseCache = new LRUCache({
+  maxEntries: parseInt(process.env.RESPONSE_CACHE_MAX_ENTRIES || '', 10) || 500,
+  maxBytes: (parseInt(process.env.RESPONSE_CACHE_MAX_MB || '', 10) || 64) * 1024 * 1024,
+  ttlMs: parseInt(process.env.RESPONSE_CACHE_TTL_MS || '', 10) || 30000
+});
+
+// Rows written behind the request land later; drop stale lists when they do
+onDrained((table, rows) => {
+  responseCache.invalidate(table);
+  if (table === 'gps_tracking') {
+    noteLateFixes(rows);
+  }
+});
+onRetention((summary) => {
+  if (summary.raw_rows_removed) {
+    responseCache.invalidate('gps_tracking');
+    markTableReset('gps_tracking');
+  }
+});
+
+// Buffered fixes for days already rolled up send those days' reports back to raw rows
+function noteLateFixes(rows) {
+  return markLateFixes(rows).catch((error) => console.error('Marking late GPS fixes failed:', error));
+}
+
+// Path plus normalised query, so parameter order doesn't split entries
+function cacheKey(url) {
+  const params = [...url.searchParams].sort(([a], [b]) => a.localeCompare(b));
+  return `${url.pathname}?${new URLSearchParams(params)}`;
+}
+
+// JSON response, with serialization counted in the request's timing
+function json(body, init) {
+  return timedSync('serialize', () => NextResponse.json(body, init));
+}
+
+// Send a cached list body, or 304 when the client already holds this version. Large bodies
+// go out brotli or gzip compressed when the client accepts it; a compressed variant stored on a
+// cached entry (under `key`) counts towards its size.
+function cachedResponse(request, entry, cacheStatus, key = null) {
+  const headers = {
+    ...entry.headers,
+    ETag: entry.etag,
+    'Cache-Control': 'private, no-cache',
+    Vary: 'Accept, Accept-Encoding',
+    'X-Cache': cacheStatus
+  };
+  const ifNoneMatch = request.headers.get('if-none-match');
+  if (ifNoneMatch && ifNoneMatch.split(',').map((tag) => tag.trim()).includes(entry.etag)) {
+    return new NextResponse(null, { status: 304, headers });
+  }
+  const { body, encoding, added } = timedSync('serialize', () => encodedBody(entry, request.headers.get('accept-encoding')));
+  if (added && key) {
+    responseCache.resize(key, entryBytes(entry));
+  }
+  if (encoding) {
+    headers['Content-Encoding'] = encoding;
+  }
+  return new NextResponse(body, { headers: { ...headers, 'Content-Type': entry.contentType } });
+}
+
+// A list body in the format the client's Accept header asks for, ready for cachedResponse
+function listEntry(result, format, headers = {}) {
+  return timedSync('serialize', () => {
+    const body = serializeList(result, format);
+    return { body, headers, etag: etagFor(body), contentType: format };
+  });
+}
+
+// Attach authors to listed rows. ?users=join (the default) embeds each row's user under `users`;
+// ?users=dict answers { rows, users } with every author once, keyed by id. Authors come from the
+// user directory rather than a database join unless USER_DIRECTORY=off.
+async function attachUsers(rows, params) {
+  if (!USER_DIRECTORY) {
+    if (params.users === 'join') {
+      return rows;
+    }
+    return timedSync('join', () => {
+      const users = {};
+      const stripped = rows.map(({ users: author, ...row }) => {
+        if (row.user_id !== null && row.user_id !== undefined) {
+          users[row.user_id] = author ?? null;
+        }
+        return row;
+      });
+      return { rows: stripped, users };
+    });
+  }
+
+  const users = await usersFor(rows);
+  return timedSync('join', () => {
+    if (params.users === 'dict') {
+      return { rows, users };
+    }
+    const joined = embedUsers(rows, users);
+    return params.lookupOnly ? joined.map(({ user_id, ...row }) => row) : joined;
+  });
+}
+
+// List rows newest first. With `limit`/`cursor` the response is one page and
+// X-Next-Cursor carries the cursor for the following page; `fields` projects columns.
+// Accept may ask for the columnar or delta-encoded formats instead of a JSON array.
+// `recent` lists (GPS fixes) read the newest time partitions first and stop once the page is full.
+async function listRows(request, url, table, { orderColumn = 'created_at', defaultLimit = null, transform = null, recent = false } = {}) {
+  const format = negotiateFormat(request.headers.get('accept'));
+  const key = `${format} ${cacheKey(url)}`;
+  const cached = responseCache.get(key);
+  if (cached) {
+    return cachedResponse(request, cached, 'HIT', key);
+  }
+
+  const params = timedSync('parse', () => parseListParams(url.searchParams, table, orderColumn));
+  if (params.error) {
+    return NextResponse.json({ error: params.error }, { status: 400 });
+  }
+
+  // Rows with authors carry user names and roles, so they also go stale on user writes
+  const tags = params.users ? [table, 'users'] : [table];
+  // A write that lands while this read is in flight makes its result too old to cache
+  const version = responseCache.version(tags);
+  
+  const limit = params.limit ?? defaultLimit;
+  const select = USER_DIRECTORY && params.users ? params.columns : params.select;
+  const query = () => applyKeyset(supabase.from(table).select(select), params.cursor, orderColumn);
+  // Fetch one extra row to learn whether another page exists
+  const fetchLimit = limit !== null && params.paginated ? limit + 1 : limit;
+
+  const { data, error } = recent && fetchLimit !== null
+    ? await readRecent(query, orderColumn, fetchLimit, params.cursor?.value ?? null)
+    : await timed('db', fetchLimit === null ? query() : query().limit(fetchLimit));
+  if (error) {
+    return NextResponse.json({ error: error.message }, { status: 500 });
+  }
+
+  let rows = data || [];
+  const headers = {};
+  if (params.paginated && rows.length > limit) {
+    rows.length = limit;
+    headers['X-Next-Cursor'] = encodeCursor(rows[rows.length - 1], orderColumn);
+  }
+  if (transform) {
+    rows = rows.map(transform);
+  }
+  const result = params.users ? await attachUsers(rows, params) : rows;
+
+  const entry = listEntry(result, format, headers);
+  const stored = responseCache.set(key, entry, { tags, size: entryBytes(entry), version });
+  return cachedResponse(request, entry, 'MISS', stored ? key : null);
+}
+
+// Decompressed JSON bodies larger than this are rejected before parsing
+const MAX_JSON_BODY_BYTES = (parseInt(process.env.MAX_JSON_BODY_MB || '', 10) || 32) * 1024 * 1024;
+
+// Parse a JSON request body, decoding it first when the client sent Content-Encoding: gzip
+async function readJson(request) {
+  const body = await timed('parse', async () => {
+    if ((request.headers.get('content-encoding') || '').trim().toLowerCase() === 'gzip') {
+      const raw = Buffer.from(await request.arrayBuffer());
+      return JSON.parse(gunzipSync(raw, { maxOutputLength: MAX_JSON_BODY_BYTES }).toString('utf8'));
+    }
+    return request.json();
+  });
+  noteBody(body);
+  return body;
+}
+
+// A multipart upload, refused with 413 once it is past MAX_UPLOAD_FORM_BYTES: up front when
+// Content-Length says so, otherwise as soon as that many bytes have arrived
+async function readUploadForm(request) {
+  const tooLarge = { error: 'File too large', status: 413 };
+  if (parseInt(request.headers.get('content-length') || '', 10) > MAX_UPLOAD_FORM_BYTES) {
+    return tooLarge;
+  }
+  if (!request.body) {
+    return { error: 'file is required', status: 400 };
+  }
+  
+  let received = 0;
+  const capped = request.body.pipeThrough(new TransformStream({
+    transform(chunk, controller) {
+      received += chunk.byteLength;
+      if (received > MAX_UPLOAD_FORM_BYTES) {
+        controller.error(new Error('File too large'));
+      } else {
+        controller.enqueue(chunk);
+      }
+    }
+  }));
+  try {
+    const headers = { 'Content-Type': request.headers.get('content-type') || '' };
+    return { data: await timed('parse', new Response(capped, { headers }).formData()) };
+  } catch (error) {
+    return received > MAX_UPLOAD_FORM_BYTES ? tooLarge : { error: 'Send a multipart/form-data body', status: 400 };
+  }
+}
+
+// csv or ndjson, from ?format= or else the Content-Type / Accept header
+function leadFormat(url, header) {
+  const format = url.searchParams.get('format') || ((header || '').includes('csv') ? 'csv' : 'ndjson');
+  return ['csv', 'ndjson'].includes(format) ? format : null;
+}
+
+const STREAM_TABLES = ['gps_tracking', 'photos', 'leads'];
+
+const TABLES_BY_PATH = { photos: 'photos', leads: 'leads', 'gps-tracking': 'gps_tracking' };
+
+// Endpoints callable without a bearer token; blobs/ is also open because image tags can't send one
+const PUBLIC_PATHS = new Set(['health', 'metrics', 'auth/login', 'auth/register']);
+// Endpoints limited to admins, along with users/:id/role
+const ADMIN_PATHS = new Set(['users', 'dashboard/summary', 'leads/export', 'leads/import', 'tracks/compact', 'write-queue', 'capture', 'testing/cleanup']);
+// Writes that honour an Idempotency-Key header
+const IDEMPOTENT_PATHS = new Set(['photos', 'leads', 'gps-tracking', 'gps-tracking/batch']);
+
+// Resolve the caller of a protected endpoint: { principal }, or { response } to send instead
+async function authorize(request, url, path) {
+  if (PUBLIC_PATHS.has(path) || path.startsWith('blobs/')) {
+    return {};
+  }
+  // Test cleanup only exists with TEST_CLEANUP=on, so a suite can check for it before creating anything
+  if (path === 'testing/cleanup' && !TEST_CLEANUP) {
+    return { response: NextResponse.json({ message: 'API endpoint not found' }, { status: 404 }) };
+  }
+  
+  const { principal, status, error } = await authenticate(request, url);
+  if (!principal) {
+    return { response: NextResponse.json({ error }, { status, headers: { 'WWW-Authenticate': 'Bearer' } }) };
+  }
+  noteUser({ id: principal.id, role: principal.role });
+  if ((ADMIN_PATHS.has(path) || path.startsWith('users/')) && !isAdmin(principal)) {
+    return { response: NextResponse.json({ error: 'Admin access required' }, { status: 403 }) };
+  }
+  return { principal };
+}
+
+// Run a keyed write once per caller, endpoint and key, replaying the stored response for retries
+async function idempotentWrite(principal, path, key, body) {
+  if (!validKey(key)) {
+    return NextResponse.json({ error: `Idempotency-Key must be 1-${MAX_KEY_LENGTH} characters` }, { status: 400 });
+  }
+  
+  const result = await runOnce(`${principal.id} ${path} ${key}`, body, () => handleJsonPost(path, body, principal));
+  if (result.conflict) {
+    return NextResponse.json({ error: 'Idempotency-Key was already used with a different request body' }, { status: 422 });
+  }
+  
+  const { status, headers, body: responseBody } = result.stored;
+  return new NextResponse(responseBody, {
+    status,
+    headers: [...headers, ['Idempotent-Replayed', String(result.replayed)]]
+  });
+}
+
+// Write-behind mode: acknowledge with 202 once the rows are durably queued; ids are assigned as they drain
+async function queueWrite(table, rows, extra = {}) {
+  const invalid = rows.map((row) => invalidRow(table, row)).find(Boolean);
+  if (invalid) {
+    return NextResponse.json({ error: invalid }, { status: 400 });
+  }
+  const queued = await timed('queue', enqueueWrites(table, rows));
+  if (queued.error) {
+    return NextResponse.json({ error: queued.error }, { status: queued.status, headers: { 'Retry-After': '1' } });
+  }
+  return json({ queued: rows.length, sequence: queued.last, ...extra }, { status: 202 });
+}
+
+function forbidden() {
+  return NextResponse.json({ error: 'Agents can only record data for themselves' }, { status: 403 });
+}
+
+// Server-Sent Events feed of newly written rows. Filters: `tables` and `user_id`
+// (comma-separated). Reconnecting clients send Last-Event-ID to receive what they missed.
+function eventStream(request, url) {
+  const tables = (url.searchParams.get('tables') || STREAM_TABLES.join(','))
+    .split(',')
+    .filter((table) => STREAM_TABLES.includes(table));
+  const userIds = url.searchParams.get('user_id')?.split(',');
+  const lastEventId = parseInt(request.headers.get('last-event-id') || url.searchParams.get('last_event_id') || '', 10);
+  const matches = (event) =>
+    tables.includes(event.table) && (!userIds || userIds.includes(String(event.row.user_id)));
+
+  const encoder = new TextEncoder();
+  let cleanup = () => {};
+  const stream = new ReadableStream({
+    start(controller) {
+      const write = (chunk) => {
+        try {
+          controller.enqueue(encoder.encode(chunk));
+        } catch {
+          cleanup();
+        }
+      };
+      const send = (event) => write(`id: ${event.id}\nevent: ${event.table}\ndata: ${JSON.stringify(event.row)}\n\n`);
+
+      write('retry: 3000\n\n');
+      // Replay and subscribe run synchronously, so no event can slip in between
+      if (Number.isInteger(lastEventId)) {
+        eventsSince(lastEventId).filter(matches).forEach(send);
+      }
+      const unsubscribe = subscribe((event) => {
+        if (matches(event)) send(event);
+      });
+      const heartbeat = setInterval(() => write(': keep-alive\n\n'), 15000);
+
+      cleanup = () => {
+        clearInterval(heartbeat);
+        unsubscribe();
+        cleanup = () => {};
+      };
+      request.signal?.addEventListener('abort', () => cleanup());
+    },
+    cancel() {
+      cleanup();
+    }
+  });
+
+  return new Response(stream, {
+    headers: {
+      'Content-Type': 'text/event-stream',
+      'Cache-Control': 'no-cache, no-transform',
+      Connection: 'keep-alive',
+      'X-Accel-Buffering': 'no'
+    }
+  });
+}
+
+async function handleGet(request) {
   const url = new URL(request.url);
   const path = url.pathname.replace('/api/', '');
   
   try {
-    await initializeDatabase();
+    const { principal, response: denied } = await authorize(request, url, path);
+    if (denied) {
+      return denied;
+    }
     
-    // Auth endpoints
-    if (path === 'auth/user') {
-      const { data: { user }, error } = await supabase.auth.getUser()
-      if (error) {
-        return NextResponse.json({ error: error.message }, { status: 401 });
+    // Stored photo bytes are immutable and content-addressed, so serve them before touching the database
+    if (path.startsWith('blobs/')) {
+      const blob = await getBlob(path.slice('blobs/'.length));
+      if (!blob) {
+        return NextResponse.json({ error: 'Blob not found' }, { status: 404 });
       }
-      return NextResponse.json({ user });
+      return new NextResponse(blob.buffer, {
+        headers: {
+          'Content-Type': blob.contentType,
+          'Content-Length': String(blob.buffer.length),
+          'Cache-Control': 'public, max-age=31536000, immutable'
+        }
+      });
+    }
+    
+    // Live feed of new GPS fixes, photos and leads
+    if (path === 'stream') {
+      return eventStream(request, url);
+    }
+    
+    // Readiness: cached connectivity check plus latency stats (?refresh=1 forces a new check)
+    if (path === 'health') {
+      const healthy = await timed('db', checkDatabase({ force: url.searchParams.get('refresh') === '1' }));
+      return json(healthReport(), {
+        status: healthy ? 200 : 503,
+        headers: { 'Cache-Control': 'no-store' }
+      });
+    }
+    
+    // Request counts, latency histograms and per-phase timings in Prometheus text format
+    if (path === 'metrics') {
+      const cache = responseCache.stats();
+      const auth = authCacheStats();
+      const idempotency = idempotencyStats();
+      const queue = writeQueueStats();
+      const directory = userDirectoryStats();
+      const capture = captureStats();
+      const retention = retentionStats();
+      const body = metricsText([
+        { name: 'api_response_cache_hits_total', help: 'Response cache hits.', type: 'counter', samples: [[{}, cache.hits]] },
+        { name: 'api_response_cache_misses_total', help: 'Response cache misses.', type: 'counter', samples: [[{}, cache.misses]] },
+        { name: 'api_response_cache_entries', help: 'Entries held in the response cache.', type: 'gauge', samples: [[{}, cache.entries]] },
+        { name: 'api_response_cache_bytes', help: 'Bytes held in the response cache.', type: 'gauge', samples: [[{}, cache.bytes]] },
+        { name: 'api_auth_cache_hits_total', help: 'Bearer tokens resolved from the auth cache.', type: 'counter', samples: [[{}, auth.hits]] },
+        { name: 'api_auth_cache_misses_total', help: 'Bearer tokens verified and looked up.', type: 'counter', samples: [[{}, auth.misses]] },
+        { name: 'api_auth_cache_entries', help: 'Sessions held in the auth cache.', type: 'gauge', samples: [[{}, auth.entries]] },
+        { name: 'api_idempotency_replays_total', help: 'Keyed writes answered with a stored response.', type: 'counter', samples: [[{}, idempotency.replays]] },
+        { name: 'api_idempotency_keys', help: 'Idempotency keys held, including batch item keys.', type: 'gauge', samples: [[{}, idempotency.entries]] },
+        { name: 'api_write_queue_pending', help: 'Acknowledged writes not yet in the database.', type: 'gauge', samples: [[{}, queue.pending]] },
+        { name: 'api_write_queue_drained_total', help: 'Queued writes inserted into the database.', type: 'counter', samples: [[{}, queue.drained_total]] },
+        { name: 'api_write_queue_dead_letters_total', help: 'Queued writes the database rejected.', type: 'counter', samples: [[{}, queue.dead_letters]] },
+        { name: 'api_user_directory_users', help: 'Profiles held in the user directory.', type: 'gauge', samples: [[{}, directory.users]] },
+        { name: 'api_user_directory_loads_total', help: 'Full reloads of the user directory.', type: 'counter', samples: [[{}, directory.loads]] },
+        { name: 'api_user_directory_lookups_total', help: 'Users read by id after missing from the directory.', type: 'counter', samples: [[{}, directory.lookups]] },
+        { name: 'api_capture_records_total', help: 'Requests written to the traffic capture.', type: 'counter', samples: [[{}, capture.records]] },
+        { name: 'api_capture_dropped_total', help: 'Requests not captured because the writer fell behind.', type: 'counter', samples: [[{}, capture.dropped]] },
+        { name: 'api_gps_archived_days_total', help: 'Raw GPS days archived and deleted by retention.', type: 'counter', samples: [[{}, retention.archived_days]] },
+        { name: 'api_gps_archived_rows_total', help: 'Raw GPS fixes archived and deleted by retention.', type: 'counter', samples: [[{}, retention.archived_rows]] }
+      ]);
+      return new NextResponse(body, {
+        headers: { 'Content-Type': 'text/plain; version=0.0.4; charset=utf-8', 'Cache-Control': 'no-store' }
+      });
+    }
+    
+    // The caller's profile, from their bearer token
+    if (path === 'auth/user') {
+      const { expiresAt, ...user } = principal;
+      return json({ user, expires_at: expiresAt && new Date(expiresAt).toISOString() });
+    }
+    
+    // Write-behind queue depth and drain progress
+    if (path === 'write-queue') {
+      return json(writeQueueStats(), { headers: { 'Cache-Control': 'no-store' } });
+    }
+    
+    // Traffic capture settings and counts
+    if (path === 'capture') {
+      return json(captureStats(), { headers: { 'Cache-Control': 'no-store' } });
+    }
+    
+    // Admin dashboard aggregates: ?active_minutes=, ?recent= and ?days= size each section
+    if (path === 'dashboard/summary') {
+      const summary = await dashboardSummary(parseSummaryParams(url.searchParams));
+      return json(summary, { headers: { 'Cache-Control': 'private, no-cache' } });
     }
     
     // Get all users (for admin dashboard)
     if (path === 'users') {
-      const { data, error } = await supabase
-        .from('users')
-        .select('*')
-        .order('created_at', { ascending: false });
-      
-      if (error) {
-        return NextResponse.json({ error: error.message }, { status: 500 });
-      }
-      
-      return NextResponse.json(data || []);
+      return listRows(request, url, 'users');
     }
     
     // Get user photos with location data
     if (path === 'photos') {
-      const { data, error } = await supabase
-        .from('photos')
-        .select(`
-          *,
-          users (
-            id,
-            full_name,
-            role
-          )
-        `)
-        .order('created_at', { ascending: false });
-      
+      return listRows(request, url, 'photos', { transform: withThumbnail });
+    }
+    
+    // Get GPS tracking data
+    if (path === 'gps-tracking') {
+      return listRows(request, url, 'gps_tracking', { orderColumn: 'timestamp', defaultLimit: 100, recent: true });
+    }
+    
+    // Get leads
+    if (path === 'leads') {
+      return listRows(request, url, 'leads');
+    }
+    
+    // Offline sync: rows changed since ?since= (the token from the previous sync; none for a full
+    // snapshot) across photos, leads, GPS fixes and, for admins, users
+    if (path === 'sync') {
+      const { seq, error } = decodeToken(url.searchParams.get('since'));
       if (error) {
-        return NextResponse.json({ error: error.message }, { status: 500 });
+        return NextResponse.json({ error }, { status: 400 });
       }
       
-      return NextResponse.json(data || []);
+      const tables = SYNC_TABLES.filter((table) => table !== 'users' || isAdmin(principal));
+      const result = await changesSince(seq, tables);
+      return cachedResponse(request, listEntry(result, JSON_TYPE), 'BYPASS');
     }
     
-    // Get GPS tracking data
-    if (path === 'gps-tracking') {
-      const { data, error } = await supabase
-        .from('gps_tracking')
-        .select(`
-          *,
-          users (
-            id,
-            full_name,
-            role
-          )
-        `)
-        .order('timestamp', { ascending: false })
-        .limit(100);
+    // Stream every lead (or one agent's with ?user_id=) as CSV or NDJSON
+    if (path === 'leads/export') {
+      const format = leadFormat(url, request.headers.get('accept'));
+      if (!format) {
+        return NextResponse.json({ error: 'format must be csv or ndjson' }, { status: 400 });
+      }
       
-      if (error) {
-        return NextResponse.json({ error: error.message }, { status: 500 });
+      const date = new Date().toISOString().slice(0, 10);
+      return new Response(exportLeads({ format, userId: url.searchParams.get('user_id') }), {
+        headers: {
+          'Content-Type': format === 'csv' ? 'text/csv; charset=utf-8' : 'application/x-ndjson',
+          'Content-Disposition': `attachment; filename="leads-${date}.${format === 'csv' ? 'csv' : 'ndjson'}"`,
+          'Cache-Control': 'no-store'
+        }
+      });
+    }
+    
+    // Per-agent daily track: simplified polyline, distance, activity time and stops
+    if (path === 'tracks') {
+      const userId = url.searchParams.get('user_id');
+      const date = url.searchParams.get('date') || new Date().toISOString().slice(0, 10);
+      const tolerance = Number(url.searchParams.get('tolerance') || DEFAULT_TOLERANCE_M);
+      if (!userId || !dayBounds(date) || !(tolerance >= 0)) {
+        return NextResponse.json({ error: 'user_id and a YYYY-MM-DD date are required' }, { status: 400 });
       }
       
-      return NextResponse.json(data || []);
+      return json(await getTrack(userId, date, tolerance));
     }
     
-    // Get leads
-    if (path === 'leads') {
-      const { data, error } = await supabase
-        .from('leads')
-        .select(`
-          *,
-          users (
-            id,
-            full_name,
-            role
-          )
-        `)
-        .order('created_at', { ascending: false });
+    // Per-agent hourly rollups over whole days: ?user_id=&from=&to= (YYYY-MM-DD, inclusive; to defaults to today)
+    if (path === 'tracks/hourly') {
+      const userId = url.searchParams.get('user_id');
+      const to = url.searchParams.get('to') || new Date().toISOString().slice(0, 10);
+      const from = url.searchParams.get('from') || to;
+      const days = dayBounds(from) && dayBounds(to) && (Date.parse(to) - Date.parse(from)) / (24 * 60 * 60 * 1000) + 1;
+      if (!userId || !(days >= 1 && days <= MAX_REPORT_DAYS)) {
+        return NextResponse.json({ error: `user_id and a from/to range of 1 to ${MAX_REPORT_DAYS} days are required` }, { status: 400 });
+      }
       
-      if (error) {
-        return NextResponse.json({ error: error.message }, { status: 500 });
+      return json(await hourlyReport(userId, from, to));
+    }
+    
+    // Area and time-window queries: geo/{photos|leads|gps-tracking}?bbox=... or ?lat=&lng=&radius=
+    if (path.startsWith('geo/') && TABLES_BY_PATH[path.slice('geo/'.length)]) {
+      const query = parseSpatialParams(url.searchParams);
+      if (query.error) {
+        return NextResponse.json({ error: query.error }, { status: 400 });
       }
       
-      return NextResponse.json(data || []);
+      const { rows, matched, candidates, indexed } = await querySpatial(TABLES_BY_PATH[path.slice('geo/'.length)], query);
+      const entry = listEntry(rows, negotiateFormat(request.headers.get('accept')), {
+        'X-Spatial-Matched': String(matched),
+        'X-Spatial-Candidates': String(candidates),
+        'X-Spatial-Indexed': String(indexed)
+      });
+      return cachedResponse(request, entry, 'BYPASS');
     }
     
+    setRoute('unmatched');
     return NextResponse.json({ message: 'API endpoint not found' }, { status: 404 });
     
   } catch (error) {
     console.error('API Error:', error);
+    noteError(error);
     return NextResponse.json({ error: 'Internal server error' }, { status: 500 });
   }
 }
 
-export async function POST(request) {
+async function handlePost(request) {
   const url = new URL(request.url);
   const path = url.pathname.replace('/api/', '');
   
   try {
-    const body = await request.json();
-    
-    // User authentication
-    if (path === 'auth/login') {
-      const { email, password } = body;
-      const { data, error } = await supabase.auth.signInWithPassword({
-        email,
-        password
-      });
-      
-      if (error) {
-        return NextResponse.json({ error: error.message }, { status: 400 });
+    const { principal, response: denied } = await authorize(request, url, path);
+    if (denied) {
+      return denied;
+    }
+    
+    // Upload photo bytes (multipart `file`, optional `thumbnail`); returns compact URLs
+    if (path === 'photos/upload') {
+      const form = await readUploadForm(request);
+      if (form.error) {
+        return NextResponse.json({ error: form.error }, { status: form.status });
       }
+      const file = form.data.get('file');
+      const thumbnail = form.data.get('thumbnail');
       
-      // Get user profile
-      const { data: userProfile, error: profileError } = await supabase
-        .from('users')
-        .select('*')
-        .eq('id', data.user.id)
-        .single();
-      
-      if (profileError) {
-        return NextResponse.json({ error: 'User profile not found' }, { status: 400 });
+      if (!file || typeof file === 'string') {
+        return NextResponse.json({ error: 'file is required' }, { status: 400 });
+      }
+      if (file.size > MAX_UPLOAD_BYTES) {
+        return NextResponse.json({ error: 'File too large' }, { status: 413 });
       }
       
-      return NextResponse.json({ 
-        user: data.user, 
-        profile: userProfile,
-        session: data.session 
-      });
+      const [image, thumbnailImage] = await timed('parse', Promise.all([
+        file.arrayBuffer().then((bytes) => Buffer.from(bytes)),
+        thumbnail && typeof thumbnail !== 'string' ? thumbnail.arrayBuffer().then((bytes) => Buffer.from(bytes)) : null
+      ]));
+      const stored = await putImage(image, thumbnailImage);
+      return json(stored);
     }
     
-    // User registration
-    if (path === 'auth/register') {
-      const { email, password, fullName, role = 'agent' } = body;
-      
-      const { data, error } = await supabase.auth.signUp({
-        email,
-        password
-      });
-      
-      if (error) {
-        return NextResponse.json({ error: error.message }, { status: 400 });
+    // Bulk lead import: a CSV (with header row) or NDJSON body of any size, read as a stream.
+    // ?user_id= assigns rows that don't name an agent; the response reports per-row problems.
+    if (path === 'leads/import') {
+      const format = leadFormat(url, request.headers.get('content-type'));
+      if (!format || !request.body) {
+        return NextResponse.json({ error: 'Send a CSV or NDJSON body (format=csv|ndjson)' }, { status: 400 });
       }
       
-      // Create user profile
-      const { data: userProfile, error: profileError } = await supabase
-        .from('users')
-        .insert([{
-          id: data.user.id,
-          email: email,
-          full_name: fullName,
-          role: role,
-          created_at: new Date().toISOString()
-        }])
-        .select()
-        .single();
-      
-      if (profileError) {
-        return NextResponse.json({ error: profileError.message }, { status: 500 });
+      let bytes = request.body;
+      if ((request.headers.get('content-encoding') || '').trim().toLowerCase() === 'gzip') {
+        bytes = bytes.pipeThrough(new DecompressionStream('gzip'));
       }
-      
-      return NextResponse.json({ 
-        user: data.user, 
-        profile: userProfile 
+      const report = await importLeads(bytes.pipeThrough(new TextDecoderStream()), {
+        format,
+        defaultUserId: url.searchParams.get('user_id')
       });
+      if (report.inserted) {
+        responseCache.invalidate('leads');
+      }
+      return json(report);
     }
     
-    // Upload photo with location
-    if (path === 'photos') {
-      const { user_id, image_url, latitude, longitude, description } = body;
-      
-      const { data, error } = await supabase
-        .from('photos')
-        .insert([{
-          user_id: user_id,
-          image_url: image_url,
-          latitude: latitude,
-          longitude: longitude,
-          description: description || '',
-          created_at: new Date().toISOString()
-        }])
-        .select(`
-          *,
-          users (
-            id,
-            full_name,
-            role
-          )
-        `)
-        .single();
-      
-      if (error) {
-        return NextResponse.json({ error: error.message }, { status: 500 });
-      }
-      
-      return NextResponse.json(data);
+    const body = await readJson(request);
+    
+    // A retry carrying the same Idempotency-Key gets the first attempt's response instead of writing again
+    const idempotencyKey = request.headers.get('idempotency-key');
+    if (idempotencyKey !== null && IDEMPOTENT_PATHS.has(path)) {
+      return idempotentWrite(principal, path, idempotencyKey, body);
     }
     
-    // Record GPS tracking
-    if (path === 'gps-tracking') {
-      const { user_id, latitude, longitude, activity_type = 'active' } = body;
-      
-      const { data, error } = await supabase
-        .from('gps_tracking')
-        .insert([{
-          user_id: user_id,
-          latitude: latitude,
-          longitude: longitude,
-          activity_type: activity_type,
-          timestamp: new Date().toISOString()
-        }])
-        .select(`
-          *,
-          users (
-            id,
-            full_name,
-            role
-          )
-        `)
-        .single();
-      
-      if (error) {
-        return NextResponse.json({ error: error.message }, { status: 500 });
+    return await handleJsonPost(path, body, principal);
+    
+  } catch (error) {
+    console.error('API Error:', error);
+    noteError(error);
+    return NextResponse.json({ error: 'Internal server error' }, { status: 500 });
+  }
+}
+
+// POST endpoints with a JSON body; errors propagate to handlePost
+async function handleJsonPost(path, body, principal) {
+  // User authentication
+  if (path === 'auth/login') {
+    const { email, password } = body;
+    const { data, error } = await timed('db', supabase.auth.signInWithPassword({
+      email,
+      password
+    }));
+    
+    if (error) {
+      return NextResponse.json({ error: error.message }, { status: 400 });
+    }
+    
+    // Get user profile
+    const { data: userProfile, error: profileError } = await timed('db', supabase
+      .from('users')
+      .select('*')
+      .eq('id', data.user.id)
+      .single());
+    
+    if (profileError) {
+      return NextResponse.json({ error: 'User profile not found' }, { status: 400 });
+    }
+    
+    noteUser({ id: userProfile.id, role: userProfile.role });
+    return json({ 
+      user: data.user, 
+      profile: userProfile,
+      session: data.session 
+    });
+  }
+  
+  // User registration
+  if (path === 'auth/register') {
+    const { email, password, fullName } = body;
+    const role = registrationRole(email);
+    
+    const { data, error } = await timed('db', supabase.auth.signUp({
+      email,
+      password
+    }));
+    
+    if (error) {
+      return NextResponse.json({ error: error.message }, { status: 400 });
+    }
+    
+    // Create user profile
+    const { data: userProfile, error: profileError } = await timed('db', supabase
+      .from('users')
+      .insert([{
+        id: data.user.id,
+        email: email,
+        full_name: fullName,
+        role: role,
+        created_at: new Date().toISOString()
+      }])
+      .select()
+      .single());
+    
+    if (profileError) {
+      return NextResponse.json({ error: profileError.message }, { status: 500 });
+    }
+    
+    responseCache.invalidate('users');
+    publish('users', userProfile);
+    noteUser({ id: userProfile.id, role: userProfile.role });
+    return json({ 
+      user: data.user, 
+      profile: userProfile 
+    });
+  }
+  
+  // Upload photo with location
+  if (path === 'photos') {
+    const { user_id = principal.id, image_url, latitude, longitude, description } = body;
+    if (!canActFor(principal, user_id)) {
+      return forbidden();
+    }
+    
+    const row = {
+      user_id: user_id,
+      image_url: image_url,
+      latitude: latitude,
+      longitude: longitude,
+      description: description || '',
+      created_at: new Date().toISOString()
+    };
+    if (WRITE_BEHIND) {
+      return queueWrite('photos', [row], { row: withThumbnail(row) });
+    }
+    
+    const { data, error } = await timed('db', supabase
+      .from('photos')
+      .insert([row])
+      .select(`
+        *,
+        users (
+          id,
+          full_name,
+          role
+        )
+      `)
+      .single());
+    
+    if (error) {
+      return NextResponse.json({ error: error.message }, { status: 500 });
+    }
+    
+    responseCache.invalidate('photos');
+    const photo = withThumbnail(data);
+    publish('photos', photo);
+    return json(photo);
+  }
+  
+  // Record GPS tracking
+  if (path === 'gps-tracking') {
+    const { user_id = principal.id, latitude, longitude, activity_type = 'active' } = body;
+    if (!canActFor(principal, user_id)) {
+      return forbidden();
+    }
+    
+    if (WRITE_BEHIND) {
+      // Nothing will reject a bad fix before it is acknowledged, so check it here
+      const { row, error: validationError } = toGpsRow({ user_id, latitude, longitude, activity_type });
+      if (validationError) {
+        return NextResponse.json({ error: validationError }, { status: 400 });
       }
-      
-      return NextResponse.json(data);
+      return queueWrite('gps_tracking', [row], { row });
     }
     
-    // Create lead
-    if (path === 'leads') {
-      const { user_id, contact_name, contact_phone, contact_email, business_name, latitude, longitude, notes } = body;
-      
-      const { data, error } = await supabase
-        .from('leads')
-        .insert([{
-          user_id: user_id,
-          contact_name: contact_name,
-          contact_phone: contact_phone,
-          contact_email: contact_email,
-          business_name: business_name,
-          latitude: latitude,
-          longitude: longitude,
-          notes: notes || '',
-          created_at: new Date().toISOString()
-        }])
-        .select(`
-          *,
-          users (
-            id,
-            full_name,
-            role
-          )
-        `)
-        .single();
-      
-      if (error) {
-        return NextResponse.json({ error: error.message }, { status: 500 });
+    const { data, error } = await timed('db', supabase
+      .from('gps_tracking')
+      .insert([{
+        user_id: user_id,
+        latitude: latitude,
+        longitude: longitude,
+        activity_type: activity_type,
+        timestamp: new Date().toISOString()
+      }])
+      .select(`
+        *,
+        users (
+          id,
+          full_name,
+          role
+        )
+      `)
+      .single());
+    
+    if (error) {
+      return NextResponse.json({ error: error.message }, { status: 500 });
+    }
+    
+    responseCache.invalidate('gps_tracking');
+    publish('gps_tracking', data);
+    return json(data);
+  }
+  
+  // Record a batch of buffered GPS fixes in a single insert. Fixes carrying an idempotency_key
+  // that was already recorded (or repeats earlier in the batch) are skipped and counted as duplicates.
+  if (path === 'gps-tracking/batch') {
+    const { rows: validRows, keys, error: validationError, details, status } = toGpsRows(body);
+    if (validationError) {
+      return NextResponse.json({ error: validationError, details }, { status });
+    }
+    if (validRows.some((row) => !canActFor(principal, row.user_id))) {
+      return forbidden();
+    }
+    
+    const { fresh, reserved } = reserveKeys(keys.map((key, index) => key && `fix:${validRows[index].user_id}:${key}`));
+    const rows = validRows.filter((row, index) => fresh[index]);
+    const duplicates = validRows.length - rows.length;
+    if (!rows.length) {
+      return json({ inserted: 0, duplicates });
+    }
+    if (WRITE_BEHIND) {
+      const response = await queueWrite('gps_tracking', rows, { duplicates });
+      if (response.status !== 202) {
+        releaseKeys(reserved);
       }
-      
-      return NextResponse.json(data);
+      return response;
     }
     
-    return NextResponse.json({ message: 'API endpoint not found' }, { status: 404 });
+    // Only ids come back; the client already has the fixes it sent and no join is needed
+    const { data, error } = await timed('db', supabase
+      .from('gps_tracking')
+      .insert(rows)
+      .select('id'));
     
-  } catch (error) {
-    console.error('API Error:', error);
-    return NextResponse.json({ error: 'Internal server error' }, { status: 500 });
+    if (error) {
+      releaseKeys(reserved);
+      return NextResponse.json({ error: error.message }, { status: 500 });
+    }
+    
+    await noteLateFixes(rows);
+    responseCache.invalidate('gps_tracking');
+    publishAll('gps_tracking', rows.map((row, index) => ({ ...row, id: data?.[index]?.id })));
+    return json({ inserted: rows.length, duplicates });
   }
+  
+  // Age old raw GPS fixes into compact per-agent daily tracks
+  if (path === 'tracks/compact') {
+    const { before = retentionCutoff(), user_id = null, max_days = MAX_COMPACT_DAYS } = body;
+    if (!dayBounds(before) || before > new Date().toISOString().slice(0, 10)) {
+      return NextResponse.json({ error: 'before must be a YYYY-MM-DD date no later than today' }, { status: 400 });
+    }
+    
+    const summary = await runRetention({
+      before,
+      userId: user_id,
+      maxDays: Math.min(Math.max(parseInt(max_days, 10) || 1, 1), MAX_COMPACT_DAYS)
+    });
+    return json(summary);
+  }
+  
+  // Create lead
+  if (path === 'leads') {
+    const { user_id = principal.id, contact_name, contact_phone, contact_email, business_name, latitude, longitude, notes } = body;
+    if (!canActFor(principal, user_id)) {
+      return forbidden();
+    }
+    
+    const row = {
+      user_id: user_id,
+      contact_name: contact_name,
+      contact_phone: contact_phone,
+      contact_email: contact_email,
+      business_name: business_name,
+      latitude: latitude,
+      longitude: longitude,
+      notes: notes || '',
+      created_at: new Date().toISOString()
+    };
+    if (WRITE_BEHIND) {
+      return queueWrite('leads', [row], { row });
+    }
+    
+    const { data, error } = await timed('db', supabase
+      .from('leads')
+      .insert([row])
+      .select(`
+        *,
+        users (
+          id,
+          full_name,
+          role
+        )
+      `)
+      .single());
+    
+    if (error) {
+      return NextResponse.json({ error: error.message }, { status: 500 });
+    }
+    
+    responseCache.invalidate('leads');
+    publish('leads', data);
+    return json(data);
+  }
+  
+  // Remove a test namespace's users and everything they own (TEST_CLEANUP=on only). The caller
+  // must be one of the namespace's own admins, so a test run can only clean up after itself.
+  if (path === 'testing/cleanup') {
+    const { namespace } = body;
+    if (!validNamespace(namespace)) {
+      return NextResponse.json({ error: 'namespace must be 6-63 lowercase letters, digits or hyphens' }, { status: 400 });
+    }
+    if (!inNamespace(principal.email, namespace)) {
+      return NextResponse.json({ error: 'Only an admin in the namespace may remove it' }, { status: 403 });
+    }
+    
+    const { ids, removed } = await removeNamespace(namespace);
+    forgetUsers(ids);
+    forgetSpatialUsers(ids);
+    responseCache.invalidate(...OWNED_TABLES, 'users');
+    SYNC_TABLES.forEach(markTableReset);
+    refreshSummary();
+    return json({ namespace, removed });
+  }
+  
+  setRoute('unmatched');
+  return NextResponse.json({ message: 'API endpoint not found' }, { status: 404 });
 }
 
-export async function PUT(request) {
+async function handlePut(request) {
   const url = new URL(request.url);
   const path = url.pathname.replace('/api/', '');
   
   try {
-    const body = await request.json();
+    const { principal, response: denied } = await authorize(request, url, path);
+    if (denied) {
+      return denied;
+    }
+    
+    const body = await readJson(request);
     
     // Update user role
     if (path.startsWith('users/') && path.includes('/role')) {
       const userId = path.split('/')[1];
       const { role } = body;
+      if (!ROLES.includes(role)) {
+        return NextResponse.json({ error: `role must be one of: ${ROLES.join(', ')}` }, { status: 400 });
+      }
       
-      const { data, error } = await supabase
+      const { data, error } = await timed('db', supabase
         .from('users')
         .update({ role: role })
         .eq('id', userId)
         .select()
-        .single();
+        .single());
       
       if (error) {
         return NextResponse.json({ error: error.message }, { status: 500 });
       }
       
-      return NextResponse.json(data);
+      responseCache.invalidate('users');
+      publish('users', data);
+      return json(data);
     }
     
+    setRoute('unmatched');
     return NextResponse.json({ message: 'API endpoint not found' }, { status: 404 });
     
   } catch (error) {
     console.error('API Error:', error);
+    noteError(error);
     return NextResponse.json({ error: 'Internal server error' }, { status: 500 });
   }
-}
\ No newline at end of file
+}
+
+// Every path the API serves without an id in it
+const ROUTES = new Set([
+  'health', 'metrics', 'stream', 'sync', 'auth/login', 'auth/register', 'auth/user', 'users',
+  'photos', 'photos/upload', 'leads', 'leads/import', 'leads/export', 'gps-tracking', 'gps-tracking/batch',
+  'tracks', 'tracks/hourly', 'tracks/compact', 'dashboard/summary', 'write-queue', 'capture', 'testing/cleanup',
+  ...Object.keys(TABLES_BY_PATH).map((name) => `geo/${name}`)
+]);
+
+// Endpoint label for metrics, settled before authentication so every response is recorded under a
+// fixed set of labels: the API path with ids and keys collapsed, or 'unmatched' for anything else
+function routeLabel(request) {
+  const path = new URL(request.url).pathname.replace('/api/', '');
+  if (ROUTES.has(path)) return path;
+  if (/^blobs\/[^/]+$/.test(path)) return 'blobs/:key';
+  if (/^users\/[^/]+\/role$/.test(path)) return 'users/:id/role';
+  return 'unmatched';
+}
+
+export function GET(request) {
+  return withTiming(request, routeLabel(request), handleGet);
+}
+
+export function POST(request) {
+  return withTiming(request, routeLabel(request), handlePost);
+}
+
+export function PUT(request) {
+  return withTiming(request, routeLabel(request), handlePut);
+}
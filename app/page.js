@@ -10,6 +10,12 @@ import { Tabs, TabsContent, TabsList, TabsTrigger } from '@/components/ui/tabs'
 import { Textarea } from '@/components/ui/textarea'
 import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from '@/components/ui/select'
 import { MapPin, Camera, Users, BarChart3, PlusCircle, Upload, LogOut } from 'lucide-react'
+import { bufferGpsFix, clearGpsFixes, flushGpsFixes, pendingGpsFixCount, GPS_FLUSH_SIZE, GPS_FLUSH_INTERVAL } from '@/lib/gpsBuffer'
+import { apiFetch, streamUrl, submissionKey, submissionDone, currentUserId } from '@/lib/session'
+import { loadSyncedData, syncNow, clearSyncedData } from '@/lib/syncStore'
+
+// List responses fetched with ?users=dict carry each author once; put them back on the rows
+const withAuthors = ({ rows, users }) => rows.map((row) => ({ ...row, users: users[row.user_id] ?? null }))
 
 export default function FieldManagementApp() {
   const [user, setUser] = useState(null)
@@ -18,12 +24,13 @@ export default function FieldManagementApp() {
   const [leads, setLeads] = useState([])
   const [users, setUsers] = useState([])
   const [gpsTracking, setGpsTracking] = useState([])
+  const [summary, setSummary] = useState(null)
   const [isLoading, setIsLoading] = useState(false)
 
   // Auth state
   const [showLogin, setShowLogin] = useState(true)
   const [loginData, setLoginData] = useState({ email: '', password: '' })
-  const [registerData, setRegisterData] = useState({ email: '', password: '', fullName: '', role: 'agent' })
+  const [registerData, setRegisterData] = useState({ email: '', password: '', fullName: '' })
 
   // Photo upload state
   const [photoData, setPhotoData] = useState({ description: '' })
@@ -62,35 +69,66 @@ export default function FieldManagementApp() {
     }
   }, [])
 
+  // The GPS list shows the latest fixes
+  const GPS_LIST_ROWS = 100
+
+  const showSynced = (data) => {
+    setPhotos(data.photos)
+    setLeads(data.leads)
+    setUsers(data.users)
+    setGpsTracking(data.gps_tracking.slice(0, GPS_LIST_ROWS))
+  }
+
+  // Without IndexedDB, fetch each list in full
+  const loadLists = async () => {
+    // Load photos
+    const photosRes = await apiFetch('/api/photos?users=dict')
+    if (photosRes.ok) {
+      setPhotos(withAuthors(await photosRes.json()))
+    }
+
+    // Load leads
+    const leadsRes = await apiFetch('/api/leads?users=dict')
+    if (leadsRes.ok) {
+      setLeads(withAuthors(await leadsRes.json()))
+    }
+
+    if (user?.profile?.role === 'admin') {
+      const usersRes = await apiFetch('/api/users')
+      if (usersRes.ok) {
+        const usersData = await usersRes.json()
+        setUsers(usersData)
+      }
+
+      // Load GPS tracking
+      const gpsRes = await apiFetch('/api/gps-tracking')
+      if (gpsRes.ok) {
+        const gpsData = await gpsRes.json()
+        setGpsTracking(gpsData)
+      }
+    }
+  }
+
   const loadDashboardData = async () => {
     try {
-      // Load photos
-      const photosRes = await fetch('/api/photos')
-      if (photosRes.ok) {
-        const photosData = await photosRes.json()
-        setPhotos(photosData)
+      // Show what was synced last time straight away, then fetch only what changed since
+      const owner = currentUserId()
+      const cached = await loadSyncedData(owner)
+      if (cached) {
+        showSynced(cached)
       }
-
-      // Load leads
-      const leadsRes = await fetch('/api/leads')
-      if (leadsRes.ok) {
-        const leadsData = await leadsRes.json()
-        setLeads(leadsData)
+      const synced = await syncNow(owner)
+      if (synced) {
+        showSynced(synced)
+      } else {
+        await loadLists()
       }
 
-      // Load users (for admin)
+      // Load dashboard aggregates (for admin)
       if (user?.profile?.role === 'admin') {
-        const usersRes = await fetch('/api/users')
-        if (usersRes.ok) {
-          const usersData = await usersRes.json()
-          setUsers(usersData)
-        }
-
-        // Load GPS tracking
-        const gpsRes = await fetch('/api/gps-tracking')
-        if (gpsRes.ok) {
-          const gpsData = await gpsRes.json()
-          setGpsTracking(gpsData)
+        const summaryRes = await apiFetch('/api/dashboard/summary')
+        if (summaryRes.ok) {
+          setSummary(await summaryRes.json())
         }
       }
     } catch (error) {
@@ -175,7 +213,7 @@ export default function FieldManagementApp() {
       if (response.ok) {
         alert('Registration successful! Please login.')
         setShowLogin(true)
-        setRegisterData({ email: '', password: '', fullName: '', role: 'agent' })
+        setRegisterData({ email: '', password: '', fullName: '' })
       } else {
         throw new Error(data.error || 'Registration failed')
       }
@@ -187,6 +225,28 @@ export default function FieldManagementApp() {
     }
   }
 
+  // Downscale a photo in the browser so list views can load a small variant
+  const createThumbnail = (file, maxSize = 320) => new Promise((resolve, reject) => {
+    const objectUrl = URL.createObjectURL(file)
+    const image = new Image()
+    image.onload = () => {
+      const scale = Math.min(1, maxSize / Math.max(image.width, image.height))
+      const canvas = document.createElement('canvas')
+      canvas.width = Math.round(image.width * scale)
+      canvas.height = Math.round(image.height * scale)
+      canvas.getContext('2d').drawImage(image, 0, 0, canvas.width, canvas.height)
+      canvas.toBlob((blob) => {
+        URL.revokeObjectURL(objectUrl)
+        resolve(blob)
+      }, 'image/jpeg', 0.7)
+    }
+    image.onerror = (error) => {
+      URL.revokeObjectURL(objectUrl)
+      reject(error)
+    }
+    image.src = objectUrl
+  })
+
   const handlePhotoUpload = async (e) => {
     e.preventDefault()
     if (!selectedFile || !currentLocation) {
@@ -197,38 +257,52 @@ export default function FieldManagementApp() {
     setIsLoading(true)
 
     try {
-      // Convert file to base64 for simple storage (in production, use proper file upload)
-      const reader = new FileReader()
-      reader.onloadend = async () => {
-        const base64Image = reader.result
-
-        const response = await fetch('/api/photos', {
-          method: 'POST',
-          headers: {
-            'Content-Type': 'application/json',
-          },
-          body: JSON.stringify({
-            user_id: user.user.id,
-            image_url: base64Image,
-            latitude: currentLocation.latitude,
-            longitude: currentLocation.longitude,
-            description: photoData.description,
-          }),
-        })
-
-        const data = await response.json()
+      // Upload the binary once; the photo row only stores the returned URL
+      const form = new FormData()
+      form.append('file', selectedFile)
+      try {
+        form.append('thumbnail', await createThumbnail(selectedFile), 'thumbnail.jpg')
+      } catch (thumbnailError) {
+        console.error('Thumbnail generation failed:', thumbnailError)
+      }
 
-        if (response.ok) {
-          setPhotos([data, ...photos])
-          setPhotoData({ description: '' })
-          setSelectedFile(null)
-          alert('Photo uploaded successfully!')
-        } else {
-          alert(data.error || 'Photo upload failed')
-        }
+      const uploadRes = await apiFetch('/api/photos/upload', {
+        method: 'POST',
+        body: form,
+      })
+      const stored = await uploadRes.json()
+      if (!uploadRes.ok) {
+        throw new Error(stored.error || 'Upload failed')
       }
 
-      reader.readAsDataURL(selectedFile)
+      const body = JSON.stringify({
+        user_id: user.user.id,
+        image_url: stored.image_url,
+        latitude: currentLocation.latitude,
+        longitude: currentLocation.longitude,
+        description: photoData.description,
+      })
+      const response = await apiFetch('/api/photos', {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+          'Idempotency-Key': submissionKey('photo', body),
+        },
+        body,
+      })
+
+      const data = await response.json()
+
+      if (response.ok) {
+        submissionDone('photo')
+        // In write-behind mode (202) the row has no id until it is drained into the database
+        setPhotos([response.status === 202 ? { ...data.row, id: `queued-${data.sequence}` } : data, ...photos])
+        setPhotoData({ description: '' })
+        setSelectedFile(null)
+        alert('Photo uploaded successfully!')
+      } else {
+        alert(data.error || 'Photo upload failed')
+      }
     } catch (error) {
       alert('Photo upload failed: ' + error.message)
     } finally {
@@ -246,23 +320,26 @@ export default function FieldManagementApp() {
     setIsLoading(true)
 
     try {
-      const response = await fetch('/api/leads', {
+      const body = JSON.stringify({
+        user_id: user.user.id,
+        ...leadData,
+        latitude: currentLocation.latitude,
+        longitude: currentLocation.longitude,
+      })
+      const response = await apiFetch('/api/leads', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          'Idempotency-Key': submissionKey('lead', body),
         },
-        body: JSON.stringify({
-          user_id: user.user.id,
-          ...leadData,
-          latitude: currentLocation.latitude,
-          longitude: currentLocation.longitude,
-        }),
+        body,
       })
 
       const data = await response.json()
 
       if (response.ok) {
-        setLeads([data, ...leads])
+        submissionDone('lead')
+        setLeads([response.status === 202 ? { ...data.row, id: `queued-${data.sequence}` } : data, ...leads])
         setLeadData({
           contact_name: '',
           contact_phone: '',
@@ -281,33 +358,40 @@ export default function FieldManagementApp() {
     }
   }
 
+  const flushGPSBuffer = async () => {
+    try {
+      await flushGpsFixes()
+    } catch (error) {
+      // Fixes stay buffered and are retried on the next flush
+      console.error('GPS tracking error:', error)
+    }
+  }
+
   const startGPSTracking = async () => {
     if (!currentLocation) {
       alert('Please enable location services')
       return
     }
 
-    try {
-      await fetch('/api/gps-tracking', {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({
-          user_id: user.user.id,
-          latitude: currentLocation.latitude,
-          longitude: currentLocation.longitude,
-          activity_type: 'active'
-        }),
-      })
-    } catch (error) {
-      console.error('GPS tracking error:', error)
+    bufferGpsFix({
+      user_id: user.user.id,
+      latitude: currentLocation.latitude,
+      longitude: currentLocation.longitude,
+      activity_type: 'active'
+    })
+
+    if (pendingGpsFixCount() >= GPS_FLUSH_SIZE) {
+      await flushGPSBuffer()
     }
   }
 
-  const handleLogout = () => {
+  const handleLogout = async () => {
+    // Send buffered fixes while the session is still here; anything left can't go under the next one
+    await flushGPSBuffer()
+    clearGpsFixes()
     setUser(null)
     localStorage.removeItem('fieldapp_user')
+    clearSyncedData()
     setPhotos([])
     setLeads([])
     setUsers([])
@@ -316,7 +400,7 @@ export default function FieldManagementApp() {
 
   const updateUserRole = async (userId, newRole) => {
     try {
-      const response = await fetch(`/api/users/${userId}/role`, {
+      const response = await apiFetch(`/api/users/${userId}/role`, {
         method: 'PUT',
         headers: {
           'Content-Type': 'application/json',
@@ -343,6 +427,46 @@ export default function FieldManagementApp() {
     }
   }, [user, currentLocation])
 
+  // Admins receive new rows as they are written instead of re-fetching whole lists
+  useEffect(() => {
+    if (user?.profile?.role !== 'admin') return
+    const source = new EventSource(streamUrl('/api/stream'))
+    const prepend = (setter, limit) => (event) => {
+      const row = JSON.parse(event.data)
+      setter((current) => [row, ...current.filter((item) => item.id !== row.id)].slice(0, limit))
+    }
+    // Keep the dashboard totals and activity feed current without re-fetching the summary
+    const count = (table, type, describe) => (event) => {
+      const row = JSON.parse(event.data)
+      setSummary((current) => current && {
+        ...current,
+        totals: { ...current.totals, [table]: current.totals[table] + 1 },
+        recent_activity: [
+          { type, id: row.id, user_id: row.user_id, full_name: row.users?.full_name, summary: describe(row), created_at: row.created_at },
+          ...current.recent_activity
+        ].slice(0, current.recent_activity.length || 5)
+      })
+    }
+    source.addEventListener('photos', prepend(setPhotos))
+    source.addEventListener('photos', count('photos', 'photo', (row) => row.description))
+    source.addEventListener('leads', prepend(setLeads))
+    source.addEventListener('leads', count('leads', 'lead', (row) => [row.contact_name, row.business_name].filter(Boolean).join(', ')))
+    source.addEventListener('gps_tracking', prepend(setGpsTracking, 100))
+    return () => source.close()
+  }, [user])
+
+  // Send buffered fixes periodically and as soon as the device is back online
+  useEffect(() => {
+    if (!user) return
+    flushGPSBuffer()
+    const interval = setInterval(flushGPSBuffer, GPS_FLUSH_INTERVAL)
+    window.addEventListener('online', flushGPSBuffer)
+    return () => {
+      clearInterval(interval)
+      window.removeEventListener('online', flushGPSBuffer)
+    }
+  }, [user])
+
   if (!user) {
     return (
       <div className="min-h-screen bg-gradient-to-br from-blue-50 to-indigo-100 flex items-center justify-center p-4">
@@ -420,18 +544,6 @@ export default function FieldManagementApp() {
                     required
                   />
                 </div>
-                <div>
-                  <Label htmlFor="role">Role</Label>
-                  <Select value={registerData.role} onValueChange={(value) => setRegisterData({ ...registerData, role: value })}>
-                    <SelectTrigger>
-                      <SelectValue />
-                    </SelectTrigger>
-                    <SelectContent>
-                      <SelectItem value="agent">Field Agent</SelectItem>
-                      <SelectItem value="admin">Administrator</SelectItem>
-                    </SelectContent>
-                  </Select>
-                </div>
                 <Button type="submit" className="w-full" disabled={isLoading}>
                   {isLoading ? 'Creating Account...' : 'Create Account'}
                 </Button>
@@ -537,7 +649,8 @@ export default function FieldManagementApp() {
                   <div className="aspect-square bg-muted">
                     {photo.image_url && (
                       <img
-                        src={photo.image_url}
+                        src={photo.thumbnail_url || photo.image_url}
+                        loading="lazy"
                         alt={photo.description}
                         className="w-full h-full object-cover"
                       />
@@ -672,7 +785,7 @@ export default function FieldManagementApp() {
                     <Camera className="h-4 w-4 text-muted-foreground" />
                   </CardHeader>
                   <CardContent>
-                    <div className="text-2xl font-bold">{photos.length}</div>
+                    <div className="text-2xl font-bold">{summary?.totals.photos ?? photos.length}</div>
                   </CardContent>
                 </Card>
                 <Card>
@@ -681,7 +794,7 @@ export default function FieldManagementApp() {
                     <Users className="h-4 w-4 text-muted-foreground" />
                   </CardHeader>
                   <CardContent>
-                    <div className="text-2xl font-bold">{leads.length}</div>
+                    <div className="text-2xl font-bold">{summary?.totals.leads ?? leads.length}</div>
                   </CardContent>
                 </Card>
                 <Card>
@@ -690,7 +803,12 @@ export default function FieldManagementApp() {
                     <BarChart3 className="h-4 w-4 text-muted-foreground" />
                   </CardHeader>
                   <CardContent>
-                    <div className="text-2xl font-bold">{users.length}</div>
+                    <div className="text-2xl font-bold">{summary?.active_agents.count ?? users.length}</div>
+                    {summary && (
+                      <p className="text-xs text-muted-foreground">
+                        of {summary.totals.users} • last {summary.active_agents.window_minutes} min
+                      </p>
+                    )}
                   </CardContent>
                 </Card>
               </div>
@@ -702,23 +820,20 @@ export default function FieldManagementApp() {
                 </CardHeader>
                 <CardContent>
                   <div className="space-y-4">
-                    {[...photos.slice(0, 3), ...leads.slice(0, 3)]
-                      .sort((a, b) => new Date(b.created_at) - new Date(a.created_at))
-                      .slice(0, 5)
-                      .map((item, index) => (
-                        <div key={index} className="flex items-center space-x-4">
-                          <div className="w-2 h-2 rounded-full bg-primary"></div>
-                          <div className="flex-1">
-                            <p className="text-sm">
-                              {item.description || item.contact_name} 
-                              {item.image_url ? ' uploaded a photo' : ' captured a lead'}
-                            </p>
-                            <p className="text-xs text-muted-foreground">
-                              By {item.users?.full_name} • {new Date(item.created_at).toLocaleDateString()}
-                            </p>
-                          </div>
+                    {(summary?.recent_activity || []).map((item) => (
+                      <div key={`${item.type}-${item.id}`} className="flex items-center space-x-4">
+                        <div className="w-2 h-2 rounded-full bg-primary"></div>
+                        <div className="flex-1">
+                          <p className="text-sm">
+                            {item.summary} 
+                            {item.type === 'photo' ? ' uploaded a photo' : ' captured a lead'}
+                          </p>
+                          <p className="text-xs text-muted-foreground">
+                            By {item.full_name} • {new Date(item.created_at).toLocaleDateString()}
+                          </p>
                         </div>
-                      ))}
+                      </div>
+                    ))}
                   </div>
                 </CardContent>
               </Card>
@@ -5,10 +5,27 @@ Tests all backend endpoints with Supabase integration
 """
 
 import requests
+import base64
+import csv
+import gzip
+import io
 import json
+import math
+import random
+import statistics
+import threading
 import uuid
 import time
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from api_client import (APIClient, PhaseRecorder, parse_server_timing, decode_list, admin_client, grant_admin,
+                        JSON_TYPE, COLUMNS_TYPE, DELTA_TYPE)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 # Configuration
 BASE_URL = "http://localhost:3000/api"
@@ -30,14 +47,91 @@ TEST_USER_DATA = {
     }
 }
 
+# Smallest valid PNG (1x1 pixel) used for blob upload tests
+TEST_PNG_BYTES = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=="
+)
+
 # GPS coordinates for testing (New York City area)
 TEST_GPS_COORDS = {
     "latitude": 40.7128,
     "longitude": -74.0060
 }
 
+def haversine_meters(lat1, lng1, lat2, lng2):
+    """Great-circle distance in meters, matching the server's spatial filter"""
+    d_lat = math.radians(lat2 - lat1)
+    d_lng = math.radians(lng2 - lng1)
+    a = (math.sin(d_lat / 2) ** 2
+         + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(d_lng / 2) ** 2)
+    return 2 * 6371008.8 * math.asin(min(1.0, math.sqrt(a)))
+
+def decode_polyline(encoded):
+    """Decode a Google encoded polyline into (latitude, longitude) tuples"""
+    points, index, lat, lng = [], 0, 0, 0
+    while index < len(encoded):
+        deltas = []
+        for _ in range(2):
+            shift, result = 0, 0
+            while True:
+                byte = ord(encoded[index]) - 63
+                index += 1
+                result |= (byte & 0x1f) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lng += deltas[1]
+        points.append((lat / 1e5, lng / 1e5))
+    return points
+
+def wait_for_ready(timeout=60, interval=0.5, base_url=BASE_URL, client=None):
+    """Poll /api/health until the backend reports a healthy database; returns the report or None"""
+    client = client or APIClient(base_url, retries=0)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            response = client.get("health", timeout=5)
+            if response.status_code == 200:
+                return response.json()
+        except requests.RequestException:
+            pass
+        time.sleep(interval)
+    return None
+
+def iter_paginated(endpoint, page_size=100, fields=None, base_url=BASE_URL, client=None):
+    """Yield rows from a list endpoint page by page using its X-Next-Cursor header"""
+    client = client or APIClient(base_url)
+    params = {"limit": page_size}
+    if fields:
+        params["fields"] = ",".join(fields)
+    
+    while True:
+        response = client.get(endpoint, params=params, timeout=10)
+        response.raise_for_status()
+        for row in response.json():
+            yield row
+        
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return
+        params["cursor"] = cursor
+
+def print_phase_breakdown(summary):
+    """Print mean client latency per endpoint split into server phases (from Server-Timing)"""
+    columns = ("client", "network", "total", "auth", "parse", "queue", "db", "join", "serialize", "other")
+    print(f"{'Endpoint (mean ms)':<28}{'Count':>7}" + "".join(f"{column:>10}" for column in columns))
+    for endpoint in sorted(summary):
+        row = summary[endpoint]
+        print(f"{endpoint:<28}{row['count']:>7}" + "".join(f"{row[column]:>10.2f}" for column in columns))
+
 class FieldManagementAPITester:
-    def __init__(self):
+    def __init__(self, client=None):
+        # One pooled keep-alive session for the whole run, so latencies exclude connection setup;
+        # every response's Server-Timing header feeds the per-phase report
+        self.phases = PhaseRecorder()
+        self.client = client or APIClient(BASE_URL, phase_recorder=self.phases)
         self.test_results = []
         self.registered_users = {}
         self.logged_in_users = {}
@@ -63,9 +157,8 @@ class FieldManagementAPITester:
         
         for role, user_data in TEST_USER_DATA.items():
             try:
-                response = requests.post(
-                    f"{BASE_URL}/auth/register",
-                    headers=HEADERS,
+                response = self.client.post(
+                    "auth/register",
                     json=user_data,
                     timeout=10
                 )
@@ -84,6 +177,8 @@ class FieldManagementAPITester:
                             f"Successfully registered {role} user with ID: {data['user']['id']}",
                             data
                         )
+                        if role == 'admin':
+                            self.grant_admin_role(data['user']['id'], data['profile'])
                     else:
                         self.log_test(
                             f"Register {role} user",
@@ -106,6 +201,20 @@ class FieldManagementAPITester:
                     f"Registration error: {str(e)}"
                 )
     
+    def grant_admin_role(self, user_id, profile):
+        """Self-registration ignores the requested role, so the configured admin grants it"""
+        self.log_test(
+            "Self-Registration Role",
+            profile.get('role') == 'agent',
+            f"Registering with role=admin created a {profile.get('role')!r} account"
+        )
+        try:
+            with admin_client(BASE_URL, retries=0) as admin:
+                self.registered_users['admin']['profile'] = grant_admin(admin, user_id)
+            self.log_test("Grant Admin Role", True, "The configured admin granted the admin role")
+        except (RuntimeError, requests.RequestException) as e:
+            self.log_test("Grant Admin Role", False, f"Could not grant the admin role: {str(e)}")
+    
     def test_user_login(self):
         """Test user login endpoint"""
         print("\n=== Testing User Login ===")
@@ -113,9 +222,8 @@ class FieldManagementAPITester:
         for role, user_info in self.registered_users.items():
             try:
                 credentials = user_info['credentials']
-                response = requests.post(
-                    f"{BASE_URL}/auth/login",
-                    headers=HEADERS,
+                response = self.client.post(
+                    "auth/login",
                     json={
                         "email": credentials['email'],
                         "password": credentials['password']
@@ -158,6 +266,133 @@ class FieldManagementAPITester:
                     False,
                     f"Login error: {str(e)}"
                 )
+        
+        # The rest of the run acts as the admin, who may read everything and write for any agent
+        if self.logged_in_users.get('admin'):
+            self.client.token = self.logged_in_users['admin']['session']['access_token']
+    
+    def test_auth_middleware(self):
+        """Test bearer-token checks, role limits and the verified-session cache under load"""
+        print("\n=== Testing Auth Middleware ===")
+        
+        admin = self.logged_in_users.get('admin')
+        if not admin:
+            self.log_test("Auth Middleware", False, "No logged-in admin available for testing")
+            return
+        
+        try:
+            credentials = {
+                "email": f"auth_{uuid.uuid4().hex[:8]}@fieldmanager.com",
+                "password": "AuthPass123!",
+                "fullName": "Auth Agent",
+                "role": "agent"
+            }
+            self.client.post("auth/register", json=credentials, timeout=10).raise_for_status()
+            agent = APIClient(BASE_URL, pool_size=8)
+            agent_id = agent.login(credentials['email'], credentials['password'])['user']['id']
+            anonymous = APIClient(BASE_URL, pool_size=1)
+            forged = APIClient(BASE_URL, pool_size=1, token=agent.token[:-4] + "AAAA")
+            
+            statuses = {
+                "anonymous photos": anonymous.get("photos", params={"limit": 1}).status_code,
+                "anonymous health": anonymous.get("health").status_code,
+                "forged token": forged.get("photos", params={"limit": 1}).status_code,
+                "agent photos": agent.get("photos", params={"limit": 1}).status_code,
+                "agent users": agent.get("users").status_code,
+                "agent lead for admin": agent.post("leads", json={
+                    "user_id": admin['user_id'], "contact_name": "Not Mine", **TEST_GPS_COORDS
+                }).status_code,
+                "agent own role": agent.put(f"users/{agent_id}/role", json={"role": "admin"}).status_code,
+            }
+            own_lead = agent.post("leads", json={"contact_name": "Auth Contact", **TEST_GPS_COORDS})
+            me = agent.get("auth/user").json().get('user', {})
+            expected = {
+                "anonymous photos": 401, "anonymous health": 200, "forged token": 401,
+                "agent photos": 200, "agent users": 403, "agent lead for admin": 403, "agent own role": 403
+            }
+            ok = (
+                statuses == expected
+                and own_lead.status_code == 200
+                and own_lead.json().get('user_id') == agent_id
+                and me.get('id') == agent_id and me.get('role') == 'agent'
+            )
+            self.log_test(
+                "Auth Access Rules",
+                ok,
+                "Missing and forged tokens rejected, admin-only and other-agent writes refused, "
+                "own writes default to the caller",
+                None if ok else {"statuses": statuses, "own_lead": own_lead.status_code, "me": me}
+            )
+            
+            # A role change reaches the cached session on its next request
+            self.client.put(f"users/{agent_id}/role", json={"role": "admin"}, timeout=10).raise_for_status()
+            promoted = agent.get("users").status_code
+            self.client.put(f"users/{agent_id}/role", json={"role": "agent"}, timeout=10).raise_for_status()
+            demoted = agent.get("users").status_code
+            self.log_test(
+                "Auth Cache Invalidation",
+                (promoted, demoted) == (200, 403),
+                f"Same token saw users list {promoted} after promotion and {demoted} after demotion"
+            )
+            agent.close()
+            anonymous.close()
+            forged.close()
+            
+            self.measure_auth_overhead(credentials)
+            
+        except Exception as e:
+            self.log_test("Auth Middleware", False, f"Auth middleware error: {str(e)}")
+    
+    def measure_auth_overhead(self, credentials, sessions=20, calls_per_session=10):
+        """Authenticated load: each new session's first request verifies the token and reads the
+        profile (no cache); the rest are served from the cache. Compares the two from Server-Timing."""
+        tokens = []
+        for _ in range(sessions):
+            login = self.client.post("auth/login", json={
+                "email": credentials['email'], "password": credentials['password']
+            }, timeout=10)
+            tokens.append(login.json()['session']['access_token'])
+        
+        def auth_ms(response):
+            timings = parse_server_timing(response.headers.get("Server-Timing"))
+            return sum(timings.get(phase, {}).get("dur", 0.0) for phase in ("auth", "db"))
+        
+        def run_session(token):
+            samples = []
+            for _ in range(calls_per_session):
+                start = time.perf_counter()
+                response = self.client.get("auth/user", headers={"Authorization": f"Bearer {token}"}, timeout=10)
+                samples.append((response.status_code, auth_ms(response), (time.perf_counter() - start) * 1000))
+            return samples
+        
+        before = self.client.get("metrics", timeout=10).text
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(run_session, tokens))
+        after = self.client.get("metrics", timeout=10).text
+        
+        def counter(text, name):
+            for line in text.splitlines():
+                if line.startswith(name + " "):
+                    return float(line.split()[-1])
+            return 0.0
+        
+        uncached = [samples[0] for samples in results]
+        cached = [sample for samples in results for sample in samples[1:]]
+        hits = counter(after, "api_auth_cache_hits_total") - counter(before, "api_auth_cache_hits_total")
+        mean = lambda values: sum(values) / len(values) if values else 0.0
+        ok = (
+            all(status == 200 for samples in results for status, _, _ in samples)
+            and hits >= len(cached)
+        )
+        self.log_test(
+            "Authenticated Load",
+            ok,
+            f"{sessions} sessions x {calls_per_session} calls: server auth overhead "
+            f"{mean([ms for _, ms, _ in uncached]):.3f}ms uncached vs {mean([ms for _, ms, _ in cached]):.3f}ms cached; "
+            f"client latency {mean([ms for _, _, ms in uncached]):.1f}ms vs {mean([ms for _, _, ms in cached]):.1f}ms; "
+            f"{int(hits)} cache hits",
+            None if ok else {"hits": hits, "statuses": [status for samples in results for status, _, _ in samples]}
+        )
     
     def test_photo_upload_api(self):
         """Test photo upload API"""
@@ -179,9 +414,8 @@ class FieldManagementAPITester:
                     "description": "Field inspection photo from downtown location"
                 }
                 
-                response = requests.post(
-                    f"{BASE_URL}/photos",
-                    headers=HEADERS,
+                response = self.client.post(
+                    "photos",
                     json=photo_data,
                     timeout=10
                 )
@@ -213,12 +447,85 @@ class FieldManagementAPITester:
             except Exception as e:
                 self.log_test("Photo Upload", False, f"Photo upload error: {str(e)}")
     
+    def test_photo_blob_upload_api(self):
+        """Test binary photo upload, blob serving and thumbnails"""
+        print("\n=== Testing Photo Blob Upload API ===")
+        
+        try:
+            files = {
+                "file": ("photo.png", TEST_PNG_BYTES, "image/png"),
+                "thumbnail": ("thumbnail.png", TEST_PNG_BYTES, "image/png")
+            }
+            response = self.client.post("photos/upload", files=files, timeout=10)
+            
+            if response.status_code != 200:
+                self.log_test(
+                    "Photo Blob Upload",
+                    False,
+                    f"Blob upload failed with status {response.status_code}",
+                    response.json() if response.content else None
+                )
+                return
+            
+            stored = response.json()
+            if not stored.get('image_url', '').startswith('/api/blobs/') or 'thumbnail_url' not in stored:
+                self.log_test("Photo Blob Upload", False, "Upload response missing compact URLs", stored)
+                return
+            self.log_test("Photo Blob Upload", True, f"Stored {stored['bytes']} bytes as {stored['image_url']}")
+            
+            # The same bytes are stored once under the same key
+            repeat = self.client.post("photos/upload", files=files, timeout=10).json()
+            self.log_test(
+                "Photo Blob Dedupe",
+                repeat.get('key') == stored['key'],
+                "Re-uploading identical bytes returned the same key"
+                if repeat.get('key') == stored['key'] else "Identical bytes were stored twice"
+            )
+            
+            for label, url in (("image", stored['image_url']), ("thumbnail", stored['thumbnail_url'])):
+                blob = self.client.get(url, timeout=10)
+                ok = (blob.status_code == 200 and blob.content == TEST_PNG_BYTES
+                      and 'immutable' in blob.headers.get('Cache-Control', ''))
+                self.log_test(
+                    f"Fetch Blob ({label})",
+                    ok,
+                    f"Fetched {len(blob.content)} bytes as {blob.headers.get('Content-Type')}"
+                    if ok else f"Blob fetch returned status {blob.status_code}"
+                )
+            
+            # A declared size over the limit is refused before any of the body is read
+            class DeclaredGiB:
+                def __len__(self):
+                    return 1024 ** 3
+                
+                def __iter__(self):
+                    yield TEST_PNG_BYTES
+            
+            oversized = self.client.post("photos/upload", data=DeclaredGiB(), headers={
+                "Content-Type": "multipart/form-data; boundary=x"
+            }, timeout=10)
+            self.log_test(
+                "Oversized Upload",
+                oversized.status_code == 413,
+                f"A 1 GiB upload returned status {oversized.status_code}"
+            )
+            
+            missing = self.client.get(f"blobs/{'0' * 64}", timeout=10)
+            self.log_test(
+                "Missing Blob",
+                missing.status_code == 404,
+                f"Unknown blob key returned status {missing.status_code}"
+            )
+            
+        except Exception as e:
+            self.log_test("Photo Blob Upload", False, f"Blob upload error: {str(e)}")
+    
     def test_get_photos_api(self):
         """Test get photos API"""
         print("\n=== Testing Get Photos API ===")
         
         try:
-            response = requests.get(f"{BASE_URL}/photos", timeout=10)
+            response = self.client.get("photos", timeout=10)
             
             if response.status_code == 200:
                 data = response.json()
@@ -270,9 +577,8 @@ class FieldManagementAPITester:
                     "notes": "Interested in enterprise field management solution. Follow up next week."
                 }
                 
-                response = requests.post(
-                    f"{BASE_URL}/leads",
-                    headers=HEADERS,
+                response = self.client.post(
+                    "leads",
                     json=lead_data,
                     timeout=10
                 )
@@ -309,7 +615,7 @@ class FieldManagementAPITester:
         print("\n=== Testing Get Leads API ===")
         
         try:
-            response = requests.get(f"{BASE_URL}/leads", timeout=10)
+            response = self.client.get("leads", timeout=10)
             
             if response.status_code == 200:
                 data = response.json()
@@ -338,6 +644,585 @@ class FieldManagementAPITester:
         except Exception as e:
             self.log_test("Get Leads", False, f"Get leads error: {str(e)}")
     
+    def test_leads_import_export(self):
+        """Test bulk lead import (validation, dedupe, quoting) and streaming export in both formats"""
+        print("\n=== Testing Lead Import/Export ===")
+        
+        agent_user = self.registered_users.get('agent')
+        if not agent_user:
+            self.log_test("Lead Import", False, "No registered agent available for testing")
+            return
+        
+        try:
+            tag = uuid.uuid4().hex[:8]
+            existing = self.client.post("leads", json={
+                "user_id": agent_user['user_id'],
+                "contact_name": "Existing Contact",
+                "contact_email": f"existing.{tag}@example.com",
+                **TEST_GPS_COORDS
+            }, timeout=10)
+            
+            rows = [
+                ["contact_name", "contact_email", "contact_phone", "business_name", "latitude", "longitude", "notes"],
+                ["Quoted, Contact", f"one.{tag}@example.com", "", "Comma, Inc.", "37.7749", "-122.4194", 'Said "hi"\nand left'],
+                ["Second Contact", "", f"+1 555 {int(tag, 16) % 10 ** 7:07d}", "", "", "", ""],
+                ["", f"noname.{tag}@example.com", "", "", "", "", "missing name"],
+                ["Bad Latitude", f"badlat.{tag}@example.com", "", "", "123", "0", ""],
+                ["Repeat Contact", f"ONE.{tag}@example.com", "", "", "", "", "same email, other case"],
+                ["Stored Contact", f"existing.{tag}@example.com", "", "", "", "", "already stored"],
+            ]
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(rows)
+            response = self.client.post(
+                "leads/import",
+                params={"format": "csv", "user_id": agent_user['user_id']},
+                headers={"Content-Type": "text/csv", "Content-Encoding": "gzip"},
+                data=gzip.compress(buffer.getvalue().encode()),
+                timeout=30
+            )
+            report = response.json()
+            problems = {entry.get('row'): entry for entry in report.get('errors', [])}
+            ok = (
+                existing.status_code == 200
+                and response.status_code == 200
+                and (report.get('received'), report.get('inserted'), report.get('duplicates'), report.get('invalid'), report.get('failed'))
+                == (6, 2, 2, 2, 0)
+                and set(problems) == {3, 4, 5, 6}
+                and problems[5].get('duplicate') and problems[6].get('duplicate')
+            )
+            self.log_test(
+                "Lead Import",
+                ok,
+                f"{report.get('inserted')} inserted, {report.get('duplicates')} duplicates, "
+                f"{report.get('invalid')} invalid of {report.get('received')} rows in {report.get('duration_ms')}ms",
+                None if ok else report
+            )
+            
+            params = {"user_id": agent_user['user_id']}
+            ndjson = self.client.get("leads/export", params={**params, "format": "ndjson"}, timeout=30)
+            exported = [json.loads(line) for line in ndjson.text.splitlines() if line]
+            csv_response = self.client.get("leads/export", params={**params, "format": "csv"}, timeout=30)
+            from_csv = list(csv.DictReader(io.StringIO(csv_response.text, newline="")))
+            listed = list(iter_paginated("leads", page_size=200, fields=["user_id"], client=self.client))
+            agent_count = sum(1 for lead in listed if lead['user_id'] == agent_user['user_id'])
+            
+            quoted = next((lead for lead in from_csv if lead['contact_email'] == f"one.{tag}@example.com"), {})
+            ok = (
+                ndjson.status_code == 200
+                and csv_response.status_code == 200
+                and csv_response.headers.get('Content-Type', '').startswith('text/csv')
+                and len(exported) == len(from_csv) == agent_count
+                and [str(lead['id']) for lead in exported] == [lead['id'] for lead in from_csv]
+                and quoted.get('contact_name') == "Quoted, Contact"
+                and quoted.get('notes') == 'Said "hi"\nand left'
+                and quoted.get('business_name') == "Comma, Inc."
+            )
+            self.log_test(
+                "Lead Export",
+                ok,
+                f"{len(exported)} leads exported as NDJSON ({len(ndjson.content)} bytes) "
+                f"and CSV ({len(csv_response.content)} bytes); quoted fields round-trip",
+                None if ok else {"ndjson": len(exported), "csv": len(from_csv), "listed": agent_count, "quoted": quoted}
+            )
+            
+        except Exception as e:
+            self.log_test("Lead Import/Export", False, f"Lead import/export error: {str(e)}")
+    
+    def test_response_cache(self):
+        """Test list caching: ETag revalidation and freshness after writes"""
+        print("\n=== Testing Response Cache ===")
+        
+        agent_user = self.registered_users.get('agent')
+        if not agent_user:
+            self.log_test("Response Cache", False, "No registered agent available for testing")
+            return
+        
+        try:
+            first = self.client.get("leads", timeout=10)
+            second = self.client.get("leads", timeout=10)
+            etag = first.headers.get('ETag')
+            self.log_test(
+                "Cache Hit",
+                second.headers.get('X-Cache') == 'HIT' and second.headers.get('ETag') == etag,
+                f"Repeated read returned X-Cache {second.headers.get('X-Cache')}"
+            )
+            
+            revalidated = self.client.get("leads", headers={"If-None-Match": etag}, timeout=10)
+            self.log_test(
+                "Cache Revalidation",
+                revalidated.status_code == 304 and not revalidated.content,
+                f"If-None-Match returned status {revalidated.status_code}"
+            )
+            
+            # A read straight after a write must include the write
+            created = self.client.post(
+                "leads",
+                json={
+                    "user_id": agent_user['user_id'],
+                    "contact_name": f"Cache Probe {uuid.uuid4().hex[:6]}",
+                    "latitude": TEST_GPS_COORDS['latitude'],
+                    "longitude": TEST_GPS_COORDS['longitude']
+                },
+                timeout=10
+            ).json()
+            after_write = self.client.get("leads", headers={"If-None-Match": etag}, timeout=10)
+            fresh = after_write.status_code == 200 and any(
+                lead['id'] == created.get('id') for lead in after_write.json()
+            )
+            self.log_test(
+                "Cache Freshness After Write",
+                fresh,
+                "Post-write read included the new lead" if fresh
+                else f"Post-write read was stale (status {after_write.status_code})"
+            )
+            
+        except Exception as e:
+            self.log_test("Response Cache", False, f"Response cache error: {str(e)}")
+            return
+        
+        self.benchmark_response_cache(agent_user['user_id'])
+    
+    def benchmark_response_cache(self, user_id, reads=200, write_every=20):
+        """Mixed dashboard reads with periodic writes; reports hit rate and hit/miss latency"""
+        endpoints = ["photos", "leads", "users", "gps-tracking"]
+        latencies = {"HIT": [], "MISS": []}
+        
+        try:
+            for i in range(reads):
+                if i and i % write_every == 0:
+                    self.client.post(
+                        "gps-tracking",
+                        json={"user_id": user_id, **TEST_GPS_COORDS},
+                        timeout=10
+                    )
+                start = time.perf_counter()
+                response = self.client.get(endpoints[i % len(endpoints)], timeout=10)
+                elapsed = (time.perf_counter() - start) * 1000
+                latencies.setdefault(response.headers.get('X-Cache', 'MISS'), []).append(elapsed)
+            
+            hits, misses = latencies['HIT'], latencies['MISS']
+            average = lambda values: sum(values) / len(values) if values else 0.0
+            self.log_test(
+                "Cache Hit Rate",
+                len(hits) > 0,
+                f"{len(hits) / reads * 100:.1f}% hits over {reads} reads; "
+                f"avg {average(hits):.1f} ms on hit vs {average(misses):.1f} ms on miss"
+            )
+        except Exception as e:
+            self.log_test("Cache Hit Rate", False, f"Cache benchmark error: {str(e)}")
+    
+    def test_idempotent_writes(self):
+        """Test Idempotency-Key replays under concurrent retries and per-fix batch dedupe"""
+        print("\n=== Testing Idempotent Writes ===")
+        
+        try:
+            registered = self.client.post("auth/register", json={
+                "email": f"idem_{uuid.uuid4().hex[:8]}@fieldmanager.com",
+                "password": "IdemPass123!",
+                "fullName": "Idempotency Agent",
+                "role": "agent"
+            }, timeout=10)
+            registered.raise_for_status()
+            user_id = registered.json()['user']['id']
+            tag = uuid.uuid4().hex[:8]
+            key = f"lead-{tag}"
+            lead = {
+                "user_id": user_id,
+                "contact_name": "Retry Contact",
+                "contact_email": f"retry.{tag}@example.com",
+                **TEST_GPS_COORDS
+            }
+            
+            # Twenty devices retrying the same write at once
+            def post_lead(_):
+                start = time.perf_counter()
+                response = self.client.post("leads", json=lead, idempotency_key=key, timeout=10)
+                return response, (time.perf_counter() - start) * 1000
+            
+            with ThreadPoolExecutor(max_workers=20) as pool:
+                results = list(pool.map(post_lead, range(20)))
+            ids = {response.json().get('id') for response, _ in results}
+            originals = [response for response, _ in results if response.headers.get('Idempotent-Replayed') == 'false']
+            stored = [row for row in iter_paginated("leads", page_size=500, fields=["user_id", "contact_email"], client=self.client)
+                      if row['contact_email'] == lead['contact_email']]
+            ok = (
+                all(response.status_code == 200 for response, _ in results)
+                and len(ids) == 1
+                and len(originals) == 1
+                and len(stored) == 1
+            )
+            self.log_test(
+                "Idempotent Concurrent Retries",
+                ok,
+                f"20 concurrent requests with one key: {len(originals)} executed, {len(stored)} row stored, "
+                f"{len(results) - len(originals)} replayed",
+                None if ok else {"ids": list(ids), "originals": len(originals), "stored": len(stored)}
+            )
+            
+            # Later replays are answered from the key store without touching the database
+            replays = [post_lead(i) for i in range(30)]
+            latencies = sorted(ms for _, ms in replays)
+            replay_db = [parse_server_timing(response.headers.get("Server-Timing")).get("db") for response, _ in replays]
+            first_ms = next(ms for response, ms in results if response in originals)
+            ok = (
+                all(response.json().get('id') in ids for response, _ in replays)
+                and all(response.headers.get('Idempotent-Replayed') == 'true' for response, _ in replays)
+                and not any(replay_db)
+            )
+            self.log_test(
+                "Idempotent Replay Latency",
+                ok,
+                f"Replay p50 {latencies[len(latencies) // 2]:.1f}ms, max {latencies[-1]:.1f}ms "
+                f"(original {first_ms:.1f}ms under contention); no database time on replays"
+            )
+            
+            conflict = self.client.post("leads", json={**lead, "contact_name": "Someone Else"}, idempotency_key=key, timeout=10)
+            self.log_test(
+                "Idempotency Key Reuse",
+                conflict.status_code == 422,
+                f"Same key with a different body returned {conflict.status_code}"
+            )
+            
+            # Batch: per-fix keys, one repeated within the batch, then the whole batch resent
+            fixes = [
+                {"user_id": user_id, "latitude": TEST_GPS_COORDS["latitude"] + i * 0.001,
+                 "longitude": TEST_GPS_COORDS["longitude"], "idempotency_key": f"{tag}-{i}"}
+                for i in range(5)
+            ]
+            batch = fixes + [dict(fixes[0])]
+            first = self.client.post("gps-tracking/batch", json={"fixes": batch}, timeout=10).json()
+            resent = self.client.post("gps-tracking/batch", json={"fixes": batch}, timeout=10).json()
+            recorded = sum(1 for row in iter_paginated("gps-tracking", page_size=500, fields=["user_id"], client=self.client)
+                           if row['user_id'] == user_id)
+            ok = (
+                first == {"inserted": 5, "duplicates": 1}
+                and resent == {"inserted": 0, "duplicates": 6}
+                and recorded == 5
+            )
+            self.log_test(
+                "Batch Fix Dedupe",
+                ok,
+                f"First upload {first}, resend {resent}; {recorded} fixes stored",
+                None if ok else {"first": first, "resent": resent, "recorded": recorded}
+            )
+            
+        except Exception as e:
+            self.log_test("Idempotent Writes", False, f"Idempotent writes error: {str(e)}")
+    
+    def test_traffic_capture(self, replay_last=200):
+        """Test that the capture holds no credentials, and that replaying it reproduces its statuses"""
+        print("\n=== Testing Traffic Capture ===")
+        
+        status = self.client.get("capture", timeout=10)
+        if status.status_code != 200 or not status.json().get('enabled'):
+            print("⏭️  Traffic capture is off on the server (start it with CAPTURE_FILE=path); skipping")
+            return
+        
+        try:
+            from replay import Replayer, load_capture, diff
+            
+            path = status.json()['file']
+            with open(path) as handle:
+                text = handle.read()
+            secrets = [value for user in TEST_USER_DATA.values() for value in (user['email'], user['password'])]
+            secrets += [self.client.token]
+            leaked = [secret for secret in secrets if secret and secret in text]
+            self.log_test(
+                "Capture Sanitized",
+                not leaked,
+                f"{text.count(chr(10))} captured requests hold no test emails, passwords or tokens" if not leaked
+                else f"{len(leaked)} credentials found in {path}"
+            )
+            
+            records, skipped = load_capture(path)
+            replayer = Replayer(records[-replay_last:], BASE_URL, speed=0)
+            try:
+                replayer.create_accounts()
+                wall_time, results = replayer.run()
+            finally:
+                replayer.cleanup()
+            rows = diff(results)
+            matched = sum(row['count'] - row['status_mismatches'] for row in rows.values())
+            total = sum(row['count'] for row in rows.values())
+            # Interleaving across users differs at full speed, so a few statuses may too
+            self.log_test(
+                "Capture Replay",
+                total > 0 and matched / total >= 0.9,
+                f"Replayed {total} requests from {len(replayer.accounts)} users in {wall_time:.2f}s; "
+                f"{matched} statuses match the capture, {sum(skipped.values())} records not replayable"
+            )
+        except Exception as e:
+            self.log_test("Traffic Capture", False, f"Capture error: {str(e)}")
+    
+    def test_gps_history(self, days=120, agents=6, fixes_per_day=96, checkpoints=4):
+        """Seed months of fixes: recent GPS reads stay flat, old days archive, rollups cover the range"""
+        print("\n=== Testing GPS History Retention ===")
+        
+        try:
+            user_ids = []
+            for index in range(agents):
+                response = self.client.post("auth/register", json={
+                    "email": f"history_{index}_{uuid.uuid4().hex[:8]}@fieldmanager.com",
+                    "password": "HistoryPass123!",
+                    "fullName": f"History Agent {index}",
+                    "role": "agent"
+                }, timeout=10)
+                response.raise_for_status()
+                user_ids.append(response.json()['user']['id'])
+        except Exception as e:
+            self.log_test("GPS History", False, f"Could not register history agents: {str(e)}")
+            return
+        
+        today = datetime.utcnow().date()
+        
+        # One fix every 5 minutes from 09:00, walking north-east; day 1 is yesterday
+        def day_fixes(day_offset):
+            day = today - timedelta(days=day_offset)
+            return [{
+                "user_id": user_id,
+                "latitude": round(TEST_GPS_COORDS['latitude'] + agent * 0.01 + i * 0.0002, 7),
+                "longitude": round(TEST_GPS_COORDS['longitude'] + i * 0.0002, 7),
+                "activity_type": ("active", "active", "break")[i % 3],
+                "timestamp": f"{day.isoformat()}T{9 + i // 12:02d}:{(i % 12) * 5:02d}:00Z"
+            } for agent, user_id in enumerate(user_ids) for i in range(fixes_per_day)]
+        
+        # Server db time for the GPS list, with varying limits so every read misses the cache
+        def recent_list_ms():
+            spent = []
+            for limit in range(60, 80):
+                response = self.client.get("gps-tracking", params={"limit": limit}, timeout=30)
+                response.raise_for_status()
+                spent.append(parse_server_timing(response.headers.get("Server-Timing")).get("db", {}).get("dur", 0.0))
+            return statistics.median(spent)
+        
+        def report(user_id):
+            start = time.perf_counter()
+            response = self.client.get("tracks/hourly", params={
+                "user_id": user_id,
+                "from": (today - timedelta(days=days + 1)).isoformat(),
+                "to": today.isoformat()
+            }, timeout=120)
+            response.raise_for_status()
+            return response.json(), (time.perf_counter() - start) * 1000
+        
+        # History grows backwards from the day before yesterday, so the recent window holds the same rows throughout
+        try:
+            timings = [(0, recent_list_ms())]
+            seeded_days = list(range(2, days + 2))
+            per_checkpoint = math.ceil(len(seeded_days) / checkpoints)
+            for chunk_start in range(0, len(seeded_days), per_checkpoint):
+                fixes = [fix for offset in seeded_days[chunk_start:chunk_start + per_checkpoint] for fix in day_fixes(offset)]
+                for start in range(0, len(fixes), 500):
+                    self.client.post("gps-tracking/batch", json={"fixes": fixes[start:start + 500]}, timeout=60).raise_for_status()
+                timings.append((min(chunk_start + per_checkpoint, len(seeded_days)), recent_list_ms()))
+            
+            for seeded, db_ms in timings:
+                print(f"  {seeded:>4} days seeded ({seeded * agents * fixes_per_day:>6} fixes): GPS list db {db_ms:.2f} ms")
+            baseline = timings[0][1]
+            self.log_test(
+                "Recent GPS Latency",
+                timings[-1][1] <= baseline * 2 + 2,
+                f"GPS list db time {baseline:.2f} ms empty, {timings[-1][1]:.2f} ms after "
+                f"{days * agents * fixes_per_day} fixes over {days} days"
+            )
+        except Exception as e:
+            self.log_test("GPS History Seed", False, f"Seeding error: {str(e)}")
+            return
+        
+        try:
+            raw_report, raw_ms = report(user_ids[0])
+            summaries = []
+            while True:
+                summary = self.client.post("tracks/compact", json={}, timeout=300).json()
+                summaries.append(summary)
+                if not summary.get('days'):
+                    break
+            archived = [entry for summary in summaries for entry in summary.get('archived', [])]
+            archived_days = {entry['date'] for entry in archived}
+            dropped_days = {day for summary in summaries for day in summary.get('partitions_dropped', [])}
+            
+            # Days before the cutoff (GPS_RAW_RETENTION_DAYS ago) are archived; the rest stay raw
+            expected_days = {(today - timedelta(days=offset)).isoformat() for offset in seeded_days
+                             if (today - timedelta(days=offset)).isoformat() < summaries[0]['before']}
+            ours = set(user_ids)
+            archived_rows = 0
+            for entry in archived:
+                if entry.get('file') and entry['date'] in expected_days:
+                    with gzip.open(entry['file'], "rt") as handle:
+                        archived_rows += sum(1 for line in handle if json.loads(line)['user_id'] in ours)
+            expected_rows = len(expected_days) * agents * fixes_per_day
+            self.log_test(
+                "GPS Archive",
+                expected_days <= archived_days and expected_days <= dropped_days and archived_rows == expected_rows,
+                f"{len(archived_days)} days archived in {len(summaries) - 1} run(s), "
+                f"{sum(entry.get('bytes', 0) for entry in archived)} bytes gzipped, {len(dropped_days)} partitions dropped; "
+                f"{archived_rows} of {expected_rows} seeded fixes found in the archives"
+            )
+            
+            old_day = (today - timedelta(days=seeded_days[-1])).isoformat()
+            track = self.client.get("tracks", params={"user_id": user_ids[0], "date": old_day}, timeout=30).json()
+            self.log_test(
+                "Archived Day Track",
+                track.get('source') == 'compacted' and track.get('point_count') == fixes_per_day,
+                f"{old_day}: {track.get('source')} track of {track.get('point_count')} fixes"
+            )
+            
+            rolled_report, rolled_ms = report(user_ids[0])
+            expected_fixes = days * fixes_per_day
+            hours_per_day = math.ceil(fixes_per_day / 12)
+            self.log_test(
+                "Hourly Rollups",
+                rolled_report['totals']['fixes'] == expected_fixes == raw_report['totals']['fixes']
+                and len(rolled_report['hours']) == days * hours_per_day
+                and rolled_report['totals']['distance_m'] == raw_report['totals']['distance_m']
+                and rolled_report['raw_days'] == [today.isoformat()],
+                f"{len(rolled_report['hours'])} hours, {rolled_report['totals']['fixes']} fixes "
+                f"(expected {expected_fixes}); {days + 2}-day report {raw_ms:.0f} ms from raw fixes, "
+                f"{rolled_ms:.0f} ms from rollups with raw days {rolled_report['raw_days']}"
+            )
+            
+            again = self.client.post("tracks/compact", json={}, timeout=60).json()
+            self.log_test(
+                "Retention Rerun",
+                not again.get('days') and not again.get('raw_rows_removed'),
+                f"A second run archived {len(again.get('days', []))} days"
+            )
+        except Exception as e:
+            self.log_test("GPS Retention", False, f"Retention error: {str(e)}")
+        
+        try:
+            response = self.client.get("tracks/hourly", params={"user_id": user_ids[0], "from": "2020-01-01"}, timeout=10)
+            self.log_test(
+                "Hourly Report Range",
+                response.status_code == 400,
+                f"A multi-year range returned status {response.status_code}"
+            )
+        except Exception as e:
+            self.log_test("Hourly Report Range", False, f"Error: {str(e)}")
+    
+    def test_write_behind(self, fixes=300, batch_size=200):
+        """Test write-behind mode: every acknowledged write lands; ack vs end-to-end latency"""
+        print("\n=== Testing Write-Behind Queue ===")
+        
+        status = self.client.get("write-queue", timeout=10)
+        if status.status_code != 200 or not status.json().get('enabled'):
+            print("⏭️  Write-behind is off on the server (start it with WRITE_BEHIND=on); skipping")
+            return
+        
+        try:
+            from sse_fanout import EventStreamClient
+            
+            registered = self.client.post("auth/register", json={
+                "email": f"queue_{uuid.uuid4().hex[:8]}@fieldmanager.com",
+                "password": "QueuePass123!",
+                "fullName": "Queue Agent",
+                "role": "agent"
+            }, timeout=10)
+            registered.raise_for_status()
+            user_id = registered.json()['user']['id']
+            total = fixes + batch_size
+            
+            # Each fix has a distinct latitude, which identifies it when its event arrives after the drain
+            sent_at = {}
+            delivered = {}
+            stream = EventStreamClient(tables=["gps_tracking"], user_ids=[user_id], token=self.client.token)
+            
+            def listen():
+                try:
+                    for event in stream.events():
+                        latitude = round(json.loads(event['data'])['latitude'], 6)
+                        delivered.setdefault(latitude, event['received_at'])
+                        if len(delivered) >= total:
+                            return
+                except requests.RequestException:
+                    pass
+            
+            listener = threading.Thread(target=listen, daemon=True)
+            listener.start()
+            
+            def latitude_for(index):
+                return round(TEST_GPS_COORDS["latitude"] + 0.1 + index * 0.00001, 6)
+            
+            def post_fix(index):
+                latitude = latitude_for(index)
+                sent_at[latitude] = time.perf_counter()
+                response = self.client.post("gps-tracking", json={
+                    "user_id": user_id, "latitude": latitude, "longitude": TEST_GPS_COORDS["longitude"]
+                }, timeout=30)
+                return response.status_code, (time.perf_counter() - sent_at[latitude]) * 1000
+            
+            with ThreadPoolExecutor(max_workers=20) as pool:
+                acks = list(pool.map(post_fix, range(fixes)))
+            
+            batch = [{"user_id": user_id, "latitude": latitude_for(fixes + i), "longitude": TEST_GPS_COORDS["longitude"]}
+                     for i in range(batch_size)]
+            start = time.perf_counter()
+            for fix in batch:
+                sent_at[fix['latitude']] = start
+            batch_response = self.client.post("gps-tracking/batch", json={"fixes": batch}, timeout=30)
+            batch_ms = (time.perf_counter() - start) * 1000
+            
+            # Poll until the queue has drained everything acknowledged so far
+            deadline = time.time() + 60
+            queue = {}
+            while time.time() < deadline:
+                queue = self.client.get("write-queue", timeout=10).json()
+                if queue.get('pending') == 0 and queue.get('appending') == 0:
+                    break
+                time.sleep(0.1)
+            listener.join(timeout=10)
+            stream.close()
+            
+            stored = sum(1 for row in iter_paginated("gps-tracking", page_size=500, fields=["user_id"], client=self.client)
+                         if row['user_id'] == user_id)
+            accepted = sum(1 for code, _ in acks if code == 202) + (batch_size if batch_response.status_code == 202 else 0)
+            ok = accepted == total and stored == total and queue.get('dead_letters') == 0
+            self.log_test(
+                "Write-Behind Delivery",
+                ok,
+                f"{accepted}/{total} writes acknowledged, {stored} in the database after the drain "
+                f"({queue.get('drained_total')} drained, {queue.get('dead_letters')} dead-lettered)",
+                None if ok else {"accepted": accepted, "stored": stored, "queue": queue}
+            )
+            
+            ack_ms = sorted(ms for _, ms in acks)
+            end_to_end_ms = sorted((delivered[latitude] - sent_at[latitude]) * 1000
+                                   for latitude in delivered if latitude in sent_at)
+            pct = lambda values, p: values[min(len(values) - 1, int(p / 100 * len(values)))] if values else 0.0
+            self.log_test(
+                "Write-Behind Latency",
+                len(end_to_end_ms) == total,
+                f"ack p50 {pct(ack_ms, 50):.1f}ms p95 {pct(ack_ms, 95):.1f}ms (batch of {batch_size}: {batch_ms:.1f}ms); "
+                f"end-to-end p50 {pct(end_to_end_ms, 50):.1f}ms p95 {pct(end_to_end_ms, 95):.1f}ms; "
+                f"{len(end_to_end_ms)}/{total} delivered on the stream"
+            )
+            
+            # Queued rows get no database checks before the 202, so bad ones must be refused up front
+            invalid = {
+                "photos": [
+                    {"user_id": user_id, "latitude": TEST_GPS_COORDS["latitude"], "longitude": TEST_GPS_COORDS["longitude"]},
+                    {"user_id": user_id, "image_url": "https://example.com/queued.jpg", "latitude": "north"}
+                ],
+                "leads": [
+                    {"user_id": user_id, "contact_email": "nameless@example.com"},
+                    {"user_id": user_id, "contact_name": "Queued Lead", "longitude": 500},
+                    {"user_id": user_id, "contact_name": ["not", "text"]}
+                ]
+            }
+            codes = [self.client.post(endpoint, json=body, timeout=10).status_code
+                     for endpoint, bodies in invalid.items() for body in bodies]
+            valid = self.client.post("leads", json={"user_id": user_id, "contact_name": "Queued Lead"}, timeout=10)
+            ok = all(code == 400 for code in codes) and valid.status_code == 202
+            self.log_test(
+                "Write-Behind Validation",
+                ok,
+                f"invalid photo/lead rows answered {codes}, a valid lead {valid.status_code}",
+                None if ok else valid.text
+            )
+            
+        except Exception as e:
+            self.log_test("Write-Behind Queue", False, f"Write-behind error: {str(e)}")
+    
     def test_gps_tracking_api(self):
         """Test GPS tracking API"""
         print("\n=== Testing GPS Tracking API ===")
@@ -365,9 +1250,8 @@ class FieldManagementAPITester:
                         "activity_type": activity['activity_type']
                     }
                     
-                    response = requests.post(
-                        f"{BASE_URL}/gps-tracking",
-                        headers=HEADERS,
+                    response = self.client.post(
+                        "gps-tracking",
                         json=gps_data,
                         timeout=10
                     )
@@ -401,13 +1285,334 @@ class FieldManagementAPITester:
                     
             except Exception as e:
                 self.log_test("GPS Tracking", False, f"GPS tracking error: {str(e)}")
+            
+            self.test_gps_batch_ingestion(agent_user['user_id'])
+    
+    def test_gps_batch_ingestion(self, user_id, batch_size=500, batches=5):
+        """Post large batches of buffered fixes and measure rows/second"""
+        started_at = time.time() - batch_size * batches * 30
+        total_rows = 0
+        elapsed = 0.0
+        
+        try:
+            for batch_index in range(batches):
+                fixes = []
+                for i in range(batch_size):
+                    n = batch_index * batch_size + i
+                    fixes.append({
+                        "user_id": user_id,
+                        "latitude": TEST_GPS_COORDS['latitude'] + (n % 200) * 0.0001,
+                        "longitude": TEST_GPS_COORDS['longitude'] + (n // 200) * 0.0001,
+                        "activity_type": ("active", "break", "idle")[n % 3],
+                        "timestamp": datetime.utcfromtimestamp(started_at + n * 30).isoformat() + "Z"
+                    })
+                
+                start = time.perf_counter()
+                response = self.client.post(
+                    "gps-tracking/batch",
+                    json={"fixes": fixes},
+                    timeout=60
+                )
+                elapsed += time.perf_counter() - start
+                
+                if response.status_code != 200 or response.json().get('inserted') != batch_size:
+                    self.log_test(
+                        "GPS Batch Ingestion",
+                        False,
+                        f"Batch {batch_index} failed with status {response.status_code}",
+                        response.json() if response.content else None
+                    )
+                    return
+                total_rows += batch_size
+            
+            self.log_test(
+                "GPS Batch Ingestion",
+                True,
+                f"Inserted {total_rows} fixes in {batches} batches: "
+                f"{total_rows / elapsed:.0f} rows/s ({elapsed / batches * 1000:.0f} ms per batch)"
+            )
+            
+        except Exception as e:
+            self.log_test("GPS Batch Ingestion", False, f"GPS batch error: {str(e)}")
+            return
+        
+        # A single invalid fix rejects the whole batch and reports its index
+        try:
+            response = self.client.post(
+                "gps-tracking/batch",
+                json={"fixes": [
+                    {"user_id": user_id, "latitude": 40.7, "longitude": -74.0},
+                    {"user_id": user_id, "latitude": 200, "longitude": -74.0}
+                ]},
+                timeout=10
+            )
+            details = response.json().get('details', []) if response.content else []
+            self.log_test(
+                "GPS Batch Validation",
+                response.status_code == 400 and [d.get('index') for d in details] == [1],
+                f"Invalid batch returned status {response.status_code} with details {details}"
+            )
+        except Exception as e:
+            self.log_test("GPS Batch Validation", False, f"GPS batch validation error: {str(e)}")
+    
+    def test_event_stream(self):
+        """Test live event delivery and Last-Event-ID catch-up on /api/stream"""
+        print("\n=== Testing Event Stream ===")
+        from sse_fanout import EventStreamClient
+        
+        agent_user = self.registered_users.get('agent')
+        if not agent_user:
+            self.log_test("Event Stream", False, "No registered agent available for testing")
+            return
+        
+        def post_fix(offset):
+            return self.client.post(
+                "gps-tracking",
+                json={
+                    "user_id": agent_user['user_id'],
+                    "latitude": TEST_GPS_COORDS['latitude'] + offset,
+                    "longitude": TEST_GPS_COORDS['longitude'],
+                    "activity_type": "active"
+                },
+                timeout=10
+            ).json()
+        
+        try:
+            client = EventStreamClient(tables=["gps_tracking"], user_ids=[agent_user['user_id']], token=self.client.token)
+            written = post_fix(0.01)
+            event = next(client.events())
+            client.close()
+            live_ok = event.get('event') == 'gps_tracking' and json.loads(event['data'])['id'] == written['id']
+            self.log_test(
+                "Event Stream Delivery",
+                live_ok,
+                f"Received event {event.get('id')} for the new GPS fix" if live_ok
+                else "Stream delivered a different event",
+                None if live_ok else event
+            )
+            
+            # Writes made while disconnected arrive on reconnect
+            missed = [post_fix(0.02)['id'], post_fix(0.03)['id']]
+            client = EventStreamClient(
+                tables=["gps_tracking"],
+                user_ids=[agent_user['user_id']],
+                last_event_id=event['id'],
+                token=self.client.token
+            )
+            events = client.events()
+            replayed = [json.loads(next(events)['data'])['id'] for _ in missed]
+            client.close()
+            self.log_test(
+                "Event Stream Catch-up",
+                replayed == missed,
+                f"Replayed {len(replayed)} missed events after Last-Event-ID {event['id']}"
+            )
+            
+        except Exception as e:
+            self.log_test("Event Stream", False, f"Event stream error: {str(e)}")
+    
+    def test_spatial_queries(self, points=2000):
+        """Seed points around TEST_GPS_COORDS and check bbox, radius and time-window queries"""
+        print("\n=== Testing Spatial Queries ===")
+        
+        # A dedicated agent, so fixes posted by earlier tests at the same coordinates don't match
+        try:
+            response = self.client.post("auth/register", json={
+                "email": f"spatial_{uuid.uuid4().hex[:8]}@fieldmanager.com",
+                "password": "SpatialPass123!",
+                "fullName": "Spatial Agent",
+                "role": "agent"
+            }, timeout=10)
+            response.raise_for_status()
+            user_id = response.json()['user']['id']
+        except Exception as e:
+            self.log_test("Spatial Queries", False, f"Could not register a spatial test agent: {str(e)}")
+            return
+        
+        rng = random.Random(42)
+        now = time.time()
+        seeded = []
+        for _ in range(points):
+            seeded.append({
+                "user_id": user_id,
+                "latitude": round(TEST_GPS_COORDS['latitude'] + rng.uniform(-0.02, 0.02), 7),
+                "longitude": round(TEST_GPS_COORDS['longitude'] + rng.uniform(-0.02, 0.02), 7),
+                "activity_type": "active",
+                "timestamp": datetime.utcfromtimestamp(now - rng.uniform(0, 48 * 3600)).isoformat() + "Z"
+            })
+        
+        try:
+            for start in range(0, points, 500):
+                response = self.client.post(
+                    "gps-tracking/batch",
+                    json={"fixes": seeded[start:start + 500]},
+                    timeout=60
+                )
+                response.raise_for_status()
+        except Exception as e:
+            self.log_test("Spatial Seed", False, f"Seeding {points} points failed: {str(e)}")
+            return
+        
+        center_lat, center_lng = TEST_GPS_COORDS['latitude'], TEST_GPS_COORDS['longitude']
+        since = datetime.utcfromtimestamp(now - 24 * 3600 + 0.5).isoformat() + "Z"
+        bbox = (center_lat - 0.005, center_lng - 0.005, center_lat + 0.005, center_lng + 0.005)
+        
+        def in_bbox(fix):
+            return bbox[0] <= fix['latitude'] <= bbox[2] and bbox[1] <= fix['longitude'] <= bbox[3]
+        
+        scenarios = [
+            ("Radius 250m", {"lat": center_lat, "lng": center_lng, "radius": 250},
+             lambda fix: haversine_meters(center_lat, center_lng, fix['latitude'], fix['longitude']) <= 250),
+            ("Bounding Box", {"bbox": ",".join(str(v) for v in bbox)}, in_bbox),
+            ("Bounding Box Last 24h", {"bbox": ",".join(str(v) for v in bbox), "since": since},
+             lambda fix: in_bbox(fix) and fix['timestamp'] >= since)
+        ]
+        
+        for name, params, predicate in scenarios:
+            try:
+                params = {**params, "user_id": user_id}
+                expected = sorted((f['latitude'], f['longitude']) for f in seeded if predicate(f))
+                timings = []
+                for _ in range(10):
+                    start = time.perf_counter()
+                    response = self.client.get("geo/gps-tracking", params=params, timeout=30)
+                    timings.append((time.perf_counter() - start) * 1000)
+                    response.raise_for_status()
+                
+                returned = sorted((row['latitude'], row['longitude']) for row in response.json())
+                candidates = int(response.headers.get('X-Spatial-Candidates', 0))
+                indexed = int(response.headers.get('X-Spatial-Indexed', 0))
+                self.log_test(
+                    f"Spatial {name}",
+                    returned == expected,
+                    f"{len(returned)}/{len(expected)} expected points; cold {timings[0]:.1f} ms, "
+                    f"warm median {sorted(timings[1:])[len(timings[1:]) // 2]:.1f} ms; "
+                    f"examined {candidates} of {indexed} indexed points"
+                )
+            except Exception as e:
+                self.log_test(f"Spatial {name}", False, f"Spatial query error: {str(e)}")
+        
+        try:
+            response = self.client.get("geo/photos", params={"bbox": "1,2"}, timeout=10)
+            self.log_test(
+                "Spatial Invalid Query",
+                response.status_code == 400,
+                f"Malformed bbox returned status {response.status_code}"
+            )
+        except Exception as e:
+            self.log_test("Spatial Invalid Query", False, f"Spatial validation error: {str(e)}")
+    
+    def test_track_summaries(self):
+        """Seed one synthetic agent-day, check its track summary, then compact it"""
+        print("\n=== Testing Track Summaries ===")
+        
+        agent_user = self.registered_users.get('agent')
+        if not agent_user:
+            self.log_test("Track Summaries", False, "No registered agent available for testing")
+            return
+        user_id = agent_user['user_id']
+        
+        # 30 minutes walking east, a 15 minute break in place, then 15 minutes idle
+        day = (datetime.utcnow() - timedelta(days=30)).date()
+        start = datetime(day.year, day.month, day.day, 8, 0, 0)
+        fixes = []
+        for i in range(120):
+            step = min(i, 60)
+            activity = "active" if i < 60 else ("break" if i < 90 else "idle")
+            fixes.append({
+                "user_id": user_id,
+                "latitude": TEST_GPS_COORDS['latitude'],
+                "longitude": TEST_GPS_COORDS['longitude'] + step * 0.0003,
+                "activity_type": activity,
+                "timestamp": (start + timedelta(seconds=30 * i)).isoformat() + "Z"
+            })
+        expected_distance = sum(
+            haversine_meters(a['latitude'], a['longitude'], b['latitude'], b['longitude'])
+            for a, b in zip(fixes, fixes[1:])
+        )
+        
+        try:
+            self.client.post(
+                "gps-tracking/batch", json={"fixes": fixes}, timeout=30
+            ).raise_for_status()
+            
+            params = {"user_id": user_id, "date": day.isoformat()}
+            track = self.client.get("tracks", params=params, timeout=30).json()
+            polyline = decode_polyline(track.get('polyline', ''))
+            ok = (
+                track.get('point_count') == len(fixes)
+                and abs(track.get('distance_m', 0) - expected_distance) <= 1
+                and track.get('activity_seconds', {}).get('break') == 900
+                and len(track.get('stops', [])) == 1
+                and track.get('stops', [{}])[0].get('duration_s', 0) >= 1800
+                and len(polyline) == track.get('simplified_count') < len(fixes)
+                and abs(polyline[-1][1] - fixes[-1]['longitude']) < 1e-5
+            )
+            self.log_test(
+                "Track Summary",
+                ok,
+                f"{track.get('point_count')} fixes -> {track.get('simplified_count')} polyline points, "
+                f"{track.get('distance_m')} m (expected {expected_distance:.0f}), {len(track.get('stops', []))} stop(s)",
+                None if ok else track
+            )
+            
+            compacted = self.client.post(
+                "tracks/compact",
+                json={"before": (day + timedelta(days=1)).isoformat(), "user_id": user_id},
+                timeout=60
+            ).json()
+            stored = self.client.get("tracks", params=params, timeout=30).json()
+            ok = (
+                compacted.get('raw_rows_removed', 0) >= len(fixes)
+                and stored.get('source') == 'compacted'
+                and stored.get('distance_m') == track.get('distance_m')
+            )
+            self.log_test(
+                "Track Compaction",
+                ok,
+                f"Compacted {compacted.get('raw_rows_removed')} raw fixes over {len(compacted.get('days', []))} day(s) "
+                f"into a {len(stored.get('polyline', ''))}-character polyline",
+                None if ok else {"compact": compacted, "stored": stored}
+            )
+            
+            # Fixes arriving after compaction are merged into the stored track, not swapped for it
+            late = [{
+                "user_id": user_id,
+                "latitude": TEST_GPS_COORDS['latitude'] + 0.001,
+                "longitude": fixes[-1]['longitude'],
+                "activity_type": "active",
+                "timestamp": (start + timedelta(hours=2, seconds=30 * i)).isoformat() + "Z"
+            } for i in range(3)]
+            self.client.post("gps-tracking/batch", json={"fixes": late}, timeout=30).raise_for_status()
+            self.client.post(
+                "tracks/compact",
+                json={"before": (day + timedelta(days=1)).isoformat(), "user_id": user_id},
+                timeout=60
+            ).raise_for_status()
+            merged = self.client.get("tracks", params=params, timeout=30).json()
+            ok = (
+                merged.get('point_count') == len(fixes) + len(late)
+                and merged.get('distance_m', 0) >= stored.get('distance_m', 0)
+                and merged.get('simplified_count', 0) > stored.get('simplified_count', 0)
+                and merged.get('ended_at', '').startswith(late[-1]['timestamp'][:19])
+            )
+            self.log_test(
+                "Track Recompaction",
+                ok,
+                f"{len(late)} late fixes merged into the stored track: {merged.get('point_count')} fixes, "
+                f"{merged.get('simplified_count')} polyline points",
+                None if ok else {"stored": stored, "merged": merged}
+            )
+            
+        except Exception as e:
+            self.log_test("Track Summaries", False, f"Track summary error: {str(e)}")
     
     def test_get_gps_tracking_api(self):
         """Test get GPS tracking API"""
         print("\n=== Testing Get GPS Tracking API ===")
         
         try:
-            response = requests.get(f"{BASE_URL}/gps-tracking", timeout=10)
+            response = self.client.get("gps-tracking", timeout=10)
             
             if response.status_code == 200:
                 data = response.json()
@@ -442,7 +1647,7 @@ class FieldManagementAPITester:
         
         # Test get all users
         try:
-            response = requests.get(f"{BASE_URL}/users", timeout=10)
+            response = self.client.get("users", timeout=10)
             
             if response.status_code == 200:
                 data = response.json()
@@ -477,9 +1682,8 @@ class FieldManagementAPITester:
                 agent_user = self.registered_users['agent']
                 user_id = agent_user['user_id']
                 
-                response = requests.put(
-                    f"{BASE_URL}/users/{user_id}/role",
-                    headers=HEADERS,
+                response = self.client.put(
+                    f"users/{user_id}/role",
                     json={"role": "admin"},
                     timeout=10
                 )
@@ -511,13 +1715,541 @@ class FieldManagementAPITester:
             except Exception as e:
                 self.log_test("Update User Role", False, f"Update user role error: {str(e)}")
     
+    def test_user_directory(self):
+        """Test ?users=dict list responses against the joined form, and directory freshness"""
+        print("\n=== Testing User Directory ===")
+        
+        cases = [
+            ("photos", {}),
+            ("leads", {}),
+            ("leads", {"fields": "contact_name,users"}),
+            ("gps-tracking", {"limit": 500}),
+        ]
+        for endpoint, params in cases:
+            name = f"Users Dictionary {endpoint}" + (f" ({params['fields']})" if "fields" in params else "")
+            try:
+                joined = self.client.get(endpoint, params=params, timeout=10)
+                compact = self.client.get(endpoint, params={**params, "users": "dict"}, timeout=10)
+                body = compact.json()
+                rows, users = body["rows"], body["users"]
+                rebuilt = []
+                for row, original in zip(rows, joined.json()):
+                    row = {**row, "users": users.get(str(row["user_id"]))}
+                    if "user_id" not in original:
+                        row.pop("user_id")
+                    rebuilt.append(row)
+                
+                if rebuilt != joined.json():
+                    self.log_test(name, False, "Dictionary form differs from the joined form",
+                                  {"joined": joined.json()[:1], "rebuilt": rebuilt[:1]})
+                else:
+                    saved = 1 - len(compact.content) / max(len(joined.content), 1)
+                    self.log_test(
+                        name,
+                        True,
+                        f"{len(rows)} rows, {len(users)} users: {len(joined.content)} -> "
+                        f"{len(compact.content)} bytes ({-saved:+.0%})"
+                    )
+            except Exception as e:
+                self.log_test(name, False, f"Users dictionary error: {str(e)}")
+        
+        # Server db + join time per form; varying limits keeps every read a cache miss
+        try:
+            timings = {}
+            for form in ("join", "dict"):
+                spent = []
+                for limit in range(300, 320):
+                    response = self.client.get("gps-tracking", params={"limit": limit, "users": form}, timeout=10)
+                    phases = parse_server_timing(response.headers.get("Server-Timing"))
+                    spent.append(sum(phases.get(phase, {}).get("dur", 0.0) for phase in ("db", "join")))
+                timings[form] = sum(spent) / len(spent)
+            print(f"⏱️  GPS list db+join: joined {timings['join']:.2f} ms, dictionary {timings['dict']:.2f} ms")
+        except Exception as e:
+            self.log_test("Users Dictionary Timing", False, f"Timing error: {str(e)}")
+        
+        # Role updates reach the directory straight away
+        agent_user = self.registered_users.get('agent')
+        if agent_user:
+            try:
+                user_id = agent_user['user_id']
+                before = self.client.get("users", timeout=10).json()
+                role = next(user['role'] for user in before if user['id'] == user_id)
+                changed = 'agent' if role == 'admin' else 'admin'
+                self.client.put(f"users/{user_id}/role", json={"role": changed}, timeout=10).raise_for_status()
+                seen = self.client.get("leads", params={"users": "dict"}, timeout=10).json()["users"].get(user_id)
+                joined = [lead['users'] for lead in self.client.get("leads", timeout=10).json()
+                          if lead['user_id'] == user_id]
+                self.client.put(f"users/{user_id}/role", json={"role": role}, timeout=10)
+                self.log_test(
+                    "User Directory Freshness",
+                    bool(seen) and seen['role'] == changed and all(user['role'] == changed for user in joined),
+                    f"After a role change lists report {seen and seen['role']!r} (expected {changed!r})"
+                )
+            except Exception as e:
+                self.log_test("User Directory Freshness", False, f"Directory freshness error: {str(e)}")
+        
+        try:
+            response = self.client.get("leads", params={"users": "embed"}, timeout=10)
+            self.log_test(
+                "Invalid Users Form",
+                response.status_code == 400,
+                f"users=embed returned status {response.status_code}"
+            )
+        except Exception as e:
+            self.log_test("Invalid Users Form", False, f"Error testing invalid users form: {str(e)}")
+    
+    def test_response_encodings(self):
+        """Decode every list format and compression; report wire bytes and client decode time"""
+        print("\n=== Testing Response Encodings ===")
+        
+        def fetch(endpoint, params, media_type, encoding):
+            response = self.client.get(
+                endpoint,
+                params=params,
+                headers={"Accept": media_type, "Accept-Encoding": encoding},
+                stream=True,
+                timeout=30
+            )
+            response.raise_for_status()
+            raw = response.raw.read(decode_content=False)
+            start = time.perf_counter()
+            sent_as = response.headers.get("Content-Encoding", "identity")
+            body = {"gzip": gzip.decompress, "br": brotli.decompress if brotli else None}.get(sent_as, bytes)(raw)
+            rows = decode_list(json.loads(body))
+            return rows, len(raw), (time.perf_counter() - start) * 1000, sent_as
+        
+        def instant(value):
+            return datetime.fromisoformat(value.replace("Z", "+00:00"))
+        
+        def close_enough(row, reference):
+            if set(row) != set(reference):
+                return False
+            for key, expected in reference.items():
+                value = row[key]
+                if expected is None or value is None or key not in ("latitude", "longitude", "timestamp", "created_at"):
+                    if value != expected:
+                        return False
+                elif key in ("latitude", "longitude"):
+                    if abs(value - expected) > 1e-7:
+                        return False
+                elif abs(instant(value) - instant(expected)) > timedelta(milliseconds=1):
+                    return False
+            return True
+        
+        encodings = ["identity", "gzip"] + (["br"] if brotli else [])
+        if not brotli:
+            print("ℹ️  Python brotli module not installed; br responses are not decoded here")
+        formats = {"json": JSON_TYPE, "columns": COLUMNS_TYPE, "delta": DELTA_TYPE}
+        
+        for endpoint, params in (("gps-tracking", {"limit": 500}), ("leads", {"users": "dict"})):
+            try:
+                reference, _, _, _ = fetch(endpoint, params, JSON_TYPE, "identity")
+                reference_rows = reference["rows"] if isinstance(reference, dict) else reference
+                # Columnar formats send every column for every row, with null where a row lacks the key
+                keys = {key for row in reference_rows for key in row}
+                padded_rows = [{**dict.fromkeys(keys), **row} for row in reference_rows]
+                results = []
+                for label, media_type in formats.items():
+                    for encoding in encodings:
+                        rows, wire, decode_ms, sent_as = fetch(endpoint, params, media_type, encoding)
+                        results.append((label, encoding, sent_as, wire, decode_ms))
+                        decoded_rows = rows["rows"] if isinstance(rows, dict) else rows
+                        expected_rows = reference_rows if label == "json" else padded_rows
+                        matches = len(decoded_rows) == len(expected_rows) and all(
+                            close_enough(row, expected) if label == "delta" else row == expected
+                            for row, expected in zip(decoded_rows, expected_rows)
+                        )
+                        if isinstance(reference, dict):
+                            matches = matches and rows.get("users") == reference["users"]
+                        if not matches:
+                            self.log_test(f"Encoding {endpoint} {label}/{encoding}", False,
+                                          "Decoded rows differ from the JSON response",
+                                          {"decoded": decoded_rows[:1], "expected": expected_rows[:1]})
+                            return
+                
+                print(f"{endpoint} ({len(reference_rows)} rows)")
+                print(f"  {'Format':<10}{'Accept-Encoding':<18}{'Sent as':<10}{'Bytes':>10}{'Decode ms':>12}")
+                for label, encoding, sent_as, wire, decode_ms in results:
+                    print(f"  {label:<10}{encoding:<18}{sent_as:<10}{wire:>10}{decode_ms:>12.2f}")
+                smallest = min(results, key=lambda result: result[3])
+                self.log_test(
+                    f"Response Encodings {endpoint}",
+                    True,
+                    f"{len(results)} format/compression pairs decode to the JSON rows; smallest is "
+                    f"{smallest[0]}/{smallest[2]} at {smallest[3]} bytes vs {results[0][3]} plain"
+                )
+            except Exception as e:
+                self.log_test(f"Response Encodings {endpoint}", False, f"Encoding error: {str(e)}")
+        
+        # Small bodies aren't worth compressing
+        try:
+            response = self.client.get("leads", params={"limit": 1}, headers={"Accept-Encoding": "gzip"}, timeout=10)
+            self.log_test(
+                "Small Response Uncompressed",
+                "Content-Encoding" not in response.headers and response.status_code == 200,
+                f"{len(response.content)}-byte list sent with Content-Encoding "
+                f"{response.headers.get('Content-Encoding', 'identity')}"
+            )
+        except Exception as e:
+            self.log_test("Small Response Uncompressed", False, f"Error: {str(e)}")
+    
+    def test_incremental_sync(self):
+        """Sync into a local store, check it converges to the list endpoints, and compare payload sizes"""
+        print("\n=== Testing Incremental Sync ===")
+        
+        store = {"photos": {}, "leads": {}, "gps_tracking": {}, "users": {}}
+        authors = {}
+        
+        def sync(token=None):
+            response = self.client.get("sync", params={"since": token} if token else None, timeout=60)
+            response.raise_for_status()
+            body = response.json()
+            for table in body["reset"]:
+                store[table] = {}
+            for table, rows in body["changes"].items():
+                store[table].update({row["id"]: row for row in rows})
+            for table, ids in body["deleted"].items():
+                for row_id in ids:
+                    store[table].pop(row_id, None)
+            authors.update(body["users"])
+            return body, len(response.content)
+        
+        def newest(rows, column, count):
+            return sorted(rows, key=lambda row: (row[column], str(row["id"])), reverse=True)[:count]
+        
+        # The local copy, with authors joined from the dictionary, matches each list endpoint
+        def differences():
+            found = []
+            for table, endpoint, params in (("photos", "photos", {}), ("leads", "leads", {}),
+                                            ("users", "users", {}), ("gps_tracking", "gps-tracking", {"limit": 500})):
+                listed = self.client.get(endpoint, params=params, timeout=30).json()
+                local = list(store[table].values())
+                if table == "gps_tracking":
+                    local = newest(local, "timestamp", len(listed))
+                if table != "users":
+                    local = [{**row, "users": authors.get(str(row["user_id"]))} for row in local]
+                if {row["id"]: row for row in local} != {row["id"]: row for row in listed}:
+                    found.append(table)
+            return found
+        
+        def change_counts(body):
+            return {table: len(rows) for table, rows in body["changes"].items() if rows}
+        
+        agent_user = self.registered_users.get('agent')
+        if not agent_user:
+            self.log_test("Incremental Sync", False, "No agent user available for testing")
+            return
+        user_id = agent_user['user_id']
+        
+        try:
+            full, full_bytes = sync()
+            mismatched = differences()
+            self.log_test(
+                "Full Sync",
+                not mismatched and set(full["reset"]) == set(store),
+                f"Snapshot of {sum(len(rows) for rows in full['changes'].values())} rows, {full_bytes} bytes"
+                + (f"; differs from the lists for {mismatched}" if mismatched else "; matches every list")
+            )
+            
+            list_bytes = sum(
+                len(self.client.get(endpoint, params=params, timeout=30).content)
+                for endpoint, params in (("photos", {"users": "dict"}), ("leads", {"users": "dict"}),
+                                         ("users", {}), ("gps-tracking", {}))
+            )
+            
+            # One of each kind of write, then a sync that should carry only those rows
+            now = datetime.utcnow()
+            self.client.post("photos", json={
+                "user_id": user_id,
+                "image_url": "https://example.com/sync-photo.jpg",
+                "latitude": TEST_GPS_COORDS['latitude'],
+                "longitude": TEST_GPS_COORDS['longitude'],
+                "description": "Photo written between syncs"
+            }, timeout=10).raise_for_status()
+            self.client.post("leads", json={
+                "user_id": user_id,
+                "contact_name": "Sync Test Contact",
+                "business_name": "Between Syncs Ltd",
+                "latitude": TEST_GPS_COORDS['latitude'],
+                "longitude": TEST_GPS_COORDS['longitude']
+            }, timeout=10).raise_for_status()
+            fixes = [{
+                "user_id": user_id,
+                "latitude": TEST_GPS_COORDS['latitude'] + i * 0.0001,
+                "longitude": TEST_GPS_COORDS['longitude'],
+                "activity_type": "active",
+                "timestamp": (now + timedelta(seconds=i)).isoformat() + "Z"
+            } for i in range(20)]
+            self.client.post("gps-tracking/batch", json={"fixes": fixes}, timeout=10).raise_for_status()
+            role = next(user['role'] for user in self.client.get("users", timeout=10).json() if user['id'] == user_id)
+            changed = 'agent' if role == 'admin' else 'admin'
+            self.client.put(f"users/{user_id}/role", json={"role": changed}, timeout=10).raise_for_status()
+            self.client.put(f"users/{user_id}/role", json={"role": role}, timeout=10).raise_for_status()
+            
+            incremental, incremental_bytes = sync(full["token"])
+            counts = change_counts(incremental)
+            mismatched = differences()
+            expected = {"photos": 1, "leads": 1, "gps_tracking": len(fixes), "users": 1}
+            self.log_test(
+                "Incremental Sync",
+                counts == expected and not incremental["reset"] and not mismatched,
+                f"Changes {counts} (expected {expected}) in {incremental_bytes} bytes"
+                + (f"; differs from the lists for {mismatched}" if mismatched else "; store matches every list")
+            )
+            
+            idle, idle_bytes = sync(incremental["token"])
+            self.log_test(
+                "Idle Sync",
+                not change_counts(idle) and not idle["reset"] and not idle["more"],
+                f"No writes since the last sync: {change_counts(idle) or 'no changes'}, {idle_bytes} bytes"
+            )
+            
+            print(f"📦 Refresh payload: four list calls {list_bytes} bytes, full sync {full_bytes} bytes, "
+                  f"incremental sync {incremental_bytes} bytes, idle sync {idle_bytes} bytes")
+            
+            # Compacting old fixes deletes rows in bulk, so the next sync re-snapshots GPS
+            old_day = (now - timedelta(days=400)).date()
+            old_fixes = [{
+                "user_id": user_id,
+                "latitude": TEST_GPS_COORDS['latitude'],
+                "longitude": TEST_GPS_COORDS['longitude'] + i * 0.0001,
+                "activity_type": "active",
+                "timestamp": f"{old_day.isoformat()}T09:{i:02d}:00Z"
+            } for i in range(5)]
+            self.client.post("gps-tracking/batch", json={"fixes": old_fixes}, timeout=10).raise_for_status()
+            self.client.post("tracks/compact", json={
+                "before": (old_day + timedelta(days=1)).isoformat(), "user_id": user_id, "max_days": 1
+            }, timeout=60).raise_for_status()
+            after_compaction, _ = sync(idle["token"])
+            mismatched = differences()
+            self.log_test(
+                "Sync After Compaction",
+                after_compaction["reset"] == ["gps_tracking"] and not mismatched
+                and not any(row["timestamp"].startswith(old_day.isoformat()) for row in store["gps_tracking"].values()),
+                f"Reset {after_compaction['reset']} with {len(after_compaction['changes']['gps_tracking'])} GPS rows"
+                + (f"; differs from the lists for {mismatched}" if mismatched else "")
+            )
+        except Exception as e:
+            self.log_test("Incremental Sync", False, f"Sync error: {str(e)}")
+        
+        try:
+            malformed = self.client.get("sync", params={"since": "not-a-token"}, timeout=10)
+            stale = self.client.get("sync", params={
+                "since": base64.urlsafe_b64encode(b"restarted.5").decode().rstrip("=")
+            }, timeout=30)
+            self.log_test(
+                "Sync Tokens",
+                malformed.status_code == 400 and stale.status_code == 200
+                and set(stale.json()["reset"]) == set(store),
+                f"Malformed token -> {malformed.status_code}; token from another process -> "
+                f"snapshot of {stale.json().get('reset')}"
+            )
+        except Exception as e:
+            self.log_test("Sync Tokens", False, f"Error testing sync tokens: {str(e)}")
+    
+    def test_dashboard_summary(self):
+        """Check dashboard aggregates against the full lists and that new writes show up immediately"""
+        print("\n=== Testing Dashboard Summary ===")
+        
+        agent_user = self.registered_users.get('agent')
+        if not agent_user:
+            self.log_test("Dashboard Summary", False, "No registered agent available for testing")
+            return
+        
+        try:
+            response = self.client.get("dashboard/summary", params={"recent": 10, "days": 7}, timeout=30)
+            summary = response.json()
+            photo_count = sum(1 for _ in iter_paginated("photos", page_size=500, fields=["user_id"], client=self.client))
+            lead_count = sum(1 for _ in iter_paginated("leads", page_size=500, fields=["user_id"], client=self.client))
+            user_count = sum(1 for _ in iter_paginated("users", page_size=500, fields=["role"], client=self.client))
+            
+            totals = summary.get('totals', {})
+            recent = summary.get('recent_activity', [])
+            per_user = summary.get('per_user', [])
+            ok = (
+                response.status_code == 200
+                and totals.get('photos') == photo_count
+                and totals.get('leads') == lead_count
+                and totals.get('users') == user_count
+                and sum(row['photos'] for row in per_user) == photo_count
+                and sum(row['leads'] for row in per_user) == lead_count
+                and len(summary.get('per_day', [])) == 7
+                and len(recent) <= 10
+                and [item['created_at'] for item in recent] == sorted((item['created_at'] for item in recent), reverse=True)
+            )
+            list_bytes = sum(len(self.client.get(path, timeout=30).content) for path in ("photos", "leads", "users"))
+            self.log_test(
+                "Dashboard Summary",
+                ok,
+                f"{totals.get('photos')} photos, {totals.get('leads')} leads, {totals.get('users')} users, "
+                f"{summary.get('active_agents', {}).get('count')} active; "
+                f"{len(response.content)} bytes vs {list_bytes} bytes for the full lists",
+                None if ok else {"summary_totals": totals, "photos": photo_count, "leads": lead_count, "users": user_count}
+            )
+            
+            lead = self.client.post("leads", json={
+                "user_id": agent_user['user_id'],
+                "contact_name": "Dashboard Contact",
+                "business_name": "Summary Ltd",
+                **TEST_GPS_COORDS
+            }, timeout=10).json()
+            updated = self.client.get("dashboard/summary", params={"active_minutes": 60}, timeout=30).json()
+            active_ids = [row['user_id'] for row in updated.get('active_agents', {}).get('users', [])]
+            latest = (updated.get('recent_activity') or [{}])[0]
+            ok = (
+                updated.get('totals', {}).get('leads') == lead_count + 1
+                and latest.get('type') == 'lead'
+                and latest.get('id') == lead.get('id')
+                and agent_user['user_id'] in active_ids
+            )
+            self.log_test(
+                "Dashboard Incremental Update",
+                ok,
+                f"New lead counted ({updated.get('totals', {}).get('leads')} leads) and listed first; "
+                f"{len(active_ids)} agent(s) active in the last hour",
+                None if ok else updated
+            )
+            
+        except Exception as e:
+            self.log_test("Dashboard Summary", False, f"Dashboard summary error: {str(e)}")
+    
+    def test_pagination_api(self):
+        """Test cursor pagination and field projection on list endpoints"""
+        print("\n=== Testing Pagination API ===")
+        
+        list_endpoints = {
+            "photos": ["latitude", "longitude", "description"],
+            "leads": ["contact_name", "business_name"],
+            "users": ["full_name", "role"]
+        }
+        
+        for endpoint, fields in list_endpoints.items():
+            try:
+                rows = list(iter_paginated(endpoint, page_size=2, fields=fields, client=self.client))
+                ids = [row['id'] for row in rows]
+                timestamps = [row['created_at'] for row in rows]
+                allowed_keys = set(fields) | {'id', 'created_at'}
+                
+                if len(ids) != len(set(ids)):
+                    self.log_test(f"Paginate {endpoint}", False, "Pages returned duplicate rows")
+                elif timestamps != sorted(timestamps, reverse=True):
+                    self.log_test(f"Paginate {endpoint}", False, "Pages are not ordered newest first")
+                elif any(set(row) - allowed_keys for row in rows):
+                    self.log_test(
+                        f"Paginate {endpoint}",
+                        False,
+                        "Rows contain fields outside the requested projection",
+                        {"sample": rows[:1]}
+                    )
+                else:
+                    self.log_test(
+                        f"Paginate {endpoint}",
+                        True,
+                        f"Streamed {len(rows)} {endpoint} in pages of 2 with projection {fields}"
+                    )
+                    
+            except Exception as e:
+                self.log_test(f"Paginate {endpoint}", False, f"Pagination error: {str(e)}")
+        
+        # Unknown projection fields are rejected
+        try:
+            response = self.client.get("photos", params={"fields": "password"}, timeout=10)
+            self.log_test(
+                "Invalid Projection",
+                response.status_code == 400,
+                f"Unknown field returned status {response.status_code}"
+            )
+        except Exception as e:
+            self.log_test("Invalid Projection", False, f"Error testing invalid projection: {str(e)}")
+        
+        # Cursors are decoded from client input; anything but a timestamp and an id is rejected
+        try:
+            crafted = base64.urlsafe_b64encode(
+                json.dumps(['2024-01-01T00:00:00Z",user_id.neq.x', 1]).encode()
+            ).decode().rstrip("=")
+            response = self.client.get("photos", params={"cursor": crafted}, timeout=10)
+            self.log_test(
+                "Invalid Cursor",
+                response.status_code == 400,
+                f"Crafted cursor returned status {response.status_code}"
+            )
+        except Exception as e:
+            self.log_test("Invalid Cursor", False, f"Error testing crafted cursor: {str(e)}")
+    
+    def test_health_api(self):
+        """Test readiness endpoint and its latency stats"""
+        print("\n=== Testing Health API ===")
+        
+        try:
+            response = self.client.get("health", params={"refresh": "1"}, timeout=10)
+            data = response.json()
+            latency = data.get('latency_ms', {})
+            if response.status_code == 200 and data.get('status') == 'ok' and latency.get('samples'):
+                self.log_test(
+                    "Health Check",
+                    True,
+                    f"Database healthy, check latency p50 {latency['p50']} ms over {latency['samples']} samples"
+                )
+            else:
+                self.log_test("Health Check", False, f"Health returned status {response.status_code}", data)
+        except Exception as e:
+            self.log_test("Health Check", False, f"Health check error: {str(e)}")
+    
+    def test_metrics_api(self):
+        """Test Server-Timing headers and the Prometheus metrics endpoint"""
+        print("\n=== Testing Metrics API ===")
+        
+        try:
+            response = self.client.get("photos", params={"limit": 5, "_": uuid.uuid4().hex}, timeout=10)
+            timings = parse_server_timing(response.headers.get("Server-Timing"))
+            ok = {"db", "serialize", "total"} <= set(timings) and timings["total"]["desc"] == "photos"
+            self.log_test(
+                "Server-Timing Header",
+                ok,
+                ", ".join(f"{name} {metric['dur']:.2f} ms" for name, metric in timings.items()) or "Header missing",
+                None if ok else dict(response.headers)
+            )
+            
+            response = self.client.get("metrics", timeout=10)
+            body = response.text
+            ok = (
+                response.status_code == 200
+                and response.headers.get("Content-Type", "").startswith("text/plain")
+                and 'api_request_duration_seconds_bucket{method="GET",route="photos",le="+Inf"}' in body
+                and 'api_request_phase_seconds_count{method="GET",route="photos",phase="db"}' in body
+                and "# TYPE api_requests_total counter" in body
+            )
+            series = len([line for line in body.splitlines() if line and not line.startswith("#")])
+            self.log_test(
+                "Prometheus Metrics",
+                ok,
+                f"{series} series exposed in {len(body)} bytes",
+                None if ok else {"status": response.status_code, "head": body[:500]}
+            )
+            
+            # Unknown paths, answered 401 before routing without a token, must not add a series each
+            probe = f"probe-{uuid.uuid4().hex}"
+            with APIClient(self.client.base_url, retries=0) as anonymous:
+                statuses = [anonymous.get(f"{probe}/{n}", timeout=10).status_code for n in range(3)]
+            body = self.client.get("metrics", timeout=10).text
+            ok = probe not in body and 'route="unmatched"' in body
+            self.log_test(
+                "Metrics Route Labels",
+                ok,
+                f"Unknown paths answered {statuses} and were recorded as "
+                f"{'unmatched' if ok else 'their own routes'}"
+            )
+            
+        except Exception as e:
+            self.log_test("Metrics API", False, f"Metrics error: {str(e)}")
+    
     def test_error_handling(self):
         """Test API error handling"""
         print("\n=== Testing Error Handling ===")
         
         # Test invalid endpoint
         try:
-            response = requests.get(f"{BASE_URL}/invalid-endpoint", timeout=10)
+            response = self.client.get("invalid-endpoint", timeout=10)
             if response.status_code == 404:
                 self.log_test(
                     "Invalid Endpoint",
@@ -535,9 +2267,8 @@ class FieldManagementAPITester:
         
         # Test invalid login credentials
         try:
-            response = requests.post(
-                f"{BASE_URL}/auth/login",
-                headers=HEADERS,
+            response = self.client.post(
+                "auth/login",
                 json={"email": "invalid@test.com", "password": "wrongpassword"},
                 timeout=10
             )
@@ -562,19 +2293,57 @@ class FieldManagementAPITester:
         print(f"Base URL: {BASE_URL}")
         print("=" * 60)
         
+        if wait_for_ready(client=self.client) is None:
+            print("⚠️  Backend did not report ready; running tests anyway")
+        
         # Run tests in logical order
+        self.test_health_api()
         self.test_user_registration()
         self.test_user_login()
+        self.test_auth_middleware()
         self.test_photo_upload_api()
+        self.test_photo_blob_upload_api()
         self.test_get_photos_api()
         self.test_lead_capture_api()
         self.test_get_leads_api()
+        self.test_leads_import_export()
+        self.test_response_cache()
         self.test_gps_tracking_api()
+        self.test_idempotent_writes()
+        self.test_event_stream()
+        self.test_spatial_queries()
+        self.test_track_summaries()
         self.test_get_gps_tracking_api()
         self.test_user_management_api()
+        self.test_user_directory()
+        self.test_response_encodings()
+        self.test_incremental_sync()
+        self.test_dashboard_summary()
+        self.test_pagination_api()
+        self.test_metrics_api()
         self.test_error_handling()
+        self.test_traffic_capture()
+        self.test_gps_history()
+        self.test_write_behind()
         
-        # Summary
+        return self.print_summary()
+    
+    def run_write_behind_tests(self):
+        """Against a server started with WRITE_BEHIND=on, where writes answer 202 and land later"""
+        print("🚀 Starting Write-Behind Testing")
+        print(f"Base URL: {BASE_URL}")
+        print("=" * 60)
+        
+        if wait_for_ready(client=self.client) is None:
+            print("⚠️  Backend did not report ready; running tests anyway")
+        
+        self.test_user_registration()
+        self.test_user_login()
+        self.test_write_behind(fixes=1000, batch_size=500)
+        
+        return self.print_summary()
+    
+    def print_summary(self):
         print("\n" + "=" * 60)
         print("📊 TEST SUMMARY")
         print("=" * 60)
@@ -594,12 +2363,26 @@ class FieldManagementAPITester:
                 if not result['success']:
                     print(f"  - {result['test']}: {result['message']}")
         
+        print("\n⏱️  LATENCY BY PHASE")
+        print_phase_breakdown(self.phases.summary())
+        
         print("\n" + "=" * 60)
         return passed_tests, failed_tests
 
 if __name__ == "__main__":
+    import sys
+
+    # `--load` switches to the concurrent load mode; remaining flags go to load_generator
+    if "--load" in sys.argv[1:]:
+        import load_generator
+        exit(load_generator.main([arg for arg in sys.argv[1:] if arg != "--load"]))
+
     tester = FieldManagementAPITester()
-    passed, failed = tester.run_all_tests()
+    # `--write-behind` checks a server running with WRITE_BEHIND=on
+    if "--write-behind" in sys.argv[1:]:
+        passed, failed = tester.run_write_behind_tests()
+    else:
+        passed, failed = tester.run_all_tests()
     
     # Exit with appropriate code
     exit(0 if failed == 0 else 1)
\ No newline at end of file
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Benchmark Suite for Field Management Application
+Seeds a deterministic dataset, runs repeatable per-endpoint scenarios and
+compares the results against a stored baseline with regression thresholds
+"""
+
+import argparse
+import json
+import random
+import statistics
+import subprocess
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from api_client import APIClient, admin_client, grant_admin
+from backend_test import BASE_URL, TEST_GPS_COORDS, wait_for_ready
+from load_generator import percentile
+
+DEFAULT_RESULTS_FILE = "benchmark_results.json"
+DEFAULT_BASELINE_FILE = "benchmark_baseline.json"
+
+# Allowed relative change before a metric counts as a regression
+DEFAULT_THRESHOLDS = {
+    "p50_ms": 0.20,
+    "p95_ms": 0.30,
+    "throughput": 0.20,
+    "bytes_mean": 0.10,
+}
+# Seeded fixes end at the time of the run, so GPS reads (which start at the newest day) find them
+FIX_INTERVAL_S = 30
+BATCH_FIX_INTERVAL_S = 5
+
+
+class BenchmarkSuite:
+    """Seeds data and runs the benchmark scenarios against one backend"""
+
+    def __init__(self, base_url=BASE_URL, seed=1234, agents=5, rows_per_agent=40,
+                 iterations=30, warmup=3):
+        self.base_url = base_url
+        # Keep-alive pool so timings measure the API rather than connection setup; no retries,
+        # which would hide failures inside the latency numbers
+        self.client = APIClient(base_url, pool_size=4, retries=0)
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.agents = agents
+        self.rows_per_agent = rows_per_agent
+        self.iterations = iterations
+        self.warmup = warmup
+        # Accounts live in a namespace of their own (emails ending @<namespace>.test), removed with
+        # everything they own after the run, so a persistent backend doesn't grow between runs
+        self.namespace = f"bench-{seed}-{uuid.uuid4().hex[:6]}"
+        self.user_ids = []
+        self.results = {}
+
+    def _position(self):
+        return (round(TEST_GPS_COORDS["latitude"] + self.rng.uniform(-0.05, 0.05), 6),
+                round(TEST_GPS_COORDS["longitude"] + self.rng.uniform(-0.05, 0.05), 6))
+
+    def _gps_fixes(self, count, user_id, end, interval=FIX_INTERVAL_S):
+        """`count` fixes `interval` seconds apart, the last one at `end`"""
+        fixes = []
+        for i in range(count):
+            latitude, longitude = self._position()
+            fixes.append({
+                "user_id": user_id,
+                "latitude": latitude,
+                "longitude": longitude,
+                "activity_type": self.rng.choice(["active", "break", "idle"]),
+                "timestamp": (end - timedelta(seconds=interval * (count - 1 - i))).isoformat(),
+            })
+        return fixes
+
+    def seed_dataset(self):
+        """Register agents and give each the same seeded photos, leads and GPS history"""
+        print(f"🌱 Seeding {self.agents} agents x {self.rows_per_agent} rows (seed {self.seed})")
+        end = datetime.now(timezone.utc)
+        # Seeding writes on behalf of every agent, which takes an admin session; being in the
+        # namespace, the same admin removes it afterwards
+        admin = {
+            "email": f"admin@{self.namespace}.test",
+            "password": "BenchPass123!",
+            "fullName": "Bench Admin",
+        }
+        response = self.client.post("auth/register", json=admin, timeout=30)
+        response.raise_for_status()
+        with admin_client(self.base_url, retries=0) as granter:
+            grant_admin(granter, response.json()["user"]["id"])
+        self.client.login(admin["email"], admin["password"])
+        for index in range(self.agents):
+            response = self.client.post("auth/register", json={
+                "email": f"agent-{index}@{self.namespace}.test",
+                "password": "BenchPass123!",
+                "fullName": f"Bench Agent {index}",
+                "role": "agent",
+            }, timeout=30)
+            response.raise_for_status()
+            user_id = response.json()["user"]["id"]
+            self.user_ids.append(user_id)
+
+            for row in range(self.rows_per_agent):
+                latitude, longitude = self._position()
+                self.client.post("photos", json={
+                    "user_id": user_id,
+                    "image_url": f"https://example.com/bench/{self.seed}/{index}/{row}.jpg",
+                    "latitude": latitude,
+                    "longitude": longitude,
+                    "description": f"Benchmark photo {row}",
+                }, timeout=30).raise_for_status()
+                self.client.post("leads", json=self._lead(user_id, row), timeout=30).raise_for_status()
+
+            fixes = self._gps_fixes(self.rows_per_agent * 10, user_id, end)
+            self.client.post("gps-tracking/batch", json={"fixes": fixes}, timeout=60).raise_for_status()
+
+    def _lead(self, user_id, row):
+        latitude, longitude = self._position()
+        return {
+            "user_id": user_id,
+            "contact_name": f"Bench Contact {row}",
+            "contact_phone": f"+1-555-{self.rng.randint(0, 9999):04d}",
+            "contact_email": f"contact{row}@bench.example.com",
+            "business_name": self.rng.choice(["Acme", "Globex", "Initech", "Umbrella"]),
+            "latitude": latitude,
+            "longitude": longitude,
+            "notes": "Benchmark lead",
+        }
+
+    def measure(self, name, request, rows_per_call=1):
+        """Time `request()` over warmup + iterations calls and store the distribution"""
+        for i in range(self.warmup):
+            request(-1 - i)
+
+        latencies = []
+        sizes = []
+        errors = 0
+        start = time.perf_counter()
+        for i in range(self.iterations):
+            call_start = time.perf_counter()
+            response = request(i)
+            latencies.append(time.perf_counter() - call_start)
+            sizes.append(len(response.content))
+            if response.status_code >= 400:
+                errors += 1
+        wall_time = time.perf_counter() - start
+
+        self.results[name] = {
+            "iterations": self.iterations,
+            "errors": errors,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "mean_ms": statistics.mean(latencies) * 1000,
+            "max_ms": max(latencies) * 1000,
+            "throughput": self.iterations * rows_per_call / wall_time,
+            "bytes_mean": statistics.mean(sizes),
+        }
+        row = self.results[name]
+        print(f"  {name:<34} p50 {row['p50_ms']:8.1f} ms  p95 {row['p95_ms']:8.1f} ms  "
+              f"{row['throughput']:9.1f}/s  {row['bytes_mean']:10.0f} B")
+
+    def run(self):
+        self.seed_dataset()
+        print("\n⏱️  Running scenarios")
+        user_id = self.user_ids[0]
+        nonce = uuid.uuid4().hex[:6]
+
+        for path in ("photos", "leads", "users", "gps-tracking"):
+            # A unique query string always misses the response cache
+            self.measure(f"GET {path} (cold)", lambda i, p=path: self.client.get(
+                p, params={"limit": 100, "_": f"{nonce}{i}"}, timeout=30))
+            self.measure(f"GET {path} (warm)", lambda i, p=path: self.client.get(
+                p, params={"limit": 100}, timeout=30))
+
+        # The largest page rather than the whole table, whose size depends on everything else stored
+        self.measure("GET photos (large table)", lambda i: self.client.get(
+            "photos", params={"limit": 500, "_": f"{nonce}{i}"}, timeout=60))
+        self.measure("GET gps-tracking (large page)", lambda i: self.client.get(
+            "gps-tracking", params={"limit": 500, "_": f"{nonce}{i}"}, timeout=60))
+
+        self.measure("POST gps-tracking", lambda i: self.client.post(
+            "gps-tracking", json={"user_id": user_id, **TEST_GPS_COORDS, "activity_type": "active"}, timeout=30))
+        self.measure("POST leads", lambda i: self.client.post(
+            "leads", json=self._lead(user_id, i), timeout=30))
+
+        batch_size = 500
+        now = datetime.now(timezone.utc)
+        batches = [self._gps_fixes(batch_size, user_id, now - timedelta(seconds=BATCH_FIX_INTERVAL_S * batch_size * i),
+                                   interval=BATCH_FIX_INTERVAL_S)
+                   for i in range(self.iterations + self.warmup)]
+        self.measure(f"POST gps-tracking/batch ({batch_size})", lambda i: self.client.post(
+            "gps-tracking/batch", json={"fixes": batches[i]}, timeout=60), rows_per_call=batch_size)
+
+        return self.results
+
+    def cleanup(self):
+        """Remove the run's namespace; returns the counts removed, or None when the server doesn't
+        offer cleanup (TEST_CLEANUP is off) or seeding never signed in"""
+        if not self.client.token:
+            return None
+        response = self.client.post("testing/cleanup", json={"namespace": self.namespace}, timeout=120)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.json()["removed"]
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, thresholds=DEFAULT_THRESHOLDS):
+    """Return a list of (scenario, metric, baseline, current, change) regressions; any errors
+    beyond the baseline's count as one"""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        before, after = previous.get("errors", 0), current.get("errors", 0)
+        if after > before:
+            regressions.append((name, "errors", before, after, (after - before) / before if before else float("inf")))
+        for metric, allowed in thresholds.items():
+            before, after = previous.get(metric), current.get(metric)
+            if not before or after is None:
+                continue
+            # Throughput regresses downwards, everything else upwards
+            change = (before - after) / before if metric == "throughput" else (after - before) / before
+            if change > allowed:
+                regressions.append((name, metric, before, after, change))
+    return regressions
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Benchmark the field management API against a baseline")
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--agents", type=int, default=5)
+    parser.add_argument("--rows-per-agent", type=int, default=40)
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--output", default=DEFAULT_RESULTS_FILE, help="where to write this run's results")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_FILE, help="baseline results to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    for metric, allowed in DEFAULT_THRESHOLDS.items():
+        parser.add_argument(f"--max-{metric.replace('_', '-')}-regression", type=float, default=allowed,
+                            dest=f"threshold_{metric}",
+                            help=f"allowed relative regression for {metric} (default {allowed * 100:.0f}%%)")
+    return parser
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    if wait_for_ready(base_url=args.base_url) is None:
+        print(f"❌ Backend at {args.base_url} is not ready")
+        return 1
+
+    suite = BenchmarkSuite(args.base_url, args.seed, args.agents, args.rows_per_agent,
+                           args.iterations, args.warmup)
+    try:
+        results = suite.run()
+    finally:
+        removed = suite.cleanup()
+        if removed is None:
+            print(f"⚠️  Could not remove namespace {suite.namespace}; start the server with TEST_CLEANUP=on")
+        else:
+            print(f"🧹 Removed namespace {suite.namespace}: {removed}")
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "base_url": args.base_url,
+            "git_revision": git_revision(),
+            "seed": args.seed,
+            "agents": args.agents,
+            "rows_per_agent": args.rows_per_agent,
+            "iterations": args.iterations,
+            "namespace": suite.namespace,
+        },
+        "scenarios": results,
+    }
+    with open(args.output, "w") as handle:
+        json.dump(report, handle, indent=2)
+    print(f"\n💾 Results written to {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as handle:
+            json.dump(report, handle, indent=2)
+        print(f"📌 Baseline saved to {args.baseline}")
+        return 0
+
+    try:
+        with open(args.baseline) as handle:
+            baseline = json.load(handle)
+    except FileNotFoundError:
+        print(f"ℹ️  No baseline at {args.baseline}; run with --save-baseline to create one")
+        return 0
+
+    thresholds = {metric: getattr(args, f"threshold_{metric}") for metric in DEFAULT_THRESHOLDS}
+    regressions = compare(results, baseline["scenarios"], thresholds)
+    print("\n" + "=" * 60)
+    print(f"📊 COMPARISON WITH BASELINE ({baseline['meta'].get('git_revision') or baseline['meta']['timestamp']})")
+    print("=" * 60)
+    if not regressions:
+        print("✅ No regressions beyond thresholds")
+        return 0
+    for name, metric, before, after, change in regressions:
+        print(f"❌ {name}: {metric} {before:.1f} -> {after:.1f} ({change:+.0%})")
+    return 1
+
+
+if __name__ == "__main__":
+    exit(main())
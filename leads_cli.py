@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Lead Import/Export CLI for Field Management Application
+Streams CSV or NDJSON lead files of any size to /api/leads/import and
+/api/leads/export, and generates synthetic files for trying it out
+"""
+
+import argparse
+import csv
+import json
+import os
+import random
+import sys
+import time
+import zlib
+
+from api_client import APIClient
+from backend_test import BASE_URL, TEST_GPS_COORDS
+
+READ_SIZE = 1024 * 1024
+LEAD_COLUMNS = ["user_id", "contact_name", "contact_phone", "contact_email", "business_name",
+                "latitude", "longitude", "notes"]
+
+
+def detect_format(path, requested=None):
+    if requested:
+        return requested
+    return "csv" if path.lower().removesuffix(".gz").endswith(".csv") else "ndjson"
+
+
+def read_chunks(path, compress=True, progress=None):
+    """Yield the file in READ_SIZE chunks, gzip-compressed on the fly unless compress is False"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    sent = 0
+    with open(path, "rb") as handle:
+        while True:
+            chunk = handle.read(READ_SIZE)
+            if not chunk:
+                break
+            sent += len(chunk)
+            if progress:
+                progress(sent)
+            if compressor is None:
+                yield chunk
+                continue
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+    if compressor is not None:
+        yield compressor.flush()
+
+
+def import_leads(client, path, file_format=None, user_id=None, compress=True, timeout=3600):
+    """Stream one file to the import endpoint and return its report"""
+    file_format = detect_format(path, file_format)
+    total = os.path.getsize(path)
+    start = time.perf_counter()
+
+    def progress(sent):
+        print(f"\r📤 {sent / 1e6:8.1f} / {total / 1e6:.1f} MB read ({time.perf_counter() - start:.1f}s)",
+              end="", file=sys.stderr, flush=True)
+
+    headers = {"Content-Type": "text/csv" if file_format == "csv" else "application/x-ndjson"}
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    params = {"format": file_format}
+    if user_id:
+        params["user_id"] = user_id
+
+    response = client.post("leads/import", params=params, headers=headers,
+                           data=read_chunks(path, compress, progress), timeout=timeout)
+    print(file=sys.stderr)
+    response.raise_for_status()
+    return response.json()
+
+
+def export_leads(client, output, file_format="csv", user_id=None, timeout=3600):
+    """Stream the export endpoint into output (a path or "-"); returns (bytes, rows)"""
+    params = {"format": file_format}
+    if user_id:
+        params["user_id"] = user_id
+
+    written = 0
+    lines = 0
+    start = time.perf_counter()
+    with client.get("leads/export", params=params, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        handle = sys.stdout.buffer if output == "-" else open(output, "wb")
+        try:
+            for chunk in response.iter_content(chunk_size=READ_SIZE):
+                handle.write(chunk)
+                written += len(chunk)
+                lines += chunk.count(b"\n")
+                print(f"\r📥 {written / 1e6:8.1f} MB written ({time.perf_counter() - start:.1f}s)",
+                      end="", file=sys.stderr, flush=True)
+        finally:
+            if handle is not sys.stdout.buffer:
+                handle.close()
+    print(file=sys.stderr)
+    # CSV line count includes the header; quoted line breaks make it approximate
+    return written, lines - 1 if file_format == "csv" else lines
+
+
+def generate_leads(path, count, user_id, file_format=None, duplicate_rate=0.01, invalid_rate=0.0, seed=1234):
+    """Write a synthetic lead file; a share of rows repeat an earlier email and some are invalid"""
+    file_format = detect_format(path, file_format)
+    rng = random.Random(seed)
+    with open(path, "w", newline="") as handle:
+        writer = csv.DictWriter(handle, fieldnames=LEAD_COLUMNS) if file_format == "csv" else None
+        if writer:
+            writer.writeheader()
+        for index in range(count):
+            source = rng.randrange(index) if index and rng.random() < duplicate_rate else index
+            lead = {
+                "user_id": user_id,
+                "contact_name": "" if rng.random() < invalid_rate else f"Contact {index}",
+                "contact_phone": f"+1-555-{source // 10000:03d}-{source % 10000:04d}",
+                "contact_email": f"lead{source}.{seed}@example.com",
+                "business_name": rng.choice(["Acme", "Globex", "Initech", "Umbrella", "Stark, Inc."]),
+                "latitude": round(TEST_GPS_COORDS["latitude"] + rng.uniform(-0.2, 0.2), 6),
+                "longitude": round(TEST_GPS_COORDS["longitude"] + rng.uniform(-0.2, 0.2), 6),
+                "notes": "Generated by leads_cli.py" if index % 7 else "Multi-line note,\nwith \"quotes\"",
+            }
+            if writer:
+                writer.writerow(lead)
+            else:
+                handle.write(json.dumps(lead) + "\n")
+
+
+def print_report(report, errors_file=None):
+    print("\n" + "=" * 60)
+    print("📊 IMPORT SUMMARY")
+    print("=" * 60)
+    for key in ("received", "inserted", "duplicates", "invalid", "failed"):
+        print(f"{key.capitalize():<12}{report.get(key, 0):>12}")
+    print(f"{'Duration':<12}{report.get('duration_ms', 0) / 1000:>11.1f}s")
+    rate = report.get("received", 0) / (report.get("duration_ms", 0) / 1000 or 1)
+    print(f"{'Rows/s':<12}{rate:>12.0f}")
+
+    errors = report.get("errors", [])
+    if errors_file:
+        with open(errors_file, "w") as handle:
+            json.dump(errors, handle, indent=2)
+        print(f"\n💾 {len(errors)} row problems written to {errors_file}")
+    else:
+        for entry in errors[:10]:
+            where = entry.get("row") or "-".join(str(row) for row in entry.get("rows", []))
+            print(f"  row {where}: {entry['error']}")
+        if len(errors) > 10:
+            print(f"  ... {len(errors) - 10} more (use --errors-file to save them all)")
+    if report.get("errors_truncated"):
+        print("⚠️  The server listed only the first problems; counts above are complete")
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Bulk import and export of leads")
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--email", default=os.environ.get("API_EMAIL"), help="admin to log in as (or API_EMAIL)")
+    parser.add_argument("--password", default=os.environ.get("API_PASSWORD"), help="or API_PASSWORD")
+    parser.add_argument("--token", default=os.environ.get("API_TOKEN"),
+                        help="access token to use instead of logging in (or API_TOKEN)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    importer = commands.add_parser("import", help="stream a CSV or NDJSON file into the leads table")
+    importer.add_argument("path")
+    importer.add_argument("--format", choices=["csv", "ndjson"], help="defaults to the file extension")
+    importer.add_argument("--user-id", help="agent for rows without a user_id column")
+    importer.add_argument("--no-gzip", dest="gzip", action="store_false", help="send the file uncompressed")
+    importer.add_argument("--errors-file", help="write every reported row problem here as JSON")
+
+    exporter = commands.add_parser("export", help="stream all leads to a file")
+    exporter.add_argument("--output", default="-", help="file to write, or - for stdout")
+    exporter.add_argument("--format", choices=["csv", "ndjson"], default="csv")
+    exporter.add_argument("--user-id", help="only this agent's leads")
+
+    generator = commands.add_parser("generate", help="write a synthetic lead file")
+    generator.add_argument("count", type=int)
+    generator.add_argument("--output", required=True)
+    generator.add_argument("--format", choices=["csv", "ndjson"], help="defaults to the file extension")
+    generator.add_argument("--user-id", required=True)
+    generator.add_argument("--duplicate-rate", type=float, default=0.01)
+    generator.add_argument("--invalid-rate", type=float, default=0.0)
+    generator.add_argument("--seed", type=int, default=1234)
+    return parser
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+
+    if args.command == "generate":
+        generate_leads(args.output, args.count, args.user_id, args.format, args.duplicate_rate,
+                       args.invalid_rate, args.seed)
+        print(f"🌱 Wrote {args.count} leads to {args.output}")
+        return 0
+
+    # Import and export are admin-only
+    client = APIClient(args.base_url, token=args.token)
+    if not args.token:
+        if not (args.email and args.password):
+            print("❌ Pass --email and --password (or --token) for an admin account", file=sys.stderr)
+            return 2
+        client.login(args.email, args.password)
+    if args.command == "import":
+        report = import_leads(client, args.path, args.format, args.user_id, args.gzip)
+        print_report(report, args.errors_file)
+        return 0 if not report.get("failed") else 1
+
+    written, rows = export_leads(client, args.output, args.format, args.user_id)
+    print(f"✅ Exported about {rows} leads ({written / 1e6:.1f} MB)", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
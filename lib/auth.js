@@ -0,0 +1,103 @@
+import { supabase, dataBackend } from './supabase.js'
+import { MEMORY_JWT_SECRET } from './memoryClient.js'
+import { verifyJwt } from './jwt.js'
+import { LRUCache } from './cache.js'
+import { subscribe } from './events.js'
+import { timed, timedSync } from './metrics.js'
+
+// Bearer-token authentication for API routes. Access tokens from /api/auth/login are verified
+// locally against the project's JWT secret (falling back to the auth server when no secret is
+// configured), and the caller's profile is cached until the token expires, so a protected
+// request normally costs one map lookup instead of an auth round trip and a users read.
+const JWT_SECRET = process.env.SUPABASE_JWT_SECRET || (dataBackend === 'memory' ? MEMORY_JWT_SECRET : null)
+// AUTH_CACHE=off verifies and loads the profile on every request, for measuring the cache
+const CACHE_ENABLED = process.env.AUTH_CACHE !== 'off'
+
+const principals = new LRUCache({
+  maxEntries: parseInt(process.env.AUTH_CACHE_MAX_ENTRIES || '', 10) || 10000,
+  ttlMs: 60 * 60 * 1000
+})
+
+// A role change or profile edit takes effect on the user's next request
+subscribe((event) => {
+  if (event.table === 'users' && event.row?.id) principals.invalidate(`user:${event.row.id}`)
+})
+
+export const authCacheStats = () => principals.stats()
+
+// Drop cached sessions of deleted users, so their tokens stop working at once
+export const forgetUsers = (ids) => ids.forEach((id) => principals.invalidate(`user:${id}`))
+
+// The token from `Authorization: Bearer ...`, or ?access_token= where headers can't be set (EventSource)
+export const bearerToken = (request, url) => {
+  const header = request.headers.get('authorization') || ''
+  const match = /^Bearer\s+(\S+)$/i.exec(header)
+  if (match) return match[1]
+  return request.method === 'GET' ? url.searchParams.get('access_token') : null
+}
+
+const decodeClaims = (token) => {
+  try {
+    return JSON.parse(Buffer.from(token.split('.')[1], 'base64url').toString('utf8'))
+  } catch {
+    return null
+  }
+}
+
+const verifyToken = async (token) => {
+  if (JWT_SECRET) return timedSync('auth', () => verifyJwt(token, JWT_SECRET))
+  const { data, error } = await timed('db', supabase.auth.getUser(token))
+  if (error || !data?.user) return { error: error?.message || 'Invalid token' }
+  return { claims: { ...decodeClaims(token), sub: data.user.id } }
+}
+
+const loadPrincipal = async (token) => {
+  const { claims, error } = await verifyToken(token)
+  if (error) return { error }
+
+  const { data: profile, error: profileError } = await timed('db', supabase
+    .from('users')
+    .select('id, email, full_name, role')
+    .eq('id', claims.sub)
+    .maybeSingle())
+  if (profileError) throw new Error(profileError.message)
+  if (!profile) return { error: 'User profile not found' }
+  return { principal: { ...profile, expiresAt: typeof claims.exp === 'number' ? claims.exp * 1000 : null } }
+}
+
+// Resolve the caller: { principal } with the users row (id, email, full_name, role), or
+// { status, error } for a missing or unusable token. Token checks count as the request's auth
+// phase; the profile read on a cache miss counts as db.
+export const authenticate = async (request, url) => {
+  const token = bearerToken(request, url)
+  if (!token) return { status: 401, error: 'Authentication required' }
+
+  const cached = CACHE_ENABLED ? timedSync('auth', () => principals.get(token)) : undefined
+  if (cached) return { principal: cached }
+
+  const { principal, error } = await loadPrincipal(token)
+  if (error) return { status: 401, error }
+  if (CACHE_ENABLED) {
+    const ttlMs = principal.expiresAt === null ? principals.ttlMs : principal.expiresAt - Date.now()
+    if (ttlMs > 0) principals.set(token, principal, { ttlMs, tags: [`user:${principal.id}`] })
+  }
+  return { principal }
+}
+
+export const isAdmin = (principal) => principal?.role === 'admin'
+
+export const ROLES = ['agent', 'admin']
+
+// Self-registration always creates agents; only admins grant roles, through users/:id/role. The
+// emails in ADMIN_EMAILS (comma-separated) register as admins instead, so a new deployment has
+// its first admin.
+const BOOTSTRAP_ADMINS = new Set((process.env.ADMIN_EMAILS || '')
+  .split(',')
+  .map((email) => email.trim().toLowerCase())
+  .filter(Boolean))
+
+export const registrationRole = (email) =>
+  (typeof email === 'string' && BOOTSTRAP_ADMINS.has(email.trim().toLowerCase()) ? 'admin' : 'agent')
+
+// Agents act only for themselves; admins may act for any user
+export const canActFor = (principal, userId) => isAdmin(principal) || principal?.id === userId
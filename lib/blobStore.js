@@ -0,0 +1,70 @@
+import { createHash } from 'crypto'
+import { promises as fs } from 'fs'
+import path from 'path'
+
+// Content-addressed photo storage on the local filesystem.
+// Each upload is stored once under its SHA-256 digest, next to a `<digest>_thumb` variant.
+const blobDir = process.env.BLOB_STORAGE_DIR || path.join(process.cwd(), 'storage', 'blobs')
+
+export const MAX_UPLOAD_BYTES = parseInt(process.env.MAX_UPLOAD_BYTES || '', 10) || 20 * 1024 * 1024
+// An upload form carries the image, a thumbnail no larger than it and the multipart framing
+export const MAX_UPLOAD_FORM_BYTES = MAX_UPLOAD_BYTES * 2 + 64 * 1024
+
+const BLOB_URL_PREFIX = '/api/blobs/'
+const KEY_PATTERN = /^[a-f0-9]{64}(_thumb)?$/
+
+export const blobUrl = (key) => `${BLOB_URL_PREFIX}${key}`
+
+export const isBlobUrl = (url) => typeof url === 'string' && url.startsWith(BLOB_URL_PREFIX)
+
+// List views only need the small variant; legacy inline images have none
+export const thumbnailUrlFor = (imageUrl) =>
+  isBlobUrl(imageUrl) ? `${imageUrl}_thumb` : imageUrl
+
+export const withThumbnail = (row) =>
+  row && 'image_url' in row ? { ...row, thumbnail_url: thumbnailUrlFor(row.image_url) } : row
+
+const blobPath = (key) => path.join(blobDir, key.slice(0, 2), key)
+
+const writeOnce = async (filePath, buffer) => {
+  try {
+    await fs.writeFile(filePath, buffer, { flag: 'wx' })
+  } catch (error) {
+    if (error.code !== 'EEXIST') throw error
+  }
+}
+
+// Store an image and its thumbnail; without a thumbnail the original doubles as one
+export const putImage = async (buffer, thumbnail = null) => {
+  const key = createHash('sha256').update(buffer).digest('hex')
+  const filePath = blobPath(key)
+  await fs.mkdir(path.dirname(filePath), { recursive: true })
+  await writeOnce(filePath, buffer)
+  await writeOnce(`${filePath}_thumb`, thumbnail || buffer)
+
+  return {
+    key,
+    bytes: buffer.length,
+    image_url: blobUrl(key),
+    thumbnail_url: blobUrl(`${key}_thumb`)
+  }
+}
+
+const sniffContentType = (buffer) => {
+  if (buffer[0] === 0xff && buffer[1] === 0xd8) return 'image/jpeg'
+  if (buffer[0] === 0x89 && buffer.toString('ascii', 1, 4) === 'PNG') return 'image/png'
+  if (buffer.toString('ascii', 0, 3) === 'GIF') return 'image/gif'
+  if (buffer.toString('ascii', 0, 4) === 'RIFF' && buffer.toString('ascii', 8, 12) === 'WEBP') return 'image/webp'
+  return 'application/octet-stream'
+}
+
+export const getBlob = async (key) => {
+  if (!KEY_PATTERN.test(key)) return null
+  try {
+    const buffer = await fs.readFile(blobPath(key))
+    return { buffer, contentType: sniffContentType(buffer) }
+  } catch (error) {
+    if (error.code === 'ENOENT') return null
+    throw error
+  }
+}
@@ -0,0 +1,94 @@
+import { createHash } from 'crypto'
+
+// In-process LRU cache with per-entry TTL, an optional byte budget and tag-based invalidation.
+// Map iteration order is insertion order, so the first key is always the least recently used.
+// Each tag has a generation, bumped on invalidation: a value read before a write finishes after it
+// carries the older generation and is not stored.
+export class LRUCache {
+  constructor({ maxEntries = 500, maxBytes = Infinity, ttlMs = 30000 } = {}) {
+    this.maxEntries = maxEntries
+    this.maxBytes = maxBytes
+    this.ttlMs = ttlMs
+    this.entries = new Map()
+    this.generations = new Map()
+    this.bytes = 0
+    this.hits = 0
+    this.misses = 0
+  }
+
+  get(key) {
+    const entry = this.entries.get(key)
+    if (!entry || entry.expiresAt <= Date.now()) {
+      if (entry) this.delete(key)
+      this.misses += 1
+      return undefined
+    }
+    // Re-insert to mark as most recently used
+    this.entries.delete(key)
+    this.entries.set(key, entry)
+    this.hits += 1
+    return entry.value
+  }
+
+  // Take this before reading the value to cache, and pass it to set()
+  version(tags) {
+    return tags.map((tag) => this.generations.get(tag) || 0).join(',')
+  }
+
+  set(key, value, { ttlMs = this.ttlMs, tags = [], size = 0, version = null } = {}) {
+    if (version !== null && version !== this.version(tags)) return false
+    this.delete(key)
+    this.entries.set(key, { value, tags, size, expiresAt: Date.now() + ttlMs })
+    this.bytes += size
+    while (this.entries.size > this.maxEntries || (this.bytes > this.maxBytes && this.entries.size > 1)) {
+      this.delete(this.entries.keys().next().value)
+    }
+    return true
+  }
+
+  // Account for an entry that grew after it was stored, evicting others if it no longer fits
+  resize(key, size) {
+    const entry = this.entries.get(key)
+    if (!entry) return false
+    this.bytes += size - entry.size
+    entry.size = size
+    for (const other of this.entries.keys()) {
+      if (this.bytes <= this.maxBytes) break
+      if (other !== key) this.delete(other)
+    }
+    return true
+  }
+
+  delete(key) {
+    const entry = this.entries.get(key)
+    if (!entry) return false
+    this.bytes -= entry.size
+    return this.entries.delete(key)
+  }
+
+  // Drop every entry carrying any of the given tags
+  invalidate(...tags) {
+    tags.forEach((tag) => this.generations.set(tag, (this.generations.get(tag) || 0) + 1))
+    let removed = 0
+    for (const [key, entry] of this.entries) {
+      if (entry.tags.some((tag) => tags.includes(tag))) {
+        this.delete(key)
+        removed += 1
+      }
+    }
+    return removed
+  }
+
+  stats() {
+    const lookups = this.hits + this.misses
+    return {
+      entries: this.entries.size,
+      bytes: this.bytes,
+      hits: this.hits,
+      misses: this.misses,
+      hit_rate: lookups ? this.hits / lookups : 0
+    }
+  }
+}
+
+export const etagFor = (body) => `W/"${createHash('sha1').update(body).digest('base64url')}"`
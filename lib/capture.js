@@ -0,0 +1,148 @@
+import { createWriteStream, mkdirSync } from 'fs'
+import path from 'path'
+import { createHash, randomBytes } from 'crypto'
+import { onRequestComplete } from './metrics.js'
+
+// Optional traffic capture (CAPTURE_FILE=path). Each API request is appended to the file as one
+// JSON line: method, path and query, the shape of its JSON body, status and timings. Records are
+// sanitized for sharing: users, user ids and idempotency keys become salted pseudonyms, strings
+// are reduced to their length (apart from a few enum-like fields), dates and times to offsets
+// from the request, coordinates are rounded to about 1km and tokens are dropped. replay.py
+// re-drives a capture against any server.
+export const CAPTURE_FILE = process.env.CAPTURE_FILE || null
+// Share of users whose requests are captured; a sampled user's requests are all kept, in order
+const SAMPLE = Math.min(Math.max(Number(process.env.CAPTURE_SAMPLE || 1), 0), 1)
+// Stable pseudonyms across restarts need a fixed CAPTURE_SALT
+const SALT = process.env.CAPTURE_SALT || randomBytes(16).toString('hex')
+// Beyond this much unwritten output, records are dropped rather than buffered
+const MAX_BUFFERED_BYTES = 8 * 1024 * 1024
+
+// String fields kept as they are, rather than reduced to a length
+const KEPT_STRINGS = new Set(['role', 'activity_type', 'format'])
+const USER_KEYS = new Set(['user_id', 'userId'])
+const COARSE_PARAMS = new Set(['lat', 'lng', 'bbox'])
+const DROPPED_PARAMS = new Set(['access_token'])
+const HEADERS = ['accept', 'accept-encoding', 'content-type', 'content-encoding', 'content-length']
+
+const stats = { records: 0, dropped: 0, sampledOut: 0, lastError: null }
+let output = null
+
+const hash = (value) => createHash('sha256').update(`${SALT}:${value}`).digest('base64url')
+
+export const pseudonym = (userId) => `@u_${hash(userId).slice(0, 12)}`
+
+// Anonymous requests are sampled one by one, users as a whole
+const sampled = (user) => {
+  if (SAMPLE >= 1) return true
+  if (!user) return Math.random() < SAMPLE
+  return parseInt(createHash('sha256').update(`${SALT}:sample:${user}`).digest('hex').slice(0, 8), 16) / 0xffffffff < SAMPLE
+}
+
+const DATE = /^\d{4}-\d{2}-\d{2}$/
+const DATE_TIME = /^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}/
+const DAY_MS = 24 * 60 * 60 * 1000
+
+// Dates and times become offsets from the request (<date:-1> is yesterday, <time:-60000> a
+// minute earlier), so a replay asks for the same relative windows
+const relativeTime = (value) => {
+  const time = Date.parse(value)
+  if (!Number.isFinite(time)) return null
+  if (DATE.test(value)) return `<date:${Math.round((time - Date.parse(new Date().toISOString().slice(0, 10))) / DAY_MS)}>`
+  return DATE_TIME.test(value) ? `<time:${time - Date.now()}>` : null
+}
+
+const coarse = (text) => text.replace(/-?\d+\.\d+/g, (number) => String(Math.round(Number(number) * 100) / 100))
+
+// The structure of a JSON value with its contents sanitized. Arrays record their length and the
+// shape of their first element.
+export const shapeOf = (value, key = null) => {
+  if (value === null || typeof value === 'boolean') return value
+  if (typeof value === 'number') return Number.isInteger(value) ? value : Math.round(value * 100) / 100
+  if (typeof value === 'string') {
+    if (USER_KEYS.has(key)) return pseudonym(value)
+    if (KEPT_STRINGS.has(key)) return value.slice(0, 64)
+    return relativeTime(value) || `<str:${value.length}>`
+  }
+  if (Array.isArray(value)) return { $array: value.length, of: value.length ? shapeOf(value[0], key) : null }
+  if (typeof value === 'object') {
+    return Object.fromEntries(Object.entries(value).map(([name, item]) => [name, shapeOf(item, name)]))
+  }
+  return null
+}
+
+const sanitizeQuery = (searchParams) => {
+  const query = {}
+  for (const [name, value] of searchParams) {
+    if (DROPPED_PARAMS.has(name)) continue
+    if (USER_KEYS.has(name)) query[name] = pseudonym(value)
+    else if (name === 'cursor') query[name] = `<str:${value.length}>`
+    else query[name] = COARSE_PARAMS.has(name) ? coarse(value) : relativeTime(value) || value
+  }
+  return query
+}
+
+const sanitizePath = (apiPath) =>
+  apiPath
+    .replace(/^users\/([^/]+)\/role$/, (_, id) => `users/${pseudonym(id)}/role`)
+    .replace(/^blobs\/.+$/, 'blobs/:key')
+
+const round = (ms) => Math.round(ms * 100) / 100
+
+const record = ({ request, response, route, totalMs, phases, user, body }) => {
+  const url = new URL(request.url)
+  const who = user ? pseudonym(user.id) : null
+  if (!sampled(who)) {
+    stats.sampledOut += 1
+    return
+  }
+  if (output.writableLength > MAX_BUFFERED_BYTES) {
+    stats.dropped += 1
+    return
+  }
+
+  const headers = {}
+  for (const name of HEADERS) {
+    const value = request.headers.get(name)
+    if (value) headers[name] = value
+  }
+  const key = request.headers.get('idempotency-key')
+  if (key) headers['idempotency-key'] = `@k_${hash(key).slice(0, 12)}`
+
+  const line = JSON.stringify({
+    time: new Date().toISOString(),
+    at_ms: Math.round(Date.now() - totalMs),
+    user: who,
+    role: user?.role ?? null,
+    method: request.method,
+    path: sanitizePath(url.pathname.replace('/api/', '')),
+    route,
+    query: sanitizeQuery(url.searchParams),
+    headers,
+    body: body === undefined ? null : shapeOf(body),
+    status: response.status,
+    duration_ms: round(totalMs),
+    phases_ms: Object.fromEntries(Object.entries(phases).map(([phase, ms]) => [phase, round(ms)]))
+  })
+  output.write(`${line}\n`)
+  stats.records += 1
+}
+
+if (CAPTURE_FILE) {
+  mkdirSync(path.dirname(path.resolve(CAPTURE_FILE)), { recursive: true })
+  output = createWriteStream(CAPTURE_FILE, { flags: 'a' })
+  output.on('error', (error) => {
+    stats.lastError = error.message
+    console.error('Traffic capture failed:', error)
+  })
+  onRequestComplete(record)
+}
+
+export const captureStats = () => ({
+  enabled: Boolean(CAPTURE_FILE),
+  file: CAPTURE_FILE && path.resolve(CAPTURE_FILE),
+  sample: SAMPLE,
+  records: stats.records,
+  dropped: stats.dropped,
+  sampled_out: stats.sampledOut,
+  last_error: stats.lastError
+})
@@ -0,0 +1,94 @@
+// Streaming text record parsers (RFC 4180 CSV and newline-delimited lines) and CSV formatting
+
+// Yield complete lines from an async iterable of text chunks, without the line terminator
+export async function* splitLines(chunks) {
+  let buffered = ''
+  for await (const chunk of chunks) {
+    buffered += chunk
+    let newline
+    while ((newline = buffered.indexOf('\n')) !== -1) {
+      const line = buffered.slice(0, newline)
+      buffered = buffered.slice(newline + 1)
+      yield line.endsWith('\r') ? line.slice(0, -1) : line
+    }
+  }
+  if (buffered) yield buffered.endsWith('\r') ? buffered.slice(0, -1) : buffered
+}
+
+// Yield each CSV record as an array of strings. Quoted fields may contain commas,
+// doubled quotes and line breaks, and may span chunk boundaries.
+export async function* parseCsv(chunks) {
+  let record = []
+  let field = ''
+  let quoted = false
+  // A quote seen inside a quoted field: either an escaped quote or the closing quote
+  let pendingQuote = false
+  let fieldStarted = false
+  let skipNewline = false
+
+  for await (const chunk of chunks) {
+    for (let i = 0; i < chunk.length; i += 1) {
+      const char = chunk[i]
+      if (skipNewline) {
+        skipNewline = false
+        if (char === '\n') continue
+      }
+
+      if (quoted) {
+        if (pendingQuote) {
+          pendingQuote = false
+          if (char === '"') {
+            field += '"'
+            continue
+          }
+          quoted = false
+        } else if (char === '"') {
+          pendingQuote = true
+          continue
+        } else {
+          field += char
+          continue
+        }
+      }
+
+      if (char === '"' && !fieldStarted) {
+        quoted = true
+        fieldStarted = true
+      } else if (char === ',') {
+        record.push(field)
+        field = ''
+        fieldStarted = false
+      } else if (char === '\n' || char === '\r') {
+        record.push(field)
+        // Blank lines carry no record
+        if (record.length > 1 || record[0] !== '') yield record
+        record = []
+        field = ''
+        fieldStarted = false
+        skipNewline = char === '\r'
+      } else {
+        field += char
+        fieldStarted = true
+      }
+    }
+  }
+
+  if (fieldStarted || record.length) {
+    record.push(field)
+    yield record
+  }
+}
+
+const NEEDS_QUOTING = /[",\r\n]/
+// Spreadsheets run text cells starting with these as formulas
+const FORMULA_START = /^[=+\-@\t\r]/
+
+// Text that would start a formula gets a leading apostrophe; numbers are written as they are
+export const toCsvRow = (values) =>
+  values
+    .map((value) => {
+      if (value === null || value === undefined) return ''
+      const text = typeof value === 'string' && FORMULA_START.test(value) ? `'${value}` : String(value)
+      return NEEDS_QUOTING.test(text) ? `"${text.replace(/"/g, '""')}"` : text
+    })
+    .join(',') + '\r\n'
@@ -0,0 +1,208 @@
+import { supabase } from './supabase.js'
+import { subscribe } from './events.js'
+import { scanRows } from './pagination.js'
+import { timed, timedSync } from './metrics.js'
+
+// Admin dashboard aggregates: totals, per-agent and per-day counts, recently active agents and
+// the latest activity. Built once from narrow column scans, then kept current from the write
+// event feed and rebuilt periodically to pick up rows written outside this process.
+export const DEFAULT_ACTIVE_MINUTES = 15
+export const MAX_ACTIVE_MINUTES = 24 * 60
+export const DEFAULT_RECENT = 5
+export const MAX_RECENT = 50
+export const DEFAULT_DAYS = 14
+export const MAX_DAYS = 90
+const REBUILD_MS = parseInt(process.env.DASHBOARD_REBUILD_MS || '', 10) || 5 * 60 * 1000
+const DAY_MS = 24 * 60 * 60 * 1000
+
+const ACTIVITY_TABLES = {
+  photos: 'id, user_id, description, created_at',
+  leads: 'id, user_id, contact_name, business_name, created_at'
+}
+
+const emptyState = () => ({
+  users: new Map(),
+  perUser: new Map(),
+  perDay: new Map(),
+  lastSeen: new Map(),
+  counted: { photos: new Set(), leads: new Set() },
+  recent: []
+})
+
+const toActivity = (table, row) => ({
+  type: table === 'photos' ? 'photo' : 'lead',
+  id: row.id,
+  user_id: row.user_id,
+  summary: table === 'photos' ? row.description || '' : [row.contact_name, row.business_name].filter(Boolean).join(', '),
+  created_at: row.created_at
+})
+
+const seen = (state, userId, time) => {
+  if (userId === undefined || userId === null || !Number.isFinite(time)) return
+  if (!(state.lastSeen.get(userId) >= time)) state.lastSeen.set(userId, time)
+}
+
+// Apply one written row; photos and leads are counted once per id so replays are harmless
+const apply = (state, table, row) => {
+  if (table === 'users') {
+    state.users.set(row.id, { full_name: row.full_name, role: row.role })
+    return
+  }
+  if (table === 'gps_tracking') {
+    seen(state, row.user_id, Date.parse(row.timestamp))
+    return
+  }
+  if (!ACTIVITY_TABLES[table] || state.counted[table].has(row.id)) return
+  state.counted[table].add(row.id)
+
+  const counts = state.perUser.get(row.user_id) || { photos: 0, leads: 0 }
+  counts[table] += 1
+  state.perUser.set(row.user_id, counts)
+
+  const date = (row.created_at || '').slice(0, 10)
+  const day = state.perDay.get(date) || { photos: 0, leads: 0 }
+  day[table] += 1
+  state.perDay.set(date, day)
+
+  const time = Date.parse(row.created_at)
+  seen(state, row.user_id, time)
+  if (state.recent.length < MAX_RECENT || time > Date.parse(state.recent[state.recent.length - 1].created_at)) {
+    state.recent.push(toActivity(table, row))
+    state.recent.sort((a, b) => Date.parse(b.created_at) - Date.parse(a.created_at))
+    state.recent.length = Math.min(state.recent.length, MAX_RECENT)
+  }
+}
+
+const buildState = async () => {
+  const state = emptyState()
+  const { data: users, error } = await timed('db', supabase.from('users').select('id, full_name, role'))
+  if (error) throw new Error(error.message)
+  users.forEach((row) => apply(state, 'users', row))
+
+  for (const [table, columns] of Object.entries(ACTIVITY_TABLES)) {
+    await scanRows(
+      () => supabase.from(table).select(columns),
+      'created_at',
+      (rows) => rows.forEach((row) => apply(state, table, row))
+    )
+  }
+
+  // Only fixes recent enough to count towards the widest activity window are read
+  const since = new Date(Date.now() - MAX_ACTIVE_MINUTES * 60 * 1000).toISOString()
+  await scanRows(
+    () => supabase.from('gps_tracking').select('id, user_id, timestamp').gte('timestamp', since),
+    'timestamp',
+    (rows) => rows.forEach((row) => apply(state, 'gps_tracking', row))
+  )
+  return state
+}
+
+let current = null
+// Bumped for every build and refresh; a build finishing after a newer one started is discarded
+let generation = 0
+
+const getState = () => {
+  const previous = current
+  if (!previous || Date.now() - previous.builtAt > REBUILD_MS) {
+    // Writes that land while the tables are being read are buffered and replayed into the new state
+    const buffer = []
+    const build = ++generation
+    const pending = buildState()
+    current = {
+      builtAt: Date.now(),
+      // Keep serving the previous aggregates while a rebuild is in flight
+      ready: previous?.state ? Promise.resolve(previous.state) : pending,
+      state: previous?.state,
+      buffer
+    }
+    pending.then(
+      (state) => {
+        if (build !== generation) return
+        buffer.forEach(([table, row]) => apply(state, table, row))
+        current = { builtAt: Date.now(), ready: Promise.resolve(state), state }
+      },
+      (error) => {
+        console.error('Dashboard aggregate build failed:', error)
+        if (build === generation) current = null
+      }
+    )
+  }
+  return current.ready
+}
+
+// After rows were deleted outside the event feed: the aggregates still count them, so they are
+// dropped rather than served during the rebuild, and the next request waits for fresh ones
+export const refreshSummary = () => {
+  generation += 1
+  current = null
+}
+
+subscribe((event) => {
+  if (!current) return
+  if (current.state) apply(current.state, event.table, event.row)
+  current.buffer?.push([event.table, event.row])
+})
+
+const clamp = (value, fallback, max) => Math.min(Math.max(parseInt(value, 10) || fallback, 1), max)
+
+export const parseSummaryParams = (searchParams) => ({
+  activeMinutes: clamp(searchParams.get('active_minutes'), DEFAULT_ACTIVE_MINUTES, MAX_ACTIVE_MINUTES),
+  recent: clamp(searchParams.get('recent'), DEFAULT_RECENT, MAX_RECENT),
+  days: clamp(searchParams.get('days'), DEFAULT_DAYS, MAX_DAYS)
+})
+
+const assemble = (state, { activeMinutes, recent, days }) => {
+  const now = Date.now()
+  const nameOf = (userId) => state.users.get(userId)?.full_name ?? null
+  const lastSeenAt = (userId) => (state.lastSeen.has(userId) ? new Date(state.lastSeen.get(userId)).toISOString() : null)
+
+  const totals = { users: state.users.size, agents: 0, admins: 0, photos: 0, leads: 0 }
+  for (const { role } of state.users.values()) {
+    if (role === 'admin') totals.admins += 1
+    else totals.agents += 1
+  }
+
+  const userIds = new Set([...state.users.keys(), ...state.perUser.keys()])
+  const perUser = [...userIds].map((userId) => {
+    const counts = state.perUser.get(userId) || { photos: 0, leads: 0 }
+    totals.photos += counts.photos
+    totals.leads += counts.leads
+    return {
+      user_id: userId,
+      full_name: nameOf(userId),
+      role: state.users.get(userId)?.role ?? null,
+      photos: counts.photos,
+      leads: counts.leads,
+      last_seen: lastSeenAt(userId)
+    }
+  }).sort((a, b) => b.photos + b.leads - (a.photos + a.leads))
+
+  const activeSince = now - activeMinutes * 60 * 1000
+  const active = [...state.lastSeen]
+    .filter(([, time]) => time >= activeSince)
+    .sort(([, a], [, b]) => b - a)
+    .map(([userId, time]) => ({ user_id: userId, full_name: nameOf(userId), last_seen: new Date(time).toISOString() }))
+
+  // Oldest first, including days with no activity
+  const today = Date.parse(`${new Date(now).toISOString().slice(0, 10)}T00:00:00.000Z`)
+  const perDay = []
+  for (let i = days - 1; i >= 0; i -= 1) {
+    const date = new Date(today - i * DAY_MS).toISOString().slice(0, 10)
+    perDay.push({ date, ...(state.perDay.get(date) || { photos: 0, leads: 0 }) })
+  }
+
+  return {
+    generated_at: new Date(now).toISOString(),
+    totals,
+    active_agents: { window_minutes: activeMinutes, count: active.length, users: active },
+    per_user: perUser,
+    per_day: perDay,
+    recent_activity: state.recent.slice(0, recent).map((item) => ({ ...item, full_name: nameOf(item.user_id) }))
+  }
+}
+
+export const dashboardSummary = async ({ activeMinutes = DEFAULT_ACTIVE_MINUTES, recent = DEFAULT_RECENT, days = DEFAULT_DAYS } = {}) => {
+  const state = await getState()
+  // Resolving user names onto the per-agent and activity rows
+  return timedSync('join', () => assemble(state, { activeMinutes, recent, days }))
+}
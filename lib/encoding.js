@@ -0,0 +1,125 @@
+import { brotliCompressSync, gzipSync, constants } from 'zlib'
+
+// Content negotiation for list responses. Accept picks the body format: plain JSON, columnar
+// JSON (each key sent once with an array of values), or columnar with coordinates and times
+// delta-encoded as integers. Accept-Encoding picks brotli or gzip for bodies of at least
+// COMPRESS_MIN_BYTES; compressed variants are kept on the cached entry so hits don't recompress.
+export const COMPRESS_MIN_BYTES = parseInt(process.env.COMPRESS_MIN_BYTES || '', 10) || 1024
+const BROTLI_QUALITY = parseInt(process.env.BROTLI_QUALITY || '', 10) || 5
+const GZIP_LEVEL = parseInt(process.env.GZIP_LEVEL || '', 10) || 6
+
+export const JSON_TYPE = 'application/json'
+export const COLUMNS_TYPE = 'application/vnd.fieldapp.columns+json'
+export const DELTA_TYPE = 'application/vnd.fieldapp.delta+json'
+const FORMATS = [JSON_TYPE, COLUMNS_TYPE, DELTA_TYPE]
+
+// Coordinates travel as integer steps of 1e-7 degrees (about 1cm), times as epoch milliseconds
+export const COORDINATE_SCALE = 1e7
+const DELTA_COLUMNS = { latitude: 'coordinate', longitude: 'coordinate', timestamp: 'time', created_at: 'time' }
+
+// Media ranges from an Accept-style header, highest q first, without those refused with q=0
+const preferences = (header) =>
+  (header || '')
+    .split(',')
+    .map((part, index) => {
+      const [name, ...params] = part.split(';').map((piece) => piece.trim().toLowerCase())
+      const q = params.find((param) => param.startsWith('q='))
+      return { name, q: q ? Number(q.slice(2)) : 1, index }
+    })
+    .filter(({ name, q }) => name && q > 0)
+    .sort((a, b) => b.q - a.q || a.index - b.index)
+
+// The body format for an Accept header; anything unrecognised gets plain JSON
+export const negotiateFormat = (accept) => {
+  for (const { name } of preferences(accept)) {
+    if (FORMATS.includes(name)) return name
+    if (name === '*/*' || name === 'application/*') return JSON_TYPE
+  }
+  return JSON_TYPE
+}
+
+// br or gzip for an Accept-Encoding header, or null to send the body as it is
+export const negotiateEncoding = (acceptEncoding) => {
+  const accepted = preferences(acceptEncoding).map(({ name }) => name)
+  if (accepted.includes('br')) return 'br'
+  if (accepted.includes('gzip') || accepted.includes('*')) return 'gzip'
+  return null
+}
+
+const columnNames = (rows) => {
+  const names = new Set()
+  rows.forEach((row) => Object.keys(row).forEach((name) => names.add(name)))
+  return [...names]
+}
+
+// Integer deltas for one column, or null when a value doesn't fit the column's kind.
+// Nulls stay null and don't move the running value.
+const deltaEncode = (values, kind) => {
+  const encoded = []
+  let previous = 0
+  for (const value of values) {
+    if (value === null || value === undefined) {
+      encoded.push(null)
+      continue
+    }
+    if (kind === 'coordinate' && typeof value !== 'number') return null
+    const number = kind === 'time' ? Date.parse(value) : Math.round(value * COORDINATE_SCALE)
+    if (!Number.isFinite(number)) return null
+    encoded.push(number - previous)
+    previous = number
+  }
+  return encoded
+}
+
+// { count, columns: { name: [values] } }, plus `deltas` naming the delta-encoded columns.
+// Keys missing from a row come back as null.
+const toColumns = (rows, delta) => {
+  const columns = {}
+  const deltas = {}
+  for (const name of columnNames(rows)) {
+    const values = rows.map((row) => row[name] ?? null)
+    const kind = delta && DELTA_COLUMNS[name]
+    const encoded = kind ? deltaEncode(values, kind) : null
+    if (encoded) {
+      columns[name] = encoded
+      deltas[name] = kind === 'time' ? { unit: 'ms' } : { scale: COORDINATE_SCALE }
+    } else {
+      columns[name] = values
+    }
+  }
+  return delta ? { count: rows.length, columns, deltas } : { count: rows.length, columns }
+}
+
+// Serialize a list result (an array of rows, or { rows, users }) in the negotiated format
+export const serializeList = (result, format) => {
+  if (format === JSON_TYPE) return JSON.stringify(result)
+  const delta = format === DELTA_TYPE
+  if (Array.isArray(result)) return JSON.stringify(toColumns(result, delta))
+  const { rows, ...rest } = result
+  return JSON.stringify({ ...toColumns(rows, delta), ...rest })
+}
+
+const compress = (body, encoding) =>
+  encoding === 'br'
+    ? brotliCompressSync(body, {
+      params: {
+        [constants.BROTLI_PARAM_QUALITY]: BROTLI_QUALITY,
+        [constants.BROTLI_PARAM_SIZE_HINT]: Buffer.byteLength(body)
+      }
+    })
+    : gzipSync(body, { level: GZIP_LEVEL })
+
+// Bytes a cached entry holds: its body as UTF-8 plus every compressed variant stored with it
+export const entryBytes = (entry) =>
+  Buffer.byteLength(entry.body) + Object.values(entry.variants || {}).reduce((total, variant) => total + variant.length, 0)
+
+// The bytes to send for a cached entry ({ body, variants }) and their Content-Encoding (or null).
+// `added` is true when this call compressed and stored a new variant, which grows the entry.
+export const encodedBody = (entry, acceptEncoding) => {
+  const encoding = Buffer.byteLength(entry.body) >= COMPRESS_MIN_BYTES ? negotiateEncoding(acceptEncoding) : null
+  if (!encoding) return { body: entry.body, encoding: null, added: false }
+  if (!entry.variants) entry.variants = {}
+  const added = !entry.variants[encoding]
+  if (added) entry.variants[encoding] = compress(entry.body, encoding)
+  return { body: entry.variants[encoding], encoding, added }
+}
@@ -0,0 +1,37 @@
+// In-process change feed for newly written rows, fanned out to stream subscribers.
+// A bounded history lets reconnecting clients catch up from their last-seen event id.
+const REPLAY_SIZE = parseInt(process.env.EVENT_REPLAY_SIZE || '', 10) || 1000
+
+const history = []
+const subscribers = new Set()
+let lastId = 0
+
+export const publish = (table, row) => {
+  lastId += 1
+  const event = { id: lastId, table, row }
+  history.push(event)
+  if (history.length > REPLAY_SIZE) history.shift()
+
+  for (const listener of subscribers) {
+    try {
+      listener(event)
+    } catch (error) {
+      console.error('Event subscriber error:', error)
+    }
+  }
+  return event
+}
+
+export const publishAll = (table, rows) => rows.forEach((row) => publish(table, row))
+
+export const subscribe = (listener) => {
+  subscribers.add(listener)
+  return () => subscribers.delete(listener)
+}
+
+// Events after `sinceId`. An id from before a restart is newer than anything we have,
+// so the whole buffer is replayed rather than silently sending nothing.
+export const eventsSince = (sinceId) => {
+  const since = sinceId > lastId ? 0 : sinceId
+  return history.filter((event) => event.id > since)
+}
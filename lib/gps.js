@@ -0,0 +1,63 @@
+// GPS fix validation shared by the single and batch ingestion endpoints
+
+export const MAX_GPS_BATCH = parseInt(process.env.MAX_GPS_BATCH || '', 10) || 1000
+
+const ACTIVITY_TYPES = ['active', 'break', 'idle']
+
+const isCoordinate = (value, limit) =>
+  typeof value === 'number' && Number.isFinite(value) && Math.abs(value) <= limit
+
+// Turn a client fix into a gps_tracking row, or return { error } describing why it can't be.
+// Buffered fixes carry the time they were taken; live ones are stamped on arrival.
+export const toGpsRow = (fix, receivedAt = new Date().toISOString()) => {
+  if (!fix || typeof fix !== 'object') return { error: 'fix must be an object' }
+
+  const { user_id, latitude, longitude, activity_type = 'active', timestamp, idempotency_key = null } = fix
+  if (!user_id) return { error: 'user_id is required' }
+  if (idempotency_key !== null && !(typeof idempotency_key === 'string' && idempotency_key && idempotency_key.length <= 255)) {
+    return { error: 'idempotency_key must be a string of at most 255 characters' }
+  }
+  if (!isCoordinate(latitude, 90)) return { error: 'latitude must be a number between -90 and 90' }
+  if (!isCoordinate(longitude, 180)) return { error: 'longitude must be a number between -180 and 180' }
+  if (!ACTIVITY_TYPES.includes(activity_type)) return { error: `Unknown activity_type: ${activity_type}` }
+
+  let recordedAt = receivedAt
+  if (timestamp !== undefined) {
+    const parsed = new Date(timestamp)
+    if (Number.isNaN(parsed.getTime())) return { error: 'timestamp must be an ISO date' }
+    recordedAt = parsed.toISOString()
+  }
+
+  return { row: { user_id, latitude, longitude, activity_type, timestamp: recordedAt }, key: idempotency_key }
+}
+
+// Validate a batch body ({ fixes: [...] } or a bare array) in one pass
+export const toGpsRows = (body) => {
+  const fixes = Array.isArray(body) ? body : body?.fixes
+  if (!Array.isArray(fixes) || fixes.length === 0) {
+    return { error: 'fixes must be a non-empty array', status: 400 }
+  }
+  if (fixes.length > MAX_GPS_BATCH) {
+    return { error: `A batch may contain at most ${MAX_GPS_BATCH} fixes`, status: 413 }
+  }
+
+  const receivedAt = new Date().toISOString()
+  const rows = []
+  // Each row's client-assigned idempotency_key, or null
+  const keys = []
+  const errors = []
+  fixes.forEach((fix, index) => {
+    const result = toGpsRow(fix, receivedAt)
+    if (result.error) {
+      errors.push({ index, error: result.error })
+    } else {
+      rows.push(result.row)
+      keys.push(result.key)
+    }
+  })
+
+  if (errors.length) {
+    return { error: 'Invalid fixes', details: errors, status: 400 }
+  }
+  return { rows, keys }
+}
@@ -0,0 +1,90 @@
+// Browser-side GPS fix buffer. Fixes are kept in localStorage so they survive
+// reloads and offline periods, and are sent to /api/gps-tracking/batch in batches.
+
+import { apiFetch } from './session.js'
+
+const STORAGE_KEY = 'fieldapp_gps_buffer'
+// Batches the server refused outright, kept for inspection instead of blocking the queue
+const REJECTED_KEY = 'fieldapp_gps_rejected'
+
+export const GPS_FLUSH_SIZE = 10
+export const GPS_FLUSH_INTERVAL = 5 * 60 * 1000
+const MAX_BATCH = 500
+// Roughly four days of fixes at one every 30 seconds; the oldest are dropped first
+const MAX_BUFFERED = 12000
+
+let inFlight = null
+
+const readBuffer = () => {
+  try {
+    return JSON.parse(localStorage.getItem(STORAGE_KEY)) || []
+  } catch {
+    return []
+  }
+}
+
+const writeBuffer = (fixes) => {
+  localStorage.setItem(STORAGE_KEY, JSON.stringify(fixes.slice(-MAX_BUFFERED)))
+}
+
+export const pendingGpsFixCount = () => readBuffer().length
+
+// Drop whatever is still buffered, e.g. on logout, so it is never sent under another session
+export const clearGpsFixes = () => localStorage.removeItem(STORAGE_KEY)
+
+// Timeouts, rate limiting and server errors pass; 401 means the session lapsed, and the fixes go
+// once the agent signs in again. Any other 4xx will fail the same way every time.
+const isRetryable = (status) => status >= 500 || [401, 408, 429].includes(status)
+
+const quarantine = (batch, status) => {
+  let rejected = []
+  try {
+    rejected = JSON.parse(localStorage.getItem(REJECTED_KEY)) || []
+  } catch {}
+  rejected.push(...batch.map((fix) => ({ ...fix, rejected_status: status })))
+  localStorage.setItem(REJECTED_KEY, JSON.stringify(rejected.slice(-MAX_BUFFERED)))
+}
+
+// Each fix gets a key when it is taken, so resending a batch whose response was lost doesn't record it twice
+export const bufferGpsFix = (fix) => {
+  writeBuffer([...readBuffer(), {
+    ...fix,
+    timestamp: fix.timestamp || new Date().toISOString(),
+    idempotency_key: fix.idempotency_key || crypto.randomUUID()
+  }])
+}
+
+const sendBatches = async () => {
+  while (typeof navigator === 'undefined' || navigator.onLine !== false) {
+    const batch = readBuffer().slice(0, MAX_BATCH)
+    if (batch.length === 0) return
+
+    const response = await apiFetch('/api/gps-tracking/batch', {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      body: JSON.stringify({ fixes: batch }),
+    })
+    if (!response.ok && isRetryable(response.status)) {
+      throw new Error(`GPS batch upload failed with status ${response.status}`)
+    }
+    if (!response.ok) {
+      console.error(`GPS batch rejected with status ${response.status}; set aside under ${REJECTED_KEY}`)
+      quarantine(batch, response.status)
+    }
+
+    // Fixes buffered while the request was in flight stay queued; a refused batch is not retried
+    writeBuffer(readBuffer().slice(batch.length))
+  }
+}
+
+// Send everything buffered; concurrent callers share one flush
+export const flushGpsFixes = () => {
+  if (!inFlight) {
+    inFlight = sendBatches().finally(() => {
+      inFlight = null
+    })
+  }
+  return inFlight
+}
@@ -0,0 +1,326 @@
+import { promises as fs } from 'fs'
+import path from 'path'
+import { promisify } from 'util'
+import { gzip, gunzip } from 'zlib'
+import { supabase } from './supabase.js'
+import { timed } from './metrics.js'
+import { compactBefore, dayBounds, hourlyRollups, loadRawRows, MAX_COMPACT_DAYS } from './tracks.js'
+
+// Time-partitioned GPS history. gps_tracking is partitioned by UTC day of `timestamp` (range
+// partitions in Postgres; see memoryClient.js for the in-memory backend), so reads bounded in time
+// only touch the days they cover. Recent reads start at the current day and widen only as far as
+// they need to fill a page. Raw fixes are kept for GPS_RAW_RETENTION_DAYS; the retention run then
+// writes each older day to a gzipped NDJSON archive on local disk (or drops it, with
+// GPS_RETENTION=drop) and deletes it, keeping per-agent daily tracks in gps_tracks and hourly
+// rollups in gps_hourly for long-range reporting. gps_partitions records which days are rolled up
+// and archived; a run over every agent drops each day's emptied partition once it is archived.
+export const RAW_RETENTION_DAYS = parseInt(process.env.GPS_RAW_RETENTION_DAYS || '', 10) || 7
+export const ARCHIVE_RAW = process.env.GPS_RETENTION !== 'drop'
+const archiveDir = process.env.GPS_ARCHIVE_DIR || path.join(process.cwd(), 'storage', 'gps-archive')
+// Also run retention on this interval; otherwise it runs through POST /api/tracks/compact only
+const RETENTION_INTERVAL_MS = parseInt(process.env.GPS_RETENTION_INTERVAL_MS || '', 10) || 0
+export const MAX_REPORT_DAYS = 366
+const UPSERT_CHUNK = 500
+
+const DAY_MS = 24 * 60 * 60 * 1000
+const gzipAsync = promisify(gzip)
+const gunzipAsync = promisify(gunzip)
+
+const stats = { runs: 0, archivedDays: 0, archivedRows: 0, archiveBytes: 0, droppedPartitions: 0, lastRunAt: null, lastError: null }
+const retentionListeners = new Set()
+
+// Called with each retention run's summary, e.g. to invalidate cached GPS lists
+export const onRetention = (listener) => {
+  retentionListeners.add(listener)
+  return () => retentionListeners.delete(listener)
+}
+
+const startOfDay = (time) => Math.floor(time / DAY_MS) * DAY_MS
+const isoDay = (time) => new Date(time).toISOString().slice(0, 10)
+
+// Raw fixes before this day are due for archiving
+export const retentionCutoff = (now = Date.now()) => isoDay(startOfDay(now) - RAW_RETENTION_DAYS * DAY_MS)
+
+// Time windows for a newest-first read from `from` (a time; now by default): the day holding it,
+// open-ended above, then 1, 2, 4... more days at a time back to the retention cutoff, then
+// everything older. Retention may not have run, so raw rows can predate the cutoff.
+export const recentWindows = (from = null, now = Date.now()) => {
+  const anchor = startOfDay(from === null ? now : from)
+  const oldest = Date.parse(retentionCutoff(now))
+  const windows = [{ start: anchor, end: null }]
+  let end = anchor
+  for (let days = 1; end > oldest; days *= 2) {
+    const start = Math.max(end - days * DAY_MS, oldest)
+    windows.push({ start, end })
+    end = start
+  }
+  windows.push({ start: null, end })
+  const iso = (time) => time === null ? null : new Date(time).toISOString()
+  return windows.map(({ start, end }) => ({ start: iso(start), end: iso(end) }))
+}
+
+// Up to `limit` rows newest first, reading window by window until the page is full. `buildQuery`
+// returns a fresh, ordered query; `from` is the cursor's time when resuming a page.
+export const readRecent = async (buildQuery, column, limit, from = null) => {
+  const rows = []
+  const resumeAt = from === null ? null : Date.parse(from)
+  for (const { start, end } of recentWindows(Number.isFinite(resumeAt) ? resumeAt : null)) {
+    let query = buildQuery()
+    if (start) query = query.gte(column, start)
+    if (end) query = query.lt(column, end)
+    const { data, error } = await timed('db', query.limit(limit - rows.length))
+    if (error) return { data: null, error }
+    rows.push(...data)
+    if (rows.length >= limit) break
+  }
+  return { data: rows, error: null }
+}
+
+const ROLLUP_COLUMNS = ['user_id', 'hour', 'fixes', 'distance_m', 'activity_seconds', 'first_at', 'last_at']
+
+// Postgres returns timestamptz as "...+00:00", so hours are compared in one form
+const hourKey = (rollup) => `${rollup.user_id} ${new Date(rollup.hour).toISOString()}`
+
+// Two rollups of the same agent and hour, from disjoint fixes, as one
+const addRollups = (a, b) => {
+  const activity = { ...(a.activity_seconds || {}) }
+  for (const [type, seconds] of Object.entries(b.activity_seconds || {})) activity[type] = (activity[type] || 0) + seconds
+  const times = [a.first_at, a.last_at, b.first_at, b.last_at].filter(Boolean).sort((x, y) => Date.parse(x) - Date.parse(y))
+  return {
+    user_id: a.user_id,
+    hour: new Date(a.hour).toISOString(),
+    fixes: a.fixes + b.fixes,
+    distance_m: a.distance_m + b.distance_m,
+    activity_seconds: activity,
+    first_at: times[0] || null,
+    last_at: times[times.length - 1] || null
+  }
+}
+
+const upsertRollups = async (rollups) => {
+  for (let start = 0; start < rollups.length; start += UPSERT_CHUNK) {
+    const { error } = await timed('db', supabase
+      .from('gps_hourly')
+      .upsert(rollups.slice(start, start + UPSERT_CHUNK), { onConflict: 'user_id,hour' }))
+    if (error) throw new Error(error.message)
+  }
+}
+
+// Add rollups of fixes not yet counted to the stored rollups for the same agent and hour
+const addToStoredRollups = async (rollups) => {
+  if (!rollups.length) return
+  const hours = rollups.map((rollup) => rollup.hour).sort()
+  const { data, error } = await timed('db', supabase
+    .from('gps_hourly')
+    .select(ROLLUP_COLUMNS.join(', '))
+    .in('user_id', [...new Set(rollups.map((rollup) => rollup.user_id))])
+    .gte('hour', hours[0])
+    .lte('hour', hours[hours.length - 1]))
+  if (error) throw new Error(error.message)
+  const stored = new Map(data.map((rollup) => [hourKey(rollup), rollup]))
+  await upsertRollups(rollups.map((rollup) => {
+    const existing = stored.get(hourKey(rollup))
+    return existing ? addRollups(existing, rollup) : rollup
+  }))
+}
+
+const recordDay = async (day, values) => {
+  const { error } = await timed('db', supabase.from('gps_partitions').upsert({ day, ...values }, { onConflict: 'day' }))
+  if (error) throw new Error(error.message)
+}
+
+// Drop a day's partition of gps_tracking; false when it was missing or fixes landed in it meanwhile
+const dropPartition = async (day) => {
+  const { data, error } = await timed('db', supabase.rpc('drop_gps_tracking_partition', { day }))
+  if (error) throw new Error(error.message)
+  if (data) stats.droppedPartitions += 1
+  return data
+}
+
+const archivePath = (date) => path.join(archiveDir, date.slice(0, 7), `${date}.ndjson.gz`)
+
+const readArchive = async (file) => {
+  const contents = await fs.readFile(file).catch(() => null)
+  if (!contents) return []
+  return (await gunzipAsync(contents)).toString('utf8').split('\n').filter(Boolean).map((line) => JSON.parse(line))
+}
+
+// Archive one day's raw rows before compaction deletes them. A day archived before (an earlier
+// run for one agent, late fixes, or a repeat after an interrupted run) is merged by id, and its
+// hourly rollups are rebuilt from everything archived for the day. Dropped days have nothing to
+// rebuild from, so once a day has been dropped its late fixes are added to the stored rollups;
+// `fresh` leaves out fixes an interrupted earlier run already counted.
+const archiveDay = async (date, rows, fresh, userId) => {
+  let archived = rows
+  let file = null
+  let bytes = 0
+  if (ARCHIVE_RAW) {
+    file = archivePath(date)
+    const merged = new Map((await readArchive(file)).map((row) => [String(row.id), row]))
+    rows.forEach((row) => merged.set(String(row.id), row))
+    archived = [...merged.values()].sort((a, b) => Date.parse(a.timestamp) - Date.parse(b.timestamp))
+
+    const body = await gzipAsync(archived.map((row) => JSON.stringify(row)).join('\n') + '\n')
+    await fs.mkdir(path.dirname(file), { recursive: true })
+    // Write then rename, so an archive is never left half-written
+    await fs.writeFile(`${file}.tmp`, body)
+    await fs.rename(`${file}.tmp`, file)
+    bytes = body.length
+  }
+
+  if (ARCHIVE_RAW) {
+    await upsertRollups(hourlyRollups(archived))
+  } else {
+    const { data: catalog, error } = await timed('db', supabase.from('gps_partitions').select('archived_at').eq('day', date))
+    if (error) throw new Error(error.message)
+    await (catalog.some((entry) => entry.archived_at)
+      ? addToStoredRollups(hourlyRollups(fresh))
+      : upsertRollups(hourlyRollups(rows)))
+  }
+  if (!userId) {
+    const now = new Date().toISOString()
+    await recordDay(date, { rolled_up_at: now, archived_at: now, archive: file, archived_rows: archived.length })
+  }
+  stats.archivedDays += 1
+  stats.archivedRows += rows.length
+  stats.archiveBytes += bytes
+  return { date, rows: rows.length, file, bytes }
+}
+
+// Roll up complete days still held raw, from `since` (no earlier than the retention cutoff) to
+// yesterday. Days are refreshed on every run, so fixes uploaded late are counted; archived days
+// are left alone, as their rollups cover the archive.
+const rollUpRecent = async (since, userId) => {
+  const today = isoDay(Date.now())
+  const from = [since, retentionCutoff()].sort()[1]
+  const { data: catalog, error } = await timed('db', supabase
+    .from('gps_partitions')
+    .select('day, archived_at')
+    .gte('day', from)
+    .lt('day', today))
+  if (error) throw new Error(error.message)
+  const archived = new Set(catalog.filter((entry) => entry.archived_at).map((entry) => entry.day))
+
+  const days = []
+  for (let time = Date.parse(from); isoDay(time) < today; time += DAY_MS) {
+    const date = isoDay(time)
+    if (archived.has(date)) continue
+    const { start, end } = dayBounds(date)
+    await upsertRollups(hourlyRollups(await loadRawRows(start, end, userId)))
+    if (!userId) await recordDay(date, { rolled_up_at: new Date().toISOString() })
+    days.push(date)
+  }
+  return days
+}
+
+// Fixes for an earlier day can arrive after that day was rolled up. Clearing its rolled_up_at
+// sends hourly reports back to the raw rows until the next retention run rolls it up again.
+// Archived days need nothing: reports add their raw rows, which are all late, to the rollups.
+export const markLateFixes = async (rows) => {
+  const today = isoDay(Date.now())
+  const days = [...new Set(rows
+    .map((row) => Date.parse(row.timestamp))
+    .filter(Number.isFinite)
+    .map(isoDay))].filter((day) => day < today)
+  if (!days.length) return
+  const { error } = await timed('db', supabase.from('gps_partitions').update({ rolled_up_at: null }).in('day', days))
+  if (error) throw new Error(error.message)
+}
+
+// Archive (or drop) and compact raw days before `before`, then refresh the rollups of the
+// complete days still held raw
+export const runRetention = async ({ before = retentionCutoff(), userId = null, maxDays = MAX_COMPACT_DAYS } = {}) => {
+  stats.runs += 1
+  stats.lastRunAt = new Date().toISOString()
+  try {
+    const summary = await compactBefore(before, {
+      userId,
+      maxDays,
+      beforeDelete: (date, rows, fresh) => archiveDay(date, rows, fresh, userId)
+    })
+    summary.before = before
+    // A run for one agent leaves the others' fixes in the day's partition
+    summary.partitions_dropped = []
+    for (const { date } of userId ? [] : summary.archived) {
+      if (await dropPartition(date)) summary.partitions_dropped.push(date)
+    }
+    summary.rolled_up = await rollUpRecent(before, userId)
+    stats.lastError = null
+    for (const listener of retentionListeners) listener(summary)
+    return summary
+  } catch (error) {
+    stats.lastError = error.message
+    throw error
+  }
+}
+
+// Hourly rollups for one agent over whole days `from` to `to` (YYYY-MM-DD, inclusive). Rolled-up
+// days come from gps_hourly; the rest (today, and anything not rolled up yet or with fixes that
+// arrived since) are summarised from their raw partitions. Archived days add the raw rows left in
+// their partitions, late fixes not yet archived, to their rollups.
+export const hourlyReport = async (userId, from, to) => {
+  const { start } = dayBounds(from)
+  const { end } = dayBounds(to)
+  const [stored, catalog] = await Promise.all([
+    timed('db', supabase
+      .from('gps_hourly')
+      .select('*')
+      .eq('user_id', userId)
+      .gte('hour', start)
+      .lt('hour', end)),
+    timed('db', supabase.from('gps_partitions').select('day, rolled_up_at, archived_at').gte('day', from).lte('day', to))
+  ])
+  if (stored.error || catalog.error) throw new Error((stored.error || catalog.error).message)
+  const archived = new Set(catalog.data.filter((entry) => entry.archived_at).map((entry) => entry.day))
+  const rolledUp = new Set(catalog.data.filter((entry) => entry.rolled_up_at || entry.archived_at).map((entry) => entry.day))
+
+  const hours = new Map(stored.data
+    .filter((rollup) => rolledUp.has(isoDay(Date.parse(rollup.hour))))
+    .map((rollup) => [hourKey(rollup), rollup]))
+  const rawDays = []
+  const readDays = []
+  for (let time = Date.parse(start); time < Date.parse(end); time += DAY_MS) {
+    const day = isoDay(time)
+    if (!rolledUp.has(day)) rawDays.push(day)
+    if (!rolledUp.has(day) || archived.has(day)) readDays.push(day)
+  }
+  // Consecutive days are read together
+  for (let i = 0; i < readDays.length;) {
+    let j = i
+    while (j + 1 < readDays.length && Date.parse(readDays[j + 1]) - Date.parse(readDays[j]) === DAY_MS) j += 1
+    const rows = await loadRawRows(dayBounds(readDays[i]).start, dayBounds(readDays[j]).end, userId)
+    hourlyRollups(rows).forEach((rollup) => {
+      const existing = hours.get(hourKey(rollup))
+      hours.set(hourKey(rollup), existing ? addRollups(existing, rollup) : rollup)
+    })
+    i = j + 1
+  }
+
+  const sorted = [...hours.values()].sort((a, b) => Date.parse(a.hour) - Date.parse(b.hour))
+  const totals = { fixes: 0, distance_m: 0, activity_seconds: {} }
+  for (const rollup of sorted) {
+    totals.fixes += rollup.fixes
+    totals.distance_m += rollup.distance_m
+    for (const [activity, seconds] of Object.entries(rollup.activity_seconds || {})) {
+      totals.activity_seconds[activity] = (totals.activity_seconds[activity] || 0) + seconds
+    }
+  }
+  return { user_id: userId, from, to, hours: sorted, totals, raw_days: rawDays }
+}
+
+if (RETENTION_INTERVAL_MS) {
+  setInterval(() => {
+    runRetention().catch((error) => console.error('GPS retention failed:', error))
+  }, RETENTION_INTERVAL_MS).unref()
+}
+
+export const retentionStats = () => ({
+  raw_retention_days: RAW_RETENTION_DAYS,
+  archive: ARCHIVE_RAW ? path.resolve(archiveDir) : null,
+  runs: stats.runs,
+  archived_days: stats.archivedDays,
+  archived_rows: stats.archivedRows,
+  archive_bytes: stats.archiveBytes,
+  last_run_at: stats.lastRunAt,
+  last_error: stats.lastError
+})
@@ -0,0 +1,75 @@
+import { supabase } from './supabase.js'
+
+// Database readiness, checked once at startup and then at most once per TTL.
+// Request handlers no longer pay a connectivity round trip on every read.
+const HEALTH_TTL_MS = parseInt(process.env.HEALTH_TTL_MS || '', 10) || 30000
+const LATENCY_SAMPLES = 100
+
+const startedAt = Date.now()
+const latencies = []
+let state = { healthy: null, checkedAt: 0, error: null }
+let pendingCheck = null
+
+const percentileOf = (sorted, pct) =>
+  sorted.length ? sorted[Math.min(sorted.length - 1, Math.ceil((pct / 100) * sorted.length) - 1)] : null
+
+const runCheck = async () => {
+  const start = performance.now()
+  let error = null
+  try {
+    const result = await supabase.from('users').select('id').limit(1)
+    error = result.error
+  } catch (thrown) {
+    error = thrown
+  }
+
+  const latency = performance.now() - start
+  latencies.push(latency)
+  if (latencies.length > LATENCY_SAMPLES) latencies.shift()
+
+  if (error && state.healthy !== false) {
+    console.error('Database health check failed:', error)
+  } else if (!error && state.healthy !== true) {
+    console.log('Database connection successful')
+  }
+  state = { healthy: !error, checkedAt: Date.now(), error: error ? error.message || String(error) : null }
+  return state.healthy
+}
+
+// Run the connectivity check unless a fresh result is cached; concurrent callers share one check
+export const checkDatabase = ({ force = false } = {}) => {
+  if (!force && state.checkedAt && Date.now() - state.checkedAt < HEALTH_TTL_MS) {
+    return Promise.resolve(state.healthy)
+  }
+  if (!pendingCheck) {
+    pendingCheck = runCheck().finally(() => {
+      pendingCheck = null
+    })
+  }
+  return pendingCheck
+}
+
+export const healthReport = () => {
+  const sorted = [...latencies].sort((a, b) => a - b)
+  const round = (value) => (value === null ? null : Math.round(value * 100) / 100)
+  return {
+    status: state.healthy === null ? 'starting' : state.healthy ? 'ok' : 'unavailable',
+    database: {
+      healthy: state.healthy,
+      checked_at: state.checkedAt ? new Date(state.checkedAt).toISOString() : null,
+      ttl_ms: HEALTH_TTL_MS,
+      error: state.error
+    },
+    latency_ms: {
+      last: round(latencies.length ? latencies[latencies.length - 1] : null),
+      p50: round(percentileOf(sorted, 50)),
+      p95: round(percentileOf(sorted, 95)),
+      max: round(sorted.length ? sorted[sorted.length - 1] : null),
+      samples: sorted.length
+    },
+    uptime_s: Math.round((Date.now() - startedAt) / 1000)
+  }
+}
+
+// Startup check: warm the cached state as soon as the route module loads
+checkDatabase()
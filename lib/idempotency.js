@@ -0,0 +1,83 @@
+import { createHash } from 'crypto'
+import { LRUCache } from './cache.js'
+
+// Idempotency-Key support for write endpoints. The first request with a key runs and its
+// response is kept (bounded, with TTL eviction); retries with the same key get that response
+// back, and retries that arrive while the original is still running wait for it instead of
+// writing again. Batch endpoints reserve per-item keys in the same store.
+export const IDEMPOTENCY_TTL_MS = parseInt(process.env.IDEMPOTENCY_TTL_MS || '', 10) || 24 * 60 * 60 * 1000
+const MAX_KEYS = parseInt(process.env.IDEMPOTENCY_MAX_KEYS || '', 10) || 100000
+// Stored responses are kept whole, so they are also bounded by size
+const MAX_BYTES = (parseInt(process.env.IDEMPOTENCY_MAX_MB || '', 10) || 64) * 1024 * 1024
+export const MAX_KEY_LENGTH = 255
+
+const store = new LRUCache({ maxEntries: MAX_KEYS, maxBytes: MAX_BYTES, ttlMs: IDEMPOTENCY_TTL_MS })
+const inFlight = new Map()
+let replays = 0
+
+export const idempotencyStats = () => ({ ...store.stats(), in_flight: inFlight.size, replays })
+
+export const validKey = (key) => typeof key === 'string' && key.length > 0 && key.length <= MAX_KEY_LENGTH
+
+const fingerprint = (body) => createHash('sha1').update(JSON.stringify(body ?? null)).digest('base64url')
+
+// Bytes an entry holds: its key, and a stored response's body and headers
+const sizeOf = (key, stored) => Buffer.byteLength(key) + (stored.body === undefined ? 0 : Buffer.byteLength(stored.body) +
+  stored.headers.reduce((total, [name, value]) => total + Buffer.byteLength(name) + Buffer.byteLength(value), 0))
+
+const toStored = async (response, print) => ({
+  fingerprint: print,
+  status: response.status,
+  headers: [...response.headers],
+  body: await response.text()
+})
+
+// Run `execute` (returning a Response) at most once per key. Resolves to
+// { stored: { status, headers, body }, replayed } or { conflict: true } when the key was
+// first used with a different body. Only responses below 500 are kept, so a failed write
+// can be retried under the same key.
+export const runOnce = async (key, body, execute) => {
+  const print = fingerprint(body)
+
+  const stored = store.get(key)
+  if (stored) {
+    if (stored.fingerprint !== print) return { conflict: true }
+    replays += 1
+    return { stored, replayed: true }
+  }
+
+  const pending = inFlight.get(key)
+  if (pending) {
+    if (pending.fingerprint !== print) return { conflict: true }
+    replays += 1
+    return { stored: await pending.promise, replayed: true }
+  }
+
+  const promise = Promise.resolve()
+    .then(execute)
+    .then((response) => toStored(response, print))
+    .then((result) => {
+      if (result.status < 500) store.set(key, result, { size: sizeOf(key, result) })
+      return result
+    })
+    .finally(() => inFlight.delete(key))
+  inFlight.set(key, { fingerprint: print, promise })
+  return { stored: await promise, replayed: false }
+}
+
+// One pass over a batch's item keys: reserves the unseen ones and flags the rest (already
+// stored, reserved by a concurrent batch, or repeated earlier in this batch) as duplicates.
+// Items without a key are always new. Call release() with the reserved keys if the write fails.
+export const reserveKeys = (keys) => {
+  const reserved = []
+  const fresh = keys.map((key) => {
+    if (key === null || key === undefined) return true
+    if (store.get(key)) return false
+    store.set(key, { reserved: true }, { size: sizeOf(key, {}) })
+    reserved.push(key)
+    return true
+  })
+  return { fresh, reserved }
+}
+
+export const releaseKeys = (keys) => keys.forEach((key) => store.delete(key))
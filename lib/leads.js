@@ -0,0 +1,245 @@
+import { supabase } from './supabase.js'
+import { publishAll } from './events.js'
+import { iteratePages, scanRows } from './pagination.js'
+import { parseCsv, splitLines, toCsvRow } from './csv.js'
+import { timed } from './metrics.js'
+
+// Bulk lead import (CSV or NDJSON, streamed) with validation, dedupe by email/phone and chunked
+// inserts, and streaming export that writes each page of rows as it is read.
+export const IMPORT_CHUNK_SIZE = parseInt(process.env.LEAD_IMPORT_CHUNK_SIZE || '', 10) || 500
+export const MAX_IMPORT_ROWS = parseInt(process.env.LEAD_IMPORT_MAX_ROWS || '', 10) || 1000000
+// Per-row problems beyond this many are counted but not listed
+const MAX_REPORTED = 1000
+const EXPORT_PAGE_SIZE = 1000
+
+export const LEAD_COLUMNS = [
+  'user_id', 'contact_name', 'contact_phone', 'contact_email', 'business_name', 'latitude', 'longitude', 'notes'
+]
+export const EXPORT_COLUMNS = ['id', ...LEAD_COLUMNS, 'created_at']
+
+const EMAIL = /^[^\s@]+@[^\s@]+\.[^\s@]+$/
+
+export const emailKey = (email) => (email ? String(email).trim().toLowerCase() : null)
+// Digits only, so "+1 (555) 010-0001" and "15550100001" are the same number
+export const phoneKey = (phone) => (phone ? String(phone).replace(/\D/g, '') || null : null)
+
+const text = (value) => (value === undefined || value === null ? '' : String(value).trim())
+
+const coordinate = (value, limit) => {
+  if (value === undefined || value === null || value === '') return { value: null }
+  const number = typeof value === 'number' ? value : Number(String(value).trim())
+  return Number.isFinite(number) && Math.abs(number) <= limit ? { value: number } : { error: true }
+}
+
+// Turn an imported record into a leads row, or return { error } describing why it can't be
+export const toLeadRow = (record, defaultUserId = null) => {
+  if (!record || typeof record !== 'object' || Array.isArray(record)) return { error: 'row must be an object' }
+
+  const userId = text(record.user_id) || defaultUserId
+  const contactName = text(record.contact_name)
+  const email = text(record.contact_email)
+  const phone = text(record.contact_phone)
+  if (!userId) return { error: 'user_id is required' }
+  if (!contactName) return { error: 'contact_name is required' }
+  if (!email && !phone) return { error: 'contact_email or contact_phone is required' }
+  if (email && !EMAIL.test(email)) return { error: `Invalid contact_email: ${email}` }
+  const digits = phoneKey(phone)
+  if (phone && !(digits && digits.length >= 7 && digits.length <= 15)) return { error: `Invalid contact_phone: ${phone}` }
+
+  const latitude = coordinate(record.latitude, 90)
+  if (latitude.error) return { error: 'latitude must be a number between -90 and 90' }
+  const longitude = coordinate(record.longitude, 180)
+  if (longitude.error) return { error: 'longitude must be a number between -180 and 180' }
+
+  return {
+    row: {
+      user_id: userId,
+      contact_name: contactName,
+      contact_phone: phone || null,
+      contact_email: email || null,
+      business_name: text(record.business_name) || null,
+      latitude: latitude.value,
+      longitude: longitude.value,
+      notes: text(record.notes)
+    }
+  }
+}
+
+// Records from a text stream: CSV with a header row, or one JSON object per line
+async function* readRecords(chunks, format) {
+  if (format === 'csv') {
+    let header = null
+    for await (const values of parseCsv(chunks)) {
+      if (!header) {
+        header = values.map((name) => name.trim().toLowerCase())
+        continue
+      }
+      yield Object.fromEntries(header.map((name, i) => [name, values[i]]))
+    }
+    return
+  }
+
+  for await (const line of splitLines(chunks)) {
+    if (!line.trim()) continue
+    try {
+      yield JSON.parse(line)
+    } catch {
+      yield { __parseError: 'Invalid JSON' }
+    }
+  }
+}
+
+// Email and phone keys of every stored lead
+const existingKeys = async () => {
+  const emails = new Set()
+  const phones = new Set()
+  await scanRows(
+    () => supabase.from('leads').select('id, contact_email, contact_phone, created_at'),
+    'created_at',
+    (rows) => rows.forEach((row) => {
+      const email = emailKey(row.contact_email)
+      const phone = phoneKey(row.contact_phone)
+      if (email) emails.add(email)
+      if (phone) phones.add(phone)
+    })
+  )
+  return { emails, phones }
+}
+
+// Import a stream of text chunks. Rows are numbered from 1 in file order (excluding a CSV header).
+// Each chunk is a single insert statement, so it lands or fails as a whole; a failed chunk is
+// retried row by row, so only the rows that fail on their own are reported, and the import
+// continues with the next chunk. A row's email and phone count towards later duplicates only once
+// it has been inserted.
+export const importLeads = async (chunks, { format, defaultUserId = null, chunkSize = IMPORT_CHUNK_SIZE }) => {
+  const started = Date.now()
+  const report = { received: 0, inserted: 0, duplicates: 0, invalid: 0, failed: 0, errors: [] }
+  const problem = (entry) => {
+    if (report.errors.length < MAX_REPORTED) report.errors.push(entry)
+  }
+
+  const { emails, phones } = await existingKeys()
+  // Keys of rows waiting in the current chunk, so duplicates within it are caught too
+  const pendingEmails = new Set()
+  const pendingPhones = new Set()
+  let pending = []
+
+  const insert = async (entries) => {
+    const created_at = new Date().toISOString()
+    return timed('db', supabase
+      .from('leads')
+      .insert(entries.map(({ row }) => ({ ...row, created_at })))
+      .select('id, user_id, contact_name, business_name, latitude, longitude, created_at'))
+  }
+
+  const inserted = (entries, data) => {
+    report.inserted += entries.length
+    entries.forEach(({ email, phone }) => {
+      if (email) emails.add(email)
+      if (phone) phones.add(phone)
+    })
+    publishAll('leads', data || [])
+  }
+
+  const flush = async () => {
+    if (!pending.length) return
+    const chunk = pending
+    pending = []
+    pendingEmails.clear()
+    pendingPhones.clear()
+
+    const { data, error } = await insert(chunk)
+    if (!error) {
+      inserted(chunk, data)
+      return
+    }
+    for (const entry of chunk) {
+      const { data: rowData, error: rowError } = await insert([entry])
+      if (rowError) {
+        report.failed += 1
+        problem({ row: entry.index, error: rowError.message })
+      } else {
+        inserted([entry], rowData)
+      }
+    }
+  }
+
+  for await (const record of readRecords(chunks, format)) {
+    report.received += 1
+    const index = report.received
+    if (index > MAX_IMPORT_ROWS) {
+      report.received -= 1
+      problem({ row: index, error: `Imports are limited to ${MAX_IMPORT_ROWS} rows; the rest were not read` })
+      break
+    }
+
+    const result = record?.__parseError ? { error: record.__parseError } : toLeadRow(record, defaultUserId)
+    if (result.error) {
+      report.invalid += 1
+      problem({ row: index, error: result.error })
+      continue
+    }
+
+    // Duplicates of stored leads or of earlier rows in this file are skipped
+    const email = emailKey(result.row.contact_email)
+    const phone = phoneKey(result.row.contact_phone)
+    const emailTaken = email && (emails.has(email) || pendingEmails.has(email))
+    if (emailTaken || (phone && (phones.has(phone) || pendingPhones.has(phone)))) {
+      report.duplicates += 1
+      problem({ row: index, error: `Duplicate lead (${emailTaken ? 'contact_email' : 'contact_phone'})`, duplicate: true })
+      continue
+    }
+    if (email) pendingEmails.add(email)
+    if (phone) pendingPhones.add(phone)
+
+    pending.push({ index, row: result.row, email, phone })
+    if (pending.length >= chunkSize) await flush()
+  }
+  await flush()
+
+  report.errors_truncated = report.invalid + report.duplicates + report.failed > report.errors.length
+  report.duration_ms = Date.now() - started
+  return report
+}
+
+// A byte stream of every lead (optionally one agent's), newest first, in CSV or NDJSON.
+// Pages are only read from the database as the client consumes the previous ones.
+export const exportLeads = ({ format, userId = null }) => {
+  const encoder = new TextEncoder()
+  const query = () => {
+    const select = supabase.from('leads').select(EXPORT_COLUMNS.join(', '))
+    return userId ? select.eq('user_id', userId) : select
+  }
+  const pages = iteratePages(query, 'created_at', EXPORT_PAGE_SIZE)
+  let headerSent = false
+
+  return new ReadableStream({
+    async pull(controller) {
+      let output = ''
+      if (format === 'csv' && !headerSent) {
+        output += toCsvRow(EXPORT_COLUMNS)
+        headerSent = true
+      }
+      try {
+        const { value: page, done } = await pages.next()
+        if (done) {
+          if (output) controller.enqueue(encoder.encode(output))
+          controller.close()
+          return
+        }
+        for (const row of page) {
+          output += format === 'csv'
+            ? toCsvRow(EXPORT_COLUMNS.map((column) => row[column]))
+            : `${JSON.stringify(row)}\n`
+        }
+        controller.enqueue(encoder.encode(output))
+      } catch (error) {
+        console.error('Lead export failed:', error)
+        controller.error(error)
+      }
+    },
+    cancel() {
+      pages.return()
+    }
+  })
+}
@@ -0,0 +1,529 @@
+import { createHash, randomBytes, randomUUID } from 'crypto'
+import { signJwt, verifyJwt } from './jwt.js'
+
+// In-process stand-in for the Supabase client, selected with DATA_BACKEND=memory.
+// It implements the subset of supabase-js the API uses: auth signUp/signInWithPassword/getUser
+// (and admin.deleteUser)
+// and from(table) queries with select (including the users(...) join), insert, upsert, update,
+// delete, filters, or(), order, limit, range, single and maybeSingle.
+// Data lives in process memory and is lost on restart. gps_tracking is partitioned by UTC day of
+// its timestamp, like the range-partitioned Postgres table: queries that bound the timestamp only
+// scan the days they overlap.
+
+export const MEMORY_JWT_SECRET = process.env.SUPABASE_JWT_SECRET || 'memory-backend-jwt-secret'
+const SESSION_TTL_S = 3600
+// Added to every query, to stand in for the round trip to a remote database
+const SIMULATED_LATENCY_MS = parseInt(process.env.MEMORY_LATENCY_MS || '', 10) || 0
+
+// Columns Postgres would fill in on insert
+const TABLE_DEFAULTS = {
+  users: () => ({ created_at: new Date().toISOString() }),
+  photos: () => ({ created_at: new Date().toISOString() }),
+  leads: () => ({ created_at: new Date().toISOString() }),
+  gps_tracking: () => ({ timestamp: new Date().toISOString() })
+}
+
+// Partitioned tables and the timestamp column they are partitioned on
+const PARTITIONED_BY = {
+  gps_tracking: 'timestamp'
+}
+
+// Database functions called through rpc(), as defined in the migrations
+const FUNCTIONS = {
+  drop_gps_tracking_partition: ({ day }) => {
+    const partitions = partitionsOf('gps_tracking')
+    if (partitions.get(day)?.length !== 0) return false
+    partitions.delete(day)
+    return true
+  }
+}
+
+// Embedded relations: name -> [foreign key column, referenced table]
+const RELATIONS = {
+  users: ['user_id', 'users']
+}
+
+const createDatabase = () => ({ tables: new Map(), partitions: new Map(), sequences: new Map(), authUsers: new Map() })
+
+// Survive module reloads in `next dev` so data isn't lost on every edit
+const db = globalThis.__fieldappMemoryDb || (globalThis.__fieldappMemoryDb = createDatabase())
+
+const tableRows = (name) => {
+  if (!db.tables.has(name)) db.tables.set(name, [])
+  return db.tables.get(name)
+}
+
+// UTC day (YYYY-MM-DD) a partition key falls in, or '' when it isn't a time
+const partitionDay = (value) => {
+  const time = typeof value === 'number' ? value : Date.parse(value)
+  return Number.isFinite(time) ? new Date(time).toISOString().slice(0, 10) : ''
+}
+
+// day -> rows for a partitioned table
+const partitionsOf = (name) => {
+  if (!db.partitions.has(name)) db.partitions.set(name, new Map())
+  return db.partitions.get(name)
+}
+
+// A table's rows; for a partitioned table only those in days within { from, to }
+const storedRows = (name, days = {}) => {
+  if (!PARTITIONED_BY[name]) return tableRows(name)
+  const rows = []
+  for (const [day, partition] of partitionsOf(name)) {
+    if ((days.from && day < days.from) || (days.to && day > days.to)) continue
+    for (const row of partition) rows.push(row)
+  }
+  return rows
+}
+
+const addRow = (name, row) => {
+  if (!PARTITIONED_BY[name]) {
+    tableRows(name).push(row)
+    return
+  }
+  const partitions = partitionsOf(name)
+  const day = partitionDay(row[PARTITIONED_BY[name]])
+  if (!partitions.has(day)) partitions.set(day, [])
+  partitions.get(day).push(row)
+}
+
+const removeRows = (name, removed) => {
+  if (!PARTITIONED_BY[name]) {
+    db.tables.set(name, tableRows(name).filter((row) => !removed.has(row)))
+    return
+  }
+  const partitions = partitionsOf(name)
+  for (const [day, partition] of partitions) {
+    // Emptied partitions stay until dropped, as in Postgres
+    partitions.set(day, partition.filter((row) => !removed.has(row)))
+  }
+}
+
+const nextId = (table) => {
+  const id = (db.sequences.get(table) || 0) + 1
+  db.sequences.set(table, id)
+  return id
+}
+
+const ISO_TIMESTAMP = /^\d{4}-\d{2}-\d{2}T/
+
+const comparable = (value) =>
+  typeof value === 'string' && ISO_TIMESTAMP.test(value) ? Date.parse(value) : value
+
+// Compare a stored value with a filter value, coercing filter strings the way PostgREST would
+const compareValues = (stored, filter) => {
+  let a = comparable(stored)
+  let b = comparable(filter)
+  if (typeof a === 'number' && typeof b === 'string' && b.trim() !== '' && !Number.isNaN(Number(b))) b = Number(b)
+  if (typeof b === 'number' && typeof a === 'string' && a.trim() !== '' && !Number.isNaN(Number(a))) a = Number(a)
+  if (a === b) return 0
+  return a < b ? -1 : 1
+}
+
+// A value as a unique index would see it: equal keys wherever compareValues finds them equal
+const keyValue = (value) => {
+  const normalised = comparable(value)
+  if (typeof normalised === 'string' && normalised.trim() !== '' && !Number.isNaN(Number(normalised))) return Number(normalised)
+  return normalised ?? null
+}
+
+const OPERATORS = {
+  eq: (value, target) => value !== null && value !== undefined && compareValues(value, target) === 0,
+  neq: (value, target) => value !== null && value !== undefined && compareValues(value, target) !== 0,
+  lt: (value, target) => value !== null && value !== undefined && compareValues(value, target) < 0,
+  lte: (value, target) => value !== null && value !== undefined && compareValues(value, target) <= 0,
+  gt: (value, target) => value !== null && value !== undefined && compareValues(value, target) > 0,
+  gte: (value, target) => value !== null && value !== undefined && compareValues(value, target) >= 0,
+  is: (value, target) => (target === null || target === 'null' ? value === null || value === undefined : value === target),
+  in: (value, targets) => targets.some((target) => OPERATORS.eq(value, target)),
+  ilike: (value, pattern) => typeof value === 'string' &&
+    new RegExp(`^${pattern.replace(/[.+?^${}()|[\]\\]/g, '\\$&').replace(/%/g, '.*').replace(/_/g, '.')}$`, 'i').test(value)
+}
+
+// Split on commas that are not nested in parentheses or quotes
+const splitTopLevel = (text) => {
+  const parts = []
+  let depth = 0
+  let quoted = false
+  let current = ''
+  for (const char of text) {
+    if (char === '"') quoted = !quoted
+    if (!quoted && char === '(') depth += 1
+    if (!quoted && char === ')') depth -= 1
+    if (!quoted && depth === 0 && char === ',') {
+      parts.push(current.trim())
+      current = ''
+    } else {
+      current += char
+    }
+  }
+  if (current.trim()) parts.push(current.trim())
+  return parts
+}
+
+const unquote = (value) => (value.startsWith('"') && value.endsWith('"') ? value.slice(1, -1) : value)
+
+// PostgREST logic tree syntax used by .or(): `a.lt.1,and(b.eq.2,c.gt.3)`
+const parseLogic = (expression) => {
+  const conditions = splitTopLevel(expression).map((part) => {
+    const group = part.match(/^(and|or)\((.*)\)$/s)
+    if (group) {
+      const children = parseLogic(group[2])
+      return group[1] === 'and'
+        ? (row) => children.every((child) => child(row))
+        : (row) => children.some((child) => child(row))
+    }
+    const [column, operator, ...rest] = part.split('.')
+    const value = unquote(rest.join('.'))
+    if (!OPERATORS[operator]) throw new Error(`Unsupported operator in or(): ${operator}`)
+    return (row) => OPERATORS[operator](row[column], value)
+  })
+  return conditions
+}
+
+// Parse a select string such as `*, users (id, full_name, role)` into columns and embeds
+const parseSelect = (columns) => {
+  const plain = []
+  const embeds = []
+  for (const part of splitTopLevel(columns.replace(/\s+/g, ' '))) {
+    const embed = part.match(/^(\w+)(?:!\w+)?\s*\((.*)\)$/s)
+    if (embed) {
+      embeds.push({ relation: embed[1], columns: parseSelect(embed[2]) })
+    } else {
+      plain.push(part)
+    }
+  }
+  return { plain, embeds }
+}
+
+const project = (row, selection) => {
+  const result = {}
+  for (const column of selection.plain) {
+    if (column === '*') {
+      Object.assign(result, row)
+    } else {
+      result[column] = row[column] ?? null
+    }
+  }
+  for (const { relation, columns } of selection.embeds) {
+    const [foreignKey, referenced] = RELATIONS[relation] || []
+    if (!foreignKey) throw new Error(`Could not find a relationship for '${relation}'`)
+    const target = tableRows(referenced).find((candidate) => compareValues(candidate.id, row[foreignKey]) === 0)
+    result[relation] = target ? project(target, columns) : null
+  }
+  return result
+}
+
+const clone = (value) => (value === undefined ? undefined : structuredClone(value))
+
+class MemoryQuery {
+  constructor(table) {
+    this.table = table
+    this.action = 'select'
+    this.columns = '*'
+    this.returning = false
+    this.filters = []
+    this.orders = []
+    this.limitCount = null
+    this.rangeFrom = 0
+    this.singleMode = null
+    this.countMode = null
+    this.head = false
+    // Days a partitioned table's query can touch, narrowed by filters on the partition key
+    this.days = {}
+  }
+
+  select(columns = '*', { count = null, head = false } = {}) {
+    if (this.action !== 'select') this.returning = true
+    this.columns = columns
+    this.countMode = count
+    this.head = head
+    return this
+  }
+
+  insert(rows) {
+    this.action = 'insert'
+    this.payload = Array.isArray(rows) ? rows : [rows]
+    return this
+  }
+
+  upsert(rows, { onConflict = 'id' } = {}) {
+    this.action = 'upsert'
+    this.payload = Array.isArray(rows) ? rows : [rows]
+    this.conflictColumns = onConflict.split(',').map((column) => column.trim())
+    return this
+  }
+
+  update(values) {
+    this.action = 'update'
+    this.payload = values
+    return this
+  }
+
+  delete() {
+    this.action = 'delete'
+    return this
+  }
+
+  filter(column, operator, value) {
+    if (column === PARTITIONED_BY[this.table]) this.prune(operator, value)
+    this.filters.push((row) => OPERATORS[operator](row[column], value))
+    return this
+  }
+
+  eq(column, value) { return this.filter(column, 'eq', value) }
+  neq(column, value) { return this.filter(column, 'neq', value) }
+  lt(column, value) { return this.filter(column, 'lt', value) }
+  lte(column, value) { return this.filter(column, 'lte', value) }
+  gt(column, value) { return this.filter(column, 'gt', value) }
+  gte(column, value) { return this.filter(column, 'gte', value) }
+  is(column, value) { return this.filter(column, 'is', value) }
+  in(column, values) { return this.filter(column, 'in', values) }
+  ilike(column, pattern) { return this.filter(column, 'ilike', pattern) }
+
+  prune(operator, value) {
+    const day = partitionDay(value)
+    if (!day) return
+    if (['gt', 'gte', 'eq'].includes(operator) && !(this.days.from >= day)) this.days.from = day
+    if (['lt', 'lte', 'eq'].includes(operator) && !(this.days.to <= day)) this.days.to = day
+  }
+
+  or(expression) {
+    const conditions = parseLogic(expression)
+    this.filters.push((row) => conditions.some((condition) => condition(row)))
+    return this
+  }
+
+  order(column, { ascending = true } = {}) {
+    this.orders.push({ column, ascending })
+    return this
+  }
+
+  limit(count) {
+    this.limitCount = count
+    return this
+  }
+
+  range(from, to) {
+    this.rangeFrom = from
+    this.limitCount = to - from + 1
+    return this
+  }
+
+  single() {
+    this.singleMode = 'single'
+    return this
+  }
+
+  maybeSingle() {
+    this.singleMode = 'maybe'
+    return this
+  }
+
+  matching() {
+    return storedRows(this.table, this.days).filter((row) => this.filters.every((filter) => filter(row)))
+  }
+
+  write() {
+    const defaults = TABLE_DEFAULTS[this.table] || (() => ({}))
+
+    if (this.action === 'insert') {
+      const inserted = this.payload.map((values) => ({ id: nextId(this.table), ...defaults(), ...clone(values) }))
+      // Generated ids are unique; only ids supplied by the caller can clash
+      const supplied = this.payload.filter((values) => values.id !== undefined && values.id !== null)
+      if (supplied.length && storedRows(this.table).some((existing) =>
+        supplied.some((values) => compareValues(existing.id, values.id) === 0))) {
+        throw new Error(`duplicate key value violates unique constraint "${this.table}_pkey"`)
+      }
+      inserted.forEach((row) => addRow(this.table, row))
+      return inserted
+    }
+
+    if (this.action === 'upsert') {
+      const keyOf = (row) => JSON.stringify(this.conflictColumns.map((column) => keyValue(row[column])))
+      const byKey = new Map(storedRows(this.table).map((row) => [keyOf(row), row]))
+      return this.payload.map((values) => {
+        const existing = byKey.get(keyOf(values))
+        if (existing) return Object.assign(existing, clone(values))
+        const inserted = { id: nextId(this.table), ...defaults(), ...clone(values) }
+        addRow(this.table, inserted)
+        byKey.set(keyOf(inserted), inserted)
+        return inserted
+      })
+    }
+
+    if (this.action === 'update') {
+      const updated = this.matching()
+      updated.forEach((row) => Object.assign(row, clone(this.payload)))
+      // A changed partition key moves the row to its new partition
+      const key = PARTITIONED_BY[this.table]
+      if (key && key in this.payload) {
+        removeRows(this.table, new Set(updated))
+        updated.forEach((row) => addRow(this.table, row))
+      }
+      return updated
+    }
+
+    const removed = new Set(this.matching())
+    removeRows(this.table, removed)
+    return [...removed]
+  }
+
+  execute() {
+    let rows
+    if (this.action === 'select') {
+      rows = this.matching()
+    } else {
+      rows = this.write()
+      if (!this.returning) return { data: null, error: null, count: null, status: 201 }
+    }
+
+    for (const { column, ascending } of [...this.orders].reverse()) {
+      rows = [...rows].sort((a, b) => {
+        const [left, right] = [a[column], b[column]]
+        // Postgres puts nulls last ascending and first descending
+        if (left === null || left === undefined) return right === null || right === undefined ? 0 : 1
+        if (right === null || right === undefined) return -1
+        const order = compareValues(left, right)
+        return ascending ? order : -order
+      })
+    }
+
+    const count = this.countMode ? rows.length : null
+    if (this.rangeFrom || this.limitCount !== null) {
+      rows = rows.slice(this.rangeFrom, this.limitCount === null ? undefined : this.rangeFrom + this.limitCount)
+    }
+
+    const selection = parseSelect(this.columns)
+    let data = this.head ? null : rows.map((row) => clone(project(row, selection)))
+
+    if (this.singleMode && !this.head) {
+      if (data.length > 1 || (data.length === 0 && this.singleMode === 'single')) {
+        return {
+          data: null,
+          error: { message: 'JSON object requested, multiple (or no) rows returned', code: 'PGRST116' },
+          count,
+          status: 406
+        }
+      }
+      data = data[0] ?? null
+    }
+    return { data, error: null, count, status: 200 }
+  }
+
+  then(resolve, reject) {
+    const start = SIMULATED_LATENCY_MS
+      ? new Promise((wait) => setTimeout(wait, SIMULATED_LATENCY_MS))
+      : Promise.resolve()
+    return start
+      .then(() => {
+        try {
+          return this.execute()
+        } catch (error) {
+          return { data: null, error: { message: error.message }, count: null, status: 400 }
+        }
+      })
+      .then(resolve, reject)
+  }
+}
+
+const hashPassword = (password, salt) => createHash('sha256').update(`${salt}:${password}`).digest('hex')
+
+const publicUser = (authUser) => ({
+  id: authUser.id,
+  aud: 'authenticated',
+  role: 'authenticated',
+  email: authUser.email,
+  created_at: authUser.created_at
+})
+
+const issueSession = (authUser) => {
+  const now = Math.floor(Date.now() / 1000)
+  const user = publicUser(authUser)
+  return {
+    access_token: signJwt({
+      sub: user.id,
+      email: user.email,
+      // Distinguishes sessions issued in the same second, as Supabase's own tokens do
+      session_id: randomUUID(),
+      role: 'authenticated',
+      aud: 'authenticated',
+      iat: now,
+      exp: now + SESSION_TTL_S
+    }, MEMORY_JWT_SECRET),
+    token_type: 'bearer',
+    expires_in: SESSION_TTL_S,
+    expires_at: now + SESSION_TTL_S,
+    refresh_token: randomBytes(16).toString('hex'),
+    user
+  }
+}
+
+export const createMemoryClient = () => {
+  let currentSession = null
+
+  const auth = {
+    async signUp({ email, password }) {
+      const key = String(email || '').toLowerCase()
+      if (!key || !password) {
+        return { data: { user: null, session: null }, error: { message: 'Email and password are required' } }
+      }
+      if (db.authUsers.has(key)) {
+        return { data: { user: null, session: null }, error: { message: 'User already registered' } }
+      }
+      const salt = randomBytes(8).toString('hex')
+      const authUser = {
+        id: randomUUID(),
+        email: key,
+        salt,
+        password_hash: hashPassword(password, salt),
+        created_at: new Date().toISOString()
+      }
+      db.authUsers.set(key, authUser)
+      return { data: { user: publicUser(authUser), session: null }, error: null }
+    },
+
+    async signInWithPassword({ email, password }) {
+      const authUser = db.authUsers.get(String(email || '').toLowerCase())
+      if (!authUser || authUser.password_hash !== hashPassword(password, authUser.salt)) {
+        return { data: { user: null, session: null }, error: { message: 'Invalid login credentials' } }
+      }
+      currentSession = issueSession(authUser)
+      return { data: { user: currentSession.user, session: currentSession }, error: null }
+    },
+
+    // With a token, check it the way the auth server would; without one, use the client's own session
+    async getUser(jwt) {
+      if (jwt) {
+        const { claims, error } = verifyJwt(jwt, MEMORY_JWT_SECRET)
+        const authUser = claims && [...db.authUsers.values()].find((candidate) => candidate.id === claims.sub)
+        if (!authUser) {
+          return { data: { user: null }, error: { message: error || 'User not found' } }
+        }
+        return { data: { user: publicUser(authUser) }, error: null }
+      }
+      if (!currentSession) {
+        return { data: { user: null }, error: { message: 'Auth session missing!' } }
+      }
+      return { data: { user: currentSession.user }, error: null }
+    },
+
+    admin: {
+      async deleteUser(id) {
+        const entry = [...db.authUsers].find(([, candidate]) => candidate.id === id)
+        if (!entry) return { data: { user: null }, error: { message: 'User not found' } }
+        db.authUsers.delete(entry[0])
+        return { data: { user: publicUser(entry[1]) }, error: null }
+      }
+    }
+  }
+
+  return {
+    auth,
+    from: (table) => new MemoryQuery(table),
+    async rpc(name, args = {}) {
+      if (!FUNCTIONS[name]) return { data: null, error: { message: `Could not find the function public.${name}` } }
+      return { data: FUNCTIONS[name](args), error: null }
+    }
+  }
+}
@@ -0,0 +1,240 @@
+import { AsyncLocalStorage } from 'async_hooks'
+
+// Per-request phase timing (auth, parse, queue, db, join, serialize), reported as Server-Timing headers and
+// structured log lines, and aggregated into per-endpoint histograms served in Prometheus format.
+export const PHASES = ['auth', 'parse', 'queue', 'db', 'join', 'serialize']
+// Seconds, as Prometheus expects
+export const BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+// Recent samples kept per endpoint for the rolling quantiles
+const WINDOW_SAMPLES = parseInt(process.env.METRICS_WINDOW_SAMPLES || '', 10) || 1000
+const QUANTILES = [0.5, 0.9, 0.99]
+// 'all' logs every request, 'errors' only 5xx responses, 'off' nothing
+const REQUEST_LOG = process.env.REQUEST_LOG || 'all'
+
+const storage = new AsyncLocalStorage()
+
+class RequestTimer {
+  constructor(route) {
+    this.start = performance.now()
+    this.route = route
+    this.phases = {}
+    this.error = null
+    // Caller and parsed JSON body, for request-complete listeners such as traffic capture
+    this.user = null
+    this.body = undefined
+  }
+
+  add(phase, ms) {
+    this.phases[phase] = (this.phases[phase] || 0) + ms
+  }
+
+  elapsed() {
+    return performance.now() - this.start
+  }
+}
+
+// Time a promise (or a function's result) against the current request's phase; a no-op outside requests
+export const timed = async (phase, work) => {
+  const timer = storage.getStore()
+  const start = performance.now()
+  try {
+    return await (typeof work === 'function' ? work() : work)
+  } finally {
+    timer?.add(phase, performance.now() - start)
+  }
+}
+
+// Synchronous variant for in-process work such as serialization
+export const timedSync = (phase, work) => {
+  const timer = storage.getStore()
+  const start = performance.now()
+  try {
+    return work()
+  } finally {
+    timer?.add(phase, performance.now() - start)
+  }
+}
+
+// Override the current request's endpoint label, e.g. 'unmatched' for unknown paths
+export const setRoute = (route) => {
+  const timer = storage.getStore()
+  if (timer) timer.route = route
+}
+
+// Attach an unexpected error to the current request's log line
+export const noteError = (error) => {
+  const timer = storage.getStore()
+  if (timer) timer.error = error?.message || String(error)
+}
+
+// Note the authenticated caller ({ id, role }) on the current request
+export const noteUser = (user) => {
+  const timer = storage.getStore()
+  if (timer) timer.user = user
+}
+
+// Note the current request's parsed JSON body
+export const noteBody = (body) => {
+  const timer = storage.getStore()
+  if (timer) timer.body = body
+}
+
+const completeListeners = new Set()
+
+// Called after every timed request with { request, response, route, totalMs, phases, user, body }
+export const onRequestComplete = (listener) => {
+  completeListeners.add(listener)
+  return () => completeListeners.delete(listener)
+}
+
+class Histogram {
+  constructor() {
+    this.counts = new Array(BUCKETS.length).fill(0)
+    this.sum = 0
+    this.count = 0
+  }
+
+  observe(seconds) {
+    for (let i = 0; i < BUCKETS.length; i += 1) {
+      if (seconds <= BUCKETS[i]) this.counts[i] += 1
+    }
+    this.sum += seconds
+    this.count += 1
+  }
+}
+
+const endpoints = new Map()
+
+const endpointFor = (method, route) => {
+  const key = `${method} ${route}`
+  if (!endpoints.has(key)) {
+    endpoints.set(key, {
+      method,
+      route,
+      duration: new Histogram(),
+      phases: Object.fromEntries(PHASES.map((phase) => [phase, new Histogram()])),
+      statuses: new Map(),
+      window: [],
+      windowNext: 0
+    })
+  }
+  return endpoints.get(key)
+}
+
+const record = (method, route, status, totalMs, phases) => {
+  const endpoint = endpointFor(method, route)
+  endpoint.duration.observe(totalMs / 1000)
+  for (const phase of PHASES) {
+    if (phases[phase] !== undefined) endpoint.phases[phase].observe(phases[phase] / 1000)
+  }
+  endpoint.statuses.set(status, (endpoint.statuses.get(status) || 0) + 1)
+
+  // Ring buffer of the most recent totals
+  if (endpoint.window.length < WINDOW_SAMPLES) {
+    endpoint.window.push(totalMs / 1000)
+  } else {
+    endpoint.window[endpoint.windowNext] = totalMs / 1000
+    endpoint.windowNext = (endpoint.windowNext + 1) % WINDOW_SAMPLES
+  }
+}
+
+const round = (ms) => Math.round(ms * 100) / 100
+
+// The total entry carries the endpoint label so clients can group timings the way /api/metrics does
+export const serverTiming = (phases, totalMs, route) => [
+  ...Object.entries(phases).map(([phase, ms]) => `${phase};dur=${round(ms)}`),
+  `total;dur=${round(totalMs)};desc="${route.replace(/["\\]/g, '')}"`
+].join(', ')
+
+// Run a handler with a request timer, then add Server-Timing, log and record it under `route`,
+// a low-cardinality label such as 'users/:id/role'
+export const withTiming = async (request, route, handler) => {
+  const timer = new RequestTimer(route)
+  const response = await storage.run(timer, () => handler(request))
+  const totalMs = timer.elapsed()
+  const label = timer.route
+
+  record(request.method, label, response.status, totalMs, timer.phases)
+  response.headers.set('Server-Timing', serverTiming(timer.phases, totalMs, label))
+
+  if (REQUEST_LOG === 'all' || (REQUEST_LOG === 'errors' && response.status >= 500)) {
+    console.log(JSON.stringify({
+      level: response.status >= 500 ? 'error' : 'info',
+      msg: 'request',
+      time: new Date().toISOString(),
+      method: request.method,
+      route: label,
+      status: response.status,
+      duration_ms: round(totalMs),
+      phases_ms: Object.fromEntries(Object.entries(timer.phases).map(([phase, ms]) => [phase, round(ms)])),
+      ...(timer.error ? { error: timer.error } : {})
+    }))
+  }
+  for (const listener of completeListeners) {
+    try {
+      listener({ request, response, route: label, totalMs, phases: timer.phases, user: timer.user, body: timer.body })
+    } catch (error) {
+      console.error('Request listener error:', error)
+    }
+  }
+  return response
+}
+
+const labels = (values) => {
+  const pairs = Object.entries(values).map(([name, value]) => `${name}="${String(value).replace(/["\\\n]/g, '\\$&')}"`)
+  return pairs.length ? `{${pairs.join(',')}}` : ''
+}
+
+const histogramLines = (name, values, histogram) => [
+  ...BUCKETS.map((bucket, i) => `${name}_bucket${labels({ ...values, le: bucket })} ${histogram.counts[i]}`),
+  `${name}_bucket${labels({ ...values, le: '+Inf' })} ${histogram.count}`,
+  `${name}_sum${labels(values)} ${histogram.sum}`,
+  `${name}_count${labels(values)} ${histogram.count}`
+]
+
+// Prometheus text exposition format. `extra` is a list of { name, help, type, samples: [[labels, value]] }
+export const metricsText = (extra = []) => {
+  const lines = [
+    '# HELP api_requests_total Requests handled, by endpoint and status.',
+    '# TYPE api_requests_total counter'
+  ]
+  for (const { method, route, statuses } of endpoints.values()) {
+    for (const [status, count] of statuses) {
+      lines.push(`api_requests_total${labels({ method, route, status })} ${count}`)
+    }
+  }
+
+  lines.push('# HELP api_request_duration_seconds Request latency, by endpoint.')
+  lines.push('# TYPE api_request_duration_seconds histogram')
+  for (const { method, route, duration } of endpoints.values()) {
+    lines.push(...histogramLines('api_request_duration_seconds', { method, route }, duration))
+  }
+
+  lines.push('# HELP api_request_phase_seconds Time spent in each request phase, by endpoint.')
+  lines.push('# TYPE api_request_phase_seconds histogram')
+  for (const { method, route, phases } of endpoints.values()) {
+    for (const phase of PHASES) {
+      if (phases[phase].count) {
+        lines.push(...histogramLines('api_request_phase_seconds', { method, route, phase }, phases[phase]))
+      }
+    }
+  }
+
+  lines.push(`# HELP api_request_duration_recent_seconds Latency quantiles over the last ${WINDOW_SAMPLES} requests, by endpoint.`)
+  lines.push('# TYPE api_request_duration_recent_seconds summary')
+  for (const { method, route, window } of endpoints.values()) {
+    const sorted = [...window].sort((a, b) => a - b)
+    for (const quantile of QUANTILES) {
+      const value = sorted[Math.min(sorted.length - 1, Math.ceil(quantile * sorted.length) - 1)]
+      lines.push(`api_request_duration_recent_seconds${labels({ method, route, quantile })} ${value}`)
+    }
+    lines.push(`api_request_duration_recent_seconds_sum${labels({ method, route })} ${sorted.reduce((sum, value) => sum + value, 0)}`)
+    lines.push(`api_request_duration_recent_seconds_count${labels({ method, route })} ${sorted.length}`)
+  }
+
+  for (const { name, help, type, samples } of extra) {
+    lines.push(`# HELP ${name} ${help}`, `# TYPE ${name} ${type}`)
+    for (const [values, value] of samples) lines.push(`${name}${labels(values)} ${value}`)
+  }
+  return `${lines.join('\n')}\n`
+}
@@ -0,0 +1,140 @@
+import { timed } from './metrics.js'
+
+// Keyset (cursor) pagination and field projection for list endpoints
+
+export const MAX_PAGE_SIZE = 500
+
+export const USERS_JOIN = 'users (id, full_name, role)'
+
+// Columns that may be requested through `fields=`; `users` selects the join
+export const LIST_FIELDS = {
+  users: ['id', 'email', 'full_name', 'role', 'created_at'],
+  photos: ['id', 'user_id', 'image_url', 'latitude', 'longitude', 'description', 'created_at', 'users'],
+  leads: [
+    'id', 'user_id', 'contact_name', 'contact_phone', 'contact_email', 'business_name',
+    'latitude', 'longitude', 'notes', 'created_at', 'users'
+  ],
+  gps_tracking: ['id', 'user_id', 'latitude', 'longitude', 'activity_type', 'timestamp', 'users']
+}
+
+export const encodeCursor = (row, orderColumn) =>
+  Buffer.from(JSON.stringify([row[orderColumn], row.id])).toString('base64url')
+
+// Cursor parts end up inside a PostgREST or() filter, so only values a real cursor can hold are
+// accepted: an ISO timestamp and an integer or UUID id
+const ISO_TIMESTAMP = /^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d{1,6})?(Z|[+-]\d{2}:\d{2})$/
+const UUID = /^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$/i
+
+const validCursorValue = (value) => typeof value === 'string' && ISO_TIMESTAMP.test(value) && !Number.isNaN(Date.parse(value))
+
+const validCursorId = (id) =>
+  (typeof id === 'number' && Number.isSafeInteger(id)) || (typeof id === 'string' && (/^\d{1,19}$/.test(id) || UUID.test(id)))
+
+export const decodeCursor = (cursor) => {
+  try {
+    const [value, id] = JSON.parse(Buffer.from(cursor, 'base64url').toString('utf8'))
+    if (!validCursorValue(value) || !validCursorId(id)) return null
+    return { value, id }
+  } catch {
+    return null
+  }
+}
+
+// How list rows carry their author: embedded in each row, or once per response in a dictionary
+export const USERS_FORMS = ['join', 'dict']
+
+// Parse `limit`, `cursor`, `fields` and `users` from the query string.
+// Returns { error } for invalid input so the route can answer with a 400.
+// `select` includes the users join; `columns` is the same projection without it (keeping user_id),
+// for callers that attach users themselves. `users` is the requested form, or null without users.
+export const parseListParams = (searchParams, table, orderColumn) => {
+  const allowed = LIST_FIELDS[table]
+  const rawLimit = searchParams.get('limit')
+  const rawCursor = searchParams.get('cursor')
+  const rawFields = searchParams.get('fields')
+  const rawUsers = searchParams.get('users')
+
+  let limit = null
+  if (rawLimit !== null) {
+    limit = parseInt(rawLimit, 10)
+    if (!Number.isInteger(limit) || limit < 1) {
+      return { error: 'limit must be a positive integer' }
+    }
+    limit = Math.min(limit, MAX_PAGE_SIZE)
+  }
+
+  let cursor = null
+  if (rawCursor) {
+    cursor = decodeCursor(rawCursor)
+    if (!cursor) return { error: 'Invalid cursor' }
+  }
+
+  if (rawUsers !== null && !(allowed.includes('users') && USERS_FORMS.includes(rawUsers))) {
+    return { error: allowed.includes('users') ? `users must be one of: ${USERS_FORMS.join(', ')}` : 'users is not available here' }
+  }
+
+  let columns = '*'
+  let withUsers = allowed.includes('users')
+  // user_id added only to look users up, and left out of the rows returned
+  let lookupOnly = false
+  if (rawFields) {
+    const requested = rawFields.split(',').map((field) => field.trim()).filter(Boolean)
+    const unknown = requested.filter((field) => !allowed.includes(field))
+    if (unknown.length) return { error: `Unknown field: ${unknown.join(', ')}` }
+
+    // id and the order column are always returned so the cursor can be built;
+    // asking for users in dictionary form implies them
+    withUsers = requested.includes('users') || rawUsers === 'dict'
+    const projected = new Set(['id', orderColumn, ...requested.filter((field) => field !== 'users')])
+    columns = [...projected].join(', ')
+    if (withUsers && !projected.has('user_id')) {
+      columns += ', user_id'
+      lookupOnly = true
+    }
+  }
+
+  const select = withUsers ? `${columns}, ${USERS_JOIN}` : columns
+  return {
+    limit,
+    cursor,
+    select,
+    columns,
+    users: withUsers ? rawUsers || 'join' : null,
+    lookupOnly,
+    paginated: limit !== null || cursor !== null
+  }
+}
+
+// Apply newest-first keyset ordering, resuming strictly after the cursor row
+export const applyKeyset = (query, cursor, orderColumn) => {
+  let filtered = query
+  if (cursor) {
+    const value = `"${cursor.value}"`
+    const id = `"${cursor.id}"`
+    filtered = filtered.or(`${orderColumn}.lt.${value},and(${orderColumn}.eq.${value},id.lt.${id})`)
+  }
+  return filtered
+    .order(orderColumn, { ascending: false })
+    .order('id', { ascending: false })
+}
+
+// Yield a whole table newest first, one page at a time; the next page is only read when asked for
+export async function* iteratePages(query, orderColumn, pageSize = 1000) {
+  let cursor = null
+  for (;;) {
+    const { data, error } = await timed('db', applyKeyset(query(), cursor, orderColumn).limit(pageSize))
+    if (error) throw new Error(error.message)
+
+    if (data.length) yield data
+    if (data.length < pageSize) return
+    const last = data[data.length - 1]
+    cursor = { value: last[orderColumn], id: last.id }
+  }
+}
+
+// Read a whole table newest first, page by page, handing each page to onPage
+export const scanRows = async (query, orderColumn, onPage, pageSize = 1000) => {
+  for await (const page of iteratePages(query, orderColumn, pageSize)) {
+    onPage(page)
+  }
+}
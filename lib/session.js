@@ -0,0 +1,50 @@
+// Browser-side session: the login response saved by the app, whose access token
+// authorizes API calls as a bearer credential.
+
+const STORAGE_KEY = 'fieldapp_user'
+
+export const accessToken = () => {
+  try {
+    return JSON.parse(localStorage.getItem(STORAGE_KEY))?.session?.access_token || null
+  } catch {
+    return null
+  }
+}
+
+export const currentUserId = () => {
+  try {
+    return JSON.parse(localStorage.getItem(STORAGE_KEY))?.user?.id || null
+  } catch {
+    return null
+  }
+}
+
+// fetch() with the current session's Authorization header
+export const apiFetch = (url, options = {}) => {
+  const token = accessToken()
+  return fetch(url, {
+    ...options,
+    headers: token ? { ...options.headers, Authorization: `Bearer ${token}` } : options.headers
+  })
+}
+
+// EventSource can't send headers, so the stream takes the token as ?access_token=
+export const streamUrl = (url) => {
+  const token = accessToken()
+  return token ? `${url}${url.includes('?') ? '&' : '?'}access_token=${encodeURIComponent(token)}` : url
+}
+
+const submissions = new Map()
+
+// Idempotency key for a form submission. Resubmitting the same body (a double click, or a retry
+// after a lost response) reuses the key so the server records it once; a changed body gets a new key.
+export const submissionKey = (form, body) => {
+  const previous = submissions.get(form)
+  if (previous?.body === body) return previous.key
+  const key = crypto.randomUUID()
+  submissions.set(form, { body, key })
+  return key
+}
+
+// Call once a submission has succeeded, so an identical later one is a new record
+export const submissionDone = (form) => submissions.delete(form)
@@ -0,0 +1,286 @@
+import { supabase } from './supabase.js'
+import { subscribe } from './events.js'
+import { scanRows, USERS_JOIN } from './pagination.js'
+import { timed, timedSync } from './metrics.js'
+import { USER_DIRECTORY, usersFor, embedUsers } from './userDirectory.js'
+
+// Grid index over photo, lead and GPS coordinates for bounding-box, radius and time-window queries.
+// Each table is loaded once (positions only), kept current from the write event feed and the
+// deletion paths, and rebuilt periodically to pick up rows written outside this process.
+export const CELL_DEGREES = 0.01
+export const MAX_SPATIAL_RESULTS = 500
+const REBUILD_MS = parseInt(process.env.SPATIAL_INDEX_REBUILD_MS || '', 10) || 10 * 60 * 1000
+const LOAD_PAGE_SIZE = 1000
+const FETCH_CHUNK = 100
+const EARTH_RADIUS_M = 6371008.8
+
+export const SPATIAL_TABLES = {
+  photos: 'created_at',
+  leads: 'created_at',
+  gps_tracking: 'timestamp'
+}
+
+const toRadians = (degrees) => (degrees * Math.PI) / 180
+
+export const haversineMeters = (lat1, lng1, lat2, lng2) => {
+  const dLat = toRadians(lat2 - lat1)
+  const dLng = toRadians(lng2 - lng1)
+  const a = Math.sin(dLat / 2) ** 2 +
+    Math.cos(toRadians(lat1)) * Math.cos(toRadians(lat2)) * Math.sin(dLng / 2) ** 2
+  return 2 * EARTH_RADIUS_M * Math.asin(Math.min(1, Math.sqrt(a)))
+}
+
+export const boundsAround = (lat, lng, radius) => {
+  const dLat = (radius / EARTH_RADIUS_M) * (180 / Math.PI)
+  const dLng = dLat / Math.max(Math.cos(toRadians(lat)), 1e-6)
+  return {
+    minLat: Math.max(lat - dLat, -90),
+    maxLat: Math.min(lat + dLat, 90),
+    minLng: Math.max(lng - dLng, -180),
+    maxLng: Math.min(lng + dLng, 180)
+  }
+}
+
+export class GridIndex {
+  constructor(cellDegrees = CELL_DEGREES) {
+    this.cellDegrees = cellDegrees
+    this.cells = new Map()
+    // id -> the key of the cell holding it
+    this.ids = new Map()
+  }
+
+  cellOf(value) {
+    return Math.floor(value / this.cellDegrees)
+  }
+
+  add(point) {
+    if (point.id === undefined || point.id === null || this.ids.has(point.id)) return
+    if (!Number.isFinite(point.lat) || !Number.isFinite(point.lng)) return
+    const key = `${this.cellOf(point.lat)}:${this.cellOf(point.lng)}`
+    if (!this.cells.has(key)) this.cells.set(key, [])
+    this.cells.get(key).push(point)
+    this.ids.set(point.id, key)
+  }
+
+  remove(id) {
+    const key = this.ids.get(id)
+    if (key === undefined) return false
+    const points = this.cells.get(key).filter((point) => point.id !== id)
+    if (points.length) this.cells.set(key, points)
+    else this.cells.delete(key)
+    return this.ids.delete(id)
+  }
+
+  removeUsers(userIds) {
+    const users = new Set(userIds.map(String))
+    for (const [key, points] of this.cells) {
+      const kept = points.filter((point) => !users.has(String(point.userId)))
+      if (kept.length === points.length) continue
+      points.filter((point) => users.has(String(point.userId))).forEach((point) => this.ids.delete(point.id))
+      if (kept.length) this.cells.set(key, kept)
+      else this.cells.delete(key)
+    }
+  }
+
+  get size() {
+    return this.ids.size
+  }
+
+  // Points in every cell overlapping the bounds; callers apply the exact predicate
+  *candidates(bounds) {
+    const [minRow, maxRow] = [this.cellOf(bounds.minLat), this.cellOf(bounds.maxLat)]
+    const [minCol, maxCol] = [this.cellOf(bounds.minLng), this.cellOf(bounds.maxLng)]
+
+    // Huge boxes cover more cells than exist; walking the populated cells is cheaper
+    if ((maxRow - minRow + 1) * (maxCol - minCol + 1) > this.cells.size) {
+      for (const points of this.cells.values()) yield* points
+      return
+    }
+    for (let row = minRow; row <= maxRow; row += 1) {
+      for (let col = minCol; col <= maxCol; col += 1) {
+        const points = this.cells.get(`${row}:${col}`)
+        if (points) yield* points
+      }
+    }
+  }
+}
+
+const indexes = {}
+
+const toPoint = (table, row) => ({
+  id: row.id,
+  userId: row.user_id,
+  lat: row.latitude,
+  lng: row.longitude,
+  time: Date.parse(row[SPATIAL_TABLES[table]])
+})
+
+const buildIndex = async (table) => {
+  const timeColumn = SPATIAL_TABLES[table]
+  const index = new GridIndex()
+  await scanRows(
+    () => supabase.from(table).select(`id, user_id, latitude, longitude, ${timeColumn}`),
+    timeColumn,
+    (rows) => rows.forEach((row) => index.add(toPoint(table, row))),
+    LOAD_PAGE_SIZE
+  )
+  return index
+}
+
+const getIndex = (table) => {
+  const current = indexes[table]
+  if (!current || Date.now() - current.builtAt > REBUILD_MS) {
+    // Writes and deletions that land while the table is being read are buffered and replayed into the new index
+    const buffer = []
+    const pending = buildIndex(table)
+    indexes[table] = {
+      builtAt: Date.now(),
+      // Keep serving the previous index while a rebuild is in flight
+      ready: current?.index ? Promise.resolve(current.index) : pending,
+      index: current?.index,
+      buffer
+    }
+    pending.then(
+      (index) => {
+        buffer.forEach((change) => change(index))
+        indexes[table] = { builtAt: Date.now(), ready: Promise.resolve(index), index }
+      },
+      (error) => {
+        console.error(`Spatial index build failed for ${table}:`, error)
+        delete indexes[table]
+      }
+    )
+  }
+  return indexes[table].ready
+}
+
+const applyChange = (table, change) => {
+  const entry = indexes[table]
+  if (!entry) return
+  if (entry.index) change(entry.index)
+  entry.buffer?.push(change)
+}
+
+subscribe((event) => {
+  if (!SPATIAL_TABLES[event.table]) return
+  const point = toPoint(event.table, event.row)
+  applyChange(event.table, (index) => index.add(point))
+})
+
+// Call after deleting rows, so they stop taking up result slots
+export const forgetSpatialRows = (table, ids) => {
+  applyChange(table, (index) => ids.forEach((id) => index.remove(id)))
+}
+
+// Call after deleting users and everything they own
+export const forgetSpatialUsers = (userIds) => {
+  for (const table of Object.keys(SPATIAL_TABLES)) {
+    applyChange(table, (index) => index.removeUsers(userIds))
+  }
+}
+
+const parseNumber = (value) => (value === null || value === '' ? NaN : Number(value))
+
+// Parse bbox / lat+lng+radius / since / until / user_id / limit into a query, or { error }
+export const parseSpatialParams = (searchParams) => {
+  const query = { limit: MAX_SPATIAL_RESULTS }
+
+  const bbox = searchParams.get('bbox')
+  const lat = parseNumber(searchParams.get('lat'))
+  const lng = parseNumber(searchParams.get('lng'))
+  const radius = parseNumber(searchParams.get('radius'))
+
+  if (bbox) {
+    const [minLat, minLng, maxLat, maxLng] = bbox.split(',').map(Number)
+    if (![minLat, minLng, maxLat, maxLng].every(Number.isFinite) || minLat > maxLat || minLng > maxLng) {
+      return { error: 'bbox must be minLat,minLng,maxLat,maxLng' }
+    }
+    query.bounds = { minLat, minLng, maxLat, maxLng }
+  } else if ([lat, lng, radius].every(Number.isFinite) && radius > 0) {
+    query.center = { lat, lng }
+    query.radius = radius
+    query.bounds = boundsAround(lat, lng, radius)
+  } else {
+    return { error: 'Provide bbox=minLat,minLng,maxLat,maxLng or lat, lng and radius (meters)' }
+  }
+
+  for (const name of ['since', 'until']) {
+    const value = searchParams.get(name)
+    if (value) {
+      const time = Date.parse(value)
+      if (Number.isNaN(time)) return { error: `${name} must be an ISO date` }
+      query[name] = time
+    }
+  }
+
+  query.userId = searchParams.get('user_id')
+  const limit = searchParams.get('limit')
+  if (limit) {
+    query.limit = Math.min(parseInt(limit, 10) || MAX_SPATIAL_RESULTS, MAX_SPATIAL_RESULTS)
+  }
+  return query
+}
+
+// Rows inside the area and time window, nearest first for radius queries and newest first otherwise
+export const querySpatial = async (table, { bounds, center, radius, since, until, userId, limit }) => {
+  const index = await getIndex(table)
+
+  const matches = []
+  let candidates = 0
+  for (const point of index.candidates(bounds)) {
+    candidates += 1
+    if (point.lat < bounds.minLat || point.lat > bounds.maxLat) continue
+    if (point.lng < bounds.minLng || point.lng > bounds.maxLng) continue
+    if (since !== undefined && !(point.time >= since)) continue
+    if (until !== undefined && !(point.time <= until)) continue
+    if (userId && String(point.userId) !== userId) continue
+    if (center) {
+      const distance = haversineMeters(center.lat, center.lng, point.lat, point.lng)
+      if (distance > radius) continue
+      matches.push({ point, distance })
+    } else {
+      matches.push({ point })
+    }
+  }
+
+  matches.sort(center
+    ? (a, b) => a.distance - b.distance
+    : (a, b) => b.point.time - a.point.time)
+
+  // Rows deleted behind the index's back are dropped from it, and the next matches take their slots
+  const rowsById = new Map()
+  const selected = []
+  let missing = 0
+  let next = 0
+  while (selected.length < limit && next < matches.length) {
+    const chunk = matches.slice(next, next + Math.min(FETCH_CHUNK, limit - selected.length))
+    next += chunk.length
+    const { data, error } = await timed('db', supabase
+      .from(table)
+      .select(USER_DIRECTORY ? '*' : `*, ${USERS_JOIN}`)
+      .in('id', chunk.map(({ point }) => point.id)))
+    if (error) throw new Error(error.message)
+    data.forEach((row) => rowsById.set(row.id, row))
+    for (const match of chunk) {
+      if (rowsById.has(match.point.id)) {
+        selected.push(match)
+      } else {
+        index.remove(match.point.id)
+        missing += 1
+      }
+    }
+  }
+  if (USER_DIRECTORY) {
+    const found = [...rowsById.values()]
+    const users = await usersFor(found)
+    embedUsers(found, users).forEach((row) => rowsById.set(row.id, row))
+  }
+
+  const rows = timedSync('join', () => selected
+    .map(({ point, distance }) => {
+      const row = rowsById.get(point.id)
+      return distance === undefined ? row : { ...row, distance_m: Math.round(distance * 10) / 10 }
+    }))
+
+  return { rows, matched: matches.length - missing, candidates, indexed: index.size }
+}
@@ -1,22 +1,22 @@
 import { createClient } from '@supabase/supabase-js'
+import { createMemoryClient } from './memoryClient.js'
 
 // Use server-side env vars for API routes, fallback to client-side for browser
 const supabaseUrl = process.env.SUPABASE_URL || process.env.NEXT_PUBLIC_SUPABASE_URL
 const supabaseAnonKey = process.env.SUPABASE_ANON_KEY || process.env.NEXT_PUBLIC_SUPABASE_ANON_KEY
+// Server-only key for auth administration (deleting accounts); never exposed to the browser
+const supabaseServiceKey = process.env.SUPABASE_SERVICE_ROLE_KEY
 
-export const supabase = createClient(supabaseUrl, supabaseAnonKey)
+// DATA_BACKEND=memory swaps in an in-process stand-in so the API runs without a network
+export const dataBackend = process.env.DATA_BACKEND === 'memory' ? 'memory' : 'supabase'
 
-// Database initialization function
-export const initializeDatabase = async () => {
-  try {
-    // Check if users table exists by querying it
-    const { data: existingUsers } = await supabase
-      .from('users')
-      .select('id')
-      .limit(1)
-    
-    console.log('Database connection successful')
-  } catch (error) {
-    console.error('Database initialization error:', error)
-  }
-}
\ No newline at end of file
+export const supabase = dataBackend === 'memory'
+  ? createMemoryClient()
+  : createClient(supabaseUrl, supabaseAnonKey)
+
+// auth.admin, or null when no service role key is configured
+export const authAdmin = dataBackend === 'memory'
+  ? supabase.auth.admin
+  : supabaseServiceKey
+    ? createClient(supabaseUrl, supabaseServiceKey, { auth: { persistSession: false } }).auth.admin
+    : null
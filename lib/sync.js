@@ -0,0 +1,141 @@
+import { randomBytes } from 'crypto'
+import { supabase } from './supabase.js'
+import { subscribe } from './events.js'
+import { timed, timedSync } from './metrics.js'
+import { withThumbnail } from './blobStore.js'
+import { usersFor } from './userDirectory.js'
+import { MAX_PAGE_SIZE } from './pagination.js'
+import { readRecent } from './gpsHistory.js'
+
+// Incremental sync for the field app. Every write already goes through the change feed; this
+// keeps a compacted log of it (the latest change sequence per row) so a client holding a change
+// token can ask for just the rows inserted or updated since. Changed rows are re-read by id, so
+// they match the list endpoints exactly, and ids that are gone come back as deletions. Tokens are
+// tied to this process: after a restart, once the log has evicted a client's position, or when a
+// table was bulk-deleted (track compaction), the client gets a full snapshot of that table instead.
+export const SYNC_TABLES = ['photos', 'leads', 'gps_tracking', 'users']
+// Entries kept in the change log; older positions fall back to a snapshot
+const MAX_LOG_ENTRIES = parseInt(process.env.SYNC_LOG_MAX_ENTRIES || '', 10) || 200000
+// Changed rows returned per response; the client asks again while `more` is set
+export const MAX_CHANGES = parseInt(process.env.SYNC_MAX_CHANGES || '', 10) || 5000
+// GPS snapshots carry the newest fixes only, like the GPS list
+export const GPS_SNAPSHOT_ROWS = MAX_PAGE_SIZE
+const FETCH_CHUNK = 200
+
+// Distinguishes tokens issued by this process from ones issued before a restart
+const EPOCH = randomBytes(6).toString('base64url')
+const ORDER = { photos: 'created_at', leads: 'created_at', gps_tracking: 'timestamp', users: 'created_at' }
+
+const log = {
+  entries: new Map(),
+  seq: 0,
+  // Changes at or below this sequence have been evicted
+  floor: 0,
+  // table -> sequence of its last bulk delete
+  resets: new Map()
+}
+
+subscribe((event) => {
+  if (!SYNC_TABLES.includes(event.table) || event.row?.id === undefined || event.row?.id === null) return
+  const key = `${event.table}:${event.row.id}`
+  log.seq += 1
+  // Re-inserting moves the row to the end, so the map stays in sequence order
+  log.entries.delete(key)
+  log.entries.set(key, { seq: log.seq, table: event.table, id: event.row.id })
+  while (log.entries.size > MAX_LOG_ENTRIES) {
+    const [oldest, entry] = log.entries.entries().next().value
+    log.entries.delete(oldest)
+    log.floor = entry.seq
+  }
+})
+
+// Rows of `table` were deleted in bulk; clients behind this point re-snapshot the table
+export const markTableReset = (table) => {
+  log.seq += 1
+  log.resets.set(table, log.seq)
+}
+
+export const encodeToken = (seq) => Buffer.from(`${EPOCH}.${seq}`).toString('base64url')
+
+// { seq } for a token from this process, { seq: null } for one to answer with a snapshot, or
+// { error } when it isn't a token at all
+export const decodeToken = (token) => {
+  if (!token) return { seq: null }
+  const [epoch, seq] = Buffer.from(token, 'base64url').toString('utf8').split('.')
+  const value = Number(seq)
+  if (!epoch || !Number.isInteger(value) || value < 0) return { error: 'Invalid sync token' }
+  return { seq: epoch === EPOCH && value <= log.seq ? value : null }
+}
+
+const prepare = (table, rows) => (table === 'photos' ? rows.map(withThumbnail) : rows)
+
+const snapshot = async (table) => {
+  const query = () => supabase.from(table).select('*')
+    .order(ORDER[table], { ascending: false })
+    .order('id', { ascending: false })
+  const { data, error } = table === 'gps_tracking'
+    ? await readRecent(query, ORDER[table], GPS_SNAPSHOT_ROWS)
+    : await timed('db', query())
+  if (error) throw new Error(error.message)
+  return prepare(table, data)
+}
+
+const fetchByIds = async (table, ids) => {
+  const rows = []
+  for (let start = 0; start < ids.length; start += FETCH_CHUNK) {
+    const { data, error } = await timed('db', supabase.from(table).select('*').in('id', ids.slice(start, start + FETCH_CHUNK)))
+    if (error) throw new Error(error.message)
+    rows.push(...data)
+  }
+  return prepare(table, rows)
+}
+
+// Changes since `seq` (null for a full snapshot) for `tables`. Rows carry user_id only; `users`
+// maps the authors of returned rows, and every user whose profile changed, to { id, full_name, role }.
+export const changesSince = async (seq, tables) => {
+  const reset = tables.filter((table) => seq === null || seq < log.floor || (log.resets.get(table) || 0) > seq)
+  const incremental = tables.filter((table) => !reset.includes(table))
+  const changes = Object.fromEntries(tables.map((table) => [table, []]))
+  const deleted = Object.fromEntries(incremental.map((table) => [table, []]))
+
+  // Snapshots reflect everything up to now; incremental tables stop early when the page is full.
+  // A partial page's token can sit below a reset, so the next page snapshots that table again;
+  // each snapshot replaces the table, so repeating one is harmless.
+  let token = log.seq
+  let more = false
+  const changedIds = Object.fromEntries(incremental.map((table) => [table, []]))
+  const changedUsers = []
+  if (seq !== null) {
+    timedSync('join', () => {
+      let count = 0
+      for (const entry of log.entries.values()) {
+        if (entry.seq <= seq) continue
+        if (entry.table === 'users') changedUsers.push(entry.id)
+        if (!changedIds[entry.table]) continue
+        if (count === MAX_CHANGES) {
+          more = true
+          token = entry.seq - 1
+          break
+        }
+        changedIds[entry.table].push(entry.id)
+        count += 1
+      }
+    })
+  }
+
+  for (const table of reset) {
+    changes[table] = await snapshot(table)
+  }
+  for (const table of incremental) {
+    const ids = changedIds[table]
+    if (!ids.length) continue
+    const rows = await fetchByIds(table, ids)
+    const found = new Set(rows.map((row) => String(row.id)))
+    changes[table] = rows
+    deleted[table] = ids.filter((id) => !found.has(String(id)))
+  }
+
+  const authored = tables.filter((table) => table !== 'users').flatMap((table) => changes[table])
+  const users = await usersFor([...authored, ...changedUsers.map((id) => ({ user_id: id }))])
+  return { token: encodeToken(token), more, reset, changes, deleted, users }
+}
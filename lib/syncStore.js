@@ -0,0 +1,129 @@
+// Browser-side copy of the lists the app shows, kept in IndexedDB and brought up to date with
+// /api/sync. The dashboard renders from it straight away and then fetches only what changed
+// since the last sync, instead of downloading every list again on each load.
+
+import { apiFetch } from './session.js'
+
+const DB_NAME = 'fieldapp-sync'
+const DB_VERSION = 1
+const TABLES = ['photos', 'leads', 'gps_tracking', 'users']
+const META = 'meta'
+// The GPS list only shows recent fixes, so older ones are dropped once past this many
+const MAX_GPS_ROWS = 500
+const ORDER = { photos: 'created_at', leads: 'created_at', gps_tracking: 'timestamp', users: 'created_at' }
+
+let opening = null
+
+const request = (req) => new Promise((resolve, reject) => {
+  req.onsuccess = () => resolve(req.result)
+  req.onerror = () => reject(req.error)
+})
+
+const done = (transaction) => new Promise((resolve, reject) => {
+  transaction.oncomplete = () => resolve()
+  transaction.onerror = () => reject(transaction.error)
+  transaction.onabort = () => reject(transaction.error)
+})
+
+const openDb = () => {
+  if (typeof indexedDB === 'undefined') return Promise.resolve(null)
+  if (!opening) {
+    const open = indexedDB.open(DB_NAME, DB_VERSION)
+    open.onupgradeneeded = () => {
+      TABLES.forEach((table) => open.result.createObjectStore(table, { keyPath: 'id' }))
+      open.result.createObjectStore(META)
+    }
+    opening = request(open).catch((error) => {
+      console.error('Sync store unavailable:', error)
+      opening = null
+      return null
+    })
+  }
+  return opening
+}
+
+const newestFirst = (table) => (a, b) =>
+  String(b[ORDER[table]] ?? '').localeCompare(String(a[ORDER[table]] ?? '')) || String(b.id).localeCompare(String(a.id))
+
+const readAll = async (db) => {
+  const transaction = db.transaction([...TABLES, META])
+  const [meta, ...lists] = await Promise.all([
+    request(transaction.objectStore(META).get('state')),
+    ...TABLES.map((table) => request(transaction.objectStore(table).getAll()))
+  ])
+  const authors = meta?.authors || {}
+  const data = Object.fromEntries(TABLES.map((table, index) => {
+    const rows = lists[index].sort(newestFirst(table))
+    return [table, table === 'users' ? rows : rows.map((row) => ({ ...row, users: authors[row.user_id] ?? null }))]
+  }))
+  return { ...data, owner: meta?.owner ?? null, token: meta?.token ?? null }
+}
+
+// Everything synced so far for `owner` (the signed-in user's id), with authors attached, or null
+// when nothing is stored for them
+export const loadSyncedData = async (owner) => {
+  const db = await openDb()
+  if (!db) return null
+  const data = await readAll(db)
+  return data.owner === owner && data.token ? data : null
+}
+
+// Forget everything stored, e.g. on sign-out
+export const clearSyncedData = async () => {
+  const db = await openDb()
+  if (!db) return
+  const transaction = db.transaction([...TABLES, META], 'readwrite')
+  ;[...TABLES, META].forEach((store) => transaction.objectStore(store).clear())
+  await done(transaction)
+}
+
+const applyChanges = async (db, owner, state, response) => {
+  const transaction = db.transaction([...TABLES, META], 'readwrite')
+  // Another user's data never mixes with this one's
+  if (state.owner !== owner) TABLES.forEach((table) => transaction.objectStore(table).clear())
+  response.reset.forEach((table) => transaction.objectStore(table).clear())
+  for (const [table, rows] of Object.entries(response.changes)) {
+    const store = transaction.objectStore(table)
+    rows.forEach((row) => store.put(row))
+  }
+  for (const [table, ids] of Object.entries(response.deleted)) {
+    const store = transaction.objectStore(table)
+    ids.forEach((id) => store.delete(id))
+  }
+  const authors = { ...(state.owner === owner ? state.authors : {}), ...response.users }
+  transaction.objectStore(META).put({ owner, token: response.token, authors }, 'state')
+  await done(transaction)
+  return { owner, token: response.token, authors }
+}
+
+const trimGps = async (db) => {
+  const transaction = db.transaction('gps_tracking', 'readwrite')
+  const store = transaction.objectStore('gps_tracking')
+  const rows = await request(store.getAll())
+  if (rows.length > MAX_GPS_ROWS) {
+    rows.sort(newestFirst('gps_tracking')).slice(MAX_GPS_ROWS).forEach((row) => store.delete(row.id))
+  }
+  await done(transaction)
+}
+
+// Fetch changes since the stored token and apply them, repeating while the server has more.
+// Returns the synced data as loadSyncedData does, or null when IndexedDB isn't available.
+export const syncNow = async (owner) => {
+  const db = await openDb()
+  if (!db) return null
+  const stored = await request(db.transaction(META).objectStore(META).get('state'))
+  let state = stored || { owner: null, token: null, authors: {} }
+  let more = true
+  while (more) {
+    const since = state.owner === owner && state.token ? `?since=${encodeURIComponent(state.token)}` : ''
+    const response = await apiFetch(`/api/sync${since}`)
+    if (!response.ok) {
+      throw new Error(`Sync failed with status ${response.status}`)
+    }
+    const changes = await response.json()
+    state = await applyChanges(db, owner, state, changes)
+    more = changes.more
+  }
+  await trimGps(db)
+  return readAll(db)
+}
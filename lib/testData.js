@@ -0,0 +1,58 @@
+import { supabase, authAdmin } from './supabase.js'
+import { timed } from './metrics.js'
+
+// Bulk removal of test fixtures, for running the test suite against a shared backend. Test
+// accounts live in a namespace: their emails end in @<namespace>.test, a reserved domain no real
+// user has. Removing a namespace deletes those users, every row they own and their auth accounts.
+// Off unless TEST_CLEANUP=on, and only an admin inside the namespace may remove it.
+export const TEST_CLEANUP = process.env.TEST_CLEANUP === 'on'
+const NAMESPACE = /^[a-z0-9][a-z0-9-]{5,62}$/
+const ID_CHUNK = 200
+
+// Tables with rows owned through user_id, removed before the users themselves
+export const OWNED_TABLES = ['photos', 'leads', 'gps_tracking', 'gps_tracks', 'gps_hourly']
+
+export const validNamespace = (namespace) => typeof namespace === 'string' && NAMESPACE.test(namespace)
+
+export const inNamespace = (email, namespace) =>
+  validNamespace(namespace) && typeof email === 'string' && email.toLowerCase().endsWith(`@${namespace}.test`)
+
+const removeWhereIn = async (table, column, ids) => {
+  let removed = 0
+  for (let start = 0; start < ids.length; start += ID_CHUNK) {
+    const { data, error } = await timed('db', supabase
+      .from(table)
+      .delete()
+      .in(column, ids.slice(start, start + ID_CHUNK))
+      .select(column))
+    if (error) throw new Error(error.message)
+    removed += data.length
+  }
+  return removed
+}
+
+// Delete a namespace's users and everything they own; returns the ids removed and counts per table.
+// Auth accounts are only removed when an auth admin client is configured.
+export const removeNamespace = async (namespace) => {
+  const { data: users, error } = await timed('db', supabase
+    .from('users')
+    .select('id, email')
+    .ilike('email', `%@${namespace}.test`))
+  if (error) throw new Error(error.message)
+  const ids = users.filter((user) => inNamespace(user.email, namespace)).map((user) => user.id)
+
+  const removed = {}
+  for (const table of OWNED_TABLES) {
+    removed[table] = ids.length ? await removeWhereIn(table, 'user_id', ids) : 0
+  }
+  removed.users = ids.length ? await removeWhereIn('users', 'id', ids) : 0
+
+  removed.auth_users = 0
+  if (authAdmin) {
+    for (const id of ids) {
+      const { error: authError } = await timed('db', authAdmin.deleteUser(id))
+      if (!authError) removed.auth_users += 1
+    }
+  }
+  return { ids, removed }
+}
@@ -0,0 +1,408 @@
+import { supabase } from './supabase.js'
+import { haversineMeters, forgetSpatialRows } from './spatial.js'
+import { timed } from './metrics.js'
+
+// Per-agent daily trajectories: Douglas-Peucker simplification, encoded polylines,
+// distance, time per activity type and stop detection.
+export const DEFAULT_TOLERANCE_M = 10
+// Gaps longer than this are treated as the device being off, not as time spent in an activity
+export const MAX_GAP_S = 5 * 60
+export const STOP_RADIUS_M = 50
+export const STOP_MIN_DURATION_S = 5 * 60
+
+const HOUR_MS = 60 * 60 * 1000
+const DAY_MS = 24 * HOUR_MS
+const PAGE_SIZE = 1000
+const DELETE_CHUNK = 500
+export const MAX_COMPACT_DAYS = 31
+
+export const dayBounds = (date) => {
+  const start = Date.parse(`${date}T00:00:00.000Z`)
+  if (Number.isNaN(start)) return null
+  return { start: new Date(start).toISOString(), end: new Date(start + DAY_MS).toISOString() }
+}
+
+// Distance from p to segment a-b in meters, on a local equirectangular projection
+const segmentDistance = (p, a, b) => {
+  const metersPerDegLat = 111320
+  const metersPerDegLng = 111320 * Math.cos((a.latitude * Math.PI) / 180)
+  const [ax, ay] = [a.longitude * metersPerDegLng, a.latitude * metersPerDegLat]
+  const [bx, by] = [b.longitude * metersPerDegLng, b.latitude * metersPerDegLat]
+  const [px, py] = [p.longitude * metersPerDegLng, p.latitude * metersPerDegLat]
+  const [dx, dy] = [bx - ax, by - ay]
+  const lengthSquared = dx * dx + dy * dy
+  const t = lengthSquared ? Math.max(0, Math.min(1, ((px - ax) * dx + (py - ay) * dy) / lengthSquared)) : 0
+  return Math.hypot(px - (ax + t * dx), py - (ay + t * dy))
+}
+
+// Iterative Douglas-Peucker; keeps the first and last points and anything further than tolerance
+export const simplify = (points, toleranceM = DEFAULT_TOLERANCE_M) => {
+  if (points.length <= 2) return points.slice()
+
+  const keep = new Uint8Array(points.length)
+  keep[0] = keep[points.length - 1] = 1
+  const stack = [[0, points.length - 1]]
+
+  while (stack.length) {
+    const [first, last] = stack.pop()
+    let maxDistance = 0
+    let index = -1
+    for (let i = first + 1; i < last; i += 1) {
+      const distance = segmentDistance(points[i], points[first], points[last])
+      if (distance > maxDistance) {
+        maxDistance = distance
+        index = i
+      }
+    }
+    if (index !== -1 && maxDistance > toleranceM) {
+      keep[index] = 1
+      stack.push([first, index], [index, last])
+    }
+  }
+  return points.filter((_, i) => keep[i])
+}
+
+// Google encoded polyline format (precision 1e5)
+export const encodePolyline = (points) => {
+  let previousLat = 0
+  let previousLng = 0
+  let output = ''
+
+  const encodeValue = (value) => {
+    let shifted = value < 0 ? ~(value << 1) : value << 1
+    let chunk = ''
+    while (shifted >= 0x20) {
+      chunk += String.fromCharCode((0x20 | (shifted & 0x1f)) + 63)
+      shifted >>= 5
+    }
+    return chunk + String.fromCharCode(shifted + 63)
+  }
+
+  for (const point of points) {
+    const lat = Math.round(point.latitude * 1e5)
+    const lng = Math.round(point.longitude * 1e5)
+    output += encodeValue(lat - previousLat) + encodeValue(lng - previousLng)
+    previousLat = lat
+    previousLng = lng
+  }
+  return output
+}
+
+export const decodePolyline = (encoded) => {
+  const points = []
+  let index = 0
+  let lat = 0
+  let lng = 0
+
+  const decodeValue = () => {
+    let result = 0
+    let shift = 0
+    let byte
+    do {
+      byte = encoded.charCodeAt(index) - 63
+      index += 1
+      result |= (byte & 0x1f) << shift
+      shift += 5
+    } while (byte >= 0x20)
+    return result & 1 ? ~(result >> 1) : result >> 1
+  }
+
+  while (index < encoded.length) {
+    lat += decodeValue()
+    lng += decodeValue()
+    points.push({ latitude: lat / 1e5, longitude: lng / 1e5 })
+  }
+  return points
+}
+
+// Stops: runs of fixes that stay within STOP_RADIUS_M of where they began for STOP_MIN_DURATION_S
+const detectStops = (points) => {
+  const stops = []
+  let start = 0
+  while (start < points.length) {
+    let end = start
+    while (
+      end + 1 < points.length &&
+      haversineMeters(points[start].latitude, points[start].longitude,
+        points[end + 1].latitude, points[end + 1].longitude) <= STOP_RADIUS_M
+    ) {
+      end += 1
+    }
+
+    const duration = (points[end].time - points[start].time) / 1000
+    if (duration >= STOP_MIN_DURATION_S) {
+      const cluster = points.slice(start, end + 1)
+      stops.push({
+        latitude: cluster.reduce((sum, p) => sum + p.latitude, 0) / cluster.length,
+        longitude: cluster.reduce((sum, p) => sum + p.longitude, 0) / cluster.length,
+        started_at: new Date(points[start].time).toISOString(),
+        ended_at: new Date(points[end].time).toISOString(),
+        duration_s: Math.round(duration)
+      })
+      start = end + 1
+    } else {
+      start += 1
+    }
+  }
+  return stops
+}
+
+// Summarise one agent's raw gps_tracking rows for one day into a compact track
+export const buildTrack = (userId, date, rows, toleranceM = DEFAULT_TOLERANCE_M) => {
+  const points = rows
+    .map((row) => ({
+      latitude: row.latitude,
+      longitude: row.longitude,
+      activity_type: row.activity_type,
+      time: Date.parse(row.timestamp)
+    }))
+    .sort((a, b) => a.time - b.time)
+
+  let distance = 0
+  const activitySeconds = {}
+  for (let i = 1; i < points.length; i += 1) {
+    const previous = points[i - 1]
+    const gap = (points[i].time - previous.time) / 1000
+    if (gap > MAX_GAP_S) continue
+    distance += haversineMeters(previous.latitude, previous.longitude, points[i].latitude, points[i].longitude)
+    activitySeconds[previous.activity_type] = (activitySeconds[previous.activity_type] || 0) + gap
+  }
+
+  const simplified = simplify(points, toleranceM)
+  return {
+    user_id: userId,
+    date,
+    point_count: points.length,
+    simplified_count: simplified.length,
+    tolerance_m: toleranceM,
+    polyline: encodePolyline(simplified),
+    started_at: points.length ? new Date(points[0].time).toISOString() : null,
+    ended_at: points.length ? new Date(points[points.length - 1].time).toISOString() : null,
+    distance_m: Math.round(distance),
+    activity_seconds: Object.fromEntries(
+      Object.entries(activitySeconds).map(([activity, seconds]) => [activity, Math.round(seconds)])
+    ),
+    stops: detectStops(points)
+  }
+}
+
+// Add fixes that arrived after an agent-day was compacted to its stored track. The stored track
+// only keeps its simplified points, without times, so they are spread evenly over its time span to
+// interleave them with the new fixes; counts, distance, activity time and stops are added together.
+export const mergeTrack = (stored, userId, date, rows, toleranceM = DEFAULT_TOLERANCE_M) => {
+  const fresh = buildTrack(userId, date, rows, toleranceM)
+  if (!stored?.point_count) return fresh
+
+  const start = Date.parse(stored.started_at)
+  const end = Date.parse(stored.ended_at)
+  const storedPoints = decodePolyline(stored.polyline || '')
+  const step = storedPoints.length > 1 ? (end - start) / (storedPoints.length - 1) : 0
+  const points = [
+    ...storedPoints.map((point, i) => ({ ...point, time: start + step * i })),
+    ...rows.map((row) => ({ latitude: row.latitude, longitude: row.longitude, time: Date.parse(row.timestamp) }))
+  ].sort((a, b) => a.time - b.time)
+  const simplified = simplify(points, toleranceM)
+
+  const activitySeconds = { ...(stored.activity_seconds || {}) }
+  for (const [activity, seconds] of Object.entries(fresh.activity_seconds)) {
+    activitySeconds[activity] = (activitySeconds[activity] || 0) + seconds
+  }
+  return {
+    ...fresh,
+    point_count: stored.point_count + fresh.point_count,
+    simplified_count: simplified.length,
+    polyline: encodePolyline(simplified),
+    started_at: new Date(Math.min(start, Date.parse(fresh.started_at))).toISOString(),
+    ended_at: new Date(Math.max(end, Date.parse(fresh.ended_at))).toISOString(),
+    distance_m: (stored.distance_m || 0) + fresh.distance_m,
+    activity_seconds: activitySeconds,
+    stops: [...(stored.stops || []), ...fresh.stops].sort((a, b) => a.started_at.localeCompare(b.started_at))
+  }
+}
+
+// Per-agent hourly rollups of raw fixes: fix count, distance and time per activity type, using
+// the same gap rule as tracks. Movement between two fixes counts towards the hour of the first.
+export const hourlyRollups = (rows) => {
+  const byUser = new Map()
+  for (const row of rows) {
+    const time = Date.parse(row.timestamp)
+    if (!Number.isFinite(time)) continue
+    if (!byUser.has(row.user_id)) byUser.set(row.user_id, [])
+    byUser.get(row.user_id).push({ ...row, time })
+  }
+
+  const rollups = []
+  for (const [userId, points] of byUser) {
+    points.sort((a, b) => a.time - b.time)
+    let current = null
+    points.forEach((point, i) => {
+      const hour = new Date(Math.floor(point.time / HOUR_MS) * HOUR_MS).toISOString()
+      if (current?.hour !== hour) {
+        current = { user_id: userId, hour, fixes: 0, distance_m: 0, activity_seconds: {}, first_at: point.timestamp, last_at: null }
+        rollups.push(current)
+      }
+      current.fixes += 1
+      current.last_at = point.timestamp
+
+      const next = points[i + 1]
+      const gap = next ? (next.time - point.time) / 1000 : Infinity
+      if (gap > MAX_GAP_S) return
+      current.distance_m += haversineMeters(point.latitude, point.longitude, next.latitude, next.longitude)
+      current.activity_seconds[point.activity_type] = (current.activity_seconds[point.activity_type] || 0) + gap
+    })
+  }
+  return rollups.map((rollup) => ({
+    ...rollup,
+    distance_m: Math.round(rollup.distance_m),
+    activity_seconds: Object.fromEntries(
+      Object.entries(rollup.activity_seconds).map(([activity, seconds]) => [activity, Math.round(seconds)])
+    )
+  }))
+}
+
+const groupByUser = (rows) => {
+  const byUser = new Map()
+  for (const row of rows) {
+    if (!byUser.has(row.user_id)) byUser.set(row.user_id, [])
+    byUser.get(row.user_id).push(row)
+  }
+  return byUser
+}
+
+// Group one day's rows (any number of agents) into tracks
+export const buildTracks = (date, rows, toleranceM = DEFAULT_TOLERANCE_M) =>
+  [...groupByUser(rows)].map(([userId, userRows]) => buildTrack(userId, date, userRows, toleranceM))
+
+// Tracks for one day's rows, merged into the ones already stored for the same agent-days. A track
+// lists in pending_fix_ids the fixes merged into it whose deletion hasn't been confirmed; those are
+// not merged again if they are still there. Returns the tracks, each listing every fix it now
+// covers as pending, and the fixes an earlier run had already merged.
+const compactTracks = async (date, rows, toleranceM) => {
+  const byUser = groupByUser(rows)
+  const { data: stored, error } = await timed('db', supabase
+    .from('gps_tracks')
+    .select('*')
+    .eq('date', date)
+    .in('user_id', [...byUser.keys()]))
+  if (error) throw new Error(error.message)
+  const storedByUser = new Map(stored.map((track) => [track.user_id, track]))
+
+  const merged = new Set()
+  const tracks = [...byUser].map(([userId, userRows]) => {
+    const { id, ...track } = storedByUser.get(userId) || {}
+    const pending = new Set((track.pending_fix_ids || []).map(String))
+    const fresh = []
+    for (const row of userRows) {
+      if (pending.has(String(row.id))) merged.add(row.id)
+      else fresh.push(row)
+    }
+    return {
+      ...(fresh.length ? mergeTrack(track.point_count ? track : null, userId, date, fresh, toleranceM) : track),
+      pending_fix_ids: userRows.map((row) => row.id)
+    }
+  })
+  return { tracks, merged }
+}
+
+const TRACK_COLUMNS = 'id, user_id, latitude, longitude, activity_type, timestamp'
+
+// All raw fixes in [start, end), optionally for one agent, read page by page
+export const loadRawRows = async (start, end, userId = null, columns = TRACK_COLUMNS) => {
+  const rows = []
+  for (let from = 0; ; from += PAGE_SIZE) {
+    let query = supabase
+      .from('gps_tracking')
+      .select(columns)
+      .gte('timestamp', start)
+      .lt('timestamp', end)
+    if (userId) query = query.eq('user_id', userId)
+
+    const { data, error } = await timed('db', query
+      .order('timestamp', { ascending: true })
+      .order('id', { ascending: true })
+      .range(from, from + PAGE_SIZE - 1))
+    if (error) throw new Error(error.message)
+
+    rows.push(...data)
+    if (data.length < PAGE_SIZE) return rows
+  }
+}
+
+// Stored track for an agent-day, or one computed from raw fixes if it hasn't been compacted yet
+export const getTrack = async (userId, date, toleranceM = DEFAULT_TOLERANCE_M) => {
+  const { data: stored, error } = await timed('db', supabase
+    .from('gps_tracks')
+    .select('*')
+    .eq('user_id', userId)
+    .eq('date', date)
+    .maybeSingle())
+  if (error) throw new Error(error.message)
+  if (stored) {
+    const { pending_fix_ids, ...track } = stored
+    return { ...track, source: 'compacted' }
+  }
+
+  const { start, end } = dayBounds(date)
+  const rows = await loadRawRows(start, end, userId)
+  return { ...buildTrack(userId, date, rows, toleranceM), source: 'raw' }
+}
+
+// Age raw fixes older than `before` (YYYY-MM-DD) into gps_tracks, one UTC day at a time.
+// Tracks are written before the raw rows are deleted, and only the rows read are deleted, so fixes
+// arriving meanwhile wait for the next run, which merges them into the stored tracks. The tracks
+// record which fixes they have merged until the deletes finish, so a run that fails part way can
+// be repeated without counting any fix twice.
+// `beforeDelete(date, rows, fresh)`, when given, is awaited with each day's rows before they are
+// deleted, and the subset an interrupted earlier run had not yet merged into the tracks; whatever it
+// returns is collected in the summary's `archived`.
+export const compactBefore = async (before, {
+  userId = null,
+  maxDays = MAX_COMPACT_DAYS,
+  toleranceM = DEFAULT_TOLERANCE_M,
+  beforeDelete = null
+} = {}) => {
+  const cutoff = dayBounds(before).start
+  const summary = { days: [], tracks: 0, raw_rows_removed: 0, archived: [] }
+
+  while (summary.days.length < maxDays) {
+    let oldest = supabase.from('gps_tracking').select('timestamp').lt('timestamp', cutoff)
+    if (userId) oldest = oldest.eq('user_id', userId)
+    const { data, error } = await timed('db', oldest.order('timestamp', { ascending: true }).limit(1))
+    if (error) throw new Error(error.message)
+    if (!data.length) break
+
+    const date = data[0].timestamp.slice(0, 10)
+    const { start, end } = dayBounds(date)
+    // Whole rows when they are about to be archived
+    const rows = await loadRawRows(start, end, userId, beforeDelete ? '*' : TRACK_COLUMNS)
+    const { tracks, merged } = await compactTracks(date, rows, toleranceM)
+
+    const { error: upsertError } = await timed('db', supabase
+      .from('gps_tracks')
+      .upsert(tracks, { onConflict: 'user_id,date' }))
+    if (upsertError) throw new Error(upsertError.message)
+    if (beforeDelete) summary.archived.push(await beforeDelete(date, rows, rows.filter((row) => !merged.has(row.id))))
+
+    const ids = rows.map((row) => row.id)
+    for (let from = 0; from < ids.length; from += DELETE_CHUNK) {
+      const chunk = ids.slice(from, from + DELETE_CHUNK)
+      const { error: deleteError } = await timed('db', supabase
+        .from('gps_tracking')
+        .delete()
+        .in('id', chunk))
+      if (deleteError) throw new Error(deleteError.message)
+      forgetSpatialRows('gps_tracking', chunk)
+    }
+    const { error: clearError } = await timed('db', supabase
+      .from('gps_tracks')
+      .update({ pending_fix_ids: [] })
+      .eq('date', date)
+      .in('user_id', tracks.map((track) => track.user_id)))
+    if (clearError) throw new Error(clearError.message)
+
+    summary.days.push(date)
+    summary.tracks += tracks.length
+    summary.raw_rows_removed += rows.length
+  }
+  return summary
+}
@@ -0,0 +1,80 @@
+import { supabase } from './supabase.js'
+import { subscribe } from './events.js'
+import { timed } from './metrics.js'
+
+// In-memory directory of every user's public profile (id, full_name, role), so list endpoints
+// can attach authors without the database joining users into every row. It loads in full on
+// first use, follows register and role-update events, and reloads after USER_DIRECTORY_TTL_MS
+// to pick up changes made by other instances. USER_DIRECTORY=off falls back to the database join.
+export const USER_DIRECTORY = process.env.USER_DIRECTORY !== 'off'
+const TTL_MS = parseInt(process.env.USER_DIRECTORY_TTL_MS || '', 10) || 5 * 60 * 1000
+const LOOKUP_CHUNK = 200
+
+export const USER_COLUMNS = ['id', 'full_name', 'role']
+
+const directory = {
+  users: new Map(),
+  loadedAt: 0,
+  loading: null,
+  loads: 0,
+  lookups: 0
+}
+
+const profile = (row) => Object.fromEntries(USER_COLUMNS.map((column) => [column, row[column] ?? null]))
+
+const remember = (row) => directory.users.set(String(row.id), profile(row))
+
+subscribe((event) => {
+  if (event.table === 'users' && event.row?.id) remember(event.row)
+})
+
+const load = async () => {
+  const { data, error } = await timed('db', supabase.from('users').select(USER_COLUMNS.join(', ')))
+  if (error) throw new Error(error.message)
+  directory.users = new Map(data.map((row) => [String(row.id), profile(row)]))
+  directory.loadedAt = Date.now()
+  directory.loads += 1
+}
+
+const fresh = () => {
+  if (directory.loadedAt && Date.now() - directory.loadedAt < TTL_MS) return null
+  if (!directory.loading) directory.loading = load().finally(() => { directory.loading = null })
+  return directory.loading
+}
+
+// Users not in the directory yet (registered on another instance) are read by id
+const lookUp = async (ids) => {
+  for (let start = 0; start < ids.length; start += LOOKUP_CHUNK) {
+    const { data, error } = await timed('db', supabase
+      .from('users')
+      .select(USER_COLUMNS.join(', '))
+      .in('id', ids.slice(start, start + LOOKUP_CHUNK)))
+    if (error) throw new Error(error.message)
+    data.forEach(remember)
+  }
+  // Remember ids with no user too, until the next reload, so they aren't read on every request
+  ids.filter((id) => !directory.users.has(id)).forEach((id) => directory.users.set(id, null))
+  directory.lookups += ids.length
+}
+
+// { [user_id]: { id, full_name, role } } for the authors of `rows`. Ids with no user map to null,
+// as the joined form has `users: null` for them.
+export const usersFor = async (rows) => {
+  await fresh()
+  const ids = [...new Set(rows.map((row) => row.user_id).filter((id) => id !== null && id !== undefined).map(String))]
+  const missing = ids.filter((id) => !directory.users.has(id))
+  if (missing.length) await lookUp(missing)
+  return Object.fromEntries(ids.map((id) => [id, directory.users.get(id) ?? null]))
+}
+
+// The joined form: each row with its author under `users`
+export const embedUsers = (rows, users) =>
+  rows.map((row) => ({ ...row, users: users[String(row.user_id)] ?? null }))
+
+export const userDirectoryStats = () => ({
+  enabled: USER_DIRECTORY,
+  users: directory.users.size,
+  loads: directory.loads,
+  lookups: directory.lookups,
+  age_ms: directory.loadedAt ? Date.now() - directory.loadedAt : null
+})
@@ -0,0 +1,304 @@
+import { promises as fs } from 'fs'
+import path from 'path'
+import { supabase } from './supabase.js'
+import { publishAll } from './events.js'
+import { checkDatabase } from './health.js'
+import { withThumbnail } from './blobStore.js'
+
+// Optional write-behind mode (WRITE_BEHIND=on). Writes are acknowledged once they are appended
+// and fsynced to a local append-only log; a background worker drains the log into the database
+// in batches. Appends that arrive together share one write and fsync (group commit). Drained
+// progress is checkpointed after every batch, and on startup anything past the checkpoint is
+// replayed, so acknowledged writes survive a crash. Delivery is at-least-once: a crash between
+// an insert and its checkpoint replays that batch.
+export const WRITE_BEHIND = process.env.WRITE_BEHIND === 'on'
+const queueDir = process.env.WRITE_BEHIND_DIR || path.join(process.cwd(), 'storage', 'write-queue')
+const BATCH_SIZE = parseInt(process.env.WRITE_BEHIND_BATCH_SIZE || '', 10) || 500
+// Backpressure: beyond this many undrained rows new writes are refused until the drain catches up
+export const MAX_PENDING = parseInt(process.env.WRITE_BEHIND_MAX_PENDING || '', 10) || 50000
+// Once drained, a log larger than this is truncated
+const COMPACT_BYTES = (parseInt(process.env.WRITE_BEHIND_COMPACT_MB || '', 10) || 64) * 1024 * 1024
+// Failed batch inserts are retried with capped backoff; after this many the batch is checked for bad rows
+const MAX_ATTEMPTS = 5
+const MAX_BACKOFF_MS = 5000
+
+const LOG_FILE = path.join(queueDir, 'queue.log')
+const CHECKPOINT_FILE = path.join(queueDir, 'checkpoint')
+const DEAD_LETTER_FILE = path.join(queueDir, 'dead-letter.log')
+
+// What comes back from each insert, matching the synchronous endpoints' event payloads
+const RETURNING = {
+  gps_tracking: 'id',
+  photos: '*, users ( id, full_name, role )',
+  leads: '*, users ( id, full_name, role )'
+}
+
+// Rows are acknowledged before the database sees them, so check them here against the columns
+// an insert would: required values present, text as strings, coordinates in range. GPS fixes
+// are checked by toGpsRow before they get this far.
+const isText = (value) => typeof value === 'string'
+// Postgres casts numeric strings into numeric columns, so accept those as well
+const isCoordinate = (limit) => (value) => {
+  const number = typeof value === 'string' && value.trim() ? Number(value) : value
+  return typeof number === 'number' && Number.isFinite(number) && Math.abs(number) <= limit
+}
+const COLUMNS = {
+  photos: {
+    required: ['user_id', 'image_url'],
+    types: { user_id: isText, image_url: isText, description: isText, latitude: isCoordinate(90), longitude: isCoordinate(180) }
+  },
+  leads: {
+    required: ['user_id', 'contact_name'],
+    types: {
+      user_id: isText,
+      contact_name: isText,
+      contact_phone: isText,
+      contact_email: isText,
+      business_name: isText,
+      notes: isText,
+      latitude: isCoordinate(90),
+      longitude: isCoordinate(180)
+    }
+  }
+}
+
+const COLUMN_ERRORS = {
+  latitude: 'latitude must be a number between -90 and 90',
+  longitude: 'longitude must be a number between -180 and 180'
+}
+
+// Why a row can't be queued for `table`, or null when it can
+export const invalidRow = (table, row) => {
+  const columns = COLUMNS[table]
+  if (!columns) return null
+  for (const column of columns.required) {
+    if (row[column] === undefined || row[column] === null || row[column] === '') return `${column} is required`
+  }
+  for (const [column, check] of Object.entries(columns.types)) {
+    const value = row[column]
+    if (value !== undefined && value !== null && !check(value)) return COLUMN_ERRORS[column] || `${column} must be a string`
+  }
+  return null
+}
+
+const state = {
+  ready: null,
+  log: null,
+  logBytes: 0,
+  nextSeq: 1,
+  drainedSeq: 0,
+  // Durable records not yet in the database, in sequence order
+  pending: [],
+  // Records waiting for the next group commit: { records, resolve, reject }
+  appends: [],
+  writing: false,
+  draining: false,
+  drained: 0,
+  deadLetters: 0,
+  recovered: 0,
+  lastError: null
+}
+
+const drainListeners = new Set()
+
+// Called with (table, rows) after each drained insert, e.g. to invalidate cached lists
+export const onDrained = (listener) => {
+  drainListeners.add(listener)
+  return () => drainListeners.delete(listener)
+}
+
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms))
+
+const recover = async () => {
+  await fs.mkdir(queueDir, { recursive: true })
+  const checkpoint = await fs.readFile(CHECKPOINT_FILE, 'utf8').catch(() => '0')
+  state.drainedSeq = parseInt(checkpoint, 10) || 0
+
+  let contents = await fs.readFile(LOG_FILE).catch(() => Buffer.alloc(0))
+  // A crash mid-append leaves a partial last line; it was never acknowledged, so drop it
+  const end = contents.lastIndexOf(0x0a) + 1
+  if (end < contents.length) {
+    await fs.truncate(LOG_FILE, end)
+    contents = contents.subarray(0, end)
+  }
+
+  let maxSeq = state.drainedSeq
+  for (const line of contents.toString('utf8').split('\n')) {
+    if (!line) continue
+    const record = JSON.parse(line)
+    maxSeq = Math.max(maxSeq, record.seq)
+    if (record.seq > state.drainedSeq) state.pending.push(record)
+  }
+  state.recovered = state.pending.length
+  state.nextSeq = maxSeq + 1
+  state.logBytes = contents.length
+  state.log = await fs.open(LOG_FILE, 'a')
+  if (state.recovered) console.log(`Write-behind queue: replaying ${state.recovered} undrained writes`)
+  drain()
+}
+
+const ready = () => {
+  if (!state.ready) state.ready = recover()
+  return state.ready
+}
+
+// Write every waiting record in one append and fsync, then release their acknowledgements
+const groupCommit = async () => {
+  if (state.writing) return
+  state.writing = true
+  try {
+    while (state.appends.length) {
+      const batch = state.appends
+      state.appends = []
+      const records = batch.flatMap((append) => append.records)
+      const data = records.map((record) => `${JSON.stringify(record)}\n`).join('')
+      try {
+        await state.log.write(data)
+        await state.log.datasync()
+      } catch (error) {
+        batch.forEach((append) => append.reject(error))
+        continue
+      }
+      state.logBytes += Buffer.byteLength(data)
+      state.pending.push(...records)
+      batch.forEach((append) => append.resolve())
+      drain()
+    }
+  } finally {
+    state.writing = false
+  }
+}
+
+const queuedRows = () => state.pending.length + state.appends.reduce((sum, append) => sum + append.records.length, 0)
+
+// Durably queue rows for `table`. Resolves to { first, last } sequence numbers once they are on
+// disk, or { error, status } when the queue is full.
+export const enqueueWrites = async (table, rows) => {
+  await ready()
+  if (queuedRows() + rows.length > MAX_PENDING) {
+    return { error: 'Write queue is full; retry shortly', status: 503 }
+  }
+
+  const queuedAt = new Date().toISOString()
+  const records = rows.map((row) => ({ seq: state.nextSeq++, table, row, queued_at: queuedAt }))
+  await new Promise((resolve, reject) => {
+    state.appends.push({ records, resolve, reject })
+    groupCommit()
+  })
+  return { first: records[0].seq, last: records[records.length - 1].seq }
+}
+
+const deadLetter = async (failures) => {
+  if (!failures.length) return
+  const lines = failures.map(({ record, error }) => `${JSON.stringify({ ...record, error, failed_at: new Date().toISOString() })}\n`)
+  await fs.appendFile(DEAD_LETTER_FILE, lines.join(''))
+  state.deadLetters += failures.length
+  console.error(`Write-behind queue: ${failures.length} writes rejected by the database, see ${DEAD_LETTER_FILE}`)
+}
+
+const insert = (table, records) => supabase.from(table).insert(records.map((record) => record.row)).select(RETURNING[table])
+
+// Insert one table's records, retrying through outages. When the database is reachable but the
+// batch still fails, rows are tried one at a time and those rejected on their own are dead-lettered.
+const insertRecords = async (table, records) => {
+  for (let attempt = 1; ; attempt += 1) {
+    const { data, error } = await insert(table, records)
+    if (!error) return { records, data: data || [] }
+    state.lastError = error.message
+
+    if (attempt >= MAX_ATTEMPTS && await checkDatabase({ force: true })) {
+      const inserted = []
+      const rows = []
+      const failures = []
+      for (const record of records) {
+        const single = await insert(table, [record])
+        if (single.error) {
+          failures.push({ record, error: single.error.message })
+        } else {
+          inserted.push(record)
+          rows.push(...(single.data || []))
+        }
+      }
+      await deadLetter(failures)
+      return { records: inserted, data: rows }
+    }
+    await sleep(Math.min(100 * 2 ** (attempt - 1), MAX_BACKOFF_MS))
+  }
+}
+
+const writeCheckpoint = async (seq) => {
+  const temporary = `${CHECKPOINT_FILE}.tmp`
+  await fs.writeFile(temporary, String(seq))
+  await fs.rename(temporary, CHECKPOINT_FILE)
+}
+
+const compact = async () => {
+  if (state.logBytes < COMPACT_BYTES || state.pending.length || state.writing || state.appends.length) return
+  state.writing = true
+  try {
+    await state.log.truncate(0)
+    state.logBytes = 0
+  } finally {
+    state.writing = false
+  }
+  groupCommit()
+}
+
+// Drain pending records into the database in batches, one insert per table per batch
+const drain = async () => {
+  if (state.draining) return
+  state.draining = true
+  let failed = false
+  try {
+    while (state.pending.length) {
+      const batch = state.pending.slice(0, BATCH_SIZE)
+      const byTable = new Map()
+      for (const record of batch) {
+        if (!byTable.has(record.table)) byTable.set(record.table, [])
+        byTable.get(record.table).push(record)
+      }
+
+      for (const [table, records] of byTable) {
+        const { records: inserted, data } = await insertRecords(table, records)
+        const rows = table === 'gps_tracking'
+          ? inserted.map((record, index) => ({ ...record.row, id: data[index]?.id }))
+          : data.map(withThumbnail)
+        state.drained += inserted.length
+        for (const listener of drainListeners) listener(table, rows)
+        publishAll(table, rows)
+      }
+
+      state.pending.splice(0, batch.length)
+      state.drainedSeq = batch[batch.length - 1].seq
+      await writeCheckpoint(state.drainedSeq)
+    }
+    await compact()
+  } catch (error) {
+    failed = true
+    state.lastError = error.message
+    console.error('Write-behind drain failed:', error)
+    setTimeout(drain, MAX_BACKOFF_MS)
+  } finally {
+    state.draining = false
+  }
+  // Records committed while the last pass was finishing up
+  if (!failed && state.pending.length) drain()
+}
+
+// Start recovery at boot rather than on the first write, so a restart replays promptly
+if (WRITE_BEHIND) ready().catch((error) => console.error('Write-behind recovery failed:', error))
+
+export const writeQueueStats = () => ({
+  enabled: WRITE_BEHIND,
+  pending: state.pending.length,
+  appending: queuedRows() - state.pending.length,
+  max_pending: MAX_PENDING,
+  oldest_queued_at: state.pending[0]?.queued_at ?? null,
+  appended_seq: state.nextSeq - 1,
+  drained_seq: state.drainedSeq,
+  drained_total: state.drained,
+  recovered: state.recovered,
+  dead_letters: state.deadLetters,
+  log_bytes: state.logBytes,
+  last_error: state.lastError
+})
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Concurrent Load Generation for Field Management Application
+Simulates many field agents driving the backend API at the same time and
+reports throughput and per-endpoint latency percentiles
+"""
+
+import argparse
+import math
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from api_client import APIClient, PhaseRecorder
+from backend_test import BASE_URL, TEST_GPS_COORDS, print_phase_breakdown, wait_for_ready
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of samples (pct in 0-100)"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(math.ceil(pct / 100.0 * len(ordered)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+class LatencyRecorder:
+    """Thread-safe collection of request latencies grouped by endpoint"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, endpoint, elapsed, success):
+        with self._lock:
+            self.latencies[endpoint].append(elapsed)
+            if not success:
+                self.errors[endpoint] += 1
+
+    def summary(self, wall_time):
+        """Per-endpoint count, error count, throughput and p50/p95/p99 in ms"""
+        rows = {}
+        with self._lock:
+            for endpoint, samples in self.latencies.items():
+                rows[endpoint] = {
+                    "count": len(samples),
+                    "errors": self.errors[endpoint],
+                    "throughput": len(samples) / wall_time if wall_time else 0.0,
+                    "p50_ms": percentile(samples, 50) * 1000,
+                    "p95_ms": percentile(samples, 95) * 1000,
+                    "p99_ms": percentile(samples, 99) * 1000,
+                }
+        return rows
+
+
+class RateLimiter:
+    """Spaces requests evenly so the whole run stays at a target rate"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = time.perf_counter()
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.perf_counter()
+            slot = max(self._next_slot, now)
+            self._next_slot = slot + self.interval
+        delay = slot - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class LoadGenerator:
+    """Runs the FieldManagementAPITester flow for many concurrent agents
+
+    Every simulated agent registers, logs in, uploads a photo, captures a
+    lead, posts GPS fixes and then reads the dashboard lists, each request
+    carrying its own session's bearer token. All agents
+    wait on a barrier before the GPS phase so the fixes arrive in a burst,
+    the way a whole fleet syncs at shift start.
+    """
+
+    def __init__(self, agents=50, concurrency=None, rate=None, gps_posts=5,
+                 gps_interval=0.0, base_url=BASE_URL, pool_size=None, retries=0, keep_alive=True):
+        self.agents = agents
+        self.concurrency = concurrency or agents
+        # Retries default off so failures show up as errors instead of as slow successes
+        self.phases = PhaseRecorder()
+        self.client = APIClient(base_url, pool_size=pool_size or self.concurrency, retries=retries,
+                                phase_recorder=self.phases)
+        # Without keep-alive every request pays for a new connection, to measure what pooling saves
+        self.extra_headers = {} if keep_alive else {"Connection": "close"}
+        self.gps_posts = gps_posts
+        self.gps_interval = gps_interval
+        self.base_url = base_url
+        self.limiter = RateLimiter(rate)
+        self.recorder = LatencyRecorder()
+        self.run_id = uuid.uuid4().hex[:8]
+        # A burst is only possible when every agent is running at once
+        self.gps_barrier = threading.Barrier(agents) if self.concurrency >= agents else None
+
+    def _request(self, endpoint, method, path, token=None, **kwargs):
+        """Issue one paced, timed request (as the agent holding token) and record it under endpoint"""
+        self.limiter.acquire()
+        kwargs.setdefault("timeout", 30)
+        kwargs["headers"] = {**self.extra_headers, **kwargs.get("headers", {})}
+        if token:
+            kwargs["headers"]["Authorization"] = f"Bearer {token}"
+        start = time.perf_counter()
+        try:
+            response = self.client.request(method, path, **kwargs)
+            success = response.status_code == 200
+        except requests.RequestException:
+            response = None
+            success = False
+        self.recorder.record(endpoint, time.perf_counter() - start, success)
+        return response
+
+    def _wait_for_fleet(self):
+        if self.gps_barrier is None:
+            return
+        try:
+            self.gps_barrier.wait(timeout=60)
+        except threading.BrokenBarrierError:
+            pass
+
+    def run_agent(self, index):
+        """Drive one agent through register -> login -> writes -> reads"""
+        credentials = {
+            "email": f"load_{self.run_id}_{index}@fieldmanager.com",
+            "password": "LoadPass123!",
+            "fullName": f"Load Agent {index}",
+            "role": "agent",
+        }
+        user_id = None
+        token = None
+        try:
+            response = self._request("POST auth/register", "POST", "auth/register", json=credentials)
+            if response is not None and response.status_code == 200:
+                user_id = response.json()["user"]["id"]
+
+            response = self._request("POST auth/login", "POST", "auth/login",
+                                     json={"email": credentials["email"],
+                                           "password": credentials["password"]})
+            if response is not None and response.status_code == 200:
+                token = response.json()["session"]["access_token"]
+
+            if user_id and token:
+                offset = (index % 100) * 0.0001
+                self._request("POST photos", "POST", "photos", token, json={
+                    "user_id": user_id,
+                    "image_url": f"https://example.com/load-{self.run_id}-{index}.jpg",
+                    "latitude": TEST_GPS_COORDS["latitude"] + offset,
+                    "longitude": TEST_GPS_COORDS["longitude"] + offset,
+                    "description": f"Load test photo {index}",
+                })
+                self._request("POST leads", "POST", "leads", token, json={
+                    "user_id": user_id,
+                    "contact_name": f"Load Contact {index}",
+                    "contact_phone": f"+1-555-{index:04d}",
+                    "contact_email": f"contact_{self.run_id}_{index}@example.com",
+                    "business_name": "Load Test Inc",
+                    "latitude": TEST_GPS_COORDS["latitude"] - offset,
+                    "longitude": TEST_GPS_COORDS["longitude"] - offset,
+                    "notes": "Generated by load_generator.py",
+                })
+        finally:
+            self._wait_for_fleet()
+
+        if user_id and token:
+            for step in range(self.gps_posts):
+                self._request("POST gps-tracking", "POST", "gps-tracking", token, json={
+                    "user_id": user_id,
+                    "latitude": TEST_GPS_COORDS["latitude"] + step * 0.0005,
+                    "longitude": TEST_GPS_COORDS["longitude"] + step * 0.0005,
+                    "activity_type": "active",
+                })
+                if self.gps_interval:
+                    time.sleep(self.gps_interval)
+
+        # The users list is admin-only, so agents read the lists they can see
+        for path in ("photos", "leads", "gps-tracking"):
+            self._request(f"GET {path}", "GET", path, token)
+
+    def run(self):
+        """Run every agent and return (wall time, per-endpoint summary)"""
+        print(f"🚀 Load test: {self.agents} agents, concurrency {self.concurrency}, "
+              f"{self.gps_posts} GPS posts each against {self.base_url} "
+              f"({'keep-alive' if not self.extra_headers else 'new connection per request'})")
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            list(pool.map(self.run_agent, range(self.agents)))
+        wall_time = time.perf_counter() - start
+        return wall_time, self.recorder.summary(wall_time)
+
+    @staticmethod
+    def print_report(wall_time, summary):
+        total = sum(row["count"] for row in summary.values())
+        errors = sum(row["errors"] for row in summary.values())
+        print("\n" + "=" * 86)
+        print("📊 LOAD TEST SUMMARY")
+        print("=" * 86)
+        print(f"{'Endpoint':<22}{'Count':>8}{'Errors':>8}{'Req/s':>10}"
+              f"{'p50 ms':>12}{'p95 ms':>12}{'p99 ms':>12}")
+        for endpoint in sorted(summary):
+            row = summary[endpoint]
+            print(f"{endpoint:<22}{row['count']:>8}{row['errors']:>8}{row['throughput']:>10.1f}"
+                  f"{row['p50_ms']:>12.1f}{row['p95_ms']:>12.1f}{row['p99_ms']:>12.1f}")
+        print("-" * 86)
+        print(f"Total: {total} requests, {errors} errors in {wall_time:.2f}s "
+              f"({total / wall_time if wall_time else 0:.1f} req/s)")
+        return errors
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Concurrent load generator for the field management API")
+    parser.add_argument("--agents", type=int, default=50, help="number of simulated agents")
+    parser.add_argument("--concurrency", type=int, default=None,
+                        help="max agents running at once (defaults to --agents)")
+    parser.add_argument("--rate", type=float, default=None,
+                        help="target requests per second across all agents (default: unthrottled)")
+    parser.add_argument("--gps-posts", type=int, default=5, help="GPS fixes posted per agent")
+    parser.add_argument("--gps-interval", type=float, default=0.0,
+                        help="seconds between one agent's GPS fixes")
+    parser.add_argument("--pool-size", type=int, default=None,
+                        help="pooled keep-alive connections (defaults to --concurrency)")
+    parser.add_argument("--retries", type=int, default=0,
+                        help="retries with backoff on transient failures (default: 0)")
+    parser.add_argument("--no-keep-alive", dest="keep_alive", action="store_false",
+                        help="open a new connection for every request")
+    parser.add_argument("--base-url", default=BASE_URL)
+    return parser
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    if wait_for_ready(base_url=args.base_url) is None:
+        print(f"❌ Backend at {args.base_url} is not ready")
+        return 1
+    generator = LoadGenerator(
+        agents=args.agents,
+        concurrency=args.concurrency,
+        rate=args.rate,
+        gps_posts=args.gps_posts,
+        gps_interval=args.gps_interval,
+        base_url=args.base_url,
+        pool_size=args.pool_size,
+        retries=args.retries,
+        keep_alive=args.keep_alive,
+    )
+    wall_time, summary = generator.run()
+    errors = LoadGenerator.print_report(wall_time, summary)
+    print("\n⏱️  LATENCY BY PHASE")
+    print_phase_breakdown(generator.phases.summary())
+    return 0 if errors == 0 else 1
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+Traffic Replay for Field Management Application
+Re-drives a sanitized traffic capture (the JSONL file the API writes when
+CAPTURE_FILE is set) against a server at recorded speed, N times faster or
+flat out, keeping each user's requests in order, then diffs status codes and
+latencies against the capture
+"""
+
+import argparse
+import itertools
+import json
+import re
+import threading
+import time
+import uuid
+import zlib
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import requests
+
+from api_client import APIClient, admin_client, grant_admin, parse_server_timing
+from backend_test import BASE_URL, wait_for_ready
+from load_generator import percentile
+
+REPLAY_PASSWORD = "ReplayPass123!"
+# Long-lived streams, binary uploads and streamed imports carry nothing a JSON capture can rebuild
+SKIPPED_ROUTES = {"stream", "blobs/:key", "photos/upload", "leads/import"}
+# Request headers passed through; the body's own headers are set when it is re-encoded
+REPLAYED_HEADERS = ("accept", "accept-encoding")
+PSEUDONYM = re.compile(r"@u_[A-Za-z0-9_-]+")
+RELATIVE = re.compile(r"<(date|time):(-?\d+)>")
+MAX_LANES = 256
+
+
+def load_capture(path, routes=None, limit=None):
+    """Replayable records from a capture file in time order, plus a Counter of skipped routes"""
+    pattern = re.compile(routes) if routes else None
+    records, skipped = [], Counter()
+    with open(path) as handle:
+        for line in handle:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            label = f"{record['method']} {record['route']}"
+            if pattern and not pattern.search(label):
+                continue
+            if record["route"] in SKIPPED_ROUTES or (record["method"] in ("POST", "PUT") and record["body"] is None):
+                skipped[label] += 1
+                continue
+            records.append(record)
+    records.sort(key=lambda record: record["at_ms"])
+    return records[:limit] if limit else records, skipped
+
+
+class Replayer:
+    """Replays capture records with one lane per captured user, each lane strictly in order"""
+
+    def __init__(self, records, base_url=BASE_URL, speed=1.0, timeout=30):
+        self.records = records
+        self.base_url = base_url
+        # 0 replays as fast as the server answers
+        self.speed = speed
+        self.timeout = timeout
+        self.run_id = uuid.uuid4().hex[:8]
+        # Every account the replay registers is in this namespace, so testing/cleanup removes them and their rows
+        self.namespace = f"replay-{self.run_id}"
+        self.accounts = {}
+        self.cleaner = None
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def _next(self):
+        with self._lock:
+            self._counter += 1
+            return self._counter
+
+    def _email(self, name):
+        return f"{name}@{self.namespace}.test"
+
+    def _register(self, name, full_name, role, admin):
+        client = APIClient(self.base_url, retries=0, timeout=self.timeout)
+        email = self._email(name)
+        try:
+            response = client.post("auth/register", json={
+                "email": email, "password": REPLAY_PASSWORD, "fullName": full_name
+            })
+            response.raise_for_status()
+            user_id = response.json()["user"]["id"]
+            if role == "admin":
+                grant_admin(admin, user_id)
+            client.login(email, REPLAY_PASSWORD)
+        except Exception:
+            client.close()
+            raise
+        return {"client": client, "email": email, "id": user_id}
+
+    def create_accounts(self):
+        """Register and log in one replay account per captured user, with the captured role, plus
+        an admin in the namespace that removes it afterwards. Accounts register as agents; the
+        configured admin grants the admin role."""
+        roles = {}
+        for record in self.records:
+            if record["user"]:
+                roles.setdefault(record["user"], record.get("role") or "agent")
+        admin = admin_client(self.base_url, retries=0, timeout=self.timeout)
+        try:
+            self.cleaner = self._register("admin", "Replay admin", "admin", admin)
+            for pseudonym, role in roles.items():
+                self.accounts[pseudonym] = self._register(
+                    f"replay{self._next()}", f"Replay {pseudonym[3:9]}", role, admin
+                )
+        finally:
+            admin.close()
+        return len(self.accounts)
+
+    def cleanup(self):
+        """Remove the replay's namespace and close its clients; returns the counts removed, or None
+        when the server doesn't offer cleanup (TEST_CLEANUP is off) or no account was created"""
+        try:
+            if not self.cleaner:
+                return None
+            response = self.cleaner["client"].post("testing/cleanup", json={"namespace": self.namespace}, timeout=120)
+            if response.status_code == 404:
+                return None
+            response.raise_for_status()
+            return response.json()["removed"]
+        finally:
+            for account in [self.cleaner, *self.accounts.values()]:
+                if account:
+                    account["client"].close()
+
+    def _user_id(self, pseudonym, lane):
+        account = self.accounts.get(pseudonym) or self.accounts.get(lane)
+        return account["id"] if account else pseudonym
+
+    def _relative(self, match):
+        """Resolve a captured <date:days> or <time:ms> offset against now"""
+        now = datetime.now(timezone.utc)
+        if match.group(1) == "date":
+            return (now + timedelta(days=int(match.group(2)))).date().isoformat()
+        return (now + timedelta(milliseconds=int(match.group(2)))).isoformat(timespec="milliseconds")
+
+    def _resolve(self, text, lane):
+        """Map user pseudonyms and relative times in a captured string"""
+        text = PSEUDONYM.sub(lambda match: str(self._user_id(match.group(0), lane)), text)
+        return RELATIVE.sub(self._relative, text)
+
+    def synthesize(self, shape, lane, unique, key=None):
+        """A value with the captured shape: sanitized strings are refilled, users mapped to replay
+        accounts. `unique` yields distinct tokens for generated emails, phones and keys."""
+        if isinstance(shape, dict):
+            if "$array" in shape:
+                return [self.synthesize(shape["of"], lane, unique, key) for _ in range(shape["$array"])]
+            return {name: self.synthesize(value, lane, unique, name) for name, value in shape.items()}
+        if not isinstance(shape, str):
+            return shape
+        match = re.fullmatch(r"<str:(\d+)>", shape)
+        if not match:
+            return self._resolve(shape, lane)
+        length = int(match.group(1))
+        account = self.accounts.get(lane)
+        if key == "email" and account:
+            return account["email"]
+        if key in ("email", "contact_email"):
+            return self._email(f"replay{next(unique)}")
+        if key == "password":
+            return REPLAY_PASSWORD
+        if key == "idempotency_key":
+            return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{self.run_id}:{next(unique)}"))
+        if key == "contact_phone":
+            return f"+1555{zlib.crc32(str(next(unique)).encode()) % 10 ** 7:07d}"
+        if key == "image_url":
+            return "https://example.com/replay.jpg"
+        return "x" * min(length, 1000)
+
+    def build_request(self, record, lane):
+        """(method, path, kwargs) for one record"""
+        path = self._resolve(record["path"], lane)
+        params = {}
+        for name, value in record["query"].items():
+            # Cursors point into the captured database, so the replay reads the first page instead
+            if name == "cursor":
+                continue
+            params[name] = self._resolve(value, lane)
+        headers = {name: record["headers"][name] for name in REPLAYED_HEADERS if name in record["headers"]}
+        key = record["headers"].get("idempotency-key")
+        if key:
+            headers["Idempotency-Key"] = f"replay-{self.run_id}-{key[3:]}"
+        kwargs = {"params": params, "headers": headers, "timeout": self.timeout}
+        if record["method"] in ("POST", "PUT"):
+            # Retries of one keyed write must send the same body, so their generated values repeat
+            unique = (f"{key[3:]}-{index}" for index in itertools.count()) if key else iter(self._next, None)
+            kwargs["json"] = self.synthesize(record["body"], lane, unique)
+            # A captured sign-up is replayed as a new one rather than as the lane's existing account
+            if path == "auth/register" and isinstance(kwargs["json"], dict):
+                kwargs["json"]["email"] = self._email(f"replay{self._next()}")
+        return record["method"], path, kwargs
+
+    def _replay_lane(self, lane, records, start, first_at):
+        account = self.accounts.get(lane)
+        client = account["client"] if account else APIClient(self.base_url, retries=0, timeout=self.timeout)
+        try:
+            return self._replay_records(client, lane, records, start, first_at)
+        finally:
+            # Account clients are closed by cleanup(); the anonymous lane's is only used here
+            if not account:
+                client.close()
+
+    def _replay_records(self, client, lane, records, start, first_at):
+        results = []
+        for record in records:
+            due = start + (record["at_ms"] - first_at) / 1000 / self.speed if self.speed else None
+            if due is not None and due > time.perf_counter():
+                time.sleep(max(due - time.perf_counter(), 0))
+            method, path, kwargs = self.build_request(record, lane)
+            sent = time.perf_counter()
+            try:
+                response = client.request(method, path, **kwargs)
+                status = response.status_code
+                server = parse_server_timing(response.headers.get("Server-Timing")).get("total", {}).get("dur")
+            except requests.RequestException as e:
+                status, server = f"error: {type(e).__name__}", None
+            results.append({
+                "record": record,
+                "status": status,
+                "client_ms": (time.perf_counter() - sent) * 1000,
+                "server_ms": server,
+                # How far behind schedule the request went out (lane blocked on earlier responses)
+                "late_ms": max((sent - due) * 1000, 0.0) if due is not None else None
+            })
+        return results
+
+    def run(self):
+        """Replay every record; returns (wall seconds, per-request results in capture order)"""
+        lanes = defaultdict(list)
+        for record in self.records:
+            lanes[record["user"] or "anonymous"].append(record)
+        if not self.records:
+            return 0.0, []
+        first_at = self.records[0]["at_ms"]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=min(len(lanes), MAX_LANES)) as pool:
+            futures = [pool.submit(self._replay_lane, lane, records, start, first_at) for lane, records in lanes.items()]
+            results = [result for future in futures for result in future.result()]
+        wall_time = time.perf_counter() - start
+        results.sort(key=lambda result: result["record"]["at_ms"])
+        return wall_time, results
+
+
+def diff(results, latency_tolerance=1.5, min_regression_ms=5.0):
+    """Per-endpoint status and latency comparison of replay results with their captured records"""
+    groups = defaultdict(list)
+    for result in results:
+        groups[f"{result['record']['method']} {result['record']['route']}"].append(result)
+
+    rows = {}
+    for endpoint, group in groups.items():
+        captured_ms = [result["record"]["duration_ms"] for result in group]
+        replayed_ms = [result["server_ms"] for result in group if result["server_ms"] is not None]
+        mismatches = [result for result in group if result["status"] != result["record"]["status"]]
+        row = {
+            "count": len(group),
+            "captured_statuses": dict(Counter(result["record"]["status"] for result in group)),
+            "replayed_statuses": dict(Counter(result["status"] for result in group)),
+            "status_mismatches": len(mismatches),
+            "captured_p50_ms": percentile(captured_ms, 50),
+            "captured_p95_ms": percentile(captured_ms, 95),
+            "replayed_p50_ms": percentile(replayed_ms, 50),
+            "replayed_p95_ms": percentile(replayed_ms, 95),
+            "client_p95_ms": percentile([result["client_ms"] for result in group], 95),
+        }
+        row["regression"] = (row["replayed_p95_ms"] > row["captured_p95_ms"] * latency_tolerance
+                             and row["replayed_p95_ms"] - row["captured_p95_ms"] > min_regression_ms)
+        rows[endpoint] = row
+    return rows
+
+
+def print_diff(rows, wall_time, skipped):
+    total = sum(row["count"] for row in rows.values())
+    mismatches = sum(row["status_mismatches"] for row in rows.values())
+    print("\n" + "=" * 104)
+    print("📊 REPLAY DIFF (server ms: captured vs replayed)")
+    print("=" * 104)
+    print(f"{'Endpoint':<30}{'Count':>7}{'Status diff':>12}{'Cap p50':>10}{'Rep p50':>10}"
+          f"{'Cap p95':>10}{'Rep p95':>10}{'Client p95':>12}")
+    for endpoint in sorted(rows):
+        row = rows[endpoint]
+        flag = " ⚠️" if row["regression"] or row["status_mismatches"] else ""
+        print(f"{endpoint:<30}{row['count']:>7}{row['status_mismatches']:>12}{row['captured_p50_ms']:>10.1f}"
+              f"{row['replayed_p50_ms']:>10.1f}{row['captured_p95_ms']:>10.1f}{row['replayed_p95_ms']:>10.1f}"
+              f"{row['client_p95_ms']:>12.1f}{flag}")
+        if row["status_mismatches"]:
+            print(f"    statuses captured {row['captured_statuses']} -> replayed {row['replayed_statuses']}")
+    print("-" * 104)
+    print(f"Replayed {total} requests in {wall_time:.2f}s; {mismatches} status differences; "
+          f"{sum(row['regression'] for row in rows.values())} endpoints slower than the capture")
+    if skipped:
+        print("Skipped (not replayable): " + ", ".join(f"{label} x{count}" for label, count in sorted(skipped.items())))
+
+
+def parse_speed(value):
+    if value == "max":
+        return 0.0
+    speed = float(value)
+    if speed <= 0:
+        raise argparse.ArgumentTypeError("speed must be positive, or max")
+    return speed
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Replay a captured traffic file against the field management API")
+    parser.add_argument("capture", help="JSONL file written by the API with CAPTURE_FILE set")
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--speed", type=parse_speed, default=1.0,
+                        help="1 replays at recorded pace, 10 ten times faster, max as fast as possible")
+    parser.add_argument("--routes", help="only replay endpoints matching this regex, e.g. '^POST gps'")
+    parser.add_argument("--limit", type=int, help="replay only the first N records")
+    parser.add_argument("--latency-tolerance", type=float, default=1.5,
+                        help="flag endpoints whose replayed p95 exceeds the captured p95 by this factor")
+    parser.add_argument("--report", help="write the per-endpoint diff here as JSON")
+    return parser
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    if wait_for_ready(base_url=args.base_url) is None:
+        print(f"❌ Backend at {args.base_url} is not ready")
+        return 1
+
+    records, skipped = load_capture(args.capture, args.routes, args.limit)
+    replayer = Replayer(records, args.base_url, args.speed)
+    print(f"👥 Creating {len({record['user'] for record in records if record['user']})} replay accounts in {replayer.namespace}")
+    try:
+        replayer.create_accounts()
+        print(f"▶️  Replaying {len(records)} requests at {'max speed' if not args.speed else f'{args.speed:g}x'}")
+        wall_time, results = replayer.run()
+    finally:
+        removed = replayer.cleanup()
+        if removed is None and replayer.cleaner:
+            print(f"⚠️  Cleanup unavailable (start the server with TEST_CLEANUP=on); {replayer.namespace} was left in place")
+        else:
+            print(f"🧹 Removed {replayer.namespace}: {removed}")
+    rows = diff(results, args.latency_tolerance)
+    print_diff(rows, wall_time, skipped)
+    if args.report:
+        with open(args.report, "w") as handle:
+            json.dump({"wall_seconds": wall_time, "skipped": dict(skipped), "endpoints": rows}, handle, indent=2)
+    return 0 if not any(row["status_mismatches"] or row["regression"] for row in rows.values()) else 1
+
+
+if __name__ == "__main__":
+    exit(main())
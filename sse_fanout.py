@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Event Stream Client and Fan-out Benchmark for Field Management Application
+Opens many /api/stream subscriptions, writes GPS fixes and measures how long
+each write takes to reach every subscriber
+"""
+
+import argparse
+import json
+import threading
+import time
+import uuid
+
+import requests
+
+from api_client import APIClient
+from backend_test import BASE_URL, TEST_GPS_COORDS, wait_for_ready
+from load_generator import percentile
+
+
+class EventStreamClient:
+    """Minimal Server-Sent Events reader for /api/stream"""
+
+    def __init__(self, base_url=BASE_URL, tables=None, user_ids=None, last_event_id=None, token=None):
+        params = {}
+        if tables:
+            params["tables"] = ",".join(tables)
+        if user_ids:
+            params["user_id"] = ",".join(user_ids)
+        headers = {"Accept": "text/event-stream"}
+        if last_event_id is not None:
+            headers["Last-Event-ID"] = str(last_event_id)
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+
+        # Each subscription holds its connection open, so it gets its own rather than one from a shared pool
+        self.response = requests.get(
+            f"{base_url}/stream", params=params, headers=headers, stream=True, timeout=(5, 30)
+        )
+        self.response.raise_for_status()
+        self.last_event_id = last_event_id
+
+    def events(self):
+        """Yield parsed events as dicts with id, event, data and received_at"""
+        event = {}
+        for line in self.response.iter_lines(decode_unicode=True):
+            if line is None:
+                continue
+            if line == "":
+                if "data" in event:
+                    event["received_at"] = time.perf_counter()
+                    self.last_event_id = event.get("id", self.last_event_id)
+                    yield event
+                event = {}
+                continue
+            if line.startswith(":"):
+                continue
+            field, _, value = line.partition(":")
+            value = value[1:] if value.startswith(" ") else value
+            if field == "data":
+                event["data"] = event["data"] + "\n" + value if "data" in event else value
+            elif field in ("id", "event"):
+                event[field] = value
+
+    def close(self):
+        self.response.close()
+
+
+class FanoutBenchmark:
+    """Measures write-to-delivery latency across many concurrent subscribers"""
+
+    def __init__(self, subscribers=50, events=20, base_url=BASE_URL):
+        self.subscriber_count = subscribers
+        self.event_count = events
+        self.base_url = base_url
+        self.client = APIClient(base_url)
+        self.sent_at = {}
+        self.latencies = []
+        self.delivered = 0
+        self._lock = threading.Lock()
+
+    def _register_agent(self):
+        credentials = {
+            "email": f"stream_{uuid.uuid4().hex[:8]}@fieldmanager.com",
+            "password": "StreamPass123!",
+            "fullName": "Stream Agent",
+            "role": "agent",
+        }
+        response = self.client.post("auth/register", json=credentials, timeout=10)
+        response.raise_for_status()
+        self.client.login(credentials["email"], credentials["password"])
+        return response.json()["user"]["id"]
+
+    def _latitude(self, index):
+        return round(TEST_GPS_COORDS["latitude"] + index * 0.00001, 6)
+
+    def _subscribe(self, user_id, ready):
+        client = EventStreamClient(self.base_url, tables=["gps_tracking"], user_ids=[user_id], token=self.client.token)
+        ready.release()
+        received = 0
+        try:
+            for event in client.events():
+                row_key = round(json.loads(event["data"])["latitude"], 6)
+                with self._lock:
+                    sent = self.sent_at.get(row_key)
+                    if sent is not None:
+                        self.latencies.append(event["received_at"] - sent)
+                    self.delivered += 1
+                received += 1
+                if received >= self.event_count:
+                    break
+        except requests.RequestException:
+            pass
+        finally:
+            client.close()
+
+    def run(self):
+        user_id = self._register_agent()
+        ready = threading.Semaphore(0)
+        threads = [
+            threading.Thread(target=self._subscribe, args=(user_id, ready), daemon=True)
+            for _ in range(self.subscriber_count)
+        ]
+        for thread in threads:
+            thread.start()
+        for _ in threads:
+            ready.acquire(timeout=30)
+
+        for index in range(self.event_count):
+            latitude = self._latitude(index)
+            with self._lock:
+                self.sent_at[latitude] = time.perf_counter()
+            self.client.post("gps-tracking", json={
+                "user_id": user_id,
+                "latitude": latitude,
+                "longitude": TEST_GPS_COORDS["longitude"],
+                "activity_type": "active",
+            }, timeout=10)
+
+        for thread in threads:
+            thread.join(timeout=30)
+
+        expected = self.subscriber_count * self.event_count
+        return {
+            "subscribers": self.subscriber_count,
+            "events": self.event_count,
+            "delivered": self.delivered,
+            "expected": expected,
+            "p50_ms": percentile(self.latencies, 50) * 1000,
+            "p95_ms": percentile(self.latencies, 95) * 1000,
+            "p99_ms": percentile(self.latencies, 99) * 1000,
+            "max_ms": max(self.latencies) * 1000 if self.latencies else 0.0,
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fan-out latency benchmark for /api/stream")
+    parser.add_argument("--subscribers", type=int, default=50)
+    parser.add_argument("--events", type=int, default=20)
+    parser.add_argument("--base-url", default=BASE_URL)
+    args = parser.parse_args(argv)
+
+    if wait_for_ready(base_url=args.base_url) is None:
+        print(f"❌ Backend at {args.base_url} is not ready")
+        return 1
+
+    print(f"🚀 Fan-out test: {args.subscribers} subscribers, {args.events} events")
+    report = FanoutBenchmark(args.subscribers, args.events, args.base_url).run()
+    print(f"Delivered {report['delivered']}/{report['expected']} events")
+    print(f"Write-to-delivery latency: p50 {report['p50_ms']:.1f} ms, p95 {report['p95_ms']:.1f} ms, "
+          f"p99 {report['p99_ms']:.1f} ms, max {report['max_ms']:.1f} ms")
+    return 0 if report["delivered"] == report["expected"] else 1
+
+
+if __name__ == "__main__":
+    exit(main())
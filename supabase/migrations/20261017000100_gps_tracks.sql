@@ -0,0 +1,27 @@
+-- Per-agent daily tracks written by POST /api/tracks/compact (lib/tracks.js).
+-- One row per agent and UTC day; compaction upserts on (user_id, date) and merges fixes that
+-- arrive after a day was compacted into the existing row.
+
+create table if not exists public.gps_tracks (
+  id bigint generated by default as identity primary key,
+  user_id uuid not null references public.users (id) on delete cascade,
+  date date not null,
+  point_count integer not null default 0,
+  simplified_count integer not null default 0,
+  tolerance_m double precision not null,
+  -- Google encoded polyline (precision 1e5) of the simplified points
+  polyline text not null default '',
+  started_at timestamptz,
+  ended_at timestamptz,
+  distance_m integer not null default 0,
+  -- { "active": seconds, "break": seconds, "idle": seconds }
+  activity_seconds jsonb not null default '{}'::jsonb,
+  -- [{ latitude, longitude, started_at, ended_at, duration_s }]
+  stops jsonb not null default '[]'::jsonb,
+  -- Ids of the raw fixes merged into this row whose deletion hasn't been confirmed yet, so a
+  -- compaction that failed part way doesn't merge them again; empty once a run completes
+  pending_fix_ids jsonb not null default '[]'::jsonb,
+  constraint gps_tracks_user_date_key unique (user_id, date)
+);
+
+create index if not exists gps_tracks_date_idx on public.gps_tracks (date);
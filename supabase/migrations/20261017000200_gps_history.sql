@@ -0,0 +1,140 @@
+-- Time-partitioned GPS history (lib/gpsHistory.js): gps_tracking range-partitioned by UTC day of
+-- "timestamp", hourly rollups in gps_hourly and the per-day catalog in gps_partitions.
+
+-- Daily partitions of gps_tracking from from_day to to_day (inclusive), skipping those that exist.
+-- Call it ahead of time so fixes never land in the default partition, e.g. daily with pg_cron:
+--   select cron.schedule('gps-partitions', '0 0 * * *',
+--     $$select public.create_gps_tracking_partitions(current_date, current_date + 30)$$);
+create or replace function public.create_gps_tracking_partitions(from_day date, to_day date)
+returns void
+language plpgsql
+as $$
+declare
+  day date := from_day;
+begin
+  while day <= to_day loop
+    execute format(
+      'create table if not exists public.%I partition of public.gps_tracking for values from (%L) to (%L)',
+      'gps_tracking_p' || to_char(day, 'YYYYMMDD'),
+      day::timestamptz,
+      (day + 1)::timestamptz
+    );
+    day := day + 1;
+  end loop;
+end;
+$$;
+
+-- Drop the partition holding `day` once retention has archived it, returning whether it was
+-- dropped. The API calls it (supabase.rpc) after each archived day; a partition that is missing, or
+-- that fixes have landed in since, is left alone. It runs as the owner so the service role can call
+-- it without owning gps_tracking. Late fixes for a dropped day go to the default partition.
+create or replace function public.drop_gps_tracking_partition(day date)
+returns boolean
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+  partition_name text := 'gps_tracking_p' || to_char(day, 'YYYYMMDD');
+  has_rows boolean;
+begin
+  if to_regclass(format('public.%I', partition_name)) is null then
+    return false;
+  end if;
+  -- Dropping a partition locks the parent anyway; taking that lock first holds off inserts
+  -- between the check and the drop, in the same order inserts take their locks
+  lock table public.gps_tracking in access exclusive mode;
+  execute format('select exists (select 1 from public.%I)', partition_name) into has_rows;
+  if has_rows then
+    return false;
+  end if;
+  execute format('drop table public.%I', partition_name);
+  return true;
+end;
+$$;
+
+revoke execute on function public.drop_gps_tracking_partition(date) from public, anon, authenticated;
+grant execute on function public.drop_gps_tracking_partition(date) to service_role;
+
+-- Rebuild gps_tracking as a partitioned table, once. Postgres can't partition a table in place, so
+-- the rows are copied into a new table with the same columns and defaults and the old one dropped,
+-- all in this migration's transaction.
+do $$
+declare
+  first_day date;
+  id_sequence text;
+begin
+  if exists (select 1 from pg_partitioned_table where partrelid = 'public.gps_tracking'::regclass) then
+    return;
+  end if;
+
+  alter table public.gps_tracking rename to gps_tracking_unpartitioned;
+  create table public.gps_tracking (
+    like public.gps_tracking_unpartitioned including defaults including identity including constraints
+  ) partition by range ("timestamp");
+
+  update public.gps_tracking_unpartitioned set "timestamp" = now() where "timestamp" is null;
+  alter table public.gps_tracking alter column "timestamp" set not null;
+  -- A primary key on a partitioned table has to include the partition column
+  alter table public.gps_tracking add primary key (id, "timestamp");
+  alter table public.gps_tracking
+    add foreign key (user_id) references public.users (id) on delete cascade;
+
+  create table public.gps_tracking_default partition of public.gps_tracking default;
+  select coalesce(min("timestamp")::date, current_date) into first_day from public.gps_tracking_unpartitioned;
+  perform public.create_gps_tracking_partitions(first_day, current_date + 30);
+
+  insert into public.gps_tracking overriding system value
+    select * from public.gps_tracking_unpartitioned;
+
+  -- A serial id keeps drawing from the old table's sequence, which has to outlive it; an identity
+  -- id has a new sequence of its own, which starts after the copied ids
+  if (select attidentity from pg_attribute
+      where attrelid = 'public.gps_tracking'::regclass and attname = 'id') = '' then
+    id_sequence := pg_get_serial_sequence('public.gps_tracking_unpartitioned', 'id');
+    if id_sequence is not null then
+      execute format('alter sequence %s owned by public.gps_tracking.id', id_sequence);
+    end if;
+  else
+    id_sequence := pg_get_serial_sequence('public.gps_tracking', 'id');
+    execute format(
+      'select setval(%L, coalesce((select max(id) from public.gps_tracking), 0) + 1, false)',
+      id_sequence
+    );
+  end if;
+
+  drop table public.gps_tracking_unpartitioned;
+end;
+$$;
+
+-- Newest-first lists and keyset pages, overall and per agent
+create index if not exists gps_tracking_timestamp_id_idx on public.gps_tracking ("timestamp" desc, id desc);
+create index if not exists gps_tracking_user_timestamp_idx on public.gps_tracking (user_id, "timestamp");
+
+-- Per-agent hourly rollups; retention upserts on (user_id, hour)
+create table if not exists public.gps_hourly (
+  id bigint generated by default as identity primary key,
+  user_id uuid not null references public.users (id) on delete cascade,
+  -- Start of the UTC hour
+  hour timestamptz not null,
+  fixes integer not null default 0,
+  distance_m integer not null default 0,
+  -- { "active": seconds, "break": seconds, "idle": seconds }
+  activity_seconds jsonb not null default '{}'::jsonb,
+  first_at timestamptz,
+  last_at timestamptz,
+  constraint gps_hourly_user_hour_key unique (user_id, hour)
+);
+
+create index if not exists gps_hourly_hour_idx on public.gps_hourly (hour);
+
+-- One row per UTC day of gps_tracking that retention has rolled up or archived. rolled_up_at is
+-- cleared when fixes for the day arrive late; archive is the gzipped NDJSON file on the API
+-- server's disk, or null when GPS_RETENTION=drop.
+create table if not exists public.gps_partitions (
+  day date primary key,
+  rolled_up_at timestamptz,
+  archived_at timestamptz,
+  archive text,
+  archived_rows integer
+);
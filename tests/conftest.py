@@ -0,0 +1,196 @@
+"""
+Fixtures for the Field Management API test suite
+Every worker process (pytest-xdist's gw0, gw1, ... or "main" when run serially) works in its
+own namespace: its accounts are registered as <role>@<namespace>.test, their leads, GPS fixes
+and photos are seeded in bulk once per session, and everything is removed in one call to
+/api/testing/cleanup at the end. Workers never share fixture data, and a run leaves nothing
+behind on a shared backend. The backend must be started with TEST_CLEANUP=on, and the suite
+signs in as the admin named by API_ADMIN_EMAIL/API_ADMIN_PASSWORD to grant each namespace's
+admin its role.
+"""
+
+import json
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip("requests")
+
+from api_client import APIClient, admin_client, grant_admin
+from backend_test import TEST_GPS_COORDS, wait_for_ready
+
+BASE_URL = os.environ.get("API_BASE_URL", "http://localhost:3000/api")
+READY_TIMEOUT = float(os.environ.get("API_READY_TIMEOUT", "5"))
+PASSWORD = "SuitePass123!"
+AGENTS = ("agent-1", "agent-2")
+LEADS_PER_AGENT = 25
+FIXES_PER_AGENT = 240
+PHOTOS_PER_AGENT = 3
+FIX_INTERVAL_S = 5
+
+
+def worker_id():
+    """The pytest-xdist worker running this process, or "main" without xdist"""
+    return os.environ.get("PYTEST_XDIST_WORKER", "main")
+
+
+def new_namespace(label=None):
+    """A fresh namespace for this worker; lowercase so it is valid in an email domain"""
+    return f"t-{label or worker_id()}-{uuid.uuid4().hex[:10]}".lower()
+
+
+def register_accounts(base_url, namespace, roles, granter):
+    """Register and log in one account per role name, with `granter` (an admin's client) making
+    the one named "admin" an admin; returns {name: {id, email, client}}"""
+    accounts = {}
+    for name in roles:
+        email = f"{name}@{namespace}.test"
+        client = APIClient(base_url, retries=1)
+        response = client.post("auth/register", json={
+            "email": email,
+            "password": PASSWORD,
+            "fullName": f"Suite {name}"
+        }, timeout=10)
+        assert response.status_code == 200, f"Registering {email} failed: {response.text}"
+        if name == "admin":
+            grant_admin(granter, response.json()["user"]["id"])
+        client.login(email, PASSWORD)
+        accounts[name] = {"id": response.json()["user"]["id"], "email": email, "client": client}
+    return accounts
+
+
+def remove_namespace(accounts, namespace):
+    """Remove the namespace through its admin and close every client; returns the response"""
+    try:
+        return accounts["admin"]["client"].post("testing/cleanup", json={"namespace": namespace}, timeout=60)
+    finally:
+        for account in accounts.values():
+            account["client"].close()
+
+
+def gps_fixes(user_ids, count, seed=0):
+    """`count` fixes per user, FIX_INTERVAL_S apart and ending now, around TEST_GPS_COORDS"""
+    now = datetime.now(timezone.utc)
+    fixes = []
+    for offset, user_id in enumerate(user_ids):
+        for n in range(count):
+            fixes.append({
+                "user_id": user_id,
+                "latitude": TEST_GPS_COORDS["latitude"] + (seed + offset) * 0.01 + (n % 20) * 0.0001,
+                "longitude": TEST_GPS_COORDS["longitude"] + (n // 20) * 0.0001,
+                "activity_type": ("active", "break", "idle")[n % 3],
+                "timestamp": (now - timedelta(seconds=(count - n) * FIX_INTERVAL_S)).isoformat()
+            })
+    return fixes
+
+
+def exported_leads(client, user_id):
+    """Every lead owned by user_id, read through the NDJSON export"""
+    response = client.get("leads/export", params={"format": "ndjson", "user_id": user_id}, timeout=30)
+    response.raise_for_status()
+    return [json.loads(line) for line in response.text.splitlines() if line]
+
+
+@pytest.fixture(scope="session")
+def base_url():
+    """The backend under test; the session is skipped when it isn't running with TEST_CLEANUP=on"""
+    if wait_for_ready(timeout=READY_TIMEOUT, base_url=BASE_URL) is None:
+        pytest.skip(f"No healthy backend at {BASE_URL}")
+    # Without a token the cleanup endpoint answers 401 when enabled and 404 when not
+    with APIClient(BASE_URL, retries=0) as client:
+        if client.post("testing/cleanup", json={}, timeout=10).status_code == 404:
+            pytest.skip("Backend is not running with TEST_CLEANUP=on; refusing to create data it can't remove")
+    return BASE_URL
+
+
+@pytest.fixture(scope="session")
+def granter(base_url):
+    """The configured admin (API_ADMIN_EMAIL), which grants each namespace's admin its role"""
+    try:
+        client = admin_client(base_url, retries=1)
+    except RuntimeError as error:
+        pytest.skip(str(error))
+    yield client
+    client.close()
+
+
+@pytest.fixture(scope="session")
+def namespace():
+    return new_namespace()
+
+
+@pytest.fixture(scope="session")
+def accounts(base_url, namespace, granter):
+    """This worker's admin and agents, logged in; the whole namespace is removed afterwards"""
+    created = {}
+    try:
+        created.update(register_accounts(base_url, namespace, ("admin",) + AGENTS, granter))
+        yield created
+    finally:
+        if "admin" in created:
+            response = remove_namespace(created, namespace)
+            assert response.status_code == 200, f"Cleaning up {namespace} failed: {response.text}"
+
+
+@pytest.fixture(scope="session")
+def admin(accounts):
+    return accounts["admin"]
+
+
+@pytest.fixture(scope="session")
+def agent(accounts):
+    return accounts[AGENTS[0]]
+
+
+@pytest.fixture(scope="session")
+def other_agent(accounts):
+    return accounts[AGENTS[1]]
+
+
+@pytest.fixture(scope="session")
+def seeded(accounts, namespace):
+    """Bulk-seed each agent's leads (one NDJSON import each), GPS fixes (one batch) and photos.
+    Returns the ids created, per agent name."""
+    client = accounts["admin"]["client"]
+    agents = {name: accounts[name] for name in AGENTS}
+    data = {name: {"leads": [], "photos": []} for name in agents}
+
+    for name, account in agents.items():
+        lines = [json.dumps({
+            "contact_name": f"Lead {n} of {name}",
+            "contact_email": f"lead-{n}.{name}@{namespace}.test",
+            "business_name": f"{namespace} business {n}",
+            **TEST_GPS_COORDS
+        }) for n in range(LEADS_PER_AGENT)]
+        report = client.post(
+            "leads/import",
+            params={"format": "ndjson", "user_id": account["id"]},
+            headers={"Content-Type": "application/x-ndjson"},
+            data="\n".join(lines).encode(),
+            timeout=60
+        ).json()
+        assert report.get("inserted") == LEADS_PER_AGENT, f"Lead import for {name}: {report}"
+        data[name]["leads"] = [
+            lead["id"] for lead in exported_leads(client, account["id"])
+            if (lead["business_name"] or "").startswith(f"{namespace} business ")
+        ]
+
+    response = client.post(
+        "gps-tracking/batch",
+        json={"fixes": gps_fixes([account["id"] for account in agents.values()], FIXES_PER_AGENT)},
+        timeout=60
+    )
+    assert response.status_code == 200, f"GPS batch failed: {response.text}"
+
+    for name, account in agents.items():
+        for n in range(PHOTOS_PER_AGENT):
+            response = account["client"].post("photos", json={
+                "image_url": f"https://example.com/{namespace}/{name}-{n}.jpg",
+                "description": f"{namespace} photo {n}",
+                **TEST_GPS_COORDS
+            }, timeout=10)
+            assert response.status_code == 200, f"Photo for {name} failed: {response.text}"
+            data[name]["photos"].append(response.json()["id"])
+    return data
@@ -0,0 +1,85 @@
+"""
+Authentication and authorization
+Bearer tokens, roles and acting on behalf of other users
+"""
+
+from api_client import APIClient
+
+from .conftest import PASSWORD
+
+
+def test_login_returns_session_and_profile(base_url, agent):
+    with APIClient(base_url, retries=0) as client:
+        body = client.login(agent["email"], PASSWORD)
+    assert body["session"]["access_token"]
+    assert body["profile"]["id"] == agent["id"]
+    assert body["profile"]["role"] == "agent"
+
+
+def test_wrong_password_is_rejected(base_url, agent):
+    with APIClient(base_url, retries=0) as client:
+        response = client.post("auth/login", json={"email": agent["email"], "password": "not-the-password"}, timeout=10)
+    assert response.status_code in (400, 401)
+
+
+def test_protected_endpoints_need_a_token(base_url):
+    with APIClient(base_url, retries=0) as client:
+        for endpoint in ("photos", "leads", "gps-tracking", "sync"):
+            response = client.get(endpoint, timeout=10)
+            assert response.status_code == 401, endpoint
+            assert response.headers.get("WWW-Authenticate") == "Bearer"
+
+
+def test_auth_user_is_the_caller(agent, admin):
+    for account in (agent, admin):
+        response = account["client"].get("auth/user", timeout=10)
+        assert response.status_code == 200
+        assert response.json()["user"]["id"] == account["id"]
+
+
+def test_agents_cannot_reach_admin_endpoints(agent):
+    for endpoint in ("users", "dashboard/summary", "leads/export", "write-queue"):
+        assert agent["client"].get(endpoint, timeout=10).status_code == 403, endpoint
+
+
+def test_agents_write_only_for_themselves(agent, other_agent, admin):
+    lead = {"user_id": other_agent["id"], "contact_name": "Not mine"}
+    assert agent["client"].post("leads", json=lead, timeout=10).status_code == 403
+
+    fixes = {"fixes": [{"user_id": other_agent["id"], "latitude": 1.0, "longitude": 1.0}]}
+    assert agent["client"].post("gps-tracking/batch", json=fixes, timeout=10).status_code == 403
+
+    # Admins may act for anyone
+    response = admin["client"].post("leads", json={**lead, "contact_name": "Entered by admin"}, timeout=10)
+    assert response.status_code == 200
+    assert response.json()["user_id"] == other_agent["id"]
+
+
+def test_role_changes_take_effect(admin, other_agent):
+    client = admin["client"]
+    try:
+        response = client.put(f"users/{other_agent['id']}/role", json={"role": "admin"}, timeout=10)
+        assert response.status_code == 200
+        assert other_agent["client"].get("users", timeout=10).status_code == 200
+    finally:
+        client.put(f"users/{other_agent['id']}/role", json={"role": "agent"}, timeout=10)
+    assert other_agent["client"].get("users", timeout=10).status_code == 403
+
+
+def test_self_registration_creates_agents(base_url, namespace, accounts):
+    # Registered in the namespace, so its cleanup removes the account
+    email = f"self-admin@{namespace}.test"
+    with APIClient(base_url, retries=0) as client:
+        response = client.post("auth/register", json={
+            "email": email, "password": PASSWORD, "fullName": "Self Admin", "role": "admin"
+        }, timeout=10)
+        assert response.status_code == 200
+        assert response.json()["profile"]["role"] == "agent"
+        client.login(email, PASSWORD)
+        assert client.get("users", timeout=10).status_code == 403
+
+
+def test_only_admins_change_roles(admin, agent):
+    assert agent["client"].put(f"users/{agent['id']}/role", json={"role": "admin"}, timeout=10).status_code == 403
+    assert admin["client"].put(f"users/{agent['id']}/role", json={"role": "owner"}, timeout=10).status_code == 400
+    assert agent["client"].get("auth/user", timeout=10).json()["user"]["role"] == "agent"
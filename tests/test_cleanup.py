@@ -0,0 +1,77 @@
+"""
+Test data cleanup
+/api/testing/cleanup removes a namespace's accounts and rows, and nothing else
+"""
+
+from api_client import APIClient
+
+from .conftest import AGENTS, PASSWORD, exported_leads, gps_fixes, new_namespace, register_accounts, remove_namespace
+
+
+def test_cleanup_is_limited_to_own_namespace(admin, agent, namespace):
+    client = admin["client"]
+    assert client.post("testing/cleanup", json={"namespace": "Not Valid!"}, timeout=10).status_code == 400
+    assert client.post("testing/cleanup", json={"namespace": new_namespace()}, timeout=10).status_code == 403
+    assert agent["client"].post("testing/cleanup", json={"namespace": namespace}, timeout=10).status_code == 403
+
+
+def test_cleanup_removes_namespace(base_url, granter, admin, agent, seeded):
+    scratch = new_namespace("scratch")
+    accounts = register_accounts(base_url, scratch, ("admin", "agent"), granter)
+    scratch_agent = accounts["agent"]
+    try:
+        client = scratch_agent["client"]
+        assert client.post("leads", json={"contact_name": "Scratch lead"}, timeout=10).status_code == 200
+        assert client.post("photos", json={"image_url": "https://example.com/scratch.jpg"}, timeout=10).status_code == 200
+        batch = {"fixes": gps_fixes([scratch_agent["id"]], 20, seed=5)}
+        assert client.post("gps-tracking/batch", json=batch, timeout=10).status_code == 200
+        # Builds the dashboard aggregates while the scratch rows exist
+        assert admin["client"].get("dashboard/summary", timeout=30).status_code == 200
+    finally:
+        response = remove_namespace(accounts, scratch)
+
+    assert response.status_code == 200
+    removed = response.json()["removed"]
+    assert removed["users"] == 2
+    assert removed["leads"] == 1
+    assert removed["photos"] == 1
+    assert removed["gps_tracking"] == 20
+    # Auth accounts are only removed where the backend has an auth admin client
+    assert removed["auth_users"] in (0, 2)
+
+    # The scratch accounts are gone: their tokens stop working and they can't log in again
+    with APIClient(base_url, retries=0, token=scratch_agent["client"].token) as client:
+        assert client.get("leads", timeout=10).status_code == 401
+        login = client.post("auth/login", json={"email": scratch_agent["email"], "password": PASSWORD}, timeout=10)
+        assert login.status_code in (400, 401)
+    users = admin["client"].get("users", params={"limit": 500}, timeout=10).json()
+    assert not {user["id"] for user in users} & {account["id"] for account in accounts.values()}
+    assert exported_leads(admin["client"], scratch_agent["id"]) == []
+    # The first summary after cleanup no longer counts them
+    summary = admin["client"].get("dashboard/summary", timeout=30).json()
+    assert not {row["user_id"] for row in summary["per_user"]} & {account["id"] for account in accounts.values()}
+
+    # This worker's own fixtures are untouched
+    assert agent["client"].get("auth/user", timeout=10).status_code == 200
+    assert {lead["id"] for lead in exported_leads(admin["client"], agent["id"])} >= set(seeded[AGENTS[0]]["leads"])
+
+
+def test_cleanup_clears_spatial_results(base_url, granter, admin):
+    scratch = new_namespace("geo")
+    accounts = register_accounts(base_url, scratch, ("admin", "agent"), granter)
+    # A spot no other test writes to, with more leads than the query's limit
+    spot = {"latitude": -41.2901, "longitude": 174.7776}
+    params = {"lat": spot["latitude"], "lng": spot["longitude"], "radius": 50, "limit": 3}
+    try:
+        client = accounts["agent"]["client"]
+        for n in range(5):
+            assert client.post("leads", json={"contact_name": f"Geo lead {n}", **spot}, timeout=10).status_code == 200
+        before = admin["client"].get("geo/leads", params=params, timeout=10)
+        assert len(before.json()) == 3
+    finally:
+        response = remove_namespace(accounts, scratch)
+    assert response.status_code == 200
+
+    after = admin["client"].get("geo/leads", params=params, timeout=10)
+    assert after.json() == []
+    assert after.headers["X-Spatial-Matched"] == "0"
@@ -0,0 +1,69 @@
+"""
+GPS tracking
+Batch ingestion, area queries and hourly reports for this worker's agents
+"""
+
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from backend_test import TEST_GPS_COORDS
+
+from .conftest import AGENTS, FIXES_PER_AGENT
+
+
+def test_batch_fixes_are_found_by_area(accounts, seeded):
+    latitude, longitude = TEST_GPS_COORDS["latitude"], TEST_GPS_COORDS["longitude"]
+    bbox = f"{latitude - 0.02},{longitude - 0.02},{latitude + 0.02},{longitude + 0.02}"
+    for name in AGENTS:
+        response = accounts[name]["client"].get(
+            "geo/gps-tracking",
+            params={"bbox": bbox, "user_id": accounts[name]["id"]},
+            timeout=10
+        )
+        assert response.status_code == 200
+        rows = response.json()
+        assert len(rows) == FIXES_PER_AGENT
+        assert {row["user_id"] for row in rows} == {accounts[name]["id"]}
+
+
+def test_gps_list_shows_newest_fixes_first(agent, seeded):
+    rows = agent["client"].get("gps-tracking", params={"limit": 50}, timeout=10).json()
+    timestamps = [row["timestamp"] for row in rows]
+    assert timestamps == sorted(timestamps, reverse=True)
+
+
+def test_batch_retries_are_deduplicated(agent):
+    now = datetime.now(timezone.utc)
+    fixes = [{
+        "user_id": agent["id"],
+        "latitude": TEST_GPS_COORDS["latitude"] - 1,
+        "longitude": TEST_GPS_COORDS["longitude"] - 1,
+        "timestamp": (now - timedelta(seconds=n)).isoformat(),
+        "idempotency_key": uuid.uuid4().hex
+    } for n in range(10)]
+    first = agent["client"].post("gps-tracking/batch", json={"fixes": fixes}, timeout=10).json()
+    retry = agent["client"].post("gps-tracking/batch", json={"fixes": fixes}, timeout=10).json()
+    assert first == {"inserted": 10, "duplicates": 0}
+    assert retry == {"inserted": 0, "duplicates": 10}
+
+
+def test_invalid_batches_are_rejected(agent):
+    client = agent["client"]
+    assert client.post("gps-tracking/batch", json={"fixes": []}, timeout=10).status_code == 400
+    bad = {"fixes": [{"user_id": agent["id"], "latitude": 91, "longitude": 0}]}
+    response = client.post("gps-tracking/batch", json=bad, timeout=10)
+    assert response.status_code == 400
+    assert response.json()["details"][0]["index"] == 0
+
+
+def test_hourly_report_counts_seeded_fixes(other_agent, seeded):
+    today = datetime.now(timezone.utc).date()
+    response = other_agent["client"].get("tracks/hourly", params={
+        "user_id": other_agent["id"],
+        "from": (today - timedelta(days=1)).isoformat(),
+        "to": today.isoformat()
+    }, timeout=30)
+    assert response.status_code == 200
+    report = response.json()
+    assert report["totals"]["fixes"] == FIXES_PER_AGENT
+    assert report["totals"]["distance_m"] > 0
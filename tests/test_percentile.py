@@ -0,0 +1,20 @@
+"""
+Latency percentiles
+The nearest-rank percentile shared by the load generator, benchmark, replay and SSE tools
+"""
+
+from load_generator import percentile
+
+
+def test_nearest_rank():
+    assert percentile([1, 2, 3, 4, 5, 6], 50) == 3
+    assert percentile(list(range(1, 11)), 50) == 5
+    assert percentile(list(range(1, 101)), 95) == 95
+    assert percentile(list(range(1, 101)), 99) == 99
+    assert percentile(list(range(1, 101)), 100) == 100
+
+
+def test_edges():
+    assert percentile([], 50) == 0.0
+    assert percentile([7], 1) == 7
+    assert percentile([3, 1, 2], 0) == 1
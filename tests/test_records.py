@@ -0,0 +1,139 @@
+"""
+Photos and leads
+Writes, bulk import/export and list endpoints, checked against this worker's own rows only
+"""
+
+import csv
+import io
+import json
+import uuid
+
+from api_client import COLUMNS_TYPE, decode_list
+from backend_test import TEST_GPS_COORDS, TEST_PNG_BYTES
+
+from .conftest import AGENTS, LEADS_PER_AGENT, exported_leads
+
+
+def walk_pages(client, endpoint, wanted, page_size=100, max_pages=50, **params):
+    """Follow X-Next-Cursor until every id in `wanted` was seen; returns the rows read"""
+    rows = []
+    params = {"limit": page_size, **params}
+    for _ in range(max_pages):
+        response = client.get(endpoint, params=params, timeout=10)
+        response.raise_for_status()
+        rows.extend(response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if wanted <= {row["id"] for row in rows} or not cursor:
+            break
+        params["cursor"] = cursor
+    return rows
+
+
+def test_seeded_leads_export_per_agent(admin, seeded, accounts):
+    for name in AGENTS:
+        leads = exported_leads(admin["client"], accounts[name]["id"])
+        # Other tests may have added leads for the agent since seeding
+        assert set(seeded[name]["leads"]) <= {lead["id"] for lead in leads}
+        assert {lead["user_id"] for lead in leads} == {accounts[name]["id"]}
+        assert len(seeded[name]["leads"]) == LEADS_PER_AGENT
+
+
+def test_lead_import_reports_duplicates_and_invalid_rows(admin, agent, seeded, namespace):
+    lines = [
+        {"contact_name": "Lead 0 again", "contact_email": f"LEAD-0.{AGENTS[0]}@{namespace}.test"},
+        {"contact_email": f"nameless@{namespace}.test"},
+        {"contact_name": "Fresh lead", "contact_email": f"fresh@{namespace}.test", "latitude": 123, "longitude": 0}
+    ]
+    report = admin["client"].post(
+        "leads/import",
+        params={"format": "ndjson", "user_id": agent["id"]},
+        headers={"Content-Type": "application/x-ndjson"},
+        data="\n".join(json.dumps(line) for line in lines).encode(),
+        timeout=30
+    ).json()
+    assert report["received"] == 3
+    assert report["inserted"] == 0
+    assert report["duplicates"] == 1
+    assert report["invalid"] == 2
+
+
+def test_csv_export_neutralises_formulas(admin, other_agent, namespace):
+    lead = {
+        "contact_name": "=HYPERLINK(\"https://example.com\",\"open\")",
+        "contact_phone": "+1 555 010 0042",
+        "business_name": f"{namespace} formula",
+        "latitude": -33.8688,
+        "longitude": 151.2093
+    }
+    report = admin["client"].post(
+        "leads/import",
+        params={"format": "ndjson", "user_id": other_agent["id"]},
+        headers={"Content-Type": "application/x-ndjson"},
+        data=json.dumps(lead).encode(),
+        timeout=30
+    ).json()
+    assert report["inserted"] == 1
+
+    response = admin["client"].get("leads/export", params={"format": "csv", "user_id": other_agent["id"]}, timeout=30)
+    rows = [row for row in csv.DictReader(io.StringIO(response.text)) if row["business_name"] == lead["business_name"]]
+    assert len(rows) == 1
+    assert rows[0]["contact_name"] == "'" + lead["contact_name"]
+    assert rows[0]["contact_phone"] == "'+1 555 010 0042"
+    assert float(rows[0]["latitude"]) == lead["latitude"]
+
+
+def test_lead_pages_are_ordered_and_include_own_rows(agent, seeded):
+    wanted = set(seeded[AGENTS[0]]["leads"])
+    rows = walk_pages(agent["client"], "leads", wanted, fields="contact_name,user_id")
+    ids = [row["id"] for row in rows]
+    assert len(ids) == len(set(ids))
+    assert [row["created_at"] for row in rows] == sorted((row["created_at"] for row in rows), reverse=True)
+    assert wanted <= set(ids)
+    assert all(set(row) <= {"id", "created_at", "contact_name", "user_id"} for row in rows)
+
+
+def test_unknown_projection_is_rejected(agent):
+    assert agent["client"].get("photos", params={"fields": "password"}, timeout=10).status_code == 400
+
+
+def test_photos_list_joins_author(agent, seeded):
+    wanted = set(seeded[AGENTS[0]]["photos"])
+    rows = [row for row in walk_pages(agent["client"], "photos", wanted) if row["id"] in wanted]
+    assert len(rows) == len(wanted)
+    assert all(row["users"]["full_name"] == f"Suite {AGENTS[0]}" for row in rows)
+
+
+def test_columnar_encoding_matches_json(agent, seeded):
+    # The geo endpoint filtered to one agent is unaffected by other workers' writes
+    params = {
+        "bbox": f"{TEST_GPS_COORDS['latitude'] - 0.01},{TEST_GPS_COORDS['longitude'] - 0.01},"
+                f"{TEST_GPS_COORDS['latitude'] + 0.01},{TEST_GPS_COORDS['longitude'] + 0.01}",
+        "user_id": agent["id"]
+    }
+    plain = agent["client"].get("geo/leads", params=params, timeout=10)
+    columns = agent["client"].get("geo/leads", params=params, headers={"Accept": COLUMNS_TYPE}, timeout=10)
+    assert columns.headers["Content-Type"].startswith(COLUMNS_TYPE)
+    assert decode_list(columns.json()) == plain.json()
+    assert {row["id"] for row in plain.json()} == set(seeded[AGENTS[0]]["leads"])
+
+
+def test_lead_retry_with_idempotency_key_writes_once(agent, namespace):
+    lead = {"contact_name": "Retried lead", "contact_email": f"retried@{namespace}.test"}
+    key = uuid.uuid4().hex
+    first = agent["client"].post("leads", json=lead, idempotency_key=key, timeout=10)
+    second = agent["client"].post("leads", json=lead, idempotency_key=key, timeout=10)
+    assert first.status_code == second.status_code == 200
+    assert first.json()["id"] == second.json()["id"]
+
+    changed = agent["client"].post("leads", json={**lead, "notes": "different"}, idempotency_key=key, timeout=10)
+    assert changed.status_code == 422
+
+
+def test_photo_blob_round_trip(agent):
+    files = {"file": ("photo.png", TEST_PNG_BYTES, "image/png")}
+    stored = agent["client"].post("photos/upload", files=files, timeout=10).json()
+    assert stored["image_url"].startswith("/api/blobs/")
+
+    blob = agent["client"].get(stored["image_url"], timeout=10)
+    assert blob.status_code == 200
+    assert blob.content == TEST_PNG_BYTES
@@ -0,0 +1,98 @@
+"""
+Incremental sync
+Change tokens from /api/sync, checked against rows this worker writes
+"""
+
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+from .conftest import AGENTS
+
+# The server's SYNC_MAX_CHANGES: changed rows per sync response
+SYNC_MAX_CHANGES = int(os.environ.get("SYNC_MAX_CHANGES", "5000"))
+
+
+def sync(client, token=None):
+    response = client.get("sync", params={"since": token} if token else None, timeout=60)
+    assert response.status_code == 200
+    return response.json()
+
+
+def catch_up(client, token):
+    """Follow `more` until the token is current; returns the last token and every change seen"""
+    changes = {}
+    more = True
+    while more:
+        body = sync(client, token)
+        for table, rows in body["changes"].items():
+            changes.setdefault(table, {}).update({row["id"]: row for row in rows})
+        token, more = body["token"], body["more"]
+    return token, changes
+
+
+def test_snapshot_holds_own_rows(agent, seeded):
+    body = sync(agent["client"])
+    assert set(body["reset"]) == {"photos", "leads", "gps_tracking"}
+    assert set(seeded[AGENTS[0]]["leads"]) <= {row["id"] for row in body["changes"]["leads"]}
+    assert set(seeded[AGENTS[0]]["photos"]) <= {row["id"] for row in body["changes"]["photos"]}
+    assert body["users"][agent["id"]]["full_name"] == f"Suite {AGENTS[0]}"
+
+
+def test_admins_also_sync_users(admin, seeded):
+    body = sync(admin["client"])
+    assert "users" in body["reset"]
+    assert admin["id"] in {row["id"] for row in body["changes"]["users"]}
+
+
+def test_changes_since_token(agent, seeded, namespace):
+    token, _ = catch_up(agent["client"], sync(agent["client"])["token"])
+
+    lead = agent["client"].post("leads", json={
+        "contact_name": "Synced lead",
+        "contact_email": f"synced@{namespace}.test"
+    }, timeout=10).json()
+    fix = {"user_id": agent["id"], "latitude": 1.5, "longitude": 1.5, "timestamp": datetime.now(timezone.utc).isoformat()}
+    assert agent["client"].post("gps-tracking/batch", json={"fixes": [fix]}, timeout=10).status_code == 200
+
+    _, changes = catch_up(agent["client"], token)
+    assert changes["leads"][lead["id"]]["contact_name"] == "Synced lead"
+    # Other workers' writes, and the full snapshots their cleanups cause, may come back too
+    assert any(row["user_id"] == agent["id"] and row["latitude"] == 1.5 for row in changes["gps_tracking"].values())
+
+
+def test_reset_reaches_clients_behind_partial_pages(admin, agent, other_agent, namespace):
+    token, _ = catch_up(agent["client"], sync(agent["client"])["token"])
+
+    # Compacting a day of fixes deletes raw rows in bulk, which resets gps_tracking
+    day = datetime.now(timezone.utc) - timedelta(days=10)
+    fix = {"user_id": other_agent["id"], "latitude": 2.5, "longitude": 2.5, "timestamp": day.isoformat()}
+    assert other_agent["client"].post("gps-tracking/batch", json={"fixes": [fix]}, timeout=10).status_code == 200
+    summary = admin["client"].post("tracks/compact", json={
+        "before": (day + timedelta(days=1)).date().isoformat(),
+        "user_id": other_agent["id"]
+    }, timeout=60).json()
+    assert summary["raw_rows_removed"] >= 1
+
+    # Then more changed rows than fit in one response
+    lines = [{"contact_name": f"Paged {n}", "contact_email": f"paged{n}@{namespace}.test"} for n in range(SYNC_MAX_CHANGES + 1)]
+    report = admin["client"].post(
+        "leads/import",
+        params={"format": "ndjson", "user_id": agent["id"]},
+        headers={"Content-Type": "application/x-ndjson"},
+        data="\n".join(json.dumps(line) for line in lines).encode(),
+        timeout=120
+    ).json()
+    assert report["inserted"] == len(lines)
+
+    first = sync(agent["client"], token)
+    assert first["more"]
+    assert "gps_tracking" in first["reset"]
+    _, changes = catch_up(agent["client"], first["token"])
+    synced = {row["contact_email"] for row in first["changes"]["leads"]}
+    synced |= {row["contact_email"] for row in changes["leads"].values()}
+    assert {line["contact_email"] for line in lines} <= synced
+
+
+def test_malformed_token_is_rejected(agent):
+    assert agent["client"].get("sync", params={"since": "not a token"}, timeout=10).status_code == 400